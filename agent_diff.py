@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+智能体配置比较
+
+按 id 匹配两份配置中的智能体，逐级跳过没有变化的部分：
+- 整个智能体的内容哈希相同（备份对象哈希）时直接跳过，不读取、不解析
+- 哈希不同时再比较每个字段的哈希，找出实际变化的字段
+- 只有查看某个字段时才对它计算文本差异（长系统提示词按行比较）
+
+比较的输入为条目列表 [(id, 内容哈希或 None, 读取完整智能体的函数)]，
+备份一侧的 id 和哈希都来自备份索引，未变化的智能体不会被读取。
+"""
+
+import difflib
+import hashlib
+import json
+
+from backup_store import agent_blob
+
+
+def agent_entries(agents):
+    """把内存中的智能体列表转为比较条目（哈希与备份对象的哈希一致）"""
+    return [(agent.get('id'), agent_blob(agent)[0], lambda agent=agent: agent) for agent in agents]
+
+
+def field_digests(agent):
+    """每个字段值的哈希"""
+    return {
+        name: hashlib.sha1(json.dumps(value, ensure_ascii=False, sort_keys=True).encode('utf-8')).digest()
+        for name, value in agent.items()
+    }
+
+
+def match_key(agent_id):
+    # 数字和字符串形式的 id 视为同一个
+    return None if agent_id is None else str(agent_id)
+
+
+class ModifiedAgent:
+    """两份配置中 id 相同但内容不同的智能体"""
+
+    def __init__(self, old, new, fields):
+        self.old = old          # 完整的旧智能体
+        self.new = new          # 完整的新智能体
+        self.fields = fields    # 变化的字段名（按新智能体的字段顺序）
+
+    @property
+    def name(self):
+        return self.new.get('name') or self.old.get('name') or ''
+
+    def field_diff(self, field, context=3):
+        """单个字段的差异文本：字符串按行比较，其他值显示前后的值"""
+        old_value = self.old.get(field)
+        new_value = self.new.get(field)
+        if isinstance(old_value, str) and isinstance(new_value, str):
+            lines = difflib.unified_diff(old_value.splitlines(), new_value.splitlines(),
+                                         '修改前', '修改后', n=context, lineterm='')
+            return '\n'.join(lines)
+        if field not in self.old:
+            return f"+ {json.dumps(new_value, ensure_ascii=False)}"
+        if field not in self.new:
+            return f"- {json.dumps(old_value, ensure_ascii=False)}"
+        return (f"- {json.dumps(old_value, ensure_ascii=False)}\n"
+                f"+ {json.dumps(new_value, ensure_ascii=False)}")
+
+    def diff_text(self):
+        return '\n\n'.join(f"=== {field} ===\n{self.field_diff(field)}" for field in self.fields)
+
+
+class AgentDiff:
+    """比较结果：新增、删除、修改的智能体和未变化的数量"""
+
+    def __init__(self):
+        self.added = []       # 只在新配置中出现的智能体
+        self.removed = []     # 只在旧配置中出现的智能体
+        self.modified = []    # ModifiedAgent 列表
+        self.unchanged = 0
+        self.loaded = 0       # 实际读取的智能体数（衡量跳过的效果）
+
+    def is_empty(self):
+        return not (self.added or self.removed or self.modified)
+
+    def summary(self):
+        return (f"新增 {len(self.added)} 个，删除 {len(self.removed)} 个，"
+                f"修改 {len(self.modified)} 个，未变化 {self.unchanged} 个")
+
+
+def diff_agents(old_entries, new_entries):
+    """比较两份配置的条目列表，返回 AgentDiff
+
+    相同 id 出现多次时按出现顺序一一匹配。
+    """
+    result = AgentDiff()
+
+    def load(entry):
+        result.loaded += 1
+        return entry[2]()
+
+    old_by_key = {}
+    for entry in old_entries:
+        old_by_key.setdefault(match_key(entry[0]), []).append(entry)
+
+    unmatched_new = []
+    for new_entry in new_entries:
+        candidates = old_by_key.get(match_key(new_entry[0]))
+        if not candidates:
+            unmatched_new.append(new_entry)
+            continue
+        old_entry = candidates.pop(0)
+        if old_entry[1] is not None and old_entry[1] == new_entry[1]:
+            result.unchanged += 1
+            continue
+
+        old_agent, new_agent = load(old_entry), load(new_entry)
+        old_fields, new_fields = field_digests(old_agent), field_digests(new_agent)
+        changed = [name for name in new_fields if old_fields.get(name) != new_fields[name]]
+        changed += [name for name in old_fields if name not in new_fields]
+        if changed:
+            result.modified.append(ModifiedAgent(old_agent, new_agent, changed))
+        else:
+            # 只有格式或字段顺序不同
+            result.unchanged += 1
+
+    result.added = [load(entry) for entry in unmatched_new]
+    result.removed = [load(entry) for entries in old_by_key.values() for entry in entries]
+    return result
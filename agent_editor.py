@@ -6,9 +6,30 @@ import os
 import tkinter as tk
 from tkinter import ttk, scrolledtext, messagebox, filedialog
 import datetime
-import shutil
+import threading
+import time
 import configparser  # 添加configparser用于保存GitHub配置
 
+from agent_diff import diff_agents
+from api_probe import format_report, probe_agents, unique_targets
+from agent_index import AgentSearchIndex
+from agent_loader import LAZY_FIELDS, AgentFile
+from agent_shards import ShardStore
+from agent_list_view import AgentListView
+from backup_store import CATALOG_NAME, BackupStore, agent_blob
+from github_sync import DEFAULT_API_BASE, GitHubClient, GitHubError, SyncState, git_blob_sha
+from save_pipeline import SavePipeline, atomic_write
+
+# 连续编辑时，最后一次修改之后多久自动保存（秒）
+AUTOSAVE_DELAY = 2.0
+
+# 回复缓存选项 -> cacheResponses 的值（None 表示不写入，由 server.py 只缓存温度为 0 的请求）
+CACHE_MODES = {
+    "自动（温度为0时）": None,
+    "总是缓存": True,
+    "不缓存": False,
+}
+
 class AgentEditor:
     def __init__(self, root):
         self.root = root
@@ -23,11 +44,32 @@ class AgentEditor:
         self.agents = []
         self.current_agent_index = None
         
+        # 搜索索引（以智能体对象的id()为键）和列表框中显示的智能体下标
+        self.search_index = AgentSearchIndex()
+        self.visible_indices = []
+        self.agent_positions = {}  # id(智能体) -> 在 self.agents 中的下标
+        
+        # 延迟加载的agents.json：长文本字段在选中智能体时才读取
+        self.agent_file = AgentFile('agents.json')
+        self.index_queue = []  # 等待把长文本字段加入搜索索引的智能体
+        self.index_job = None
+        
+        # 可选的分片存储：存在 agents/manifest.json 时代替 agents.json
+        self.shard_store = ShardStore('agents')
+        
+        # 后台保存：序列化和写盘不占用界面线程，连续编辑合并为一次自动保存
+        self.save_pipeline = SavePipeline()
+        self.save_poll_job = None
+        self.autosave_backed_up = False  # 本次运行是否已在自动保存前备份过
+        
         # 创建备份目录
         self.backup_dir = 'backups'
         if not os.path.exists(self.backup_dir):
             os.makedirs(self.backup_dir)
         
+        # 去重备份存储：每个智能体按内容哈希只保存一份
+        self.backup_store = BackupStore(self.backup_dir)
+        
         # 创建配置目录
         self.config_dir = 'config'
         if not os.path.exists(self.config_dir):
@@ -51,7 +93,9 @@ class AgentEditor:
             'owner': '',
             'repo': '',
             'branch': 'main',
-            'file_path': 'agents.json'
+            'file_path': 'agents.json',
+            'api_base': DEFAULT_API_BASE,
+            'batch_paths': ''
         }
         
         config_file = os.path.join(self.config_dir, 'github_config.ini')
@@ -87,13 +131,21 @@ class AgentEditor:
         
         ttk.Label(left_frame, text="智能体列表").pack(anchor="w", pady=(0, 5))
         
+        # 搜索框：按名称、模型、API地址和系统提示词过滤
+        self.search_var = tk.StringVar()
+        search_entry = ttk.Entry(left_frame, textvariable=self.search_var, width=25)
+        search_entry.pack(fill=tk.X, pady=(0, 5))
+        self.search_var.trace_add('write', lambda *args: self.update_agent_listbox())
+        
         # 添加滚动条
         list_scroll = ttk.Scrollbar(left_frame)
         list_scroll.pack(side=tk.RIGHT, fill=tk.Y)
         
-        self.agent_listbox = tk.Listbox(left_frame, yscrollcommand=list_scroll.set, width=25, height=20)
+        self.agent_listbox = tk.Listbox(left_frame, width=25, height=20, exportselection=False)
         self.agent_listbox.pack(fill=tk.BOTH, expand=True)
-        list_scroll.config(command=self.agent_listbox.yview)
+        
+        # 列表视图：只渲染可见的一页，刷新时只改动变化的行
+        self.agent_list = AgentListView(self.agent_listbox, list_scroll, on_select=self.on_agent_select)
         
         # 左侧按钮框架
         left_buttons = ttk.Frame(left_frame)
@@ -130,6 +182,12 @@ class AgentEditor:
         self.tokens_entry = ttk.Entry(temp_frame, width=8)
         self.tokens_entry.pack(side=tk.LEFT, padx=5)
         
+        # 相同输入是否复用缓存的回复（由server.py处理）
+        ttk.Label(temp_frame, text="回复缓存:").pack(side=tk.LEFT, padx=(20, 0))
+        self.cache_var = tk.StringVar(value=self.cache_mode(None))
+        ttk.Combobox(temp_frame, textvariable=self.cache_var, values=list(CACHE_MODES),
+                     state="readonly", width=14).pack(side=tk.LEFT, padx=5)
+        
         # 系统提示词 (大文本区域)
         ttk.Label(form_frame, text="系统提示词:").grid(row=6, column=0, sticky="nw", pady=5)
         self.prompt_text = scrolledtext.ScrolledText(form_frame, width=70, height=10, wrap=tk.WORD)
@@ -148,6 +206,13 @@ class AgentEditor:
         ttk.Button(button_frame, text="保存所有到agents.json", command=self.save_all_agents).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="导出到...", command=self.export_agents).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="导入...", command=self.import_agents).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="在线验证", command=self.validate_agents_live).pack(side=tk.LEFT, padx=5)
+        
+        # 自动保存开关和保存状态
+        self.autosave_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(button_frame, text="自动保存", variable=self.autosave_var).pack(side=tk.LEFT, padx=5)
+        self.save_status = ttk.Label(button_frame, text="")
+        self.save_status.pack(side=tk.LEFT, padx=5)
         
         # 添加备份和恢复按钮
         backup_frame = ttk.Frame(right_frame)
@@ -156,21 +221,20 @@ class AgentEditor:
         ttk.Button(backup_frame, text="创建备份", command=self.create_backup).pack(side=tk.LEFT, padx=5)
         ttk.Button(backup_frame, text="恢复备份", command=self.restore_backup).pack(side=tk.LEFT, padx=5)
         ttk.Button(backup_frame, text="管理备份", command=self.manage_backups).pack(side=tk.LEFT, padx=5)
+        ttk.Button(backup_frame, text="转换为分片存储", command=self.convert_to_shards).pack(side=tk.LEFT, padx=5)
         
         # 添加GitHub同步按钮和设置按钮
         github_frame = ttk.Frame(right_frame)
         github_frame.pack(fill=tk.X, pady=5)
         
         ttk.Button(github_frame, text="同步到GitHub", command=self.sync_to_github).pack(side=tk.LEFT, padx=5)
+        ttk.Button(github_frame, text="批量同步(单次提交)", command=self.sync_batch_to_github).pack(side=tk.LEFT, padx=5)
         ttk.Button(github_frame, text="GitHub设置", command=self.show_github_settings).pack(side=tk.LEFT, padx=5)
         
         # 设置权重，使得文本区域可以扩展
         form_frame.columnconfigure(1, weight=1)
         form_frame.rowconfigure(6, weight=1)
         form_frame.rowconfigure(7, weight=1)
-        
-        # 绑定列表选择事件
-        self.agent_listbox.bind('<<ListboxSelect>>', self.on_agent_select)
     
     def create_form_field(self, parent, label_text, entry_name, row):
         ttk.Label(parent, text=label_text).grid(row=row, column=0, sticky="w", pady=5)
@@ -180,7 +244,16 @@ class AgentEditor:
     
     def load_agents(self):
         try:
-            if os.path.exists('agents.json'):
+            if self.shard_store.exists():
+                # 分片存储：按清单读取每个智能体的文件
+                self.agents = self.shard_store.load()
+                self.reindex_agents()
+                self.update_agent_listbox()
+                if self.agents:
+                    self.select_agent(0)
+                self.check_api_keys_on_load()
+                messagebox.showinfo("成功", f"已从 {self.shard_store.directory}/ 加载 {len(self.agents)} 个智能体（分片存储）")
+            elif os.path.exists('agents.json'):
                 # 检查文件是否为空
                 if os.path.getsize('agents.json') == 0:
                     messagebox.showinfo("提示", "agents.json文件为空，将创建新文件")
@@ -188,28 +261,23 @@ class AgentEditor:
                 else:
                     # 尝试加载文件
                     try:
-                        with open('agents.json', 'r', encoding='utf-8') as f:
-                            self.agents = json.load(f)
+                        self.agents = self.agent_file.load()
                             
-                        # 更新列表框
+                        # 重建搜索索引并更新列表框
+                        self.reindex_agents()
                         self.update_agent_listbox()
                         
                         # 如果有智能体，默认选择第一个
                         if self.agents:
-                            self.agent_listbox.selection_set(0)
-                            self.on_agent_select(None)
+                            self.select_agent(0)
                         
                         # 检查API密钥
                         self.check_api_keys_on_load()
                             
                         messagebox.showinfo("成功", f"已加载 {len(self.agents)} 个智能体")
-                    except json.JSONDecodeError as json_err:
-                        # JSON解析错误，创建备份并重置
-                        error_file = f"agents_error_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-                        backup_path = os.path.join(self.backup_dir, error_file)
-                        
-                        # 备份出错的文件
-                        shutil.copy2('agents.json', backup_path)
+                    except ValueError as json_err:
+                        # JSON解析错误，备份出错的文件并重置
+                        error_file = self.backup_store.save_raw('agents.json', 'error')
                         
                         messagebox.showwarning(
                             "警告", 
@@ -222,63 +290,134 @@ class AgentEditor:
                         self.agents = []
                         
                         # 立即保存一个有效的JSON文件
-                        with open('agents.json', 'w', encoding='utf-8') as f:
-                            json.dump(self.agents, f, ensure_ascii=False, indent=2)
+                        atomic_write('agents.json', b'[]')
             else:
                 messagebox.showinfo("提示", "未找到agents.json文件，将创建新文件")
                 self.agents = []
                 
                 # 立即创建空文件
-                with open('agents.json', 'w', encoding='utf-8') as f:
-                    json.dump(self.agents, f, ensure_ascii=False, indent=2)
+                atomic_write('agents.json', b'[]')
                 
         except Exception as e:
             messagebox.showerror("错误", f"加载agents.json失败: {str(e)}")
             # 确保agents被初始化为空列表，防止后续错误
             self.agents = []
     
-    def update_agent_listbox(self):
-        self.agent_listbox.delete(0, tk.END)
+    def reindex_agents(self):
+        """整体替换智能体列表后重建搜索索引
+
+        尚未加载的长文本字段先不参与索引，之后在空闲时分批读入。
+        """
+        self.search_index.rebuild((id(agent), agent) for agent in self.agents)
+        self.index_queue = [agent for agent in self.agents if not self.agent_file.is_loaded(agent)]
+        if self.index_queue and self.index_job is None:
+            self.index_job = self.root.after(1, self.index_lazy_fields)
+    
+    def index_lazy_fields(self, time_slice=0.05):
+        """在一个时间片内把未加载智能体的长文本字段加入搜索索引（只读取，不保留在内存中）"""
+        self.index_job = None
+        deadline = time.monotonic() + time_slice
+        done = 0
+        try:
+            for agent in self.index_queue:
+                if time.monotonic() > deadline:
+                    break
+                done += 1
+                if id(agent) not in self.search_index.doc_tokens:
+                    continue  # 已被删除
+                if self.agent_file.is_loaded(agent):
+                    self.search_index.update(id(agent), agent)
+                    continue
+                fields = dict(agent)
+                for name in LAZY_FIELDS:
+                    fields[name] = self.agent_file.read_field(agent, name)
+                self.search_index.update(id(agent), fields)
+        except (OSError, ValueError) as e:
+            print(f"读取系统提示词建立索引失败: {str(e)}")
+            done = len(self.index_queue)
+        del self.index_queue[:done]
+        
+        if self.search_var.get():
+            self.update_agent_listbox()
+        if self.index_queue:
+            self.index_job = self.root.after(1, self.index_lazy_fields)
+    
+    def loaded_agents(self):
+        """读入所有智能体的长文本字段后返回完整列表（用于备份、同步等需要全部内容的操作）"""
+        return self.agent_file.load_all(self.agents)
+    
+    def forget_agents(self):
+        """整体替换智能体列表前丢弃旧智能体在agents.json中的位置记录"""
         for agent in self.agents:
-            name = agent.get('name', 'Unnamed Agent')
-            self.agent_listbox.insert(tk.END, name)
+            self.agent_file.forget(agent)
     
-    def on_agent_select(self, event):
-        selected_indices = self.agent_listbox.curselection()
-        if selected_indices:
-            index = selected_indices[0]
-            if 0 <= index < len(self.agents):
-                # 更新当前索引
-                self.current_agent_index = index
-                agent = self.agents[index]
-                
-                # 填充表单
-                self.id_entry.delete(0, tk.END)
-                self.id_entry.insert(0, agent.get('id', ''))
-                
-                self.name_entry.delete(0, tk.END)
-                self.name_entry.insert(0, agent.get('name', ''))
-                
-                self.api_key_entry.delete(0, tk.END)
-                self.api_key_entry.insert(0, agent.get('apiKeyVariableName', ''))
-                
-                self.api_url_entry.delete(0, tk.END)
-                self.api_url_entry.insert(0, agent.get('apiUrl', ''))
-                
-                self.model_entry.delete(0, tk.END)
-                self.model_entry.insert(0, agent.get('model', ''))
-                
-                self.temp_entry.delete(0, tk.END)
-                self.temp_entry.insert(0, agent.get('temperature', 0.7))
-                
-                self.tokens_entry.delete(0, tk.END)
-                self.tokens_entry.insert(0, agent.get('max_tokens', 2048))
-                
-                self.prompt_text.delete(1.0, tk.END)
-                self.prompt_text.insert(tk.END, agent.get('systemPrompt', ''))
-                
-                self.welcome_text.delete(1.0, tk.END)
-                self.welcome_text.insert(tk.END, agent.get('welcomeMessage', ''))
+    def update_agent_listbox(self):
+        """刷新列表数据；列表视图只改动实际变化的行，选中项按智能体保持不变"""
+        self.agent_positions = {id(agent): i for i, agent in enumerate(self.agents)}
+        
+        # 有搜索词时只显示匹配的智能体
+        matches = self.search_index.search(self.search_var.get())
+        if matches is None:
+            self.visible_indices = list(range(len(self.agents)))
+        else:
+            self.visible_indices = [i for i, agent in enumerate(self.agents) if id(agent) in matches]
+        
+        self.agent_list.set_items(
+            (id(self.agents[index]), self.agents[index].get('name', 'Unnamed Agent'))
+            for index in self.visible_indices
+        )
+    
+    def select_agent(self, index):
+        """在列表框中选中指定下标的智能体并填充表单"""
+        key = id(self.agents[index])
+        if self.agent_list.index_of(key) is None:
+            # 被搜索过滤掉时清除搜索词（会触发列表刷新）
+            self.search_var.set('')
+        self.agent_list.select(key)
+        self.show_agent(index)
+    
+    def on_agent_select(self, key):
+        """用户在列表中选中了另一个智能体"""
+        index = self.agent_positions.get(key)
+        if index is not None and index != self.current_agent_index:
+            self.show_agent(index)
+    
+    def show_agent(self, index):
+        """把指定下标的智能体填充到表单"""
+        if 0 <= index < len(self.agents):
+            # 更新当前索引
+            self.current_agent_index = index
+            agent = self.agent_file.load_fields(self.agents[index])
+            
+            # 填充表单
+            self.id_entry.delete(0, tk.END)
+            self.id_entry.insert(0, agent.get('id', ''))
+            
+            self.name_entry.delete(0, tk.END)
+            self.name_entry.insert(0, agent.get('name', ''))
+            
+            self.api_key_entry.delete(0, tk.END)
+            self.api_key_entry.insert(0, agent.get('apiKeyVariableName', ''))
+            
+            self.api_url_entry.delete(0, tk.END)
+            self.api_url_entry.insert(0, agent.get('apiUrl', ''))
+            
+            self.model_entry.delete(0, tk.END)
+            self.model_entry.insert(0, agent.get('model', ''))
+            
+            self.temp_entry.delete(0, tk.END)
+            self.temp_entry.insert(0, agent.get('temperature', 0.7))
+            
+            self.tokens_entry.delete(0, tk.END)
+            self.tokens_entry.insert(0, agent.get('max_tokens', 2048))
+            
+            self.prompt_text.delete(1.0, tk.END)
+            self.prompt_text.insert(tk.END, agent.get('systemPrompt', ''))
+            
+            self.welcome_text.delete(1.0, tk.END)
+            self.welcome_text.insert(tk.END, agent.get('welcomeMessage', ''))
+            
+            self.cache_var.set(self.cache_mode(agent.get('cacheResponses')))
     
     def get_form_data(self):
         agent_id = self.id_entry.get().strip()
@@ -327,9 +466,18 @@ class AgentEditor:
             "systemPrompt": self.prompt_text.get(1.0, tk.END).strip(),
             "temperature": temperature,
             "max_tokens": max_tokens,
-            "welcomeMessage": self.welcome_text.get(1.0, tk.END).strip()
+            "welcomeMessage": self.welcome_text.get(1.0, tk.END).strip(),
+            "cacheResponses": CACHE_MODES.get(self.cache_var.get())
         }
     
+    @staticmethod
+    def cache_mode(setting):
+        """cacheResponses 的值对应的缓存选项名称"""
+        for mode, value in CACHE_MODES.items():
+            if value is setting:
+                return mode
+        return next(iter(CACHE_MODES))
+    
     def save_current_agent(self):
         if self.current_agent_index is None:
             messagebox.showinfo("提示", "请先选择要保存的智能体")
@@ -337,29 +485,118 @@ class AgentEditor:
         
         data = self.get_form_data()
         if data:
-            self.agents[self.current_agent_index] = data
+            # 原地更新，保留表单中没有的其他字段
+            agent = self.agents[self.current_agent_index]
+            agent.update(data)
+            if agent.get('cacheResponses') is None:
+                agent.pop('cacheResponses', None)
+            self.search_index.update(id(agent), agent)
             self.update_agent_listbox()
+            self.schedule_autosave()
             messagebox.showinfo("成功", f"已更新智能体: {data['name']}")
     
+    def snapshot_agents(self):
+        """在界面线程中固定要保存的智能体列表
+        
+        已加载的智能体复制一份浅拷贝，之后表单再修改也不影响后台正在写入的内容；
+        未加载的智能体保留原对象，保存时直接复制原文件中的字节。
+        """
+        return [dict(agent) if self.agent_file.is_loaded(agent) else agent for agent in self.agents]
+    
+    def write_agents(self, agents, backup):
+        """在后台线程中执行的保存任务，返回 (描述, 备份名称)
+        
+        backup 为 None 表示自动保存：每次运行只在第一次自动保存前备份磁盘上的旧版本。
+        """
+        if backup is None:
+            backup = not self.autosave_backed_up
+            self.autosave_backed_up = True
+        backup_name = None
+        if self.shard_store.exists():
+            # 分片存储：自动备份直接引用清单中的哈希，只有备份中还没有的分片才会被读取
+            if backup:
+                backup_name, written = self.backup_store.save_objects(self.shard_store.backup_items(), 'auto')
+                print(f"自动备份已创建: {backup_name}（新写入 {written} 个智能体对象）")
+            shards_written, shards_removed = self.shard_store.save(agents)
+            return (f"已保存 {len(agents)} 个智能体到 {self.shard_store.directory}/\n"
+                    f"写入 {shards_written} 个分片，删除 {shards_removed} 个分片"), backup_name
+        
+        if backup and os.path.exists('agents.json'):
+            # 备份当前文件：只有内容变化的智能体才会写入新对象
+            try:
+                with open('agents.json', 'r', encoding='utf-8') as f:
+                    previous_agents = json.load(f)
+                backup_name, written = self.backup_store.save_snapshot(previous_agents, 'auto')
+                print(f"自动备份已创建: {backup_name}（新写入 {written} 个智能体对象）")
+            except json.JSONDecodeError:
+                backup_name = self.backup_store.save_raw('agents.json', 'auto')
+                print(f"自动备份已创建: {backup_name}")
+        
+        # 保存到agents.json文件（未加载的智能体直接复制原文件内容，临时文件写完后原子替换）
+        self.agent_file.save(agents)
+        return f"已保存 {len(agents)} 个智能体到agents.json", backup_name
+    
+    def schedule_autosave(self):
+        """修改智能体后调用：最后一次修改之后 AUTOSAVE_DELAY 秒在后台保存一次"""
+        if not self.autosave_var.get():
+            self.save_status.config(text="有未保存的修改")
+            return
+        self.save_status.config(text="等待自动保存...")
+        self.submit_save('agents', lambda agents=self.snapshot_agents(): self.write_agents(agents, None),
+                         self.on_autosaved, AUTOSAVE_DELAY)
+    
+    def on_autosaved(self, result, error):
+        if error is not None:
+            self.save_status.config(text="自动保存失败")
+            messagebox.showerror("错误", f"自动保存失败: {str(error)}")
+            return
+        self.save_status.config(text=f"已自动保存 {datetime.datetime.now().strftime('%H:%M:%S')}")
+    
+    def submit_save(self, name, job, on_done=None, delay=0.0):
+        """提交后台保存任务，并在界面线程中轮询完成结果"""
+        self.save_pipeline.submit(name, job, on_done, delay)
+        if self.save_poll_job is None:
+            self.save_poll_job = self.root.after(100, self.poll_saves)
+    
+    def poll_saves(self):
+        self.save_poll_job = None
+        self.save_pipeline.drain()
+        if self.save_pipeline.busy():
+            self.save_poll_job = self.root.after(100, self.poll_saves)
+    
     def save_all_agents(self):
+        """立即保存（同时创建自动备份），取代尚未执行的自动保存"""
+        self.save_status.config(text="正在保存...")
+        sharded = self.shard_store.exists()
+        
+        def done(result, error):
+            if error is not None:
+                self.save_status.config(text="保存失败")
+                if sharded:
+                    messagebox.showerror("错误", f"保存分片存储失败: {str(error)}")
+                else:
+                    messagebox.showerror("错误", f"保存agents.json失败: {str(error)}")
+                return
+            self.save_status.config(text=f"已保存 {datetime.datetime.now().strftime('%H:%M:%S')}")
+            messagebox.showinfo("成功", f"{result[0]}\n同时创建了自动备份。")
+        
+        self.submit_save('agents', lambda agents=self.snapshot_agents(): self.write_agents(agents, True), done)
+    
+    def convert_to_shards(self):
+        """把当前智能体写成分片存储（agents/ 目录），之后保存时不再改写agents.json"""
+        if self.shard_store.exists():
+            messagebox.showinfo("提示", f"已经在使用分片存储: {self.shard_store.directory}/")
+            return
+        if not messagebox.askyesno("确认", "要把智能体转换为分片存储吗？\n"
+                                         f"每个智能体将保存为 {self.shard_store.directory}/ 下的单独文件，"
+                                         "网页端会优先读取其中的清单。\nagents.json 将保留但不再更新。"):
+            return
         try:
-            # 在保存前先创建自动备份
-            if os.path.exists('agents.json'):
-                # 创建带时间戳的自动备份文件名
-                timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-                backup_name = f"agents_auto_backup_{timestamp}.json"
-                backup_path = os.path.join(self.backup_dir, backup_name)
-                
-                # 复制当前文件作为备份
-                shutil.copy2('agents.json', backup_path)
-                print(f"自动备份已创建: {backup_name}")
-            
-            # 保存到agents.json文件
-            with open('agents.json', 'w', encoding='utf-8') as f:
-                json.dump(self.agents, f, ensure_ascii=False, indent=2)
-            messagebox.showinfo("成功", f"已保存 {len(self.agents)} 个智能体到agents.json\n同时创建了自动备份。")
+            self.save_pipeline.flush()  # 先写完尚未执行的自动保存
+            written, _ = self.shard_store.save(self.loaded_agents())
+            messagebox.showinfo("成功", f"已转换为分片存储，写入 {written} 个分片")
         except Exception as e:
-            messagebox.showerror("错误", f"保存agents.json失败: {str(e)}")
+            messagebox.showerror("错误", f"转换为分片存储失败: {str(e)}")
     
     def new_agent(self):
         # 生成一个新的ID
@@ -386,14 +623,14 @@ class AgentEditor:
         
         # 添加到列表
         self.agents.append(new_agent)
+        self.search_index.add(id(new_agent), new_agent)
         
         # 更新列表框
         self.update_agent_listbox()
         
         # 选择新智能体
-        self.agent_listbox.selection_clear(0, tk.END)
-        self.agent_listbox.selection_set(len(self.agents) - 1)
-        self.on_agent_select(None)
+        self.select_agent(len(self.agents) - 1)
+        self.schedule_autosave()
     
     def validate_api_key(self, api_key):
         """验证 API 密钥格式"""
@@ -423,18 +660,20 @@ class AgentEditor:
         
         agent_name = self.agents[self.current_agent_index].get('name', 'Unnamed Agent')
         if messagebox.askyesno("确认", f"确定要删除智能体 '{agent_name}' 吗?"):
-            del self.agents[self.current_agent_index]
+            removed = self.agents.pop(self.current_agent_index)
+            self.search_index.remove(id(removed))
+            self.agent_file.forget(removed)
             self.update_agent_listbox()
             
             # 更新当前索引
             if self.agents:
                 new_index = min(self.current_agent_index, len(self.agents) - 1)
-                self.agent_listbox.selection_set(new_index)
                 self.current_agent_index = new_index
-                self.on_agent_select(None)
+                self.select_agent(new_index)
             else:
                 self.current_agent_index = None
                 self.clear_form()
+            self.schedule_autosave()
     
     def duplicate_agent(self):
         if self.current_agent_index is None:
@@ -442,7 +681,7 @@ class AgentEditor:
             return
         
         # 复制当前智能体
-        agent_copy = self.agents[self.current_agent_index].copy()
+        agent_copy = self.agent_file.load_fields(self.agents[self.current_agent_index]).copy()
         
         # 修改ID和名称
         agent_copy["id"] = f"{agent_copy['id']}_copy"
@@ -450,14 +689,14 @@ class AgentEditor:
         
         # 添加到列表
         self.agents.append(agent_copy)
+        self.search_index.add(id(agent_copy), agent_copy)
         
         # 更新列表框
         self.update_agent_listbox()
         
         # 选择新智能体
-        self.agent_listbox.selection_clear(0, tk.END)
-        self.agent_listbox.selection_set(len(self.agents) - 1)
-        self.on_agent_select(None)
+        self.select_agent(len(self.agents) - 1)
+        self.schedule_autosave()
     
     def clear_form(self):
         self.id_entry.delete(0, tk.END)
@@ -469,6 +708,7 @@ class AgentEditor:
         self.tokens_entry.delete(0, tk.END)
         self.prompt_text.delete(1.0, tk.END)
         self.welcome_text.delete(1.0, tk.END)
+        self.cache_var.set(self.cache_mode(None))
     
     def export_agents(self):
         file_path = filedialog.asksaveasfilename(
@@ -479,8 +719,7 @@ class AgentEditor:
         
         if file_path:
             try:
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    json.dump(self.agents, f, ensure_ascii=False, indent=2)
+                self.agent_file.save(self.agents, file_path)
                 messagebox.showinfo("成功", f"已导出 {len(self.agents)} 个智能体到 {file_path}")
             except Exception as e:
                 messagebox.showerror("错误", f"导出失败: {str(e)}")
@@ -501,17 +740,19 @@ class AgentEditor:
                     return
                 
                 if messagebox.askyesno("确认", f"已找到 {len(imported_agents)} 个智能体。要替换当前所有智能体吗?"):
+                    self.forget_agents()
                     self.agents = imported_agents
                 else:
                     self.agents.extend(imported_agents)
                 
+                self.reindex_agents()
                 self.update_agent_listbox()
+                self.schedule_autosave()
                 messagebox.showinfo("成功", f"已导入 {len(imported_agents)} 个智能体")
                 
                 # 选择第一个智能体
                 if self.agents:
-                    self.agent_listbox.selection_set(0)
-                    self.on_agent_select(None)
+                    self.select_agent(0)
             except Exception as e:
                 messagebox.showerror("错误", f"导入失败: {str(e)}")
 
@@ -521,19 +762,28 @@ class AgentEditor:
             messagebox.showwarning("提示", "没有可备份的智能体配置")
             return
             
+        def done(result, error):
+            if error is not None:
+                messagebox.showerror("错误", f"创建备份失败: {str(error)}")
+                return
+            backup_name, written = result
+            messagebox.showinfo("成功", f"备份已创建: {backup_name}\n新写入 {written} 个智能体，其余未修改的智能体复用已有备份")
+        
         try:
-            # 创建带时间戳的备份文件名
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_name = f"agents_backup_{timestamp}.json"
-            backup_path = os.path.join(self.backup_dir, backup_name)
-            
-            # 写入备份文件
-            with open(backup_path, 'w', encoding='utf-8') as f:
-                json.dump(self.agents, f, ensure_ascii=False, indent=2)
-                
-            messagebox.showinfo("成功", f"备份已创建: {backup_name}")
+            agents = [dict(agent) for agent in self.loaded_agents()]
         except Exception as e:
             messagebox.showerror("错误", f"创建备份失败: {str(e)}")
+            return
+        # 计算哈希和写入备份对象在后台线程中进行
+        self.submit_save('backup', lambda: self.backup_store.save_snapshot(agents, 'manual'), done)
+    
+    def backup_label(self, entry):
+        """备份列表中显示的一行：时间、类型、智能体数量、大小和名称"""
+        kind = {'auto': '自动', 'manual': '手动', 'error': '错误'}.get(entry['kind'], entry['kind'])
+        count = '?' if entry['agent_count'] is None else entry['agent_count']
+        size = entry['size']
+        size_text = f"{size / 1024 / 1024:.1f}MB" if size >= 1024 * 1024 else f"{size / 1024:.1f}KB"
+        return f"{entry['created'].replace('T', ' ')}  [{kind}]  {count}个智能体  {size_text}  {entry['name']}"
     
     def restore_backup(self):
         """从备份文件恢复智能体配置"""
@@ -542,7 +792,9 @@ class AgentEditor:
             messagebox.showwarning("提示", "未找到备份目录")
             return
             
-        backup_files = [f for f in os.listdir(self.backup_dir) if f.endswith('.json')]
+        # 备份列表直接来自索引，不需要打开各个备份文件
+        backups = self.backup_store.list_snapshots()
+        backup_files = [entry['name'] for entry in backups]
         if not backup_files:
             messagebox.showwarning("提示", "没有可用的备份文件")
             return
@@ -568,10 +820,8 @@ class AgentEditor:
         backup_listbox.pack(fill=tk.BOTH, expand=True)
         scrollbar.config(command=backup_listbox.yview)
         
-        # 填充备份文件列表（按日期排序，最新的在前面）
-        backup_files.sort(reverse=True)
-        for file in backup_files:
-            backup_listbox.insert(tk.END, file)
+        # 填充备份文件列表（最新的在前面）
+        backup_listbox.insert(tk.END, *[self.backup_label(entry) for entry in backups])
         
         # 添加按钮
         button_frame = ttk.Frame(backup_window)
@@ -584,30 +834,113 @@ class AgentEditor:
                 return
                 
             selected_file = backup_files[selected[0]]
-            file_path = os.path.join(self.backup_dir, selected_file)
             
             try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    restored_agents = json.load(f)
+                restored_agents = self.backup_store.load_snapshot(selected_file)
                 
                 # 确认是否恢复
                 if messagebox.askyesno("确认", f"确定要从 {selected_file} 恢复智能体配置吗？\n这将覆盖当前的所有智能体配置。"):
+                    self.forget_agents()
                     self.agents = restored_agents
+                    self.reindex_agents()
                     self.update_agent_listbox()
                     
                     # 如果有智能体，默认选择第一个
                     if self.agents:
-                        self.agent_listbox.selection_set(0)
-                        self.on_agent_select(None)
+                        self.select_agent(0)
+                    self.schedule_autosave()
                         
                     messagebox.showinfo("成功", f"已从 {selected_file} 恢复 {len(self.agents)} 个智能体配置")
                     backup_window.destroy()
             except Exception as e:
                 messagebox.showerror("错误", f"恢复备份失败: {str(e)}")
         
+        def do_compare():
+            selected = backup_listbox.curselection()
+            if not selected:
+                messagebox.showwarning("提示", "请选择一个备份文件")
+                return
+            self.show_backup_diff(backup_files[selected[0]], backup_window)
+        
         ttk.Button(button_frame, text="恢复选中备份", command=do_restore).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="与当前配置比较", command=do_compare).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="取消", command=backup_window.destroy).pack(side=tk.RIGHT, padx=5)
     
+    def live_diff_entries(self):
+        """当前配置的比较条目；未加载的智能体直接用文件中的字节计算哈希，不读入长文本"""
+        entries = []
+        for agent in self.agents:
+            if self.agent_file.is_loaded(agent):
+                entries.append((agent.get('id'), agent_blob(agent)[0], lambda agent=agent: agent))
+            else:
+                entries.append((agent.get('id'), self.agent_file.stored_digest(agent),
+                                lambda agent=agent: self.agent_file.peek(agent)))
+        return entries
+    
+    def show_backup_diff(self, backup_name, parent):
+        """显示从当前配置恢复到备份后会发生的变化"""
+        try:
+            diff = diff_agents(self.live_diff_entries(), self.backup_store.diff_entries(backup_name))
+        except Exception as e:
+            messagebox.showerror("错误", f"比较备份失败: {str(e)}")
+            return
+        
+        diff_window = tk.Toplevel(parent)
+        diff_window.title(f"恢复 {backup_name} 将发生的变化")
+        diff_window.geometry("800x550")
+        
+        ttk.Label(diff_window, text=diff.summary()).pack(anchor="w", padx=10, pady=10)
+        
+        # 上方为变化的智能体列表，下方为选中智能体的字段差异
+        paned = ttk.PanedWindow(diff_window, orient=tk.VERTICAL)
+        paned.pack(fill=tk.BOTH, expand=True, padx=10)
+        
+        list_frame = ttk.Frame(paned)
+        scrollbar = ttk.Scrollbar(list_frame)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        change_listbox = tk.Listbox(list_frame, height=10, yscrollcommand=scrollbar.set, exportselection=False)
+        change_listbox.pack(fill=tk.BOTH, expand=True)
+        scrollbar.config(command=change_listbox.yview)
+        paned.add(list_frame, weight=1)
+        
+        detail_text = scrolledtext.ScrolledText(paned, wrap=tk.NONE, height=15)
+        paned.add(detail_text, weight=2)
+        
+        # 每一行对应 (类型, 智能体或 ModifiedAgent)
+        rows = [('modified', item) for item in diff.modified]
+        rows += [('added', agent) for agent in diff.added]
+        rows += [('removed', agent) for agent in diff.removed]
+        labels = []
+        for kind, item in rows:
+            if kind == 'modified':
+                labels.append(f"~ {item.name} ({item.new.get('id', '')}): {', '.join(item.fields)}")
+            elif kind == 'added':
+                labels.append(f"+ {item.get('name', '')} ({item.get('id', '')})  恢复后新增")
+            else:
+                labels.append(f"- {item.get('name', '')} ({item.get('id', '')})  恢复后删除")
+        if labels:
+            change_listbox.insert(tk.END, *labels)
+        else:
+            detail_text.insert(tk.END, "备份与当前配置相同")
+        
+        def show_detail(event=None):
+            selected = change_listbox.curselection()
+            if not selected:
+                return
+            kind, item = rows[selected[0]]
+            # 只有选中修改过的智能体时才计算字段的文本差异
+            if kind == 'modified':
+                text = item.diff_text()
+            else:
+                text = json.dumps(item, ensure_ascii=False, indent=2)
+            detail_text.config(state=tk.NORMAL)
+            detail_text.delete(1.0, tk.END)
+            detail_text.insert(tk.END, text)
+            detail_text.config(state=tk.DISABLED)
+        
+        change_listbox.bind('<<ListboxSelect>>', show_detail)
+        ttk.Button(diff_window, text="关闭", command=diff_window.destroy).pack(pady=10)
+    
     def manage_backups(self):
         """管理备份文件"""
         # 获取备份文件列表
@@ -615,7 +948,9 @@ class AgentEditor:
             messagebox.showwarning("提示", "未找到备份目录")
             return
             
-        backup_files = [f for f in os.listdir(self.backup_dir) if f.endswith('.json')]
+        # 备份列表直接来自索引，不需要打开各个备份文件
+        backups = self.backup_store.list_snapshots()
+        backup_files = [entry['name'] for entry in backups]
         if not backup_files:
             messagebox.showwarning("提示", "没有可用的备份文件")
             return
@@ -641,10 +976,8 @@ class AgentEditor:
         backup_listbox.pack(fill=tk.BOTH, expand=True)
         scrollbar.config(command=backup_listbox.yview)
         
-        # 填充备份文件列表（按日期排序，最新的在前面）
-        backup_files.sort(reverse=True)
-        for file in backup_files:
-            backup_listbox.insert(tk.END, file)
+        # 填充备份文件列表（最新的在前面）
+        backup_listbox.insert(tk.END, *[self.backup_label(entry) for entry in backups])
         
         # 添加按钮
         button_frame = ttk.Frame(manage_window)
@@ -657,11 +990,10 @@ class AgentEditor:
                 return
                 
             selected_file = backup_files[selected[0]]
-            file_path = os.path.join(self.backup_dir, selected_file)
             
             try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    backup_content = json.load(f)
+                # 分页读取：只有翻到的那一页才会被读取并放入文本框
+                preview = self.backup_store.preview(selected_file)
                 
                 # 创建查看窗口
                 view_window = tk.Toplevel(manage_window)
@@ -672,13 +1004,34 @@ class AgentEditor:
                 text_area = scrolledtext.ScrolledText(view_window, wrap=tk.WORD)
                 text_area.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
                 
-                # 显示内容
-                formatted_content = json.dumps(backup_content, ensure_ascii=False, indent=2)
-                text_area.insert(tk.END, formatted_content)
-                text_area.config(state=tk.DISABLED)  # 设为只读
+                # 翻页按钮
+                page_frame = ttk.Frame(view_window)
+                page_frame.pack(fill=tk.X, pady=10)
+                page_label = ttk.Label(page_frame, text="")
+                current_page = [0]
+                
+                def show_page(index):
+                    index = min(max(0, index), preview.page_count - 1)
+                    try:
+                        page_text = preview.page(index)
+                    except Exception as e:
+                        messagebox.showerror("错误", f"读取备份内容失败: {str(e)}")
+                        return
+                    current_page[0] = index
+                    text_area.config(state=tk.NORMAL)
+                    text_area.delete(1.0, tk.END)
+                    text_area.insert(tk.END, page_text)
+                    text_area.config(state=tk.DISABLED)  # 设为只读
+                    page_label.config(text=f"第 {index + 1} / {preview.page_count} 页")
+                
+                ttk.Button(page_frame, text="上一页", command=lambda: show_page(current_page[0] - 1)).pack(side=tk.LEFT, padx=5)
+                page_label.pack(side=tk.LEFT, padx=5)
+                ttk.Button(page_frame, text="下一页", command=lambda: show_page(current_page[0] + 1)).pack(side=tk.LEFT, padx=5)
                 
                 # 添加关闭按钮
-                ttk.Button(view_window, text="关闭", command=view_window.destroy).pack(pady=10)
+                ttk.Button(page_frame, text="关闭", command=view_window.destroy).pack(side=tk.RIGHT, padx=5)
+                
+                show_page(0)
             except Exception as e:
                 messagebox.showerror("错误", f"查看备份失败: {str(e)}")
         
@@ -689,11 +1042,11 @@ class AgentEditor:
                 return
                 
             selected_file = backup_files[selected[0]]
-            file_path = os.path.join(self.backup_dir, selected_file)
             
             if messagebox.askyesno("确认", f"确定要删除备份文件 {selected_file} 吗？"):
                 try:
-                    os.remove(file_path)
+                    self.backup_store.delete_snapshot(selected_file)
+                    self.backup_store.collect_garbage()
                     messagebox.showinfo("成功", f"已删除备份文件 {selected_file}")
                     
                     # 更新列表
@@ -709,32 +1062,14 @@ class AgentEditor:
         ttk.Button(button_frame, text="删除备份", command=delete_backup).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="关闭", command=manage_window.destroy).pack(side=tk.RIGHT, padx=5)
 
-    def clean_old_backups(self, max_backups=30):
-        """清理旧备份文件，只保留最近的几个"""
+    def clean_old_backups(self, max_backups=1000):
+        """清理旧备份，只保留最近的几个
+
+        备份按智能体去重存储，每个快照只占几KB，因此可以保留更多历史。
+        """
         try:
-            if not os.path.exists(self.backup_dir):
-                return
-                
-            backup_files = [f for f in os.listdir(self.backup_dir) if f.endswith('.json')]
-            
-            # 如果备份文件数量未超过限制，不需要清理
-            if len(backup_files) <= max_backups:
-                return
-                
-            # 按文件名排序（因为包含时间戳，所以新文件会排在后面）
-            backup_files.sort()
-            
-            # 计算需要删除的文件数
-            files_to_delete = len(backup_files) - max_backups
-            
-            # 删除最老的文件
-            for i in range(files_to_delete):
-                file_path = os.path.join(self.backup_dir, backup_files[i])
-                try:
-                    os.remove(file_path)
-                    print(f"已清理旧备份: {backup_files[i]}")
-                except Exception as e:
-                    print(f"清理备份失败: {str(e)}")
+            for name in self.backup_store.prune(max_backups):
+                print(f"已清理旧备份: {name}")
         except Exception as e:
             print(f"清理备份过程中出错: {str(e)}")
 
@@ -746,108 +1081,183 @@ class AgentEditor:
             self.show_github_settings()
             return
         
-        # 先保存当前agents.json
+        # 分片存储有多个文件，通过单次提交同步
+        if self.shard_store.exists():
+            self.sync_batch_to_github()
+            return
+        
+        # 等待后台保存完成，避免与自动保存同时写agents.json
+        self.save_pipeline.flush()
+        self.save_pipeline.drain()
+        
+        # 序列化一次，同时用于写盘和上传
+        content = json.dumps(self.loaded_agents(), ensure_ascii=False, indent=2).encode('utf-8')
+        
+        # 磁盘上的agents.json内容不同时才重写
         try:
-            with open('agents.json', 'w', encoding='utf-8') as f:
-                # 使用全局导入的json模块
-                json.dump(self.agents, f, ensure_ascii=False, indent=2)
+            current = None
+            if os.path.exists('agents.json'):
+                with open('agents.json', 'rb') as f:
+                    current = f.read()
+            if current != content:
+                atomic_write('agents.json', content)
         except Exception as e:
             messagebox.showerror("错误", f"保存agents.json失败: {str(e)}")
             return
         
-        # 尝试读取文件内容
+        client = self.create_github_client()
+        # 记录上次已知的远程sha和ETag，远程未变化时GitHub只返回304
+        state = SyncState(os.path.join(self.config_dir, 'github_state.json'))
+        
         try:
-            with open('agents.json', 'r', encoding='utf-8') as f:
-                content = f.read()
+            uploaded, sha = client.sync_file(
+                self.github_config['file_path'],
+                self.github_config['branch'],
+                content,
+                f"Update agents.json via Agent Editor - {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+                state=state
+            )
+        except GitHubError as e:
+            messagebox.showerror("错误", f"同步到GitHub失败: {e.message}")
+            return
         except Exception as e:
-            messagebox.showerror("错误", f"读取agents.json失败: {str(e)}")
+            messagebox.showerror("错误", f"同步到GitHub失败: {str(e)}")
             return
         
-        # 导入需要的模块
-        import urllib.request
-        import urllib.error
-        import base64
+        repo_info = f"仓库: {self.github_config['owner']}/{self.github_config['repo']}\n分支: {self.github_config['branch']}"
+        if uploaded:
+            messagebox.showinfo("成功", f"已成功将agents.json同步到GitHub仓库\n{repo_info}")
+        else:
+            messagebox.showinfo("提示", f"GitHub上的agents.json已是最新，无需上传\n{repo_info}")
+    
+    def create_github_client(self):
+        """根据当前配置创建GitHub客户端"""
         import ssl
         
         # 创建不验证SSL证书的上下文
         ssl_context = ssl._create_unverified_context()
         
-        # GitHub文件上传需要提供文件的sha值(如果文件已存在)
-        sha = None
+        return GitHubClient(
+            self.github_config['owner'],
+            self.github_config['repo'],
+            token=self.get_github_token(),
+            api_base=self.github_config.get('api_base') or DEFAULT_API_BASE,
+            ssl_context=ssl_context
+        )
+    
+    @staticmethod
+    def is_local_only(filename):
+        """只在本地使用、不参与批量同步的文件：临时文件和备份索引数据库（含 -wal/-shm，可随时重建）"""
+        return filename.endswith('.tmp') or filename.startswith(CATALOG_NAME)
+    
+    def collect_batch_files(self, content):
+        """收集批量同步的文件：agents.json 加上配置中的其他路径（目录会递归包含）"""
+        files = {self.github_config['file_path']: content} if content is not None else {}
+        for local_path in self.github_config.get('batch_paths', '').split(','):
+            local_path = local_path.strip()
+            if not local_path or not os.path.exists(local_path):
+                continue
+            if os.path.isdir(local_path):
+                for dirpath, _, filenames in os.walk(local_path):
+                    for filename in sorted(filenames):
+                        if self.is_local_only(filename):
+                            continue
+                        full_path = os.path.join(dirpath, filename)
+                        with open(full_path, 'rb') as f:
+                            files[os.path.relpath(full_path).replace(os.sep, '/')] = f.read()
+            elif not self.is_local_only(os.path.basename(local_path)):
+                with open(local_path, 'rb') as f:
+                    files[os.path.relpath(local_path).replace(os.sep, '/')] = f.read()
+        return files
+    
+    def collect_shard_files(self, state):
+        """分片存储要同步的文件：只包含自上次同步以来哈希变化的分片
+        
+        返回 ({远程路径: 字节}, 要删除的远程路径, {远程路径: 哈希})。
+        """
+        owner, repo, branch = self.github_config['owner'], self.github_config['repo'], self.github_config['branch']
+        tracked = self.shard_store.tracked_files()
+        files = {}
+        hashes = {}
+        for remote_path, (digest, local_path) in tracked.items():
+            if state.get(state.key(owner, repo, branch, remote_path)).get('hash') != digest:
+                files[remote_path] = self.shard_store.read_file(local_path)
+                hashes[remote_path] = digest
+        
+        # 上次同步过、现在已不存在的分片
+        root_key = state.key(owner, repo, branch, '')
+        shard_prefix = os.path.basename(os.path.normpath(self.shard_store.directory)) + '/'
+        deleted = []
+        for key in state.entries:
+            remote_path = key[len(root_key):]
+            if key.startswith(root_key) and remote_path.startswith(shard_prefix) and remote_path not in tracked:
+                deleted.append(remote_path)
+        
+        # 配置中的其他路径照常同步（分片目录本身除外）
+        for remote_path, data in self.collect_batch_files(None).items():
+            if not remote_path.startswith(shard_prefix):
+                files[remote_path] = data
+        return files, deleted, hashes
+    
+    def record_shard_sync(self, state, hashes, deleted):
+        """记录已同步分片的哈希，下次同步时跳过未变化的分片"""
+        if not hashes and not deleted:
+            return
+        owner, repo, branch = self.github_config['owner'], self.github_config['repo'], self.github_config['branch']
+        for remote_path, digest in hashes.items():
+            state.entries.setdefault(state.key(owner, repo, branch, remote_path), {})['hash'] = digest
+        state.remove([state.key(owner, repo, branch, remote_path) for remote_path in deleted])
+    
+    def sync_batch_to_github(self):
+        """通过Git Data API把agents.json和其他文件放进同一次提交"""
+        if not self.github_config['owner'] or not self.github_config['repo']:
+            messagebox.showwarning("提示", "请先配置GitHub仓库信息")
+            self.show_github_settings()
+            return
+        
+        state = SyncState(os.path.join(self.config_dir, 'github_state.json'))
+        deleted = []
+        shard_hashes = {}
         try:
-            # 尝试获取GitHub上已有文件的信息
-            url = f"https://api.github.com/repos/{self.github_config['owner']}/{self.github_config['repo']}/contents/{self.github_config['file_path']}?ref={self.github_config['branch']}"
-            
-            # 询问是否需要GitHub访问令牌
-            access_token = self.get_github_token()
-            
-            if access_token:
-                headers = {
-                    "Accept": "application/vnd.github.v3+json",
-                    "Authorization": f"token {access_token}"
-                }
-                request = urllib.request.Request(url, headers=headers)
+            if self.shard_store.exists():
+                files, deleted, shard_hashes = self.collect_shard_files(state)
+                content = None
             else:
-                request = urllib.request.Request(url)
-                
-            try:
-                # 使用不验证SSL证书的上下文
-                with urllib.request.urlopen(request, context=ssl_context) as response:
-                    # 使用json模块
-                    response_content = response.read().decode('utf-8')
-                    github_data = json.loads(response_content)
-                    sha = github_data.get('sha')
-            except urllib.error.HTTPError as e:
-                if e.code != 404:  # 404意味着文件不存在，这是正常的
-                    messagebox.showerror("错误", f"获取GitHub文件信息失败: {str(e)}")
-                    return
+                content = json.dumps(self.loaded_agents(), ensure_ascii=False, indent=2).encode('utf-8')
+                files = self.collect_batch_files(content)
         except Exception as e:
-            messagebox.showerror("错误", f"获取GitHub文件信息失败: {str(e)}")
+            messagebox.showerror("错误", f"读取要同步的文件失败: {str(e)}")
+            return
+        
+        if not files and not deleted:
+            messagebox.showinfo("提示", "所有分片自上次同步以来都没有变化，无需提交")
             return
         
-        # 准备上传文件
+        client = self.create_github_client()
         try:
-            url = f"https://api.github.com/repos/{self.github_config['owner']}/{self.github_config['repo']}/contents/{self.github_config['file_path']}"
-            
-            # 准备请求数据
-            upload_data = {
-                "message": f"Update agents.json via Agent Editor - {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
-                "content": base64.b64encode(content.encode('utf-8')).decode('utf-8'),
-                "branch": self.github_config['branch']
-            }
-            
-            if sha:
-                upload_data["sha"] = sha
-            
-            # 将数据转换为JSON字符串
-            upload_json_data = json.dumps(upload_data).encode('utf-8')
-            
-            # 创建请求
-            if access_token:
-                headers = {
-                    "Accept": "application/vnd.github.v3+json",
-                    "Content-Type": "application/json",
-                    "Authorization": f"token {access_token}"
-                }
-                request = urllib.request.Request(url, data=upload_json_data, headers=headers, method="PUT")
-            else:
-                headers = {
-                    "Accept": "application/vnd.github.v3+json",
-                    "Content-Type": "application/json"
-                }
-                request = urllib.request.Request(url, data=upload_json_data, headers=headers, method="PUT")
-            
-            # 发送请求
-            try:
-                # 使用不验证SSL证书的上下文
-                with urllib.request.urlopen(request, context=ssl_context) as response:
-                    response_data = json.loads(response.read().decode('utf-8'))
-                    messagebox.showinfo("成功", f"已成功将agents.json同步到GitHub仓库\n仓库: {self.github_config['owner']}/{self.github_config['repo']}\n分支: {self.github_config['branch']}")
-            except urllib.error.HTTPError as e:
-                error_message = e.read().decode('utf-8')
-                messagebox.showerror("错误", f"同步到GitHub失败: {error_message}")
+            committed, commit_sha = client.commit_files(
+                self.github_config['branch'],
+                files,
+                f"Update {len(files)} files via Agent Editor - {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+                deleted=deleted
+            )
+        except GitHubError as e:
+            messagebox.showerror("错误", f"批量同步到GitHub失败: {e.message}")
+            return
         except Exception as e:
-            messagebox.showerror("错误", f"同步到GitHub失败: {str(e)}")
+            messagebox.showerror("错误", f"批量同步到GitHub失败: {str(e)}")
+            return
+        
+        self.record_shard_sync(state, shard_hashes, deleted)
+        if committed:
+            if content is not None:
+                # 单文件同步的缓存也随之更新，下次同步agents.json时无需重新上传
+                state_key = state.key(self.github_config['owner'], self.github_config['repo'],
+                                      self.github_config['branch'], self.github_config['file_path'])
+                state.update(state_key, sha=git_blob_sha(content), etag=None)
+            messagebox.showinfo("成功", f"已在一次提交中同步 {len(files)} 个文件\n提交: {commit_sha[:7]}\n请求次数: {client.request_count}")
+        else:
+            messagebox.showinfo("提示", f"GitHub上的 {len(files)} 个文件已是最新，无需提交")
     
     def get_github_token(self):
         """获取GitHub访问令牌"""
@@ -955,6 +1365,13 @@ class AgentEditor:
         file_path_entry.grid(row=row, column=1, sticky="ew", pady=5)
         file_path_entry.insert(0, self.github_config['file_path'])
         
+        # 批量同步的其他路径
+        row += 1
+        ttk.Label(content_frame, text="批量同步的其他路径:").grid(row=row, column=0, sticky="w", pady=5)
+        batch_paths_entry = ttk.Entry(content_frame, width=30)
+        batch_paths_entry.grid(row=row, column=1, sticky="ew", pady=5)
+        batch_paths_entry.insert(0, self.github_config.get('batch_paths', ''))
+        
         # GitHub令牌管理
         row += 1
         ttk.Label(content_frame, text="GitHub访问令牌:").grid(row=row, column=0, sticky="w", pady=5)
@@ -975,6 +1392,8 @@ class AgentEditor:
 3. 仓库名为您要上传到的仓库名称
 4. 分支通常为main或master
 5. 访问令牌可以在GitHub的Settings->Developer settings->Personal access tokens中创建
+6. 批量同步的其他路径用逗号分隔（如 backups,agents），目录会递归包含，
+   所有文件与agents.json放进同一次提交
         """
         help_label = ttk.Label(content_frame, text=help_text, wraplength=450, justify="left")
         help_label.grid(row=row, column=0, columnspan=2, sticky="ew", pady=10)
@@ -996,6 +1415,7 @@ class AgentEditor:
             self.github_config['repo'] = repo_entry.get().strip()
             self.github_config['branch'] = branch_entry.get().strip()
             self.github_config['file_path'] = file_path_entry.get().strip()
+            self.github_config['batch_paths'] = batch_paths_entry.get().strip()
             
             # 保存配置
             self.save_github_config()
@@ -1034,11 +1454,71 @@ class AgentEditor:
             warning_msg = "发现以下智能体的API密钥可能有问题：\n\n" + "\n".join(invalid_agents)
             warning_msg += "\n\n建议检查并更新这些智能体的API密钥配置。"
             messagebox.showwarning("API密钥检查", warning_msg)
+    
+    def validate_agents_live(self, concurrency=4, timeout=15):
+        """在线验证所有智能体的密钥、地址和模型
+        
+        相同的 (密钥, 地址, 模型) 只请求一次，请求在后台线程中并发进行，界面不会卡住。
+        """
+        if not self.agents:
+            messagebox.showinfo("提示", "没有可验证的智能体")
+            return
+        # 密钥、地址和模型都是轻量字段，不需要读取长文本
+        agents = [dict(agent) for agent in self.agents]
+        total = len(unique_targets(agents))
+        if not messagebox.askyesno("在线验证", f"将向接口发送 {total} 个最小请求（max_tokens=1）验证 {len(agents)} 个智能体，"
+                                             "可能产生少量费用。\n是否继续？"):
+            return
+        
+        result_window = tk.Toplevel(self.root)
+        result_window.title("在线验证结果")
+        result_window.geometry("750x500")
+        status_label = ttk.Label(result_window, text=f"正在验证... 0/{total}")
+        status_label.pack(anchor="w", padx=10, pady=10)
+        report_text = scrolledtext.ScrolledText(result_window, wrap=tk.WORD)
+        report_text.pack(fill=tk.BOTH, expand=True, padx=10)
+        ttk.Button(result_window, text="关闭", command=result_window.destroy).pack(pady=10)
+        
+        # 工作线程只写入这两个变量，界面线程轮询后更新控件
+        progress = {'done': 0, 'results': None, 'error': None}
+        
+        def on_result(result):
+            progress['done'] += 1
+        
+        def worker():
+            try:
+                progress['results'] = probe_agents(agents, concurrency=concurrency, timeout=timeout, on_result=on_result)
+            except Exception as e:
+                progress['error'] = e
+        
+        def poll():
+            if progress['error'] is not None:
+                status_label.config(text=f"验证失败: {str(progress['error'])}")
+            elif progress['results'] is not None:
+                results = progress['results']
+                ok_count = sum(result.ok for result in results)
+                status_label.config(text=f"验证完成: {ok_count}/{len(results)} 个组合可用")
+                report_text.insert(tk.END, format_report(agents, results))
+                report_text.config(state=tk.DISABLED)
+            else:
+                status_label.config(text=f"正在验证... {progress['done']}/{total}")
+                self.root.after(200, poll)
+        
+        threading.Thread(target=worker, name='api-probe', daemon=True).start()
+        self.root.after(200, poll)
 
 def main():
     root = tk.Tk()
     app = AgentEditor(root)
     
+    def on_close():
+        # 关闭窗口前写完尚未执行的自动保存
+        app.save_pipeline.flush()
+        app.save_pipeline.drain()
+        root.destroy()
+    
+    root.protocol("WM_DELETE_WINDOW", on_close)
+    
     # 在启动时显示欢迎消息和新功能介绍
     messagebox.showinfo(
         "欢迎使用智能体编辑器", 
@@ -1050,6 +1530,7 @@ def main():
 • 保存前会自动验证API密钥格式
 
 新增功能:
+• 自动保存: 修改智能体后在后台自动保存（写入临时文件后原子替换，不会留下半个文件）
 • 自动备份: 每次保存智能体配置时都会自动创建备份
 • 手动备份: 通过"创建备份"按钮随时保存当前配置
 • 备份恢复: 可以恢复到之前的任何一个备份点
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+智能体搜索索引
+
+对名称、模型、API地址和系统提示词建立内存倒排索引：
+- 英文/数字按单词切分，查询时支持前缀匹配（如 "gem" 匹配 gemini）
+- 中文等 CJK 文字按单字和相邻双字（n-gram）切分，无需分词即可做子串查询
+- 编辑单个智能体时只更新该智能体的词条，不重建整个索引
+"""
+
+import bisect
+import re
+
+# 参与索引的字段
+INDEXED_FIELDS = ('name', 'model', 'apiUrl', 'systemPrompt')
+
+WORD_PATTERN = re.compile(r'[0-9a-z]+')
+CJK_PATTERN = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]+')
+
+
+def tokenize(text):
+    """把文本切分为索引词条集合"""
+    text = (text or '').lower()
+    tokens = set(WORD_PATTERN.findall(text))
+    for run in CJK_PATTERN.findall(text):
+        tokens.update(run)
+        tokens.update(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def query_terms(query):
+    """把查询切分为 (英文单词列表, CJK 词条列表)
+
+    英文单词按前缀匹配；CJK 片段拆成相邻双字，所有双字都出现才算匹配。
+    """
+    query = (query or '').lower()
+    words = WORD_PATTERN.findall(query)
+    cjk_terms = []
+    for run in CJK_PATTERN.findall(query):
+        if len(run) == 1:
+            cjk_terms.append(run)
+        else:
+            cjk_terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return words, cjk_terms
+
+
+class AgentSearchIndex:
+    """按文档键索引智能体，文档键由调用方提供（同一智能体保持不变即可）"""
+
+    def __init__(self):
+        self.postings = {}    # 词条 -> 文档键集合
+        self.doc_tokens = {}  # 文档键 -> 词条集合（用于增量更新）
+        self._words = []      # 已排序的英文词表，用于前缀查询
+        self._words_dirty = False
+
+    def __len__(self):
+        return len(self.doc_tokens)
+
+    def agent_tokens(self, agent):
+        tokens = set()
+        for field in INDEXED_FIELDS:
+            value = agent.get(field)
+            if value:
+                tokens |= tokenize(str(value))
+        return tokens
+
+    def add(self, key, agent):
+        """加入或更新一个智能体，只改动新增和消失的词条"""
+        new_tokens = self.agent_tokens(agent)
+        old_tokens = self.doc_tokens.get(key)
+        if old_tokens is None:
+            # 新文档无需比较差异
+            postings = self.postings
+            for token in new_tokens:
+                docs = postings.get(token)
+                if docs is None:
+                    postings[token] = docs = set()
+                    self._words_dirty = True
+                docs.add(key)
+            self.doc_tokens[key] = new_tokens
+            return
+
+        for token in old_tokens - new_tokens:
+            docs = self.postings.get(token)
+            if docs is not None:
+                docs.discard(key)
+                if not docs:
+                    del self.postings[token]
+                    self._words_dirty = True
+        for token in new_tokens - old_tokens:
+            docs = self.postings.get(token)
+            if docs is None:
+                self.postings[token] = docs = set()
+                self._words_dirty = True
+            docs.add(key)
+
+        self.doc_tokens[key] = new_tokens
+
+    update = add
+
+    def remove(self, key):
+        for token in self.doc_tokens.pop(key, ()):
+            docs = self.postings.get(token)
+            if docs is not None:
+                docs.discard(key)
+                if not docs:
+                    del self.postings[token]
+                    self._words_dirty = True
+
+    def rebuild(self, items):
+        """用 (文档键, 智能体) 序列重建整个索引"""
+        self.postings = {}
+        self.doc_tokens = {}
+        self._words_dirty = True
+        for key, agent in items:
+            self.add(key, agent)
+
+    def sorted_words(self):
+        if self._words_dirty:
+            self._words = sorted(token for token in self.postings if WORD_PATTERN.fullmatch(token))
+            self._words_dirty = False
+        return self._words
+
+    def prefix_docs(self, prefix):
+        """所有以 prefix 开头的英文词条对应的文档"""
+        words = self.sorted_words()
+        start = bisect.bisect_left(words, prefix)
+        end = bisect.bisect_left(words, prefix + '\uffff')
+        if end - start == 1:
+            return self.postings[words[start]]
+        docs = set()
+        for word in words[start:end]:
+            docs |= self.postings[word]
+        return docs
+
+    def search(self, query):
+        """返回匹配全部查询词的文档键集合；查询为空时返回 None 表示不过滤"""
+        words, cjk_terms = query_terms(query)
+        if not words and not cjk_terms:
+            return None
+
+        candidates = [self.postings.get(term, set()) for term in cjk_terms]
+        candidates.extend(self.prefix_docs(word) for word in words)
+        candidates.sort(key=len)
+
+        result = set(candidates[0])
+        for docs in candidates[1:]:
+            if not result:
+                break
+            result &= docs
+        return result
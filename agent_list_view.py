@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+智能体列表视图
+
+在 Tk Listbox 之上提供增量更新和虚拟滚动：
+- 完整的行数据只保存在 Python 列表中，Listbox 里只放当前可见的一页
+- 每次刷新只比较可见页的新旧内容，去掉相同的前缀和后缀后只改动中间变化的行，
+  编辑一个智能体只需 O(1) 次控件操作
+- 选中状态按行键（而不是行号）记录，增删行后选中项保持不变
+"""
+
+import tkinter as tk
+
+try:
+    from tkinter import font as tkfont
+except ImportError:
+    tkfont = None
+
+
+def diff_window(old, new):
+    """比较新旧两页，返回 (起始位置, 需删除的旧行数, 需插入的新行列表)"""
+    start = 0
+    limit = min(len(old), len(new))
+    while start < limit and old[start] == new[start]:
+        start += 1
+
+    old_end, new_end = len(old), len(new)
+    while old_end > start and new_end > start and old[old_end - 1] == new[new_end - 1]:
+        old_end -= 1
+        new_end -= 1
+    return start, old_end - start, new[start:new_end]
+
+
+class AgentListView:
+    """虚拟滚动的列表视图，行数据为 [(键, 显示文字)]"""
+
+    def __init__(self, listbox, scrollbar, on_select=None, page_size=20):
+        self.listbox = listbox
+        self.scrollbar = scrollbar
+        self.on_select = on_select
+        self.page_size = page_size
+
+        self.items = []        # 全部行 [(键, 文字)]
+        self.positions = {}    # 键 -> 行号
+        self.rendered = []     # 当前 Listbox 中的行
+        self.rendered_offset = 0  # rendered 第一行对应的行号
+        self.offset = 0        # 可见页第一行的行号
+        self.selected_key = None
+        self.widget_ops = 0    # 控件操作计数，便于衡量刷新开销
+
+        # 滚动条控制虚拟偏移量，而不是 Listbox 自身的滚动
+        self.listbox.config(yscrollcommand='')
+        self.scrollbar.config(command=self.on_scroll)
+        self.listbox.bind('<<ListboxSelect>>', self.on_listbox_select)
+        self.listbox.bind('<MouseWheel>', self.on_mouse_wheel)
+        self.listbox.bind('<Button-4>', lambda event: self.scroll_by(-3))
+        self.listbox.bind('<Button-5>', lambda event: self.scroll_by(3))
+        self.listbox.bind('<Up>', lambda event: self.move_selection(-1))
+        self.listbox.bind('<Down>', lambda event: self.move_selection(1))
+        self.listbox.bind('<Configure>', self.on_configure)
+
+    # ---------- 数据 ----------
+
+    def set_items(self, items):
+        """替换全部行数据；控件只改动可见页中实际变化的行"""
+        self.items = list(items)
+        self.positions = {key: row for row, (key, _) in enumerate(self.items)}
+        self.clamp_offset()
+        self.render()
+
+    def index_of(self, key):
+        return self.positions.get(key)
+
+    def select(self, key):
+        """选中指定键的行并滚动到可见位置"""
+        self.selected_key = key if key in self.positions else None
+        row = self.positions.get(key)
+        if row is not None:
+            if row < self.offset:
+                self.offset = row
+            elif row >= self.offset + self.page_size:
+                self.offset = row - self.page_size + 1
+        self.render()
+
+    # ---------- 渲染 ----------
+
+    def clamp_offset(self):
+        max_offset = max(0, len(self.items) - self.page_size)
+        self.offset = min(max(0, self.offset), max_offset)
+
+    def align_rendered(self):
+        """滚动几行时先在两端删除/补入行，使已渲染的行与新的偏移量对齐"""
+        shift = self.offset - self.rendered_offset
+        if shift and abs(shift) < len(self.rendered):
+            if shift > 0:
+                self.listbox.delete(0, shift - 1)
+                self.rendered = self.rendered[shift:]
+            else:
+                head = self.items[self.offset:self.rendered_offset]
+                self.listbox.insert(0, *[label for _, label in head])
+                self.rendered = head + self.rendered
+            self.widget_ops += 1
+        self.rendered_offset = self.offset
+
+    def render(self):
+        self.align_rendered()
+        window = self.items[self.offset:self.offset + self.page_size]
+        start, delete_count, inserts = diff_window(self.rendered, window)
+        if delete_count:
+            self.listbox.delete(start, start + delete_count - 1)
+            self.widget_ops += 1
+        if inserts:
+            self.listbox.insert(start, *[label for _, label in inserts])
+            self.widget_ops += 1
+        self.rendered = window
+
+        # 恢复选中状态
+        self.listbox.selection_clear(0, tk.END)
+        row = self.positions.get(self.selected_key)
+        if row is not None and self.offset <= row < self.offset + len(window):
+            self.listbox.selection_set(row - self.offset)
+            self.listbox.activate(row - self.offset)
+
+        total = len(self.items)
+        if total:
+            self.scrollbar.set(self.offset / total, min(1.0, (self.offset + len(window)) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    # ---------- 事件 ----------
+
+    def on_listbox_select(self, event):
+        selection = self.listbox.curselection()
+        if not selection or selection[0] >= len(self.rendered):
+            return
+        key = self.rendered[selection[0]][0]
+        if key == self.selected_key:
+            return
+        self.selected_key = key
+        if self.on_select:
+            self.on_select(key)
+
+    def scroll_by(self, rows):
+        self.offset += rows
+        self.clamp_offset()
+        self.render()
+        return 'break'
+
+    def on_scroll(self, *args):
+        if not args:
+            return
+        if args[0] == 'moveto':
+            self.offset = int(float(args[1]) * len(self.items))
+        elif args[0] == 'scroll':
+            amount = int(args[1])
+            self.offset += amount * self.page_size if args[2] == 'pages' else amount
+        self.clamp_offset()
+        self.render()
+
+    def on_mouse_wheel(self, event):
+        return self.scroll_by(-3 if event.delta > 0 else 3)
+
+    def move_selection(self, step):
+        row = self.positions.get(self.selected_key)
+        row = 0 if row is None else min(max(0, row + step), len(self.items) - 1)
+        if self.items:
+            key = self.items[row][0]
+            self.select(key)
+            if self.on_select:
+                self.on_select(key)
+        return 'break'
+
+    def on_configure(self, event):
+        """窗口大小变化时按可见高度调整每页行数"""
+        line_height = 18
+        if tkfont is not None:
+            try:
+                line_height = tkfont.nametofont('TkDefaultFont').metrics('linespace') + 1
+            except (tk.TclError, RuntimeError):
+                pass
+        page_size = max(1, event.height // line_height)
+        if page_size != self.page_size:
+            self.page_size = page_size
+            self.clamp_offset()
+            self.render()
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+agents.json 延迟加载
+
+打开文件时只扫描一遍结构，记录每个智能体在文件中的位置，
+并解析 id、name、model 等轻量字段；systemPrompt、welcomeMessage
+这类可能很长的字段只记录位置，选中智能体时再从文件中读取。
+
+扫描用正则整段跳过字符串，不对长文本逐字符解析，
+打开上百 MB 的配置文件也只需很短时间，内存只与轻量字段的大小有关。
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import re
+import threading
+
+from save_pipeline import atomic_writer
+
+# 按需加载的长文本字段
+LAZY_FIELDS = ('systemPrompt', 'welcomeMessage')
+
+STRUCTURE_PATTERN = re.compile(rb'["{}\[\],:]')
+# 整个字符串（含转义）：普通字符整段匹配，只在反斜杠处前进两个字节
+STRING_PATTERN = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"', re.S)
+NON_WHITESPACE_PATTERN = re.compile(rb'\S')
+WHITESPACE = b' \t\r\n'
+
+
+class AgentFileError(ValueError):
+    """agents.json 结构不正确"""
+
+    def __init__(self, message, pos):
+        super().__init__(f"{message} (位置 {pos})")
+        self.pos = pos
+
+
+def string_end(data, start):
+    """返回从 start 处引号开始的字符串结束后的位置
+
+    用一个编译好的正则整段跳过字符串，提示词中大量的 \\" 也不会退化为逐个引号的 Python 循环。
+    """
+    match = STRING_PATTERN.match(data, start)
+    if match is None:
+        raise AgentFileError("字符串没有结束", start)
+    return match.end()
+
+
+def scan_agents(data):
+    """扫描 JSON 数组，返回每个智能体的 (起止位置, {字段名: (字段起点, 值起点, 值终点)})"""
+    first = NON_WHITESPACE_PATTERN.search(data)
+    start = first.start() if first else len(data)
+    if data[start:start + 1] != b'[':
+        raise AgentFileError("文件内容应为智能体数组", start)
+
+    entries = []
+    depth = 0
+    pos = start
+    agent_start = None
+    fields = None
+    key = None
+    key_start = None
+    value_start = None
+    outer_end = start  # 数组层上一个记号之后的位置，用于检查元素之间只有空白
+
+    def check_outer_gap(end):
+        if data[outer_end:end].strip(WHITESPACE):
+            raise AgentFileError("数组元素应为对象", outer_end)
+
+    while True:
+        match = STRUCTURE_PATTERN.search(data, pos)
+        if match is None:
+            raise AgentFileError("文件意外结束", len(data))
+        char = match.group()
+        pos = match.end()
+
+        if char == b'"':
+            pos = string_end(data, match.start())
+            if depth == 2 and key is None:
+                key_start = match.start()
+                raw_key = data[key_start + 1:pos - 1]
+                key = json.loads(data[key_start:pos]) if b'\\' in raw_key else raw_key.decode('utf-8')
+        elif char in (b'{', b'['):
+            depth += 1
+            if depth == 1:
+                outer_end = pos
+            elif depth == 2:
+                if char != b'{':
+                    raise AgentFileError("数组元素应为对象", match.start())
+                check_outer_gap(match.start())
+                agent_start = match.start()
+                fields = {}
+        elif char in (b'}', b']'):
+            if depth == 2 and key is not None:
+                fields[key] = (key_start, value_start, match.start())
+                key = None
+            depth -= 1
+            if depth == 1:
+                entries.append(((agent_start, match.end()), fields))
+                outer_end = pos
+            elif depth == 0:
+                check_outer_gap(match.start())
+                if data[pos:].strip(WHITESPACE):
+                    raise AgentFileError("数组之后还有多余内容", pos)
+                return entries
+        elif depth == 1 and char == b',':
+            check_outer_gap(match.start())
+            outer_end = pos
+        elif depth == 2:
+            if char == b':':
+                if key is None:
+                    raise AgentFileError("缺少字段名", match.start())
+                value_start = pos
+            elif key is not None:  # 逗号结束一个字段
+                fields[key] = (key_start, value_start, match.start())
+                key = None
+
+
+class AgentFile:
+    """延迟加载的 agents.json
+
+    load() 返回只含轻量字段的智能体字典列表，长文本字段在 load_fields()
+    时才读入同一个字典，因此编辑器其余代码仍然按普通字典使用智能体。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.pending = {}     # id(智能体) -> {字段名: (值起点, 值终点)}
+        self.spans = {}       # id(智能体) -> 整个对象的 (起点, 终点)
+        self.orders = {}      # id(智能体) -> 原文件中的字段顺序（相同顺序共用一个元组）
+        self.signature = None
+        # 后台保存与界面线程按需读取共用的锁（保存时会读取同一个文件并更新位置记录）
+        self.lock = threading.RLock()
+
+    def file_signature(self):
+        stat = os.stat(self.path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def load(self):
+        """扫描文件，返回轻量的智能体列表"""
+        with self.lock:
+            return self._load()
+
+    def _load(self):
+        self.pending = {}
+        self.spans = {}
+        self.orders = {}
+        shared_orders = {}
+        with open(self.path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                entries = scan_agents(data)
+                agents = []
+                for span, fields in entries:
+                    # 轻量字段拼成一个小对象一次解析
+                    parts = []
+                    lazy = {}
+                    for name, (key_start, value_start, value_end) in fields.items():
+                        if name in LAZY_FIELDS:
+                            lazy[name] = (value_start, value_end)
+                        else:
+                            parts.append(data[key_start:value_end])
+                    agent = json.loads(b'{' + b','.join(parts) + b'}')
+                    agents.append(agent)
+                    if lazy:
+                        self.pending[id(agent)] = lazy
+                        self.spans[id(agent)] = span
+                        order = tuple(fields)
+                        self.orders[id(agent)] = shared_orders.setdefault(order, order)
+            self.signature = self.file_signature()
+        return agents
+
+    def is_loaded(self, agent):
+        return id(agent) not in self.pending
+
+    def read_field(self, agent, name):
+        """读取某个尚未加载字段的值（不写入智能体），字段不存在时返回 None"""
+        with self.lock:
+            span = self.pending.get(id(agent), {}).get(name)
+            if span is None:
+                return None
+            if self.file_signature() != self.signature:
+                raise AgentFileError("agents.json 已被其他程序修改，请重新加载", span[0])
+            with open(self.path, 'rb') as f:
+                f.seek(span[0])
+                return json.loads(f.read(span[1] - span[0]))
+
+    def load_fields(self, agent):
+        """把长文本字段读入智能体字典；已加载时直接返回"""
+        with self.lock:
+            lazy = self.pending.get(id(agent))
+            if not lazy:
+                return agent
+            values = {name: self.read_field(agent, name) for name in lazy}
+            values.update(agent)  # 已在表单中修改过的字段不覆盖
+
+            # 按原文件的字段顺序原地重排，保存时与原格式一致
+            order = self.orders.get(id(agent), ())
+            agent.clear()
+            for name in order:
+                if name in values:
+                    agent[name] = values.pop(name)
+            agent.update(values)
+            self.forget(agent)
+            return agent
+
+    def peek(self, agent):
+        """返回包含长文本字段的完整副本，不把长文本留在智能体字典中"""
+        with self.lock:
+            lazy = self.pending.get(id(agent))
+            if not lazy:
+                return dict(agent)
+            values = {name: self.read_field(agent, name) for name in lazy}
+            values.update(agent)
+            order = self.orders.get(id(agent), ())
+            full = {name: values.pop(name) for name in order if name in values}
+            full.update(values)
+            return full
+
+    def stored_digest(self, agent):
+        """未加载智能体在文件中的内容按备份对象格式（单独 indent=2）计算的哈希
+
+        文件由 save() 写出时，对象文本只是每行多缩进两个空格（JSON 字符串中没有真正的换行），
+        去掉这层缩进即与备份对象逐字节相同，不需要解析长文本。已加载或无法判断时返回 None。
+        """
+        with self.lock:
+            span = self.spans.get(id(agent))
+            if span is None or self.file_signature() != self.signature:
+                return None
+            with open(self.path, 'rb') as f:
+                f.seek(span[0])
+                data = f.read(span[1] - span[0])
+        return hashlib.sha256(data.replace(b'\n  ', b'\n')).hexdigest()
+
+    def load_all(self, agents):
+        for agent in agents:
+            self.load_fields(agent)
+        return agents
+
+    def forget(self, agent):
+        """智能体被删除或整体替换时丢弃它的位置记录"""
+        with self.lock:
+            self.pending.pop(id(agent), None)
+            self.spans.pop(id(agent), None)
+            self.orders.pop(id(agent), None)
+
+    def save(self, agents, path=None):
+        """按 json.dump(indent=2) 的格式写出智能体列表（临时文件 + fsync + 原子替换）
+
+        尚未加载的智能体直接复制原文件中的字节，不需要先读入长文本；
+        写回自身文件时同步更新这些智能体的位置记录。可以在后台线程中调用。
+        """
+        path = path or self.path
+        with self.lock:
+            agents = list(agents)
+            moved = {}
+            source = None
+            if self.pending:
+                # 原文件被其他程序改过时位置记录失效，load_fields 会报错
+                if self.file_signature() == self.signature:
+                    source = open(self.path, 'rb')
+            try:
+                with atomic_writer(path) as out:
+                    if not agents:
+                        out.write(b'[]')
+                    for i, agent in enumerate(agents):
+                        out.write(b'[\n  ' if i == 0 else b',\n  ')
+                        if source is not None and id(agent) in self.pending:
+                            agent_start, agent_end = self.spans[id(agent)]
+                            source.seek(agent_start)
+                            shift = out.tell() - agent_start
+                            out.write(source.read(agent_end - agent_start))
+                            moved[id(agent)] = shift
+                        else:
+                            self.load_fields(agent)
+                            text = json.dumps(dict(agent), ensure_ascii=False, indent=2)
+                            out.write(text.replace('\n', '\n  ').encode('utf-8'))
+                    if agents:
+                        out.write(b'\n]')
+                    # Windows 上替换前必须关闭原文件
+                    if source is not None:
+                        source.close()
+                        source = None
+            finally:
+                if source is not None:
+                    source.close()
+
+            if os.path.abspath(path) == os.path.abspath(self.path):
+                for key, shift in moved.items():
+                    start, end = self.spans[key]
+                    self.spans[key] = (start + shift, end + shift)
+                    self.pending[key] = {name: (value_start + shift, value_end + shift)
+                                         for name, (value_start, value_end) in self.pending[key].items()}
+                self.signature = self.file_signature()
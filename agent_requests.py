@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按智能体 id 在服务器端组装聊天请求
+
+网页端只发送智能体 id（X-Agent-Id）和对话消息，服务器从 agents.json 中补上
+model、temperature、max_tokens、系统提示词和 API 密钥：
+- 几 KB 的系统提示词不必每轮都从浏览器上传
+- 每个智能体的请求体前缀（模型参数 + 系统提示词）只编码一次并缓存，
+  每次请求的前缀逐字节相同，上游的提示词缓存更容易命中
+- 配合 server.py --hide-agent-secrets，浏览器读到的 agents.json 中不再包含密钥
+"""
+
+import json
+
+from api_probe import agent_api_key
+from context_budget import fit_messages, input_budget, model_window
+
+# 由服务器按智能体配置决定、忽略客户端取值的字段
+SERVER_FIELDS = ('model', 'temperature', 'max_tokens', 'messages')
+
+# 提供给浏览器时隐藏的字段
+SECRET_FIELDS = ('apiKey', 'apiKeyVariableName')
+
+
+def encode(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+def redact_agent(agent):
+    """去掉密钥字段后的智能体副本"""
+    if not isinstance(agent, dict):
+        return agent
+    redacted = {name: ('' if name in SECRET_FIELDS else value) for name, value in agent.items()}
+    if isinstance(agent.get('fallbacks'), list):
+        # 备用接口也可能带有密钥（hedging.py）
+        redacted['fallbacks'] = [redact_agent(fallback) for fallback in agent['fallbacks']]
+    return redacted
+
+
+class AgentRequestBuilder:
+    """组装由服务器注入配置的请求体，缓存每个智能体的请求体前缀"""
+
+    def __init__(self):
+        self.prefixes = {}  # 智能体 id -> (配置签名, 前缀)
+
+    def clear(self):
+        self.prefixes.clear()
+
+    def prefix(self, agent):
+        """'{"model":..,"temperature":..,"max_tokens":..,"messages":[{系统消息}'"""
+        signature = (agent.get('model'), agent.get('temperature'), agent.get('max_tokens'),
+                     agent.get('systemPrompt') or '')
+        key = str(agent.get('id'))
+        cached = self.prefixes.get(key)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        model, temperature, max_tokens, system_prompt = signature
+        fields = [('model', model)]
+        if temperature is not None:
+            fields.append(('temperature', temperature))
+        if max_tokens:
+            fields.append(('max_tokens', max_tokens))
+        prefix = '{' + ''.join(f'{encode(name)}:{encode(value)},' for name, value in fields) + '"messages":['
+        if system_prompt:
+            prefix += encode({'role': 'system', 'content': system_prompt})
+        self.prefixes[key] = (signature, prefix)
+        return prefix
+
+    def build(self, agent, payload):
+        """按智能体配置组装请求体，返回 (请求体字节, 上下文预算统计或 None)
+
+        客户端发来的系统消息被忽略；历史按模型的上下文窗口裁剪（智能体可关闭）。
+        """
+        messages = [message for message in payload.get('messages') or []
+                    if isinstance(message, dict) and message.get('role') != 'system']
+        system_prompt = agent.get('systemPrompt') or ''
+
+        info = None
+        if agent.get('contextBudget') is not False:
+            window = model_window(agent.get('model'), agent)
+            max_tokens = agent.get('max_tokens') if isinstance(agent.get('max_tokens'), int) else None
+            budget = input_budget(window, max_tokens, agent.get('contextTokens'))
+            system = [{'role': 'system', 'content': system_prompt}] if system_prompt else []
+            kept, info = fit_messages(system + messages, budget)
+            info['window'] = window
+            messages = kept[len(system):]
+
+        prefix = self.prefix(agent)
+        separator = ',' if system_prompt else ''
+        body = prefix
+        if messages:
+            body += separator + ','.join(encode(message) for message in messages)
+        body += ']'
+        for name, value in payload.items():
+            if name not in SERVER_FIELDS:
+                body += f',{encode(name)}:{encode(value)}'
+        body += '}'
+        return body.encode('utf-8'), info
+
+    @staticmethod
+    def authorization(agent):
+        """智能体配置的密钥对应的 Authorization 头，没有密钥时返回 None"""
+        key = agent_api_key(agent)
+        return f'Bearer {key}' if key and key != 'YOUR_API_KEY_HERE' else None
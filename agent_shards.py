@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分片的智能体存储
+
+可选的存储格式，代替单个 agents.json：
+
+    agents/manifest.json     清单：每个智能体的 id、名称、模型、分片文件名和内容哈希
+    agents/<文件名>.json      每个智能体一个文件
+
+分片内容与去重备份中的对象完全相同（单个智能体 indent=2 的 JSON），
+清单中的哈希即备份对象的哈希，因此自动备份不需要重新序列化。
+保存时只写入哈希变化的分片；网页端先读取很小的清单渲染列表，
+选中智能体时再读取它的分片。
+"""
+
+import hashlib
+import json
+import os
+import re
+
+from backup_store import agent_blob
+from save_pipeline import atomic_write
+
+MANIFEST_NAME = 'manifest.json'
+# 清单中保存的轻量字段
+MANIFEST_FIELDS = ('id', 'name', 'model')
+
+SAFE_NAME_PATTERN = re.compile(r'[0-9A-Za-z_-]{1,64}')
+
+
+def shard_filename(agent_id, used):
+    """根据智能体 id 生成分片文件名；不安全的字符替换后附加 id 的哈希，重名时追加序号
+
+    used 是已占用的小写文件名（不区分大小写的文件系统上 A.json 和 a.json 是同一个文件），
+    应预先包含清单的文件名，id 为 manifest 的智能体不会覆盖清单。
+    """
+    agent_id = str(agent_id or '')
+    if SAFE_NAME_PATTERN.fullmatch(agent_id):
+        base = agent_id
+    else:
+        safe = re.sub(r'[^0-9A-Za-z_-]', '_', agent_id)[:40]
+        base = f"{safe}-{hashlib.sha1(agent_id.encode('utf-8')).hexdigest()[:8]}"
+
+    name = base + '.json'
+    suffix = 1
+    while name.lower() in used:
+        suffix += 1
+        name = f"{base}-{suffix}.json"
+    used.add(name.lower())
+    return name
+
+
+class ShardStore:
+    """读写 agents/ 目录，记录每个分片最后一次读写时的哈希用于判断是否需要重写"""
+
+    def __init__(self, directory='agents'):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, MANIFEST_NAME)
+        self.hashes = {}   # 文件名 -> 磁盘上内容的哈希
+        self.cache = {}    # 文件名 -> (哈希, 智能体)，供反复读取时复用未变化的分片
+        self.manifest_mtime = None
+
+    def exists(self):
+        return os.path.exists(self.manifest_path)
+
+    def read_manifest(self):
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def shard_path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def write_file(self, path, data):
+        atomic_write(path, data)
+
+    def load(self):
+        """按清单顺序读取所有智能体；哈希未变化的分片直接使用上次读取的结果"""
+        manifest = self.read_manifest()
+        self.manifest_mtime = os.path.getmtime(self.manifest_path)
+        agents = []
+        hashes = {}
+        cache = {}
+        for entry in manifest.get('agents', []):
+            filename = entry['file']
+            if filename.lower() == MANIFEST_NAME:
+                # 旧版本把 id 为 manifest 的智能体写到了清单的位置，该分片已被清单覆盖
+                continue
+            cached = self.cache.get(filename)
+            if cached is not None and cached[0] == entry.get('hash'):
+                digest, agent = cached
+            else:
+                with open(self.shard_path(filename), 'rb') as f:
+                    data = f.read()
+                digest = hashlib.sha256(data).hexdigest()
+                agent = json.loads(data.decode('utf-8'))
+            agents.append(agent)
+            hashes[filename] = digest
+            cache[filename] = (digest, agent)
+        self.hashes = hashes
+        self.cache = cache
+        return agents
+
+    def load_if_changed(self):
+        """清单修改过时重新读取，返回智能体列表；未变化时返回 None"""
+        try:
+            mtime = os.path.getmtime(self.manifest_path)
+        except OSError:
+            return None
+        if mtime == self.manifest_mtime:
+            return None
+        return self.load()
+
+    def save(self, agents):
+        """写入变化的分片和清单，删除不再使用的分片
+
+        返回 (写入的分片数, 删除的分片数)。
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        agents = list(agents)  # 可能在后台线程中保存，先固定列表
+        used = {MANIFEST_NAME}
+        entries = []
+        hashes = {}
+        written = 0
+        for agent in agents:
+            filename = shard_filename(agent.get('id'), used)
+            digest, data = agent_blob(agent)
+            if self.hashes.get(filename) != digest or not os.path.exists(self.shard_path(filename)):
+                self.write_file(self.shard_path(filename), data)
+                written += 1
+            hashes[filename] = digest
+
+            entry = {field: agent.get(field) for field in MANIFEST_FIELDS}
+            entry['file'] = filename
+            entry['hash'] = digest
+            entries.append(entry)
+
+        # 先写分片再写清单，读取方看到新清单时所引用的分片都已就绪
+        manifest = json.dumps({'version': 1, 'agents': entries}, ensure_ascii=False, indent=2).encode('utf-8')
+        self.write_file(self.manifest_path, manifest)
+        self.manifest_mtime = os.path.getmtime(self.manifest_path)
+
+        removed = 0
+        for filename in set(self.hashes) - set(hashes) - {MANIFEST_NAME}:
+            try:
+                os.remove(self.shard_path(filename))
+                removed += 1
+            except OSError:
+                pass
+        self.hashes = hashes
+        self.cache = {}
+        return written, removed
+
+    def read_file(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def backup_items(self):
+        """清单中各分片的 (哈希, 读取函数)，供 BackupStore.save_objects 使用"""
+        for entry in self.read_manifest().get('agents', []):
+            path = self.shard_path(entry['file'])
+            yield entry['hash'], lambda path=path: self.read_file(path)
+
+    def tracked_files(self):
+        """清单和全部分片的 {相对路径: (内容哈希, 本地路径)}，不读取分片内容"""
+        base = os.path.basename(os.path.normpath(self.directory))
+        manifest_data = self.read_file(self.manifest_path)
+        files = {f"{base}/{MANIFEST_NAME}": (hashlib.sha256(manifest_data).hexdigest(), self.manifest_path)}
+        for entry in json.loads(manifest_data.decode('utf-8')).get('agents', []):
+            files[f"{base}/{entry['file']}"] = (entry['hash'], self.shard_path(entry['file']))
+        return files
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+API 密钥与接口的在线验证
+
+格式检查只能发现明显错误的密钥；在线验证实际向接口发送一个 max_tokens=1 的请求：
+- 按 (apiKey, apiUrl, model) 去重，共用同一个密钥、地址和模型的智能体只验证一次
+- 用线程池并发验证，同时进行的请求数有上限，每个请求单独设置超时
+- 记录每个请求的耗时，并按 (接口地址, 模型) 汇总
+
+可以用 fake_openai.py 启动本地的 OpenAI 兼容接口进行离线测试。
+"""
+
+import concurrent.futures
+import json
+import time
+import urllib.error
+import urllib.request
+
+PLACEHOLDER_KEYS = ('', 'YOUR_API_KEY_HERE')
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_TIMEOUT = 15
+
+
+def agent_api_key(agent):
+    """智能体使用的密钥（与网页端一致，优先使用 apiKeyVariableName）"""
+    return (agent.get('apiKeyVariableName') or agent.get('apiKey') or '').strip()
+
+
+def probe_target(agent):
+    """智能体对应的验证目标 (apiKey, apiUrl, model)"""
+    return agent_api_key(agent), (agent.get('apiUrl') or '').strip(), (agent.get('model') or '').strip()
+
+
+def mask_key(api_key):
+    if len(api_key) <= 12:
+        return api_key[:3] + '...' if api_key else '(空)'
+    return f"{api_key[:8]}...{api_key[-4:]}"
+
+
+class ProbeResult:
+    """单个 (apiKey, apiUrl, model) 的验证结果"""
+
+    def __init__(self, target, agents):
+        self.api_key, self.api_url, self.model = target
+        self.agents = agents      # 使用该组合的智能体名称
+        self.ok = False
+        self.status = None        # HTTP 状态码，网络错误时为 None
+        self.latency = None       # 秒
+        self.message = ''
+
+    def describe(self):
+        latency = '' if self.latency is None else f"{self.latency * 1000:.0f}ms"
+        status = '' if self.status is None else f"HTTP {self.status}"
+        return ' '.join(part for part in (status, latency, self.message) if part)
+
+
+def unique_targets(agents):
+    """按验证目标分组，返回 {目标: [智能体名称]}（保持首次出现的顺序）"""
+    targets = {}
+    for i, agent in enumerate(agents, 1):
+        targets.setdefault(probe_target(agent), []).append(agent.get('name') or f'Agent {i}')
+    return targets
+
+
+def error_message(status, body):
+    """从错误响应中取出便于阅读的说明"""
+    try:
+        error = json.loads(body.decode('utf-8')).get('error')
+        if isinstance(error, dict) and error.get('message'):
+            return error['message']
+        if isinstance(error, str):
+            return error
+    except (ValueError, AttributeError):
+        pass
+    hints = {401: "密钥无效", 403: "没有访问权限", 404: "接口地址或模型不存在", 429: "请求过于频繁或额度不足"}
+    return hints.get(status, body[:200].decode('utf-8', errors='replace'))
+
+
+def probe(result, timeout=DEFAULT_TIMEOUT):
+    """发送一个最小的聊天请求验证密钥、地址和模型，结果写入 result"""
+    if result.api_key in PLACEHOLDER_KEYS:
+        result.message = "API密钥为空或仍是占位符"
+        return result
+    if not result.api_url.startswith(('http://', 'https://')):
+        result.message = "API地址无效"
+        return result
+
+    body = json.dumps({
+        'model': result.model,
+        'messages': [{'role': 'user', 'content': 'ping'}],
+        'max_tokens': 1,
+        'stream': False,
+    }).encode('utf-8')
+    request = urllib.request.Request(result.api_url, data=body, method='POST', headers={
+        'Content-Type': 'application/json',
+        'Authorization': f'Bearer {result.api_key}',
+    })
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            result.status = response.status
+            result.ok = True
+            result.message = "可用"
+    except urllib.error.HTTPError as e:
+        result.status = e.code
+        result.message = error_message(e.code, e.read())
+    except (urllib.error.URLError, OSError) as e:
+        reason = getattr(e, 'reason', e)
+        result.message = "请求超时" if isinstance(reason, TimeoutError) or 'timed out' in str(reason) else f"连接失败: {reason}"
+    finally:
+        result.latency = time.perf_counter() - start
+    return result
+
+
+def probe_agents(agents, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT, on_result=None):
+    """并发验证所有智能体用到的 (apiKey, apiUrl, model)
+
+    每个不同的组合只请求一次，同时最多 concurrency 个请求。
+    on_result(result) 在每个结果完成时调用（在工作线程中）。返回按原顺序排列的结果列表。
+    """
+    results = [ProbeResult(target, names) for target, names in unique_targets(agents).items()]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = [pool.submit(probe, result, timeout) for result in results]
+        for future in concurrent.futures.as_completed(futures):
+            if on_result is not None:
+                on_result(future.result())
+    return results
+
+
+def latency_summary(results):
+    """按 (接口地址, 模型) 汇总实际发出请求的耗时，返回 [(地址, 模型, 请求数, 成功数, 平均耗时, 最大耗时)]"""
+    groups = {}
+    for result in results:
+        if result.latency is None:  # 没有实际发出请求
+            continue
+        groups.setdefault((result.api_url, result.model), []).append(result)
+    summary = []
+    for (api_url, model), group in groups.items():
+        latencies = [result.latency for result in group]
+        summary.append((api_url, model, len(group), sum(result.ok for result in group),
+                        sum(latencies) / len(latencies), max(latencies)))
+    return summary
+
+
+def format_report(agents, results):
+    """生成文字报告"""
+    lines = [f"共 {len(agents)} 个智能体，去重后验证 {len(results)} 个 (密钥, 地址, 模型) 组合", ""]
+    for result in results:
+        mark = "✅" if result.ok else "❌"
+        names = ', '.join(result.agents[:3]) + (f" 等 {len(result.agents)} 个" if len(result.agents) > 3 else '')
+        lines.append(f"{mark} {result.model or '(未设置模型)'} @ {result.api_url or '(未设置地址)'}")
+        lines.append(f"   密钥: {mask_key(result.api_key)}  {result.describe()}")
+        lines.append(f"   智能体: {names}")
+    summary = latency_summary(results)
+    if summary:
+        lines += ["", "按接口和模型汇总的耗时:"]
+        for api_url, model, count, ok_count, average, longest in summary:
+            lines.append(f"   {model} @ {api_url}: {ok_count}/{count} 可用，平均 {average * 1000:.0f}ms，最长 {longest * 1000:.0f}ms")
+    return '\n'.join(lines)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+备份目录索引
+
+用 SQLite（backups/catalog.sqlite3）记录每个备份的时间、类型、智能体数量、大小
+以及其中每个智能体对象的哈希，备份对话框直接查询索引，不必逐个打开快照清单。
+
+索引只是快照清单的缓存：文件缺失或损坏时会从 snapshots/ 和旧版整文件备份重建。
+
+表结构：
+    snapshots        名称、类型、创建时间、智能体数量、大小、是否旧版、整文件对象哈希
+    snapshot_agents  快照中每个位置对应的对象哈希
+    objects          对象哈希 -> 大小、智能体 id 和名称
+"""
+
+import collections
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    name TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    created TEXT NOT NULL,
+    agent_count INTEGER,
+    size INTEGER NOT NULL DEFAULT 0,
+    legacy INTEGER NOT NULL DEFAULT 0,
+    raw TEXT
+);
+CREATE INDEX IF NOT EXISTS snapshots_created ON snapshots (created);
+CREATE TABLE IF NOT EXISTS snapshot_agents (
+    name TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (name, position)
+);
+CREATE INDEX IF NOT EXISTS snapshot_agents_digest ON snapshot_agents (digest);
+CREATE TABLE IF NOT EXISTS objects (
+    digest TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    agent_id TEXT,
+    agent_name TEXT
+);
+"""
+
+SNAPSHOT_COLUMNS = ('name', 'kind', 'created', 'agent_count', 'size', 'legacy', 'raw')
+
+
+class BackupCatalog:
+    """备份索引；后台保存线程和界面线程共用一个连接，用锁串行访问"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.executescript(SCHEMA)
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    # ---------- 写入 ----------
+
+    def add_snapshot(self, name, kind, created, digests=None, raw=None, size=None, legacy=False):
+        """记录一个快照
+
+        digests 为 None 表示无法按智能体拆分（整文件备份），智能体数量记为空；
+        size 为 None 时按对象大小求和（对象需已通过 add_object 记录）。
+        """
+        agent_count = None if digests is None else len(digests)
+        digests = list(digests or ())
+        with self.lock, self.connection:
+            if size is None:
+                size = 0
+                for digest, count in collections.Counter(digests).items():
+                    row = self.connection.execute('SELECT size FROM objects WHERE digest = ?', (digest,)).fetchone()
+                    if row:
+                        size += row[0] * count
+            self.connection.execute('DELETE FROM snapshot_agents WHERE name = ?', (name,))
+            self.connection.execute(
+                'INSERT OR REPLACE INTO snapshots (name, kind, created, agent_count, size, legacy, raw) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (name, kind, created, agent_count, size, int(legacy), raw))
+            self.connection.executemany(
+                'INSERT INTO snapshot_agents (name, position, digest) VALUES (?, ?, ?)',
+                ((name, position, digest) for position, digest in enumerate(digests)))
+
+    def add_object(self, digest, size, agent_id=None, agent_name=None):
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO objects (digest, size, agent_id, agent_name) VALUES (?, ?, ?, ?)',
+                (digest, size, agent_id, agent_name))
+
+    def has_object(self, digest):
+        with self.lock:
+            return self.connection.execute('SELECT 1 FROM objects WHERE digest = ?', (digest,)).fetchone() is not None
+
+    def remove_snapshot(self, name):
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM snapshot_agents WHERE name = ?', (name,))
+            self.connection.execute('DELETE FROM snapshots WHERE name = ?', (name,))
+
+    def remove_objects(self, digests):
+        with self.lock, self.connection:
+            self.connection.executemany('DELETE FROM objects WHERE digest = ?', ((digest,) for digest in digests))
+
+    # ---------- 查询 ----------
+
+    def snapshots(self, limit=None, offset=0):
+        """按创建时间列出快照（最新的在前，同一秒内按写入顺序），返回字典列表"""
+        sql = f"SELECT {', '.join(SNAPSHOT_COLUMNS)} FROM snapshots ORDER BY created DESC, rowid DESC"
+        params = ()
+        if limit is not None:
+            sql += ' LIMIT ? OFFSET ?'
+            params = (limit, offset)
+        with self.lock:
+            rows = self.connection.execute(sql, params).fetchall()
+        return [dict(zip(SNAPSHOT_COLUMNS, row)) for row in rows]
+
+    def snapshot(self, name):
+        with self.lock:
+            row = self.connection.execute(
+                f"SELECT {', '.join(SNAPSHOT_COLUMNS)} FROM snapshots WHERE name = ?", (name,)).fetchone()
+        return dict(zip(SNAPSHOT_COLUMNS, row)) if row else None
+
+    def names(self):
+        with self.lock:
+            return {row[0] for row in self.connection.execute('SELECT name FROM snapshots')}
+
+    def count(self):
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM snapshots').fetchone()[0]
+
+    def digests(self, name, start=0, stop=None):
+        """快照中 [start, stop) 位置的对象哈希"""
+        with self.lock:
+            if stop is None:
+                rows = self.connection.execute(
+                    'SELECT digest FROM snapshot_agents WHERE name = ? AND position >= ? ORDER BY position',
+                    (name, start)).fetchall()
+            else:
+                rows = self.connection.execute(
+                    'SELECT digest FROM snapshot_agents WHERE name = ? AND position >= ? AND position < ? '
+                    'ORDER BY position', (name, start, stop)).fetchall()
+        return [row[0] for row in rows]
+
+    def objects(self, digests):
+        """{哈希: (大小, 智能体id, 名称)}"""
+        result = {}
+        with self.lock:
+            for digest in set(digests):
+                row = self.connection.execute(
+                    'SELECT size, agent_id, agent_name FROM objects WHERE digest = ?', (digest,)).fetchone()
+                if row:
+                    result[digest] = row
+        return result
+
+    def referenced_digests(self):
+        """所有快照引用的对象哈希（含整文件备份）"""
+        with self.lock:
+            referenced = {row[0] for row in self.connection.execute('SELECT DISTINCT digest FROM snapshot_agents')}
+            referenced.update(row[0] for row in self.connection.execute(
+                'SELECT raw FROM snapshots WHERE raw IS NOT NULL'))
+        return referenced
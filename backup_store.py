@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+去重备份存储
+
+每个智能体单独序列化为一个以内容哈希命名的对象文件，
+每次备份只写一个很小的快照清单（记录各智能体的哈希）。
+未修改的智能体（尤其是很长的系统提示词）只会被写入一次。
+
+目录结构：
+    backups/objects/ab/abcdef....json   智能体对象（内容寻址）
+    backups/snapshots/<名称>.json        快照清单
+    backups/*.json                        旧版整文件备份（仍可查看和恢复）
+    backups/catalog.sqlite3               备份索引（见 backup_catalog.py），可随时删除后重建
+
+保存快照（后台保存线程）和清理未引用的对象（界面线程删除备份时）持有同一把锁：
+否则保存时判断为“已存在”而跳过写入的对象，可能在快照登记引用之前被清理掉。
+"""
+
+import datetime
+import hashlib
+import json
+import mmap
+import os
+import sqlite3
+import threading
+
+from agent_loader import AgentFileError, scan_agents
+from backup_catalog import BackupCatalog
+from save_pipeline import atomic_write
+
+# 备份类型 -> 名称前缀（与旧版备份文件名保持一致）
+KIND_PREFIXES = {
+    'auto': 'agents_auto_backup',
+    'manual': 'agents_backup',
+    'error': 'agents_error',
+}
+
+CATALOG_NAME = 'catalog.sqlite3'
+
+# 预览时每页显示的智能体数；无法按智能体分页的整文件备份按字节分页
+PREVIEW_PAGE_AGENTS = 10
+PREVIEW_PAGE_BYTES = 64 * 1024
+
+
+def kind_of(name):
+    """根据名称前缀判断备份类型（旧版备份没有清单）"""
+    for kind, prefix in sorted(KIND_PREFIXES.items(), key=lambda item: -len(item[1])):
+        if name.startswith(prefix):
+            return kind
+    return 'manual'
+
+
+def agent_blob(agent):
+    """把单个智能体序列化为对象内容，返回 (哈希, 字节)"""
+    data = json.dumps(agent, ensure_ascii=False, indent=2).encode('utf-8')
+    return hashlib.sha256(data).hexdigest(), data
+
+
+class BackupStore:
+    """内容寻址的智能体备份存储"""
+
+    def __init__(self, backup_dir='backups'):
+        self.backup_dir = backup_dir
+        self.objects_dir = os.path.join(backup_dir, 'objects')
+        self.snapshots_dir = os.path.join(backup_dir, 'snapshots')
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+        # 保存快照与清理对象互斥（可重入：prune 中会调用 collect_garbage）
+        self.lock = threading.RLock()
+        self.catalog = self.open_catalog()
+        self.sync_catalog()
+
+    # ---------- 索引 ----------
+
+    def open_catalog(self):
+        """打开备份索引；文件损坏时删除后重建"""
+        path = os.path.join(self.backup_dir, CATALOG_NAME)
+        try:
+            return BackupCatalog(path)
+        except sqlite3.DatabaseError as e:
+            print(f"备份索引损坏，将重建: {str(e)}")
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+            return BackupCatalog(path)
+
+    def sync_catalog(self):
+        """让索引与磁盘上的备份一致：只比较文件名，新出现的备份才会被读取
+
+        返回 (新增数, 删除数)。
+        """
+        on_disk = {entry.name[:-5] for entry in os.scandir(self.snapshots_dir) if entry.name.endswith('.json')}
+        on_disk.update(entry.name for entry in os.scandir(self.backup_dir)
+                       if entry.name.endswith('.json') and entry.is_file())
+        indexed = self.catalog.names()
+
+        added = 0
+        for name in sorted(on_disk - indexed):
+            try:
+                self.index_snapshot(name)
+                added += 1
+            except (OSError, ValueError) as e:
+                print(f"无法索引备份 {name}: {str(e)}")
+        for name in indexed - on_disk:
+            self.catalog.remove_snapshot(name)
+        return added, len(indexed - on_disk)
+
+    def index_object(self, digest, data):
+        """把对象的大小和智能体 id、名称记入索引"""
+        agent_id = agent_name = None
+        try:
+            agent = json.loads(data.decode('utf-8'))
+            if isinstance(agent, dict):
+                agent_id = None if agent.get('id') is None else str(agent.get('id'))
+                agent_name = agent.get('name')
+        except ValueError:
+            pass
+        self.catalog.add_object(digest, len(data), agent_id, agent_name)
+
+    def index_snapshot(self, name):
+        """读取一个尚未索引的备份（快照清单或旧版整文件备份）并加入索引"""
+        if self.is_legacy(name):
+            path = os.path.join(self.backup_dir, name)
+            stat = os.stat(path)
+            created = datetime.datetime.fromtimestamp(stat.st_mtime).isoformat(timespec='seconds')
+            digests = None
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    agents = json.load(f)
+                if isinstance(agents, list):
+                    digests = [agent_blob(agent)[0] for agent in agents]
+            except ValueError:
+                pass
+            # 旧版备份的智能体不在对象存储中，这里只记录哈希用于比较
+            self.catalog.add_snapshot(name, kind_of(name), created, digests, size=stat.st_size, legacy=True)
+            return
+
+        manifest = self.read_manifest(name)
+        raw = manifest.get('raw')
+        digests = None if raw else manifest.get('agents', [])
+        for digest in set(digests or ()) | ({raw} if raw else set()):
+            if not self.catalog.has_object(digest) and os.path.exists(self.object_path(digest)):
+                self.index_object(digest, self.get_object(digest))
+        size = None
+        if raw:
+            size = self.catalog.objects([raw]).get(raw, (0,))[0]
+        self.catalog.add_snapshot(name, manifest.get('kind', kind_of(name)), manifest.get('created', ''),
+                                  digests, raw=raw, size=size)
+
+    # ---------- 对象 ----------
+
+    def object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest + '.json')
+
+    def put_object(self, digest, data):
+        """写入对象；已存在时跳过，返回是否实际写入"""
+        path = self.object_path(digest)
+        if os.path.exists(path):
+            if not self.catalog.has_object(digest):
+                self.index_object(digest, data)
+            return False
+        atomic_write(path, data)
+        self.index_object(digest, data)
+        return True
+
+    def get_object(self, digest):
+        with open(self.object_path(digest), 'rb') as f:
+            return f.read()
+
+    # ---------- 快照 ----------
+
+    def new_snapshot_name(self, kind):
+        prefix = KIND_PREFIXES.get(kind, 'agents_backup')
+        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        name = f"{prefix}_{timestamp}"
+        suffix = 1
+        while os.path.exists(self.manifest_path(name)):
+            suffix += 1
+            name = f"{prefix}_{timestamp}_{suffix}"
+        return name
+
+    def manifest_path(self, name):
+        return os.path.join(self.snapshots_dir, name + '.json')
+
+    def write_manifest(self, name, manifest):
+        atomic_write(self.manifest_path(name), json.dumps(manifest, ensure_ascii=False).encode('utf-8'))
+
+    def save_snapshot(self, agents, kind='manual'):
+        """保存智能体列表的快照，返回 (快照名称, 新写入的对象数)"""
+        blobs = (agent_blob(agent) for agent in agents)
+        return self.save_objects(((digest, lambda data=data: data) for digest, data in blobs), kind)
+
+    def save_objects(self, items, kind='manual'):
+        """用已知哈希的对象保存快照
+
+        items 为 (哈希, 读取内容的函数)，只有对象不存在时才调用读取函数，
+        并以实际内容的哈希存储。返回 (快照名称, 新写入的对象数)。
+        """
+        with self.lock:
+            digests = []
+            written = 0
+            for digest, read in items:
+                # 对象未被索引或文件缺失时才读取内容，写入后补记索引
+                if not self.catalog.has_object(digest) or not os.path.exists(self.object_path(digest)):
+                    data = read()
+                    digest = hashlib.sha256(data).hexdigest()
+                    if self.put_object(digest, data):
+                        written += 1
+                digests.append(digest)
+
+            name = self.new_snapshot_name(kind)
+            created = datetime.datetime.now().isoformat(timespec='seconds')
+            self.write_manifest(name, {
+                'name': name,
+                'kind': kind,
+                'created': created,
+                'agents': digests,
+            })
+            self.catalog.add_snapshot(name, kind, created, digests)
+            return name, written
+
+    def save_raw(self, file_path, kind='error'):
+        """无法解析的文件整体作为一个对象保存，返回快照名称"""
+        with open(file_path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+        with self.lock:
+            self.put_object(digest, data)
+
+            name = self.new_snapshot_name(kind)
+            created = datetime.datetime.now().isoformat(timespec='seconds')
+            self.write_manifest(name, {
+                'name': name,
+                'kind': kind,
+                'created': created,
+                'raw': digest,
+            })
+            self.catalog.add_snapshot(name, kind, created, raw=digest, size=len(data))
+            return name
+
+    def read_manifest(self, name):
+        with open(self.manifest_path(name), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def list_snapshots(self, limit=None, offset=0):
+        """从索引列出所有备份（含旧版整文件备份），最新的在前
+
+        返回字典列表：name、kind、created、agent_count、size、legacy、raw；
+        旧版备份的名称带 .json 后缀。
+        """
+        return self.catalog.snapshots(limit, offset)
+
+    def is_legacy(self, name):
+        return name.endswith('.json')
+
+    def load_snapshot(self, name):
+        """读取备份内容，返回智能体列表"""
+        if self.is_legacy(name):
+            with open(os.path.join(self.backup_dir, name), 'r', encoding='utf-8') as f:
+                return json.load(f)
+
+        manifest = self.read_manifest(name)
+        if 'raw' in manifest:
+            return json.loads(self.get_object(manifest['raw']).decode('utf-8'))
+        return [json.loads(self.get_object(digest).decode('utf-8')) for digest in manifest['agents']]
+
+    def diff_entries(self, name):
+        """供 agent_diff.diff_agents 使用的条目 [(id, 哈希, 读取函数)]
+
+        快照的 id 和哈希都来自索引，读取函数只在内容不同时才会被调用；
+        旧版整文件备份需要整体读取。
+        """
+        entry = self.catalog.snapshot(name)
+        if self.is_legacy(name) or entry is None or entry['raw']:
+            return [(agent.get('id'), agent_blob(agent)[0], lambda agent=agent: agent)
+                    for agent in self.load_snapshot(name)]
+
+        def read(digest):
+            return json.loads(self.get_object(digest).decode('utf-8'))
+
+        digests = self.catalog.digests(name)
+        objects = self.catalog.objects(digests)
+        entries = []
+        for digest in digests:
+            if digest in objects:
+                agent_id = objects[digest][1]
+            else:
+                agent_id = read(digest).get('id')
+            entries.append((agent_id, digest, lambda digest=digest: read(digest)))
+        return entries
+
+    def snapshot_text(self, name):
+        """返回备份的 JSON 文本，用于查看
+
+        对象文件本身就是 indent=2 的格式，按列表缩进拼接即可，
+        结果与 json.dumps(智能体列表, indent=2) 相同。
+        """
+        if self.is_legacy(name):
+            with open(os.path.join(self.backup_dir, name), 'r', encoding='utf-8') as f:
+                return f.read()
+
+        manifest = self.read_manifest(name)
+        if 'raw' in manifest:
+            return self.get_object(manifest['raw']).decode('utf-8')
+        parts = [self.get_object(digest).decode('utf-8').replace('\n', '\n  ') for digest in manifest['agents']]
+        if not parts:
+            return '[]'
+        return '[\n  ' + ',\n  '.join(parts) + '\n]'
+
+    def delete_snapshot(self, name):
+        """删除备份清单；不再被引用的对象由 collect_garbage 清理"""
+        if self.is_legacy(name):
+            os.remove(os.path.join(self.backup_dir, name))
+        else:
+            os.remove(self.manifest_path(name))
+        self.catalog.remove_snapshot(name)
+
+    def prune(self, max_snapshots):
+        """只保留最近的 max_snapshots 个备份，返回删除的名称列表"""
+        if self.catalog.count() <= max_snapshots:
+            return []
+        removed = []
+        for entry in self.list_snapshots(offset=max_snapshots, limit=-1):
+            name = entry['name']
+            try:
+                self.delete_snapshot(name)
+                removed.append(name)
+            except OSError as e:
+                print(f"清理备份失败: {str(e)}")
+        if removed:
+            self.collect_garbage()
+        return removed
+
+    def collect_garbage(self):
+        """删除没有任何快照引用的对象，返回删除的对象数
+
+        引用关系来自索引，不需要逐个读取快照清单。持有锁，不会与进行中的 save_objects 交错。
+        """
+        with self.lock:
+            referenced = self.catalog.referenced_digests()
+
+            removed = []
+            for prefix in os.scandir(self.objects_dir):
+                if not prefix.is_dir():
+                    continue
+                for entry in os.scandir(prefix.path):
+                    if entry.name.endswith('.json') and entry.name[:-5] not in referenced:
+                        try:
+                            os.remove(entry.path)
+                            removed.append(entry.name[:-5])
+                        except OSError:
+                            pass
+            self.catalog.remove_objects(removed)
+            return len(removed)
+
+    def preview(self, name, page_agents=PREVIEW_PAGE_AGENTS):
+        """返回分页读取备份内容的 BackupPreview"""
+        return BackupPreview(self, name, page_agents)
+
+
+class BackupPreview:
+    """按页读取备份的 JSON 文本，只有翻到的那一页才会被读取
+
+    快照按智能体分页，页面文本依次拼接后与 snapshot_text() 相同；
+    旧版整文件备份按扫描到的智能体位置切分原文件，无法解析的文件按字节分页。
+    """
+
+    def __init__(self, store, name, page_agents=PREVIEW_PAGE_AGENTS):
+        self.store = store
+        self.name = name
+        self.page_agents = page_agents
+        self.boundaries = None  # 文件分页时每页的起始字节位置
+        self.path = None
+
+        entry = store.catalog.snapshot(name)
+        if entry is None and not store.is_legacy(name):
+            # 尚未索引的快照直接读取清单
+            manifest = store.read_manifest(name)
+            entry = {'raw': manifest.get('raw'), 'agent_count': len(manifest.get('agents', []))}
+        if store.is_legacy(name):
+            self.path = os.path.join(store.backup_dir, name)
+        elif entry['raw']:
+            self.path = store.object_path(entry['raw'])
+
+        if self.path is not None:
+            self.boundaries = self.file_boundaries()
+            self.page_count = max(1, len(self.boundaries) - 1)
+        else:
+            self.total = entry['agent_count']
+            self.page_count = max(1, -(-self.total // page_agents))
+
+    def file_boundaries(self):
+        """文件分页位置：能解析时按智能体切分，否则按约 PREVIEW_PAGE_BYTES 在换行处切分"""
+        size = os.path.getsize(self.path)
+        if size == 0:
+            return [0, 0]
+        with open(self.path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                try:
+                    spans = [span for span, _ in scan_agents(data)]
+                    starts = [spans[i][0] for i in range(self.page_agents, len(spans), self.page_agents)]
+                    return [0] + starts + [size]
+                except AgentFileError:
+                    pass
+                boundaries = [0]
+                while boundaries[-1] + PREVIEW_PAGE_BYTES < size:
+                    cut = data.find(b'\n', boundaries[-1] + PREVIEW_PAGE_BYTES)
+                    if cut < 0:
+                        break
+                    boundaries.append(cut + 1)
+                boundaries.append(size)
+                return boundaries
+
+    def page(self, index):
+        """第 index 页（从 0 开始）的文本"""
+        index = min(max(0, index), self.page_count - 1)
+        if self.boundaries is not None:
+            start, end = self.boundaries[index], self.boundaries[index + 1]
+            with open(self.path, 'rb') as f:
+                f.seek(start)
+                return f.read(end - start).decode('utf-8', errors='replace')
+
+        if self.total == 0:
+            return '[]'
+        start = index * self.page_agents
+        digests = self.store.catalog.digests(self.name, start, start + self.page_agents)
+        if not digests and start < self.total:
+            # 索引中没有逐个记录对象（理论上不会发生），退回读取清单
+            digests = self.store.read_manifest(self.name)['agents'][start:start + self.page_agents]
+        parts = ['  ' + self.store.get_object(digest).decode('utf-8').replace('\n', '\n  ') for digest in digests]
+        text = ',\n'.join(parts)
+        if index == 0:
+            text = '[\n' + text
+        text += '\n]' if index == self.page_count - 1 else ',\n'
+        return text
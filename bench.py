@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式对话基准测试
+
+启动本地的模拟接口（fake_openai.py，延迟、数据块大小和发送速率可配置），
+按 agents.json 中的每个智能体构造与前端 callAI 相同的流式请求，以指定并发重放，
+统计首字延迟（TTFT）、总耗时、吞吐量、客户端解析开销和错误率，结果输出为 JSON。
+
+默认直接请求模拟接口；--start-server 会启动 server.py 并经由它转发，
+--via 则使用已经运行的服务器，用于比较转发路径的开销。
+
+--slow-rate / --slow-latency 让一部分请求变慢以模拟上游长尾；--hedge 再启动一个模拟接口作为备用接口，
+经由 server.py 的对冲请求（hedging.py）转发，比较开启前后的 p99。
+
+用法：
+    python bench.py --concurrency 8 --latency 0.2 --token-rate 50 --output bench.json
+    python bench.py --repeat 20 --slow-rate 0.05 --slow-latency 3 --hedge
+"""
+
+import argparse
+import http.client
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from agent_shards import ShardStore
+from fake_openai import start_fake_openai
+from sse import SSECollector
+
+DEFAULT_QUESTION = "请简单介绍一下你自己。"
+
+
+def percentile(values, p):
+    """线性插值的百分位数，values 为空时返回 None"""
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * p / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def distribution(values, scale=1000.0):
+    """p50/p95/p99/平均/最大值（默认换算为毫秒）"""
+    if not values:
+        return None
+    return {
+        'p50': round(percentile(values, 50) * scale, 3),
+        'p95': round(percentile(values, 95) * scale, 3),
+        'p99': round(percentile(values, 99) * scale, 3),
+        'mean': round(sum(values) / len(values) * scale, 3),
+        'max': round(max(values) * scale, 3),
+    }
+
+
+def load_agents(path):
+    """读取智能体配置；path 为分片目录时按清单读取"""
+    if os.path.isdir(path):
+        return ShardStore(path).load()
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def build_request(agent, question=DEFAULT_QUESTION):
+    """与 js/api-service.js 中 callAI 相同的请求体"""
+    messages = []
+    if agent.get('systemPrompt'):
+        messages.append({'role': 'system', 'content': agent['systemPrompt']})
+    messages.append({'role': 'user', 'content': question})
+    return {
+        'model': agent.get('model'),
+        'messages': messages,
+        'temperature': agent.get('temperature', 0.7),
+        'max_tokens': agent.get('max_tokens', 2048),
+        'stream': True,
+    }
+
+
+class BenchClient:
+    """每个线程保持一条长连接（与浏览器复用连接的行为一致）"""
+
+    def __init__(self, url, timeout=60):
+        self.url = urllib.parse.urlsplit(url)
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            cls = http.client.HTTPSConnection if self.url.scheme == 'https' else http.client.HTTPConnection
+            conn = cls(self.url.hostname, self.url.port, timeout=self.timeout)
+            self.local.conn = conn
+        return conn
+
+    def reset(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            conn.close()
+        self.local.conn = None
+
+    def run(self, agent, upstream_url=None, question=DEFAULT_QUESTION):
+        """发送一个流式请求，返回测量结果字典"""
+        body = json.dumps(build_request(agent, question), ensure_ascii=False).encode('utf-8')
+        headers = {
+            'Content-Type': 'application/json',
+            'Accept': 'text/event-stream',
+            'Authorization': f"Bearer {agent.get('apiKeyVariableName') or agent.get('apiKey') or 'sk-bench'}",
+            # 避免经由 server.py 时命中回复缓存
+            'Cache-Control': 'no-cache',
+        }
+        if upstream_url:
+            headers['X-Upstream-Url'] = upstream_url
+            headers['X-Agent-Id'] = str(agent.get('id', ''))
+
+        result = {'agent': agent.get('id'), 'model': agent.get('model'), 'ok': False, 'error': None,
+                  'ttft': None, 'duration': None, 'chunks': 0, 'chars': 0, 'parse_time': 0.0}
+        collector = SSECollector()
+        path = self.url.path + (f'?{self.url.query}' if self.url.query else '')
+        start = time.perf_counter()
+        try:
+            for attempt in range(2):
+                conn = self.connection()
+                try:
+                    conn.request('POST', path, body=body, headers=headers)
+                    response = conn.getresponse()
+                    break
+                except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                    # 服务器关闭了空闲的长连接，重新连接一次
+                    self.reset()
+                    if attempt:
+                        raise
+                    start = time.perf_counter()
+
+            if response.status != 200:
+                response.read()
+                result['error'] = f"HTTP {response.status}"
+                return result
+
+            while True:
+                data = response.read1(65536)
+                if not data:
+                    break
+                received = time.perf_counter()
+                text = collector.feed(data)
+                result['parse_time'] += time.perf_counter() - received
+                if text and result['ttft'] is None:
+                    result['ttft'] = received - start
+            result['duration'] = time.perf_counter() - start
+            result['chunks'] = max(0, collector.events - 2)  # 去掉开头的角色事件和结尾的结束事件
+            result['chars'] = len(collector.text)
+            if collector.complete:
+                result['ok'] = True
+            else:
+                result['error'] = "流提前结束"
+        except (OSError, http.client.HTTPException) as e:
+            self.reset()
+            result['error'] = type(e).__name__
+        return result
+
+
+def summarize(results, wall_time, config):
+    """汇总测量结果"""
+    ok = [result for result in results if result['ok']]
+    errors = {}
+    for result in results:
+        if not result['ok']:
+            errors[result['error']] = errors.get(result['error'], 0) + 1
+
+    total_chunks = sum(result['chunks'] for result in ok)
+    total_chars = sum(result['chars'] for result in ok)
+    stream_rates = [(result['chunks'] - 1) / (result['duration'] - result['ttft'])
+                    for result in ok if result['chunks'] > 1 and result['duration'] > result['ttft']]
+    parse_per_chunk = [result['parse_time'] / result['chunks'] for result in ok if result['chunks']]
+
+    rate = distribution(stream_rates, scale=1.0)
+    return {
+        'config': config,
+        'requests': len(results),
+        'succeeded': len(ok),
+        'errors': len(results) - len(ok),
+        'error_rate': round((len(results) - len(ok)) / len(results), 4) if results else 0.0,
+        'errors_by_type': errors,
+        'wall_time_s': round(wall_time, 3),
+        'ttft_ms': distribution([result['ttft'] for result in ok if result['ttft'] is not None]),
+        'duration_ms': distribution([result['duration'] for result in ok]),
+        'throughput': {
+            'requests_per_s': round(len(ok) / wall_time, 3) if wall_time else None,
+            'tokens_per_s': round(total_chunks / wall_time, 3) if wall_time else None,
+            'chars_per_s': round(total_chars / wall_time, 3) if wall_time else None,
+        },
+        # 单个流在首字之后的数据块速率
+        'stream_tokens_per_s': rate,
+        # 客户端解析 SSE 的耗时（微秒/数据块）
+        'parse_us_per_token': distribution(parse_per_chunk, scale=1e6),
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(upstream_url, root=None):
+    """启动 server.py 并等待就绪，返回 (进程, 转发接口地址)"""
+    port = free_port()
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+    command = [sys.executable, script, '--host', '127.0.0.1', '--port', str(port),
+               '--upstream', upstream_url, '--no-response-cache']
+    if root:
+        command += ['--root', root]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(base + '/v1/health', timeout=1):
+                return process, base + '/v1/chat/completions'
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("server.py 未能在 10 秒内启动")
+
+
+def hedged_root(agents, primary_url, fallback_url):
+    """写出对冲测试用的 agents.json：主接口为 primary_url，备用接口为 fallback_url，返回目录"""
+    root = tempfile.mkdtemp(prefix='tangzai-bench-')
+    # 备用接口在另一个端口上，服务器不会把主接口的密钥发给它，需要单独配置
+    hedged = [dict(agent, apiUrl=primary_url, hedge=True, fallbacks=[{
+        'apiUrl': fallback_url,
+        'apiKey': agent.get('apiKeyVariableName') or agent.get('apiKey') or 'sk-bench',
+    }]) for agent in agents]
+    with open(os.path.join(root, 'agents.json'), 'w', encoding='utf-8') as f:
+        json.dump(hedged, f, ensure_ascii=False)
+    return root
+
+
+def run_benchmark(agents, url, concurrency=8, repeat=1, upstream_url=None, timeout=60):
+    """以指定并发重放每个智能体 repeat 次，返回 (结果列表, 总耗时)"""
+    client = BenchClient(url, timeout)
+    jobs = [agent for _ in range(repeat) for agent in agents]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        results = list(pool.map(lambda agent: client.run(agent, upstream_url), jobs))
+    return results, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="流式对话基准测试（本地模拟接口）")
+    parser.add_argument('--agents', default='agents.json', help='智能体配置（文件或分片目录）')
+    parser.add_argument('--concurrency', type=int, default=8, help='同时进行的请求数')
+    parser.add_argument('--repeat', type=int, default=1, help='每个智能体重放的次数')
+    parser.add_argument('--latency', type=float, default=0.2, help='模拟接口的首字延迟（秒）')
+    parser.add_argument('--reply-chars', type=int, default=400, help='模拟回复的长度（字数）')
+    parser.add_argument('--chunk-chars', type=int, default=4, help='每个数据块的字数')
+    parser.add_argument('--token-rate', type=float, default=50.0, help='每秒发出的数据块数（0 表示不限速）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='模拟接口返回错误的比例')
+    parser.add_argument('--slow-rate', type=float, default=0.0, help='模拟接口额外变慢的请求比例')
+    parser.add_argument('--slow-latency', type=float, default=3.0, help='变慢的请求额外等待的时间（秒）')
+    parser.add_argument('--seed', type=int, default=0, help='错误注入的随机种子')
+    parser.add_argument('--start-server', action='store_true', help='启动 server.py 并经由它转发')
+    parser.add_argument('--hedge', action='store_true', help='启动备用模拟接口，经由 server.py 的对冲请求转发')
+    parser.add_argument('--via', help='经由已运行的服务器转发（如 http://127.0.0.1:8000/v1/chat/completions）')
+    parser.add_argument('--timeout', type=float, default=60, help='每个请求的超时（秒）')
+    parser.add_argument('--output', help='结果 JSON 文件（默认输出到标准输出）')
+    args = parser.parse_args()
+
+    agents = load_agents(args.agents)
+    if not agents:
+        print("没有可测试的智能体", file=sys.stderr)
+        return 1
+
+    options = dict(latency=args.latency, reply_chars=args.reply_chars, chunk_chars=args.chunk_chars,
+                   token_rate=args.token_rate, error_rate=args.error_rate,
+                   slow_rate=args.slow_rate, slow_latency=args.slow_latency)
+    mock = start_fake_openai(seed=args.seed, **options)
+    # 备用接口使用不同的种子，变慢的请求与主接口不重合
+    fallback = start_fake_openai(seed=args.seed + 1, **options) if args.hedge else None
+    process = root = None
+    url, upstream_url, mode = mock.api_url, None, 'direct'
+    try:
+        if args.hedge:
+            root = hedged_root(agents, mock.api_url, fallback.api_url)
+            process, url = start_server(mock.api_url, root)
+            upstream_url, mode = mock.api_url, 'server.py+hedge'
+        elif args.start_server:
+            process, url = start_server(mock.api_url)
+            upstream_url, mode = mock.api_url, 'server.py'
+        elif args.via:
+            url, upstream_url, mode = args.via, mock.api_url, 'via'
+
+        config = {
+            'mode': mode,
+            'agents': len(agents),
+            'concurrency': args.concurrency,
+            'repeat': args.repeat,
+            'latency_s': args.latency,
+            'reply_chars': args.reply_chars,
+            'chunk_chars': args.chunk_chars,
+            'token_rate': args.token_rate,
+            'error_rate': args.error_rate,
+            'slow_rate': args.slow_rate,
+            'slow_latency_s': args.slow_latency,
+            'seed': args.seed,
+        }
+        results, wall_time = run_benchmark(agents, url, args.concurrency, args.repeat, upstream_url, args.timeout)
+        report = summarize(results, wall_time, config)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(5)
+        mock.shutdown()
+        if fallback is not None:
+            fallback.shutdown()
+        if root is not None:
+            shutil.rmtree(root, ignore_errors=True)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 0 if report['succeeded'] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
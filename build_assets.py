@@ -0,0 +1,561 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+前端资源构建：合并、压缩并按内容哈希命名
+
+index.html 原来分别加载十个脚本和样式表，每次打开页面都要逐个向服务器确认。
+构建后每个页面只需加载一两个合并后的文件，文件名带内容哈希，可以长期缓存：
+
+    python build_assets.py            # 输出到 dist/
+    python build_assets.py --clean    # 删除构建产物，server.py 改回直接提供源文件
+
+页面中用注释标出合并为一个文件的一组资源：
+
+    <!-- build:js app -->
+    <script src="js/api-service.js" defer></script>
+    <script src="js/app.js" defer></script>
+    <!-- endbuild -->
+
+- 同一组的脚本按出现顺序合并为 dist/assets/app.<哈希>.js（样式表为 .css），页面中整组替换为一个标签
+- JS 只去掉注释、缩进和空行，保留换行，不改变自动分号插入的结果；已压缩过的文件原样合并
+- CSS 去掉注释和多余空白，url() 中的相对路径改写为相对 assets/ 目录
+- 改写后的页面写入 dist/ 下相同的相对路径，所有产物都附带 .gz（安装了 brotli 时还有 .br）预压缩版本
+- dist/manifest.json 记录构建时源文件的大小和修改时间，server.py 只在源文件未修改时使用构建产物
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+
+try:
+    import brotli  # 可选依赖
+except ImportError:
+    brotli = None
+
+# 需要构建的页面（相对项目根目录）
+PAGES = ('index.html', 'faq.html', 'tangzai_assistant/tangzai.html')
+
+DEFAULT_OUT_DIR = 'dist'
+ASSETS_DIR = 'assets'
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 1
+
+# 文件名中的内容哈希长度
+HASH_LENGTH = 10
+
+BLOCK_RE = re.compile(r'^([ \t]*)<!--\s*build:(js|css)\s+([\w.-]+)\s*-->(.*?)<!--\s*endbuild\s*-->',
+                      re.S | re.M)
+SCRIPT_RE = re.compile(r'<script\b([^>]*?)\bsrc="([^"]+)"([^>]*)>\s*</script>', re.I)
+LINK_RE = re.compile(r'<link\b[^>]*?\bhref="([^"]+)"[^>]*>', re.I)
+HTML_COMMENT_RE = re.compile(r'<!--.*?-->', re.S)
+CSS_URL_RE = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+
+class BuildError(Exception):
+    """页面中的构建标记有误"""
+
+
+# ---------- 压缩 ----------
+
+# 正则表达式字面量可以出现在这些关键字之后（其他单词之后的 / 是除号）
+REGEX_KEYWORDS = {
+    'return', 'typeof', 'instanceof', 'in', 'of', 'new', 'delete', 'void', 'throw', 'case', 'do', 'else',
+    'yield', 'await',
+}
+# 这些符号之后的 / 开始一个正则表达式
+REGEX_AFTER = set('(,=:[!&|?{};+-*%<>~^')
+# 换行紧跟在这些符号之后、或紧挨在这些符号之前时不影响自动分号插入，可以去掉
+NEWLINE_AFTER = set('{[(,;')
+NEWLINE_BEFORE = set(')]},;.')
+WHITESPACE = set(' \t\r\n\f\v\u00a0\ufeff\u2028\u2029')
+LINE_BREAKS = set('\r\n\u2028\u2029')
+
+
+def is_word_char(ch):
+    return ch.isalnum() or ch in '_$\\' or ord(ch) > 127
+
+
+def is_minified(source):
+    """已压缩的文件（例如 docx.js）：单行很长，不再处理"""
+    head = source[:4096]
+    return '\n' not in head.strip() or max(len(line) for line in head.splitlines()) > 1000
+
+
+def minify_js(source):
+    """去掉 JS 的注释、缩进和空行
+
+    只删除空白和注释，不改写任何代码：多个空白合并为一个空格（两侧不是标识符时删除），
+    含换行的空白保留一个换行，因此自动分号插入的结果不变。字符串、模板字符串和正则表达式原样保留。
+    /*! 开头的许可证注释保留。
+    """
+    out = []
+    pending = ''        # 上一段空白：'' / ' ' / '\n'
+    last = ''           # 上一个记号，用于区分除号和正则表达式
+    braces = []         # 每层模板字符串 ${ 开始时的花括号深度
+    depth = 0
+    i = 0
+    n = len(source)
+
+    def emit(text, token):
+        nonlocal pending, last
+        if pending and out:
+            prev = out[-1][-1]
+            first = text[0]
+            if pending == '\n':
+                if prev not in NEWLINE_AFTER and first not in NEWLINE_BEFORE:
+                    out.append('\n')
+            elif ((is_word_char(prev) and is_word_char(first)) or (prev.isdigit() and first == '.')
+                  or (prev == first and prev in '+-/')):
+                out.append(' ')
+        pending = ''
+        out.append(text)
+        last = token
+
+    def regex_allowed():
+        if not last:
+            return True
+        if last in REGEX_KEYWORDS:
+            return True
+        if last in REGEX_AFTER:
+            # a++ / b：后缀自增之后是除号
+            return not (last in '+-' and len(out) >= 2 and out[-2] == last)
+        return False
+
+    def scan_template(start):
+        """从模板字符串的 ` 或 } 开始，读到结束的 ` 或下一个 ${"""
+        j = start + 1
+        while j < n:
+            ch = source[j]
+            if ch == '\\':
+                j += 2
+            elif ch == '`':
+                return j + 1, False
+            elif ch == '$' and source.startswith('${', j):
+                return j + 2, True
+            else:
+                j += 1
+        return n, False
+
+    while i < n:
+        ch = source[i]
+
+        if ch in WHITESPACE:
+            j = i
+            while j < n and source[j] in WHITESPACE:
+                j += 1
+            if any(c in LINE_BREAKS for c in source[i:j]) or pending == '\n':
+                pending = '\n'
+            else:
+                pending = pending or ' '
+            i = j
+
+        elif source.startswith('//', i):
+            j = source.find('\n', i)
+            i = n if j < 0 else j
+
+        elif source.startswith('/*', i):
+            j = source.find('*/', i + 2)
+            j = n if j < 0 else j + 2
+            comment = source[i:j]
+            if comment.startswith('/*!'):
+                emit(comment, last)
+                pending = '\n'
+            elif '\n' in comment:
+                pending = '\n'
+            else:
+                pending = pending or ' '
+            i = j
+
+        elif ch in '"\'':
+            j = i + 1
+            while j < n and source[j] != ch and source[j] != '\n':
+                j += 2 if source[j] == '\\' else 1
+            j = min(j + 1, n)
+            emit(source[i:j], '"')
+            i = j
+
+        elif ch == '`' or (ch == '}' and braces and depth == braces[-1]):
+            if ch == '}':
+                braces.pop()
+            j, opened = scan_template(i)
+            if opened:
+                braces.append(depth)
+            emit(source[i:j], '{' if opened else '`')
+            i = j
+
+        elif ch == '/' and regex_allowed():
+            j = i + 1
+            in_class = False
+            while j < n and source[j] != '\n':
+                c = source[j]
+                if c == '\\':
+                    j += 2
+                    continue
+                if c == '[':
+                    in_class = True
+                elif c == ']':
+                    in_class = False
+                elif c == '/' and not in_class:
+                    j += 1
+                    while j < n and is_word_char(source[j]):
+                        j += 1
+                    break
+                j += 1
+            emit(source[i:j], '"')
+            i = j
+
+        elif is_word_char(ch):
+            j = i + 1
+            while j < n and is_word_char(source[j]):
+                j += 1
+            word = source[i:j]
+            emit(word, word)
+            i = j
+
+        else:
+            if ch == '{':
+                depth += 1
+            elif ch == '}':
+                depth -= 1
+            emit(ch, ch)
+            i += 1
+
+    return ''.join(out).strip() + '\n'
+
+
+CSS_TOKEN_RE = re.compile(r'("(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\')|(/\*.*?(?:\*/|$))', re.S)
+
+
+def squeeze_css(code):
+    code = re.sub(r'\s+', ' ', code)
+    code = re.sub(r' ?([{};,]) ?', r'\1', code)
+    code = code.replace(': ', ':').replace(';}', '}')
+    return code
+
+
+def minify_css(source):
+    """去掉 CSS 的注释和多余空白（字符串原样保留，/*! 开头的注释保留）"""
+    parts = []
+    code = ''
+    pos = 0
+    for match in CSS_TOKEN_RE.finditer(source):
+        code += source[pos:match.start()]
+        pos = match.end()
+        string, comment = match.groups()
+        if string is not None or comment.startswith('/*!'):
+            parts.append(squeeze_css(code))
+            parts.append(string if string is not None else comment + '\n')
+            code = ''
+        else:
+            code += ' '
+    parts.append(squeeze_css(code + source[pos:]))
+    return ''.join(parts).strip().replace(';}', '}') + '\n'
+
+
+def rebase_css_urls(css, source_dir, target_dir):
+    """把样式表中 url() 的相对路径改为相对合并后文件所在的目录"""
+    def replace(match):
+        quote, url = match.groups()
+        url = url.strip()
+        if re.match(r'^([a-z][\w+.-]*:|/|#)', url, re.I):
+            return match.group(0)
+        rebased = os.path.relpath(os.path.join(source_dir, url), target_dir).replace(os.sep, '/')
+        return f'url({quote}{rebased}{quote})'
+    return CSS_URL_RE.sub(replace, css)
+
+
+# ---------- 构建 ----------
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+
+
+def write_file(path, data, precompress=True):
+    """原子写入文件，并生成预压缩版本"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    if precompress:
+        write_precompressed(path, data)
+
+
+def write_precompressed(path, data):
+    variants = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(data, quality=11)
+    elif os.path.exists(path + '.br'):
+        # 上次构建时安装了 brotli：删除过期的 .br
+        os.remove(path + '.br')
+    for suffix, body in variants.items():
+        with open(path + suffix, 'wb') as f:
+            f.write(body)
+
+
+def read_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(manifest, dict) or manifest.get('version') != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class Builder:
+    """构建所有页面；同名的资源组在多个页面中共用同一个输出文件"""
+
+    def __init__(self, root, out_dir, minify=True):
+        self.root = os.path.abspath(root)
+        self.out_dir = os.path.abspath(out_dir)
+        self.assets_dir = os.path.join(self.out_dir, ASSETS_DIR)
+        self.minify = minify
+        self.bundles = {}      # (类型, 名称) -> {'sources': [...], 'file': 相对 dist 的路径, ...}
+        self.sources = {}      # 相对根目录的源文件路径 -> [大小, 修改时间]
+
+    def relative(self, path):
+        return os.path.relpath(path, self.root).replace(os.sep, '/')
+
+    def add_source(self, path):
+        self.sources[self.relative(path)] = file_signature(path)
+
+    def build(self):
+        previous = read_manifest(self.out_dir)
+        pages = {}
+        for page in PAGES:
+            path = os.path.join(self.root, *page.split('/'))
+            if not os.path.isfile(path):
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                html = f.read()
+            self.add_source(path)
+            page_dir = os.path.dirname(path)
+            built_path = os.path.join(self.out_dir, *page.split('/'))
+            html = BLOCK_RE.sub(lambda match: self.replace_block(match, page, page_dir, built_path), html)
+            write_file(built_path, html.encode('utf-8'))
+            pages[page] = sorted(set(bundle['file'] for bundle in self.bundles.values()
+                                     if page in bundle['pages']))
+
+        manifest = {
+            'version': MANIFEST_VERSION,
+            'built': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'pages': pages,
+            'bundles': {f"{name}.{kind}": bundle['file'] for (kind, name), bundle in sorted(self.bundles.items())},
+            'sources': self.sources,
+        }
+        # 保留上一次构建的资源，已经打开的旧页面仍然可以加载
+        keep = set(manifest['bundles'].values())
+        if previous:
+            keep.update(previous.get('bundles', {}).values())
+        self.prune(keep)
+        write_file(os.path.join(self.out_dir, MANIFEST_NAME),
+                   json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8'), precompress=False)
+        return manifest
+
+    def replace_block(self, match, page, page_dir, built_path):
+        indent, kind, name, block = match.groups()
+        if kind == 'js':
+            tags = SCRIPT_RE.findall(block)
+            urls = [src for _, src, _ in tags]
+            defer = any(re.search(r'\bdefer\b', before + after) for before, _, after in tags)
+            rest = SCRIPT_RE.sub('', block)
+        else:
+            urls = LINK_RE.findall(block)
+            defer = False
+            rest = LINK_RE.sub('', block)
+        if HTML_COMMENT_RE.sub('', rest).strip():
+            raise BuildError(f"{page}: build:{kind} {name} 中只能包含 <script src> 或 <link> 标签")
+        if not urls:
+            raise BuildError(f"{page}: build:{kind} {name} 中没有资源")
+        for url in urls:
+            if re.match(r'^([a-z][\w+.-]*:|//)', url, re.I):
+                raise BuildError(f"{page}: 不能合并外部资源 {url}")
+
+        sources = [os.path.normpath(os.path.join(page_dir, *url.split('?')[0].split('/'))) for url in urls]
+        bundle = self.bundle(kind, name, sources, page)
+        href = os.path.relpath(os.path.join(self.out_dir, *bundle['file'].split('/')),
+                               os.path.dirname(built_path)).replace(os.sep, '/')
+        if kind == 'js':
+            return f'{indent}<script src="{href}"{" defer" if defer else ""}></script>'
+        return f'{indent}<link rel="stylesheet" href="{href}">'
+
+    def bundle(self, kind, name, sources, page):
+        """合并一组资源（同名的组只构建一次），返回构建信息"""
+        key = (kind, name)
+        bundle = self.bundles.get(key)
+        if bundle is not None:
+            if bundle['sources'] != sources:
+                raise BuildError(f"{page}: build:{kind} {name} 与其他页面中的同名资源组内容不同")
+            bundle['pages'].add(page)
+            return bundle
+
+        chunks = []
+        original = 0
+        for path in sources:
+            if not os.path.isfile(path):
+                raise BuildError(f"{page}: 找不到 {self.relative(path)}")
+            with open(path, 'r', encoding='utf-8') as f:
+                text = f.read()
+            self.add_source(path)
+            original += len(text.encode('utf-8'))
+            if kind == 'css':
+                text = rebase_css_urls(text, os.path.dirname(path), os.path.join(self.root, ASSETS_DIR))
+            if self.minify and not is_minified(text):
+                text = minify_js(text) if kind == 'js' else minify_css(text)
+            chunks.append(text.strip() + '\n')
+        # 脚本之间加分号，避免上一个文件缺少结尾分号时与下一个文件连在一起
+        data = (';\n' if kind == 'js' else '').join(chunks).encode('utf-8')
+
+        file_name = f"{name}.{content_hash(data)}.{kind}"
+        path = os.path.join(self.assets_dir, file_name)
+        if not os.path.exists(path):
+            write_file(path, data)
+        bundle = self.bundles[key] = {
+            'sources': sources,
+            'file': f"{ASSETS_DIR}/{file_name}",
+            'pages': {page},
+            'original': original,
+            'size': len(data),
+            'gzip': len(gzip.compress(data, compresslevel=9, mtime=0)),
+        }
+        return bundle
+
+    def prune(self, keep):
+        """删除不再被引用的旧资源"""
+        if not os.path.isdir(self.assets_dir):
+            return
+        for name in os.listdir(self.assets_dir):
+            base = name
+            for suffix in ('.gz', '.br'):
+                if base.endswith(suffix):
+                    base = base[:-len(suffix)]
+            if f"{ASSETS_DIR}/{base}" not in keep:
+                os.remove(os.path.join(self.assets_dir, name))
+
+
+def build(root='.', out_dir=None, minify=True):
+    """构建所有页面，返回 (清单, 构建器)"""
+    root = os.path.abspath(root)
+    builder = Builder(root, out_dir or os.path.join(root, DEFAULT_OUT_DIR), minify)
+    return builder.build(), builder
+
+
+class BuiltSite:
+    """server.py 使用的构建产物
+
+    页面请求时检查清单和源文件：源文件在构建后被修改过时改用源文件（并提示重新构建），
+    重新构建后自动读取新的清单。assets/ 中带哈希的文件内容永不改变，只要存在就可以提供。
+    """
+
+    def __init__(self, root, out_dir=None):
+        self.root = os.path.abspath(root)
+        self.out_dir = os.path.abspath(out_dir or os.path.join(self.root, DEFAULT_OUT_DIR))
+        self.assets_url_dir = os.path.join(self.root, ASSETS_DIR)
+        self.assets_dir = os.path.join(self.out_dir, ASSETS_DIR)
+        self.manifest_path = os.path.join(self.out_dir, MANIFEST_NAME)
+        self.manifest = None
+        self.manifest_mtime = None
+        self.pages = {}        # 源页面完整路径 -> 构建后的页面路径
+        self.stale = None      # 构建后修改过的第一个源文件
+
+    def reload(self):
+        try:
+            mtime = os.stat(self.manifest_path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime == self.manifest_mtime:
+            return
+        self.manifest_mtime = mtime
+        self.manifest = read_manifest(self.out_dir) if mtime is not None else None
+        self.pages = {}
+        self.stale = None
+        for page in (self.manifest or {}).get('pages', {}):
+            parts = page.split('/')
+            self.pages[os.path.join(self.root, *parts)] = os.path.join(self.out_dir, *parts)
+
+    def fresh(self):
+        """构建产物是否与源文件一致"""
+        self.reload()
+        if not self.manifest:
+            return False
+        for relative, signature in self.manifest.get('sources', {}).items():
+            try:
+                current = file_signature(os.path.join(self.root, *relative.split('/')))
+            except OSError:
+                current = None
+            if current != signature:
+                if self.stale != relative:
+                    self.stale = relative
+                    print(f"前端构建产物已过期（{relative} 已修改），改用源文件；"
+                          f"运行 python build_assets.py 重新构建")
+                return False
+        self.stale = None
+        return True
+
+    def resolve(self, full_path):
+        """源文件路径 -> 应提供的构建产物路径；没有对应的构建产物时返回 None"""
+        if full_path.startswith(self.assets_url_dir + os.sep):
+            built = os.path.join(self.assets_dir, os.path.relpath(full_path, self.assets_url_dir))
+            return built if os.path.isfile(built) else None
+        if full_path.endswith('.html'):
+            self.reload()
+            built = self.pages.get(full_path)
+            if built is not None and self.fresh() and os.path.isfile(built):
+                return built
+        return None
+
+    def immutable(self, path):
+        """文件名带内容哈希，可以永久缓存"""
+        return path.startswith(self.assets_dir + os.sep)
+
+
+def format_size(size):
+    return f"{size / 1024:.1f} KB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="合并、压缩前端资源并按内容哈希命名")
+    parser.add_argument('--root', default=os.path.dirname(os.path.abspath(__file__)), help="项目根目录")
+    parser.add_argument('--out', help=f"输出目录（默认 <根目录>/{DEFAULT_OUT_DIR}）")
+    parser.add_argument('--no-minify', action='store_true', help="只合并，不压缩（便于调试）")
+    parser.add_argument('--clean', action='store_true', help="删除构建产物")
+    args = parser.parse_args()
+
+    out_dir = os.path.abspath(args.out or os.path.join(args.root, DEFAULT_OUT_DIR))
+    if args.clean:
+        if os.path.exists(os.path.join(out_dir, MANIFEST_NAME)):
+            shutil.rmtree(out_dir)
+            print(f"已删除 {out_dir}")
+        else:
+            print(f"{out_dir} 不是构建输出目录，未删除")
+        return
+
+    start = time.perf_counter()
+    try:
+        manifest, builder = build(args.root, out_dir, minify=not args.no_minify)
+    except BuildError as e:
+        parser.exit(1, f"构建失败: {e}\n")
+
+    for (kind, name), bundle in sorted(builder.bundles.items()):
+        print(f"{bundle['file']}: {len(bundle['sources'])} 个文件 {format_size(bundle['original'])}"
+              f" -> {format_size(bundle['size'])}（gzip {format_size(bundle['gzip'])}）")
+    for page, files in manifest['pages'].items():
+        print(f"{page}: 加载 {len(files)} 个本地资源")
+    print(f"构建完成，输出到 {out_dir}（{(time.perf_counter() - start) * 1000:.0f} 毫秒，"
+          f"预压缩: gzip{' + brotli' if brotli is not None else ''}）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""测试共用的夹具：本地模拟接口和在后台线程中运行的 server.py"""
+
+import asyncio
+import http.client
+import json
+import threading
+
+import pytest
+
+from fake_openai import start_fake_openai
+from server import MAX_HEADER_BYTES, TangzaiServer
+
+KEY = 'sk-test-0123456789abcdef'
+
+
+class Proxy:
+    """在独立事件循环线程中运行的 TangzaiServer"""
+
+    def __init__(self, root, upstream, **options):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+        async def start():
+            server = TangzaiServer(root=str(root), upstream=upstream, **options)
+            listener = await asyncio.start_server(server.handle_connection, '127.0.0.1', 0, limit=MAX_HEADER_BYTES)
+            return server, listener
+
+        self.server, self.listener = self.call(start())
+        self.port = self.listener.sockets[0].getsockname()[1]
+
+    def call(self, coroutine):
+        """在服务器的事件循环中执行协程并返回结果"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(10)
+
+    def request(self, method, path, body=None, headers=None):
+        """发送一个请求，返回 (状态码, 响应头列表, 响应体)"""
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=10)
+        try:
+            conn.request(method, path, body=body, headers=headers or {})
+            response = conn.getresponse()
+            return response.status, response.getheaders(), response.read()
+        finally:
+            conn.close()
+
+    def chat(self, payload, headers=None):
+        return self.request('POST', '/v1/chat/completions', payload,
+                            dict({'Content-Type': 'application/json', 'Authorization': f'Bearer {KEY}'}, **(headers or {})))
+
+    def close(self):
+        async def stop():
+            self.listener.close()
+            self.server.client.pool.close_all()
+            self.server.exporter.shutdown()
+            if self.server.conversations is not None:
+                self.server.conversations.close()
+
+        self.call(stop())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(5)
+        self.loop.close()
+
+
+@pytest.fixture
+def fake_openai():
+    """启动模拟接口的工厂，测试结束时全部关闭"""
+    servers = []
+
+    def start(**options):
+        server = start_fake_openai(**options)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def proxy(tmp_path):
+    """启动 server.py 的工厂：proxy(上游地址, agents=[...], **选项)"""
+    proxies = []
+
+    def start(upstream, agents=None, **options):
+        (tmp_path / 'agents.json').write_text(json.dumps(agents or [], ensure_ascii=False), encoding='utf-8')
+        instance = Proxy(tmp_path, upstream, **options)
+        proxies.append(instance)
+        return instance
+
+    yield start
+    for instance in proxies:
+        instance.close()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+上下文预算
+
+网页端每轮都会发送完整的对话历史和系统提示词，对话变长后上传量和上游的预填充时间都会增加，
+超过模型的上下文窗口时请求会直接失败。这里按 token 预算裁剪历史：
+- 估算每条消息的 token 数：中日韩字符按 1 个 token 计，其余字符约 4 个计 1 个 token；
+  相同文本（例如每轮重复发送的系统提示词）的估算结果会被缓存
+- 预算 = 模型上下文窗口 - 为回复预留的 max_tokens（智能体可用 contextTokens 进一步限制）
+- 系统消息和最后一条消息始终保留，其余历史从最新的往前装入，装不下的旧消息被丢弃
+
+估算偏保守，预算只在超出时才裁剪，对话不长时请求保持不变。
+"""
+
+import functools
+import re
+
+# 每条消息的固定开销（角色、分隔符）和回复的起始开销
+MESSAGE_OVERHEAD = 4
+REPLY_OVERHEAD = 3
+
+# 非文本内容（例如图片）按固定数量估算
+NON_TEXT_PART_TOKENS = 85
+
+# 估算误差的余量：预算只使用窗口的这一比例
+SAFETY_RATIO = 0.9
+
+# 常见模型的上下文窗口（按前缀匹配，越具体的前缀越靠前）
+MODEL_WINDOWS = (
+    ('gemini-1.5-pro', 2097152),
+    ('gemini', 1048576),
+    ('gpt-4.1', 1047576),
+    ('gpt-4o', 128000),
+    ('gpt-4-turbo', 128000),
+    ('gpt-4', 8192),
+    ('gpt-3.5-turbo', 16385),
+    ('o1', 200000),
+    ('o3', 200000),
+    ('o4', 200000),
+    ('claude', 200000),
+    ('deepseek', 65536),
+    ('qwen', 32768),
+    ('moonshot', 131072),
+    ('glm', 131072),
+)
+DEFAULT_WINDOW = 32768
+
+CJK_PATTERN = re.compile(
+    '[\u2e80-\u2fdf\u3000-\u303f\u3040-\u30ff\u3100-\u312f\u3400-\u4dbf'
+    '\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]')
+
+
+@functools.lru_cache(maxsize=4096)
+def estimate_text_tokens(text):
+    """估算一段文本的 token 数（结果缓存）"""
+    if not text:
+        return 0
+    cjk = len(CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def content_tokens(content):
+    """消息内容的 token 数；content 可以是字符串或 OpenAI 格式的多段内容"""
+    if isinstance(content, str):
+        return estimate_text_tokens(content)
+    if isinstance(content, list):
+        total = 0
+        for part in content:
+            if isinstance(part, dict) and isinstance(part.get('text'), str):
+                total += estimate_text_tokens(part['text'])
+            else:
+                total += NON_TEXT_PART_TOKENS
+        return total
+    return 0
+
+
+def message_tokens(message):
+    return MESSAGE_OVERHEAD + content_tokens(message.get('content')) + estimate_text_tokens(message.get('name') or '')
+
+
+def count_tokens(messages):
+    """一组消息的 token 数（含回复的起始开销）"""
+    return REPLY_OVERHEAD + sum(message_tokens(message) for message in messages)
+
+
+def positive_int(value):
+    """把配置中的 token 数转换为正整数（接受整数、整数值的浮点数和数字字符串），否则返回 None"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value.strip())
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, int) and value > 0:
+        return value
+    return None
+
+
+def model_window(model, agent=None):
+    """模型的上下文窗口；智能体配置了有效的 contextWindow 时以它为准，无效的值被忽略"""
+    window = positive_int((agent or {}).get('contextWindow'))
+    if window is not None:
+        return window
+    model = (model or '').lower().rsplit('/', 1)[-1]
+    for prefix, window in MODEL_WINDOWS:
+        if model.startswith(prefix):
+            return window
+    return DEFAULT_WINDOW
+
+
+def input_budget(window, max_tokens=None, limit=None):
+    """可用于输入消息的 token 数
+
+    为回复预留的 token 数最多按窗口的一半计算，max_tokens 设置得过大时不至于把历史全部裁掉。
+    limit 不是正整数时不限制。
+    """
+    budget = int(window * SAFETY_RATIO) - min(positive_int(max_tokens) or 0, window // 2)
+    limit = positive_int(limit)
+    if limit is not None:
+        budget = min(budget, limit)
+    return max(0, budget)
+
+
+def fit_messages(messages, budget):
+    """把消息裁剪到预算以内，返回 (保留的消息, 统计信息)
+
+    系统消息和最后一条消息始终保留（即使它们已经超出预算）；
+    其余消息从最新的往前装入，遇到第一条装不下的消息就停止，保证保留的历史是连续的。
+    保留的历史不以助手消息开头，避免部分接口拒绝这种顺序。
+    """
+    tokens = [message_tokens(message) for message in messages]
+    total = REPLY_OVERHEAD + sum(tokens)
+    info = {'budget': budget, 'tokens': total, 'original_tokens': total, 'dropped': 0}
+    if total <= budget or len(messages) <= 1:
+        return messages, info
+
+    last = len(messages) - 1
+    keep = {i for i, message in enumerate(messages) if message.get('role') == 'system'}
+    keep.add(last)
+    used = REPLY_OVERHEAD + sum(tokens[i] for i in keep)
+    for i in range(last - 1, -1, -1):
+        if i in keep:
+            continue
+        if used + tokens[i] > budget:
+            break
+        keep.add(i)
+        used += tokens[i]
+
+    history = sorted(i for i in keep if messages[i].get('role') != 'system' and i != last)
+    while history and messages[history[0]].get('role') == 'assistant':
+        dropped = history.pop(0)
+        keep.discard(dropped)
+        used -= tokens[dropped]
+
+    kept = [message for i, message in enumerate(messages) if i in keep]
+    info.update(tokens=used, dropped=len(messages) - len(kept))
+    return kept, info
+
+
+def fit_request(payload, agent=None):
+    """按智能体和模型的上下文窗口裁剪请求体中的消息
+
+    返回 (新的请求体, 统计信息)；没有裁剪时返回原请求体。
+    智能体配置 contextBudget 为 false 时不裁剪。
+    """
+    messages = payload.get('messages')
+    if not isinstance(messages, list) or not all(isinstance(message, dict) for message in messages):
+        return payload, None
+    if agent is not None and agent.get('contextBudget') is False:
+        return payload, None
+
+    window = model_window(payload.get('model') or (agent or {}).get('model'), agent)
+    max_tokens = payload.get('max_tokens') or (agent or {}).get('max_tokens')
+    if not isinstance(max_tokens, int):
+        max_tokens = None
+    budget = input_budget(window, max_tokens, (agent or {}).get('contextTokens'))
+    kept, info = fit_messages(messages, budget)
+    info['window'] = window
+    if info['dropped']:
+        payload = dict(payload, messages=kept)
+    return payload, info
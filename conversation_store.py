@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+对话记录存储
+
+网页端原来把所有智能体的对话历史序列化成一个 localStorage 键，每条消息都要重写整个对象，
+空间不足时只能裁剪旧消息。由 server.py 提供时改为保存在 SQLite（WAL 模式）中：
+- 每条消息追加一行，保存耗时与历史长度无关
+- 每个浏览器生成并保存一个客户端 id（请求头 X-Client-Id），所有读写都限定在该客户端的记录内，
+  共用同一个服务器的其他人看不到、也删不掉彼此的对话
+- 按智能体分页读取（从最新的往前，用消息 id 作为游标）
+- 一次事务批量导入浏览器中已有的 localStorage 数据；与服务器已有的记录合并，只追加服务器上没有的部分
+
+表结构：
+    messages  自增 id、客户端 id、智能体 id、角色、内容、创建时间
+"""
+
+import re
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    client_id TEXT NOT NULL DEFAULT '',
+    agent_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created REAL NOT NULL
+);
+"""
+
+INDEXES = """
+DROP INDEX IF EXISTS messages_agent;
+CREATE INDEX IF NOT EXISTS messages_client ON messages (client_id, agent_id, id);
+"""
+
+# 客户端 id：浏览器生成的随机字符串
+CLIENT_ID_RE = re.compile(r'^[A-Za-z0-9_-]{16,64}$')
+
+ROLES = ('system', 'user', 'assistant')
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def normalize_message(message):
+    """校验一条消息，返回 (角色, 内容)；格式不对时返回 None"""
+    if not isinstance(message, dict):
+        return None
+    role, content = message.get('role'), message.get('content')
+    if role not in ROLES or not isinstance(content, str):
+        return None
+    return role, content
+
+
+def valid_client_id(client_id):
+    return isinstance(client_id, str) and CLIENT_ID_RE.match(client_id) is not None
+
+
+def overlap(stored, messages):
+    """messages 开头与 stored 结尾重合的条数（取最长的重合）
+
+    浏览器在服务器写入失败时把整个历史（从服务器读到的最近消息 + 之后的新消息）保存到 localStorage，
+    重合部分之后的才是服务器上没有的消息。
+    """
+    for size in range(min(len(stored), len(messages)), 0, -1):
+        if stored[-size:] == messages[:size]:
+            return size
+    return 0
+
+
+class ConversationStore:
+    """对话记录；服务器的工作线程共用一个连接，用锁串行访问"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.executescript(SCHEMA)
+            columns = [row[1] for row in self.connection.execute('PRAGMA table_info(messages)')]
+            if 'client_id' not in columns:
+                # 旧版本的记录不属于任何客户端，不再提供给任何人
+                self.connection.execute("ALTER TABLE messages ADD COLUMN client_id TEXT NOT NULL DEFAULT ''")
+            self.connection.executescript(INDEXES)
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    # ---------- 写入 ----------
+
+    def append(self, client_id, agent_id, messages):
+        """追加消息，返回新消息的 id 列表；格式不对的消息被跳过"""
+        rows = [(client_id, str(agent_id)) + item + (time.time(),)
+                for item in map(normalize_message, messages) if item is not None]
+        ids = []
+        with self.lock, self.connection:
+            for row in rows:
+                cursor = self.connection.execute(
+                    'INSERT INTO messages (client_id, agent_id, role, content, created) VALUES (?, ?, ?, ?, ?)', row)
+                ids.append(cursor.lastrowid)
+        return ids
+
+    def clear(self, client_id, agent_id):
+        """删除客户端与一个智能体的全部消息，返回删除的条数"""
+        with self.lock, self.connection:
+            return self.connection.execute('DELETE FROM messages WHERE client_id = ? AND agent_id = ?',
+                                           (client_id, str(agent_id))).rowcount
+
+    def import_histories(self, client_id, histories, replace=False):
+        """导入 localStorage 中的 {智能体id: [消息]}，返回 {'agents': 有新消息的智能体数, 'messages': 新消息数, 'skipped': 没有新消息的智能体数}
+
+        与服务器已有的记录合并：只追加与已有记录结尾重合部分之后的消息，重复导入同一份数据不会产生重复消息；
+        replace 为真时先清空再导入。
+        """
+        result = {'agents': 0, 'messages': 0, 'skipped': 0}
+        now = time.time()
+        with self.lock, self.connection:
+            for agent_id, messages in histories.items():
+                if not isinstance(messages, list):
+                    continue
+                agent_id = str(agent_id)
+                items = [item for item in map(normalize_message, messages) if item is not None]
+                if replace:
+                    self.connection.execute('DELETE FROM messages WHERE client_id = ? AND agent_id = ?',
+                                            (client_id, agent_id))
+                else:
+                    stored = self.connection.execute(
+                        'SELECT role, content FROM messages WHERE client_id = ? AND agent_id = ? '
+                        'ORDER BY id DESC LIMIT ?', (client_id, agent_id, len(items))).fetchall()
+                    stored.reverse()
+                    items = items[overlap(stored, items):]
+                if not items:
+                    result['skipped'] += 1
+                    continue
+                self.connection.executemany(
+                    'INSERT INTO messages (client_id, agent_id, role, content, created) VALUES (?, ?, ?, ?, ?)',
+                    [(client_id, agent_id) + item + (now,) for item in items])
+                result['agents'] += 1
+                result['messages'] += len(items)
+        return result
+
+    # ---------- 查询 ----------
+
+    def page(self, client_id, agent_id, before=None, limit=DEFAULT_PAGE_SIZE):
+        """读取 id 小于 before 的最近 limit 条消息（按时间顺序），返回 (消息列表, 下一页的游标或 None)"""
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        sql = 'SELECT id, role, content FROM messages WHERE client_id = ? AND agent_id = ?'
+        params = [client_id, str(agent_id)]
+        if before is not None:
+            sql += ' AND id < ?'
+            params.append(int(before))
+        sql += ' ORDER BY id DESC LIMIT ?'
+        params.append(limit + 1)
+        with self.lock:
+            rows = self.connection.execute(sql, params).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        rows.reverse()
+        messages = [{'id': row[0], 'role': row[1], 'content': row[2]} for row in rows]
+        return messages, (rows[0][0] if more else None)
+
+    def latest(self, client_id, limit=DEFAULT_PAGE_SIZE):
+        """客户端与每个智能体最近的 limit 条消息，返回 {智能体id: {'messages': [...], 'next': 游标}}"""
+        with self.lock:
+            agent_ids = [row[0] for row in self.connection.execute(
+                'SELECT DISTINCT agent_id FROM messages WHERE client_id = ?', (client_id,))]
+        result = {}
+        for agent_id in agent_ids:
+            messages, cursor = self.page(client_id, agent_id, limit=limit)
+            result[agent_id] = {'messages': messages, 'next': cursor}
+        return result
+
+    def history(self, client_id, agent_id):
+        """客户端与一个智能体的全部消息（按时间顺序），用于导出"""
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT role, content FROM messages WHERE client_id = ? AND agent_id = ? ORDER BY id',
+                (client_id, str(agent_id))).fetchall()
+        return [{'role': role, 'content': content} for role, content in rows]
+
+    def count(self, client_id=None, agent_id=None):
+        with self.lock:
+            if client_id is None:
+                return self.connection.execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+            if agent_id is None:
+                return self.connection.execute('SELECT COUNT(*) FROM messages WHERE client_id = ?',
+                                               (client_id,)).fetchone()[0]
+            return self.connection.execute('SELECT COUNT(*) FROM messages WHERE client_id = ? AND agent_id = ?',
+                                           (client_id, str(agent_id))).fetchone()[0]
@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Markdown 导出为 Word（.docx）
+
+网页端原来用 docx.js 在浏览器里逐条消息构建文档，出书助理的长稿件会让低端手机卡住。
+由 server.py 提供时改为在服务器生成：
+- 按行解析 Markdown（规则与 js/export-service.js 相同：标题、“xxx：”小标题、列表、代码块、
+  加粗/斜体/行内代码/链接），直接写出 WordprocessingML 片段，不构建文档对象树
+- 正文片段按 Markdown 内容的哈希缓存在磁盘上（多个工作进程、进程池共用），
+  同一条消息再次导出时只需重新打包；标题和导出时间在打包时加在正文前面，不影响缓存
+- 转换在进程池中进行，不阻塞服务器的事件循环；批量导出时多个文档并行转换后打包为 zip
+
+用法：
+    python docx_export.py 稿件.md -o 稿件.docx
+"""
+
+import argparse
+import asyncio
+import hashlib
+import io
+import multiprocessing
+import os
+import re
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+# 转换规则变化时修改，使旧的缓存失效
+FORMAT_VERSION = '1'
+
+DOCX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+
+# 每写入多少个缓存文件检查一次总大小
+PRUNE_EVERY = 64
+
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+
+CONTENT_TYPES = f"""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">\
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>\
+<Default Extension="xml" ContentType="application/xml"/>\
+<Override PartName="/word/document.xml" ContentType="{DOCX_CONTENT_TYPE}.main+xml"/>\
+<Override PartName="/word/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>\
+<Override PartName="/word/numbering.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.numbering+xml"/>\
+<Override PartName="/docProps/core.xml" ContentType="application/vnd.openxmlformats-package.core-properties+xml"/>\
+</Types>"""
+
+PACKAGE_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">\
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>\
+<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/package/2006/relationships/metadata/core-properties" Target="docProps/core.xml"/>\
+</Relationships>"""
+
+DOCUMENT_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">\
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>\
+<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/numbering" Target="numbering.xml"/>\
+</Relationships>"""
+
+
+def heading_style(style_id, name, size, before, after):
+    return (f'<w:style w:type="paragraph" w:styleId="{style_id}"><w:name w:val="{name}"/>'
+            '<w:basedOn w:val="Normal"/><w:next w:val="Normal"/><w:qFormat/>'
+            f'<w:pPr><w:keepNext/><w:spacing w:before="{before}" w:after="{after}"/></w:pPr>'
+            f'<w:rPr><w:b/><w:color w:val="2F5496"/><w:sz w:val="{size}"/></w:rPr></w:style>')
+
+
+# 样式与 js/export-service.js 中的 paragraphStyles 相同
+STYLES = f"""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<w:styles xmlns:w="{W_NS}">\
+<w:docDefaults><w:rPrDefault><w:rPr><w:rFonts w:ascii="Calibri" w:hAnsi="Calibri" w:eastAsia="宋体"/>\
+<w:sz w:val="22"/></w:rPr></w:rPrDefault><w:pPrDefault><w:pPr><w:spacing w:after="120"/></w:pPr></w:pPrDefault></w:docDefaults>\
+<w:style w:type="paragraph" w:default="1" w:styleId="Normal"><w:name w:val="Normal"/><w:qFormat/></w:style>\
+{heading_style('Heading1', 'heading 1', 36, 400, 120)}\
+{heading_style('Heading2', 'heading 2', 32, 320, 120)}\
+{heading_style('Heading3', 'heading 3', 28, 240, 100)}\
+<w:style w:type="paragraph" w:styleId="Code"><w:name w:val="Code"/><w:basedOn w:val="Normal"/><w:next w:val="Normal"/><w:qFormat/>\
+<w:pPr><w:shd w:val="clear" w:color="auto" w:fill="E5E5E5"/><w:spacing w:before="200" w:after="200"/></w:pPr>\
+<w:rPr><w:rFonts w:ascii="Courier New" w:hAnsi="Courier New"/></w:rPr></w:style>\
+</w:styles>"""
+
+NUMBERING = f"""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<w:numbering xmlns:w="{W_NS}">\
+<w:abstractNum w:abstractNumId="0"><w:multiLevelType w:val="singleLevel"/>\
+<w:lvl w:ilvl="0"><w:start w:val="1"/><w:numFmt w:val="bullet"/><w:lvlText w:val="•"/><w:lvlJc w:val="left"/>\
+<w:pPr><w:ind w:left="720" w:hanging="360"/></w:pPr></w:lvl></w:abstractNum>\
+<w:num w:numId="1"><w:abstractNumId w:val="0"/></w:num>\
+</w:numbering>"""
+
+DOCUMENT_HEAD = (f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                 f'<w:document xmlns:w="{W_NS}"><w:body>')
+DOCUMENT_TAIL = ('<w:sectPr><w:pgSz w:w="11906" w:h="16838"/>'
+                 '<w:pgMar w:top="1440" w:right="1440" w:bottom="1440" w:left="1440" '
+                 'w:header="708" w:footer="708" w:gutter="0"/></w:sectPr></w:body></w:document>')
+
+# XML 1.0 不允许的控制字符
+INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+HEADING_PATTERNS = [
+    (re.compile(r'^#\s+(.+)$'), 'Heading1'),
+    (re.compile(r'^##\s+(.+)$'), 'Heading2'),
+    (re.compile(r'^#{3,6}\s+(.+)$'), 'Heading3'),
+    # “标题项目：”这种单独一行的小标题按二级标题处理（与网页端一致）
+    (re.compile('^([A-Za-z0-9\u4e00-\u9fa5].*?[：:])$'), 'Heading2'),
+]
+LIST_ITEM = re.compile(r'^[*\-]\s+(.+)$')
+INLINE = re.compile(r'\*\*(.+?)\*\*|__(.+?)__|\*(.+?)\*|(?<!\w)_(.+?)_(?!\w)|`([^`]+)`|\[([^\]]*)\]\(([^)]*)\)')
+
+RUN_PROPERTIES = {
+    'bold': '<w:rPr><w:b/></w:rPr>',
+    'italic': '<w:rPr><w:i/></w:rPr>',
+    'code': ('<w:rPr><w:rFonts w:ascii="Courier New" w:hAnsi="Courier New"/>'
+             '<w:shd w:val="clear" w:color="auto" w:fill="E5E5E5"/></w:rPr>'),
+    'link': '<w:rPr><w:color w:val="0000FF"/><w:u w:val="single"/></w:rPr>',
+}
+INLINE_GROUPS = [(1, 'bold'), (2, 'bold'), (3, 'italic'), (4, 'italic'), (5, 'code'), (6, 'link')]
+
+
+def escape(text):
+    text = INVALID_XML_CHARS.sub('', text)
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def run(text, style=None):
+    if not text:
+        return ''
+    properties = RUN_PROPERTIES[style] if style else ''
+    return f'<w:r>{properties}<w:t xml:space="preserve">{escape(text)}</w:t></w:r>'
+
+
+def inline_runs(text):
+    """行内样式：**加粗**、*斜体*、`代码`、[链接](地址)"""
+    if '*' not in text and '_' not in text and '`' not in text and '[' not in text:
+        return run(text)
+    parts = []
+    position = 0
+    for match in INLINE.finditer(text):
+        parts.append(run(text[position:match.start()]))
+        for group, style in INLINE_GROUPS:
+            if match.group(group) is not None:
+                parts.append(run(match.group(group), style))
+                break
+        position = match.end()
+    parts.append(run(text[position:]))
+    return ''.join(parts)
+
+
+def paragraph(content, style=None, bullet=False):
+    properties = ''
+    if style:
+        properties = f'<w:pStyle w:val="{style}"/>'
+    if bullet:
+        properties += '<w:numPr><w:ilvl w:val="0"/><w:numId w:val="1"/></w:numPr>'
+    if properties:
+        properties = f'<w:pPr>{properties}</w:pPr>'
+    return f'<w:p>{properties}{content}</w:p>'
+
+
+def code_block(lines):
+    content = '<w:r><w:br/></w:r>'.join(run(line) or '<w:r><w:t></w:t></w:r>' for line in lines)
+    return paragraph(content, 'Code')
+
+
+def markdown_paragraphs(markdown):
+    """逐个产出 Markdown 对应的 <w:p> 片段"""
+    code_lines = None
+    for line in markdown.replace('\r\n', '\n').split('\n'):
+        if line.strip().startswith('```'):
+            if code_lines is None:
+                code_lines = []
+            else:
+                if code_lines:
+                    yield code_block(code_lines)
+                code_lines = None
+            continue
+        if code_lines is not None:
+            code_lines.append(line)
+            continue
+
+        stripped = line.strip()
+        if not stripped:
+            yield '<w:p/>'
+            continue
+        for pattern, style in HEADING_PATTERNS:
+            match = pattern.match(line)
+            if match:
+                yield paragraph(inline_runs(match.group(1)), style)
+                break
+        else:
+            match = LIST_ITEM.match(line)
+            if match:
+                yield paragraph(inline_runs(match.group(1)), bullet=True)
+            else:
+                yield paragraph(inline_runs(line))
+    if code_lines:
+        # 没有结束标记的代码块
+        yield code_block(code_lines)
+
+
+def markdown_to_body(markdown):
+    """Markdown 转换为文档正文的 XML 片段（UTF-8 字节）"""
+    return ''.join(markdown_paragraphs(markdown)).encode('utf-8')
+
+
+def content_hash(markdown):
+    return hashlib.sha256(f'{FORMAT_VERSION}\n{markdown}'.encode('utf-8')).hexdigest()
+
+
+class BodyCache:
+    """按 Markdown 内容哈希缓存正文片段的磁盘缓存，总大小超过上限时删除最久未使用的文件"""
+
+    def __init__(self, directory, max_bytes=DEFAULT_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, key):
+        return os.path.join(self.directory, key + '.xml')
+
+    def get(self, key):
+        path = self.path_for(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        try:
+            os.utime(path)  # 记录最近使用时间
+        except OSError:
+            pass
+        return data
+
+    def put(self, key, data):
+        path = self.path_for(key)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self.writes += 1
+        if self.writes % PRUNE_EVERY == 0:
+            self.prune()
+
+    def prune(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.xml') and entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+            except OSError:
+                pass
+
+    def body(self, markdown):
+        """正文片段：命中缓存时直接读取，否则转换并写入缓存"""
+        key = content_hash(markdown)
+        data = self.get(key)
+        if data is None:
+            data = markdown_to_body(markdown)
+            self.put(key, data)
+        return data
+
+
+# 每个进程（进程池中的每个子进程）每个缓存目录一个 BodyCache，写入计数跨请求累计
+_body_caches = {}
+
+
+def body_cache(directory):
+    """取得本进程的 BodyCache；第一次打开时按目录总大小清理一次（上次运行可能留下了超限的文件）"""
+    cache = _body_caches.get(directory)
+    if cache is None:
+        cache = _body_caches[directory] = BodyCache(directory)
+        cache.prune()
+    return cache
+
+
+def core_properties(title):
+    created = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    return ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<cp:coreProperties xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/core-properties" '
+            'xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:dcterms="http://purl.org/dc/terms/" '
+            'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+            f'<dc:title>{escape(title or "")}</dc:title><dc:creator>智能体聚合平台</dc:creator>'
+            '<dc:description>由智能体生成的文档</dc:description>'
+            f'<dcterms:created xsi:type="dcterms:W3CDTF">{created}</dcterms:created></cp:coreProperties>')
+
+
+def write_docx(out, body, title=None, timestamp=None):
+    """把正文片段打包为 .docx 写入 out；标题和导出时间加在正文前面（与网页端的导出选项一致）"""
+    with zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED, compresslevel=6) as package:
+        package.writestr('[Content_Types].xml', CONTENT_TYPES)
+        package.writestr('_rels/.rels', PACKAGE_RELS)
+        package.writestr('word/_rels/document.xml.rels', DOCUMENT_RELS)
+        package.writestr('word/styles.xml', STYLES)
+        package.writestr('word/numbering.xml', NUMBERING)
+        package.writestr('docProps/core.xml', core_properties(title))
+        with package.open('word/document.xml', 'w') as document:
+            document.write(DOCUMENT_HEAD.encode('utf-8'))
+            if timestamp:
+                document.write(paragraph(run(f'导出时间: {timestamp}', 'italic')).encode('utf-8') + b'<w:p/>')
+            if title:
+                document.write(paragraph(inline_runs(title), 'Heading1').encode('utf-8') + b'<w:p/>')
+            document.write(body)
+            document.write(DOCUMENT_TAIL.encode('utf-8'))
+
+
+def build_docx(cache_dir, markdown, title=None, timestamp=None):
+    """生成 .docx 文件内容（在进程池中执行）；cache_dir 为空时不使用缓存"""
+    body = body_cache(cache_dir).body(markdown) if cache_dir else markdown_to_body(markdown)
+    out = io.BytesIO()
+    write_docx(out, body, title, timestamp)
+    return out.getvalue()
+
+
+def safe_filename(name, default='文档'):
+    """去掉文件名中不允许的字符"""
+    name = re.sub(r'[\\/:*?"<>|\x00-\x1f]', '_', str(name or '')).strip().strip('.')
+    return name[:100] or default
+
+
+def unique_names(names):
+    """重名时依次加上 (2)、(3)…"""
+    seen = {}
+    result = []
+    for name in names:
+        count = seen.get(name, 0) + 1
+        seen[name] = count
+        result.append(name if count == 1 else f'{name}({count})')
+    return result
+
+
+class DocxExporter:
+    """在进程池中转换文档；进程池在第一次导出时创建"""
+
+    def __init__(self, cache_dir=None, workers=None):
+        self.cache_dir = cache_dir
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.pool = None
+        self.stats = {'documents': 0, 'batches': 0}
+
+    def executor(self):
+        if self.pool is None:
+            # spawn：子进程不继承服务器的事件循环、监听套接字和数据库连接
+            self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self.pool
+
+    async def export(self, markdown, title=None, timestamp=None):
+        loop = asyncio.get_running_loop()
+        self.stats['documents'] += 1
+        return await loop.run_in_executor(self.executor(), build_docx, self.cache_dir, markdown, title, timestamp)
+
+    async def export_zip(self, documents):
+        """documents 为 [(文件名, Markdown, 标题)]，并行转换后打包为 zip，返回 zip 内容"""
+        self.stats['batches'] += 1
+        files = await asyncio.gather(*(self.export(markdown, title) for _, markdown, title in documents))
+        names = unique_names([safe_filename(name) for name, _, _ in documents])
+        out = io.BytesIO()
+        # .docx 本身已经压缩，zip 中直接存储
+        with zipfile.ZipFile(out, 'w', zipfile.ZIP_STORED) as archive:
+            for name, data in zip(names, files):
+                archive.writestr(f'{name}.docx', data)
+        return out.getvalue()
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    def snapshot(self):
+        return dict(self.stats, workers=self.workers, pool_started=self.pool is not None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Markdown 导出为 Word（.docx）")
+    parser.add_argument('input', help="Markdown 文件")
+    parser.add_argument('-o', '--output', help="输出文件（默认与输入同名的 .docx）")
+    parser.add_argument('--title', help="文档标题")
+    args = parser.parse_args()
+
+    with open(args.input, 'r', encoding='utf-8') as f:
+        markdown = f.read()
+    output = args.output or os.path.splitext(args.input)[0] + '.docx'
+    start = time.perf_counter()
+    data = build_docx(None, markdown, args.title)
+    with open(output, 'wb') as f:
+        f.write(data)
+    print(f"已生成 {output}（{len(markdown)} 字，{(time.perf_counter() - start) * 1000:.1f} 毫秒）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地模拟的 GitHub API
+
+用于在离线环境下测试编辑器的 GitHub 同步：
+- contents API：GET 返回 sha 与 ETag，支持 If-None-Match 返回 304；
+  PUT 校验 sha，与 GitHub 一样在 sha 不匹配时返回 409
+- Git Data API：refs / commits / trees，用于单次提交同步多个文件
+
+用法：
+    python fake_github.py --port 8787
+然后在 config/github_config.ini 中设置 api_base = http://127.0.0.1:8787
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import re
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from github_sync import git_blob_sha
+
+REPO_PATTERN = re.compile(r'^/repos/([^/]+)/([^/]+)/(.+)$')
+
+
+def object_sha(kind, data):
+    """为模拟的 tree / commit 生成确定的 sha"""
+    encoded = json.dumps(data, sort_keys=True).encode('utf-8')
+    return hashlib.sha1(kind.encode('utf-8') + b'\0' + encoded).hexdigest()
+
+
+class FakeGitHubState:
+    """模拟仓库：tree 以 {路径: 内容} 的扁平形式保存"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.trees = {}    # tree sha -> {路径: 字节}
+        self.commits = {}  # commit sha -> {'tree', 'parents', 'message'}
+        self.refs = {}     # (owner, repo, branch) -> commit sha
+        self.requests = []  # [(方法, 路径, 状态码)]
+
+    def put_tree(self, files):
+        sha = object_sha('tree', sorted((path, git_blob_sha(data)) for path, data in files.items()))
+        self.trees[sha] = dict(files)
+        return sha
+
+    def put_commit(self, tree, parents, message):
+        sha = object_sha('commit', {'tree': tree, 'parents': parents, 'message': message,
+                                    'seq': len(self.commits)})
+        self.commits[sha] = {'tree': tree, 'parents': parents, 'message': message}
+        return sha
+
+    def head_files(self, owner, repo, branch):
+        """分支最新提交中的文件，分支不存在时为空"""
+        head = self.refs.get((owner, repo, branch))
+        if head is None:
+            return {}
+        return self.trees[self.commits[head]['tree']]
+
+    def commit_files(self, owner, repo, branch, files, message):
+        """在分支上提交新的文件集合"""
+        parent = self.refs.get((owner, repo, branch))
+        tree = self.put_tree(files)
+        self.refs[(owner, repo, branch)] = self.put_commit(tree, [parent] if parent else [], message)
+
+
+class FakeGitHubHandler(BaseHTTPRequestHandler):
+    server_version = 'FakeGitHub/1.0'
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, data=None, headers=None):
+        body = json.dumps(data).encode('utf-8') if data is not None else b''
+        # 先记录再响应，客户端收到响应时请求记录已经可见
+        self.state.requests.append((self.command, urllib.parse.urlsplit(self.path).path, status))
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if body:
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length).decode('utf-8')) if length else {}
+
+    def dispatch(self):
+        parsed = urllib.parse.urlsplit(self.path)
+        match = REPO_PATTERN.match(parsed.path)
+        if not match:
+            return self.send_json(404, {'message': 'Not Found'})
+
+        owner, repo, rest = match.groups()
+        query = urllib.parse.parse_qs(parsed.query)
+        routes = [
+            ('GET', r'contents/(.+)', self.get_contents),
+            ('PUT', r'contents/(.+)', self.put_contents),
+            ('GET', r'git/ref/heads/(.+)', self.get_ref),
+            ('PATCH', r'git/refs/heads/(.+)', self.update_ref),
+            ('GET', r'git/commits/([0-9a-f]+)', self.get_commit),
+            ('POST', r'git/commits', self.create_commit),
+            ('POST', r'git/trees', self.create_tree),
+        ]
+        for method, pattern, handler in routes:
+            route_match = re.fullmatch(pattern, rest)
+            if method == self.command and route_match:
+                args = [urllib.parse.unquote(group) for group in route_match.groups()]
+                with self.state.lock:
+                    return handler(owner, repo, query, *args)
+        self.send_json(404, {'message': 'Not Found'})
+
+    do_GET = do_PUT = do_POST = do_PATCH = dispatch
+
+    # ---------- contents API ----------
+
+    def get_contents(self, owner, repo, query, file_path):
+        branch = query.get('ref', ['main'])[0]
+        content = self.state.head_files(owner, repo, branch).get(file_path)
+        if content is None:
+            return self.send_json(404, {'message': 'Not Found'})
+
+        sha = git_blob_sha(content)
+        etag = f'"{sha}"'
+        if self.headers.get('If-None-Match') == etag:
+            return self.send_json(304, headers={'ETag': etag})
+        self.send_json(200, {
+            'type': 'file',
+            'path': file_path,
+            'sha': sha,
+            'size': len(content),
+            'encoding': 'base64',
+            'content': base64.b64encode(content).decode('utf-8'),
+        }, headers={'ETag': etag})
+
+    def put_contents(self, owner, repo, query, file_path):
+        data = self.read_json()
+        branch = data.get('branch', 'main')
+        content = base64.b64decode(data.get('content', ''))
+        files = dict(self.state.head_files(owner, repo, branch))
+        existing = files.get(file_path)
+        if existing is not None:
+            if not data.get('sha'):
+                return self.send_json(422, {'message': '"sha" wasn\'t supplied.'})
+            if data['sha'] != git_blob_sha(existing):
+                return self.send_json(409, {'message': f'{file_path} does not match {data["sha"]}'})
+
+        files[file_path] = content
+        self.state.commit_files(owner, repo, branch, files, data.get('message', ''))
+        self.send_json(200 if existing is not None else 201, {
+            'content': {'path': file_path, 'sha': git_blob_sha(content)},
+            'commit': {'message': data.get('message', '')},
+        })
+
+    # ---------- Git Data API ----------
+
+    def get_ref(self, owner, repo, query, branch):
+        head = self.state.refs.get((owner, repo, branch))
+        if head is None:
+            return self.send_json(404, {'message': 'Not Found'})
+        self.send_json(200, {'ref': f'refs/heads/{branch}', 'object': {'type': 'commit', 'sha': head}})
+
+    def update_ref(self, owner, repo, query, branch):
+        data = self.read_json()
+        head = self.state.refs.get((owner, repo, branch))
+        commit = self.state.commits.get(data.get('sha'))
+        if commit is None:
+            return self.send_json(422, {'message': 'Object does not exist'})
+        if head is not None and head not in commit['parents'] and not data.get('force'):
+            return self.send_json(422, {'message': 'Update is not a fast forward'})
+        self.state.refs[(owner, repo, branch)] = data['sha']
+        self.send_json(200, {'ref': f'refs/heads/{branch}', 'object': {'type': 'commit', 'sha': data['sha']}})
+
+    def get_commit(self, owner, repo, query, sha):
+        commit = self.state.commits.get(sha)
+        if commit is None:
+            return self.send_json(404, {'message': 'Not Found'})
+        self.send_json(200, {'sha': sha, 'tree': {'sha': commit['tree']},
+                             'parents': [{'sha': parent} for parent in commit['parents']],
+                             'message': commit['message']})
+
+    def create_commit(self, owner, repo, query):
+        data = self.read_json()
+        if data.get('tree') not in self.state.trees:
+            return self.send_json(422, {'message': 'Tree does not exist'})
+        sha = self.state.put_commit(data['tree'], data.get('parents', []), data.get('message', ''))
+        self.send_json(201, {'sha': sha, 'tree': {'sha': data['tree']}})
+
+    def create_tree(self, owner, repo, query):
+        data = self.read_json()
+        files = {}
+        if data.get('base_tree'):
+            if data['base_tree'] not in self.state.trees:
+                return self.send_json(422, {'message': 'Base tree does not exist'})
+            files = dict(self.state.trees[data['base_tree']])
+        for entry in data.get('tree', []):
+            if 'content' in entry:
+                files[entry['path']] = entry['content'].encode('utf-8')
+            elif entry.get('sha') is None:
+                files.pop(entry['path'], None)
+            else:
+                return self.send_json(422, {'message': 'Only inline content is supported'})
+        sha = self.state.put_tree(files)
+        self.send_json(201, {'sha': sha})
+
+
+class FakeGitHubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, handler_class=FakeGitHubHandler):
+        super().__init__(address, handler_class)
+        self.state = FakeGitHubState()
+
+    @property
+    def api_base(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_fake_github(host='127.0.0.1', port=0):
+    """在后台线程启动模拟服务器，返回服务器对象（api_base 属性为接口地址）"""
+    server = FakeGitHubServer((host, port))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟的 GitHub API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8787)
+    args = parser.parse_args()
+
+    server = FakeGitHubServer((args.host, args.port))
+    print(f"模拟GitHub API已启动: {server.api_base}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n已停止")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地模拟的 OpenAI 兼容接口
+
+用于离线测试在线验证、基准测试（bench.py）等功能：
+- POST /v1/chat/completions：校验 Bearer 密钥和模型，返回固定内容的回复；
+  "stream": true 时以 chunked 编码返回 OpenAI 格式的 SSE 流
+- GET /v1/models：列出可用模型
+- --latency 模拟首个数据到达前的延迟，--keys / --models 限定可用的密钥和模型（不指定时全部接受）
+- 流式回复：--reply-chars 回复长度，--chunk-chars 每个数据块的字数，--token-rate 每秒发出的数据块数
+- --error-rate 按比例返回 500 错误；是否出错由 --seed 和请求序号决定，结果可重复
+- --slow-rate 按比例让请求额外等待 --slow-latency 秒，模拟上游的长尾延迟
+
+用法：
+    python fake_openai.py --port 8788 --latency 0.2 --keys sk-test-key-1234567890
+然后把智能体的 apiUrl 设置为 http://127.0.0.1:8788/v1/chat/completions
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from sse import text_to_events
+
+DEFAULT_REPLY = "这是来自本地模拟接口的回复。"
+
+
+def make_reply(chars):
+    """生成指定长度的确定性回复文本"""
+    unit = "汤仔基准测试回复，内容固定便于比较。Benchmark reply text. "
+    return (unit * (chars // len(unit) + 1))[:chars]
+
+
+class FakeOpenAIState:
+    """模拟接口的配置和请求记录"""
+
+    def __init__(self, keys=None, models=None, latency=0.0, reply=DEFAULT_REPLY, reply_chars=None,
+                 chunk_chars=4, token_rate=0.0, error_rate=0.0, seed=0, slow_rate=0.0, slow_latency=0.0):
+        self.lock = threading.Lock()
+        self.keys = set(keys) if keys else None        # None 表示接受任何非空密钥
+        self.models = set(models) if models else None  # None 表示接受任何模型
+        self.latency = latency
+        self.reply = make_reply(reply_chars) if reply_chars else reply
+        self.chunk_chars = max(1, chunk_chars)
+        self.token_rate = token_rate    # 每秒发出的数据块数，0 表示不限速
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.slow_random = random.Random(seed)
+        self.requests = []  # [(方法, 路径, 状态码)]
+        self.active = 0     # 正在处理的请求数
+        self.max_active = 0  # 同时处理的最大请求数
+
+    def record(self, method, path, status):
+        with self.lock:
+            self.requests.append((method, path, status))
+
+    def should_fail(self):
+        """按 error_rate 决定本次请求是否返回错误（同一 seed 下顺序固定）"""
+        if not self.error_rate:
+            return False
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+    def delay(self):
+        """本次请求首个数据到达前的延迟：固定延迟，按 slow_rate 再加上长尾延迟"""
+        delay = self.latency
+        if self.slow_rate:
+            with self.lock:
+                if self.slow_random.random() < self.slow_rate:
+                    delay += self.slow_latency
+        return delay
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    server_version = 'FakeOpenAI/1.0'
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True  # 小数据块立即发出，不被 Nagle 算法合并延迟
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        # 先记录再响应，客户端收到响应时请求记录已经可见
+        self.state.record(self.command, urllib.parse.urlsplit(self.path).path, status)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, message, code):
+        self.send_json(status, {'error': {'message': message, 'type': 'invalid_request_error', 'code': code}})
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length).decode('utf-8')) if length else {}
+
+    def check_key(self):
+        """校验密钥，失败时发送 401 并返回 False"""
+        auth = self.headers.get('Authorization', '')
+        key = auth[7:].strip() if auth.startswith('Bearer ') else ''
+        if not key or (self.state.keys is not None and key not in self.state.keys):
+            self.send_error_json(401, 'Incorrect API key provided', 'invalid_api_key')
+            return False
+        return True
+
+    def handle_one(self, handler):
+        with self.state.lock:
+            self.state.active += 1
+            self.state.max_active = max(self.state.max_active, self.state.active)
+        try:
+            delay = self.state.delay()
+            if delay:
+                time.sleep(delay)
+            handler()
+        finally:
+            with self.state.lock:
+                self.state.active -= 1
+
+    def do_GET(self):
+        path = urllib.parse.urlsplit(self.path).path
+        if path != '/v1/models':
+            return self.send_error_json(404, 'Not Found', 'not_found')
+        if self.check_key():
+            models = sorted(self.state.models or ['gpt-4o-mini'])
+            self.send_json(200, {'object': 'list', 'data': [{'id': model, 'object': 'model'} for model in models]})
+
+    def do_POST(self):
+        path = urllib.parse.urlsplit(self.path).path
+        if path != '/v1/chat/completions':
+            self.read_json()
+            return self.send_error_json(404, 'Not Found', 'not_found')
+        self.handle_one(self.chat_completions)
+
+    def chat_completions(self):
+        try:
+            data = self.read_json()
+        except ValueError:
+            return self.send_error_json(400, 'Invalid JSON body', 'invalid_json')
+        if not self.check_key():
+            return
+        model = data.get('model')
+        if not model or (self.state.models is not None and model not in self.state.models):
+            return self.send_error_json(404, f'The model `{model}` does not exist', 'model_not_found')
+
+        if self.state.should_fail():
+            return self.send_error_json(500, 'Simulated upstream error', 'server_error')
+
+        reply = self.state.reply
+        if data.get('max_tokens'):
+            reply = reply[:max(1, int(data['max_tokens']))]
+        if data.get('stream'):
+            return self.stream_reply(model, reply)
+        self.send_json(200, {
+            'id': 'chatcmpl-fake',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': reply}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': 1, 'completion_tokens': len(reply), 'total_tokens': 1 + len(reply)},
+        })
+
+    def stream_reply(self, model, reply):
+        """按 chunk_chars / token_rate 分块发出 SSE 流（chunked 编码）"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        interval = 1.0 / self.state.token_rate if self.state.token_rate else 0.0
+        next_time = time.perf_counter()
+        status = 200
+        try:
+            for event in text_to_events(reply, model, 'chatcmpl-fake', piece_chars=self.state.chunk_chars):
+                if interval:
+                    delay = next_time - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    next_time += interval
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(event), event))
+                self.wfile.flush()
+            self.wfile.write(b'0\r\n\r\n')
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端中途断开（用于测试中断上游的行为），记为 499
+            status = 499
+            self.close_connection = True
+        self.state.record(self.command, urllib.parse.urlsplit(self.path).path, status)
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, handler_class=FakeOpenAIHandler, **options):
+        super().__init__(address, handler_class)
+        self.state = FakeOpenAIState(**options)
+
+    @property
+    def api_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+
+def start_fake_openai(host='127.0.0.1', port=0, **options):
+    """在后台线程启动模拟接口，返回服务器对象（api_url 属性为聊天接口地址）"""
+    server = FakeOpenAIServer((host, port), **options)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟的 OpenAI 兼容接口")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8788)
+    parser.add_argument('--keys', nargs='*', help='可用的密钥（不指定时接受任何非空密钥）')
+    parser.add_argument('--models', nargs='*', help='可用的模型（不指定时接受任何模型）')
+    parser.add_argument('--latency', type=float, default=0.0, help='首个数据到达前的延迟（秒）')
+    parser.add_argument('--reply-chars', type=int, default=None, help='流式回复的长度（字数）')
+    parser.add_argument('--chunk-chars', type=int, default=4, help='每个数据块的字数')
+    parser.add_argument('--token-rate', type=float, default=0.0, help='每秒发出的数据块数（0 表示不限速）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回 500 错误的比例')
+    parser.add_argument('--slow-rate', type=float, default=0.0, help='额外变慢的请求比例')
+    parser.add_argument('--slow-latency', type=float, default=0.0, help='变慢的请求额外等待的时间（秒）')
+    parser.add_argument('--seed', type=int, default=0, help='错误注入的随机种子')
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer((args.host, args.port), keys=args.keys, models=args.models, latency=args.latency,
+                              reply_chars=args.reply_chars, chunk_chars=args.chunk_chars,
+                              token_rate=args.token_rate, error_rate=args.error_rate, seed=args.seed,
+                              slow_rate=args.slow_rate, slow_latency=args.slow_latency)
+    print(f"模拟OpenAI接口已启动: {server.api_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n已停止")
+
+
+if __name__ == "__main__":
+    main()
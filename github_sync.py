@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+GitHub 同步
+
+供智能体编辑器使用的 GitHub contents API 客户端：
+- 本地计算文件的 git blob SHA，与远程 sha 相同时跳过上传
+- 缓存上次得到的远程 sha 和 ETag，使用 If-None-Match 条件请求，
+  远程未变化时 GitHub 只返回 304（不计入速率限制）
+- 通过 Git Data API 把多个文件放进一次提交，请求次数与文件数无关
+"""
+
+import base64
+import hashlib
+import json
+import os
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from save_pipeline import atomic_write
+
+DEFAULT_API_BASE = 'https://api.github.com'
+
+
+def git_blob_sha(data):
+    """计算与 git 相同的 blob SHA-1"""
+    header = f"blob {len(data)}\0".encode('utf-8')
+    return hashlib.sha1(header + data).hexdigest()
+
+
+class GitHubError(Exception):
+    """GitHub API 返回的错误"""
+
+    def __init__(self, status, message):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+        self.message = message
+
+
+class SyncState:
+    """记录每个文件上次已知的远程 sha 与 ETag（保存在 config/github_state.json）"""
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+
+    def key(self, owner, repo, branch, file_path):
+        return f"{owner}/{repo}@{branch}:{file_path}"
+
+    def get(self, key):
+        return self.entries.get(key, {})
+
+    def update(self, key, **values):
+        entry = self.entries.setdefault(key, {})
+        entry.update(values)
+        self.save()
+
+    def remove(self, keys):
+        for key in keys:
+            self.entries.pop(key, None)
+        self.save()
+
+    def save(self):
+        atomic_write(self.path, json.dumps(self.entries, ensure_ascii=False, indent=2).encode('utf-8'))
+
+
+class GitHubClient:
+    """最小化的 GitHub REST 客户端（只依赖 urllib）"""
+
+    def __init__(self, owner, repo, token=None, api_base=DEFAULT_API_BASE, ssl_context=None, timeout=30):
+        self.owner = owner
+        self.repo = repo
+        self.token = token
+        self.api_base = (api_base or DEFAULT_API_BASE).rstrip('/')
+        self.ssl_context = ssl_context
+        self.timeout = timeout
+        self.request_count = 0
+
+    def url(self, path, query=None):
+        url = f"{self.api_base}/repos/{self.owner}/{self.repo}/{path.lstrip('/')}"
+        if query:
+            url += '?' + urllib.parse.urlencode(query)
+        return url
+
+    def request(self, method, path, data=None, query=None, headers=None):
+        """发送请求，返回 (状态码, 响应头, 解析后的 JSON 或 None)；304 不视为错误"""
+        request_headers = {'Accept': 'application/vnd.github.v3+json'}
+        if self.token:
+            request_headers['Authorization'] = f"token {self.token}"
+        body = None
+        if data is not None:
+            body = json.dumps(data).encode('utf-8')
+            request_headers['Content-Type'] = 'application/json'
+        request_headers.update(headers or {})
+
+        request = urllib.request.Request(self.url(path, query), data=body,
+                                         headers=request_headers, method=method)
+        self.request_count += 1
+        try:
+            with urllib.request.urlopen(request, context=self.ssl_context, timeout=self.timeout) as response:
+                content = response.read()
+                return response.status, response.headers, json.loads(content.decode('utf-8')) if content else None
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return 304, e.headers, None
+            message = e.read().decode('utf-8', errors='replace')
+            try:
+                message = json.loads(message).get('message', message)
+            except (ValueError, AttributeError):
+                pass
+            raise GitHubError(e.code, message)
+
+    # ---------- contents API ----------
+
+    def get_contents(self, file_path, branch, etag=None):
+        """读取文件信息，返回 (状态码, sha, etag)；文件不存在时 sha 为 None"""
+        headers = {'If-None-Match': etag} if etag else None
+        try:
+            status, response_headers, data = self.request(
+                'GET', f"contents/{file_path}", query={'ref': branch}, headers=headers)
+        except GitHubError as e:
+            if e.status == 404:
+                return 404, None, None
+            raise
+        if status == 304:
+            return 304, None, etag
+        return status, data.get('sha'), response_headers.get('ETag')
+
+    def put_contents(self, file_path, branch, content, message, sha=None):
+        """上传文件内容，返回新的 blob sha"""
+        upload_data = {
+            'message': message,
+            'content': base64.b64encode(content).decode('utf-8'),
+            'branch': branch,
+        }
+        if sha:
+            upload_data['sha'] = sha
+        _, _, data = self.request('PUT', f"contents/{file_path}", data=upload_data)
+        return data['content']['sha']
+
+    def sync_file(self, file_path, branch, content, message, state=None):
+        """在远程内容不同时上传文件
+
+        返回 (是否上传, 远程 sha)。远程与本地 blob sha 相同时不上传。
+        """
+        local_sha = git_blob_sha(content)
+        state_key = state.key(self.owner, self.repo, branch, file_path) if state else None
+        cached = state.get(state_key) if state else {}
+
+        status, remote_sha, etag = self.get_contents(file_path, branch, cached.get('etag'))
+        if status == 304:
+            # 远程自上次读取以来没有变化
+            remote_sha = cached.get('sha')
+        if state and status != 404:
+            state.update(state_key, sha=remote_sha, etag=etag)
+
+        if remote_sha == local_sha:
+            return False, remote_sha
+
+        new_sha = self.put_contents(file_path, branch, content, message, remote_sha)
+        if state:
+            # 上传后远程内容已变化，旧的 ETag 不再有效
+            state.update(state_key, sha=new_sha, etag=None)
+        return True, new_sha
+
+    # ---------- Git Data API ----------
+
+    def commit_files(self, branch, files, message, deleted=()):
+        """把多个文件放进同一次提交
+
+        files 为 {远程路径: 字节}，只支持 UTF-8 文本文件（以内联内容写入 tree）；
+        deleted 为要在同一次提交中删除的远程路径。
+        无论文件多少，最多只需 5 次请求：读取分支、读取提交、创建 tree、创建提交、更新分支。
+        返回 (是否产生了新提交, 分支最新的提交 sha)；内容与远程完全一致时不提交。
+        """
+        _, _, ref = self.request('GET', f"git/ref/heads/{urllib.parse.quote(branch)}")
+        head_sha = ref['object']['sha']
+        _, _, head_commit = self.request('GET', f"git/commits/{head_sha}")
+        base_tree = head_commit['tree']['sha']
+
+        entries = []
+        for path, content in sorted(files.items()):
+            try:
+                text = content.decode('utf-8')
+            except UnicodeDecodeError:
+                raise ValueError(f"只能批量同步UTF-8文本文件: {path}")
+            entries.append({'path': path, 'mode': '100644', 'type': 'blob', 'content': text})
+        for path in sorted(deleted):
+            entries.append({'path': path, 'mode': '100644', 'type': 'blob', 'sha': None})
+        _, _, tree = self.request('POST', 'git/trees', data={'base_tree': base_tree, 'tree': entries})
+
+        # tree 没有变化说明所有文件都与远程相同
+        if tree['sha'] == base_tree:
+            return False, head_sha
+
+        _, _, commit = self.request('POST', 'git/commits', data={
+            'message': message,
+            'tree': tree['sha'],
+            'parents': [head_sha],
+        })
+        self.request('PATCH', f"git/refs/heads/{urllib.parse.quote(branch)}", data={'sha': commit['sha']})
+        return True, commit['sha']
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+对冲请求与多接口故障转移
+
+每个智能体原来只有一个 apiUrl 和 model，上游变慢时用户只能一直等到网页端 30 秒超时。
+智能体可以配置一组等价的备用接口：
+
+    "fallbacks": [{"apiUrl": "...", "model": "...", "apiKey": "..."}],
+    "hedge": true
+
+- 记录每个 (接口地址, 模型) 最近的首个数据块到达时间（TTFT），用其 p95 作为对冲阈值
+- 超过阈值仍没有收到首个数据块时，向下一个备用接口（没有备用接口时向同一接口）发出相同的请求，
+  先收到首个数据块的一方胜出，另一方立即取消并关闭连接
+- 某个请求在收到数据前失败（连接错误、5xx、429）时立即改用下一个备用接口
+- 所有请求都先读到首个数据块再返回，因此未配置对冲的请求也会记录 TTFT
+- 每个接口使用自己的密钥：备用接口配置了 apiKey 时使用它；没有配置时只有与主接口同源
+  （协议、主机和端口都相同）才沿用主接口的 Authorization，否则跳过该备用接口，密钥不会发给其他服务商
+"""
+
+import asyncio
+import collections
+import json
+import urllib.parse
+
+# 样本不足时的对冲阈值（秒）
+DEFAULT_HEDGE_DELAY = 3.0
+MIN_HEDGE_DELAY = 0.5
+MAX_HEDGE_DELAY = 15.0
+MIN_SAMPLES = 10
+MAX_SAMPLES = 200
+
+# 视为可以换一个接口重试的状态码
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class TTFTTracker:
+    """按 (接口地址, 模型) 记录最近的 TTFT"""
+
+    def __init__(self):
+        self.samples = {}
+
+    def record(self, target, seconds):
+        self.samples.setdefault(target, collections.deque(maxlen=MAX_SAMPLES)).append(seconds)
+
+    def percentile(self, target, p):
+        samples = self.samples.get(target)
+        if not samples or len(samples) < MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+    def threshold(self, target):
+        """对冲阈值：观测到的 p95 TTFT（限制在合理范围内）"""
+        p95 = self.percentile(target, 95)
+        if p95 is None:
+            return DEFAULT_HEDGE_DELAY
+        return min(MAX_HEDGE_DELAY, max(MIN_HEDGE_DELAY, p95))
+
+    def snapshot(self):
+        return {
+            f"{url} {model}": {
+                'samples': len(samples),
+                'p50_ms': round((self.percentile((url, model), 50) or 0) * 1000),
+                'p95_ms': round((self.percentile((url, model), 95) or 0) * 1000),
+                'hedge_after_ms': round(self.threshold((url, model)) * 1000),
+            }
+            for (url, model), samples in self.samples.items()
+        }
+
+
+class Attempt:
+    """一个候选上游：地址、模型、请求头和请求体"""
+
+    def __init__(self, url, model, headers, body):
+        self.url = url
+        self.model = model
+        self.headers = headers
+        self.body = body
+
+    @property
+    def target(self):
+        return self.url, self.model
+
+
+class PrefetchedResponse:
+    """已经读到首个数据块的上游响应；body() 先产出该数据块再继续读取"""
+
+    def __init__(self, upstream, chunks, first, attempt, hedged=False):
+        self.upstream = upstream
+        self.chunks = chunks
+        self.first = first
+        self.attempt = attempt
+        self.hedged = hedged      # 是否由对冲或故障转移的请求胜出
+        self.status = upstream.status
+        self.headers = upstream.headers
+
+    def header(self, name, default=''):
+        return self.upstream.header(name, default)
+
+    def relay_headers(self):
+        headers = self.upstream.relay_headers()
+        if self.hedged:
+            headers.append(('X-Hedged', '1'))
+        return headers
+
+    async def body(self):
+        if self.first:
+            yield self.first
+        async for chunk in self.chunks:
+            yield chunk
+
+    def release(self, reusable=False):
+        self.upstream.release(reusable)
+
+
+def origin(url):
+    """接口地址的 (协议, 主机, 端口)"""
+    parsed = urllib.parse.urlsplit(url)
+    try:
+        port = parsed.port
+    except ValueError:
+        port = None
+    return parsed.scheme.lower(), (parsed.hostname or '').lower(), port or (443 if parsed.scheme == 'https' else 80)
+
+
+def attempts_for(agent, url, headers, body):
+    """请求的候选上游列表：原请求 + 智能体配置的备用接口
+
+    没有配置密钥且与原请求不同源的备用接口被跳过（不把原请求的密钥发给其他接口）。
+    """
+    try:
+        payload = json.loads(body.decode('utf-8'))
+    except (UnicodeDecodeError, ValueError):
+        payload = None
+    model = payload.get('model') if isinstance(payload, dict) else None
+    attempts = [Attempt(url, model, headers, body)]
+    for fallback in (agent or {}).get('fallbacks') or []:
+        if not isinstance(fallback, dict) or not fallback.get('apiUrl') or not isinstance(payload, dict):
+            continue
+        fallback_model = fallback.get('model') or model
+        fallback_body = body
+        if fallback_model != model:
+            fallback_body = json.dumps(dict(payload, model=fallback_model), ensure_ascii=False).encode('utf-8')
+        key = (fallback.get('apiKeyVariableName') or fallback.get('apiKey') or '').strip()
+        if key:
+            fallback_headers = [(name, value) for name, value in headers if name.lower() != 'authorization']
+            fallback_headers.append(('Authorization', f'Bearer {key}'))
+        elif origin(fallback['apiUrl']) == origin(url):
+            fallback_headers = headers
+        else:
+            continue
+        attempts.append(Attempt(fallback['apiUrl'], fallback_model, fallback_headers, fallback_body))
+    return attempts
+
+
+class Hedger:
+    """按阈值发出对冲请求，返回最先收到首个数据块的上游响应"""
+
+    def __init__(self, open_upstream, tracker=None, enabled=True):
+        self.open_upstream = open_upstream    # async (attempt) -> 上游响应
+        self.tracker = tracker or TTFTTracker()
+        self.enabled = enabled
+        self.stats = {'requests': 0, 'hedged': 0, 'hedge_wins': 0, 'failovers': 0}
+
+    async def first_chunk(self, attempt):
+        """发出请求并读到首个数据块，返回 (上游响应, 数据块迭代器, 首个数据块)"""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        upstream = await self.open_upstream(attempt)
+        try:
+            chunks = upstream.body().__aiter__()
+            try:
+                first = await chunks.__anext__()
+            except StopAsyncIteration:
+                first = b''
+        except BaseException:
+            upstream.release(False)
+            raise
+        if upstream.status == 200:
+            self.tracker.record(attempt.target, loop.time() - start)
+        return upstream, chunks, first
+
+    async def request(self, attempts, hedge=False):
+        """依次或并行尝试候选上游，返回 PrefetchedResponse
+
+        hedge 为真时，超过阈值没有首个数据块就并行发出下一个请求（没有备用接口时重复原请求）。
+        """
+        self.stats['requests'] += 1
+        hedge = hedge and self.enabled
+        if hedge and len(attempts) == 1:
+            attempts = attempts * 2
+        pending = {}           # 任务 -> (序号, 候选)
+        next_index = 0
+        failed_over = False    # 是否因为前一个请求失败而改用备用接口
+        last_error = None
+        last_response = None
+
+        def launch():
+            nonlocal next_index
+            attempt = attempts[next_index]
+            task = asyncio.ensure_future(self.first_chunk(attempt))
+            pending[task] = (next_index, attempt)
+            next_index += 1
+
+        launch()
+        try:
+            while pending:
+                timeout = None
+                if hedge and next_index < len(attempts) and len(pending) == 1:
+                    (index, attempt), = pending.values()
+                    timeout = self.tracker.threshold(attempt.target)
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # 超过阈值：发出对冲请求
+                    self.stats['hedged'] += 1
+                    launch()
+                    continue
+                for task in done:
+                    index, attempt = pending.pop(task)
+                    try:
+                        upstream, chunks, first = task.result()
+                    except Exception as e:
+                        last_error = e
+                        upstream = None
+                    if upstream is not None and upstream.status not in RETRYABLE_STATUS:
+                        if index > 0:
+                            self.stats['failovers' if failed_over else 'hedge_wins'] += 1
+                        if last_response is not None:
+                            last_response.release(False)
+                        return PrefetchedResponse(upstream, chunks, first, attempt, hedged=index > 0)
+                    if upstream is not None:
+                        # 可重试的错误：保留最后一个错误响应，全部失败时转发给客户端
+                        if last_response is not None:
+                            last_response.release(False)
+                        last_response = PrefetchedResponse(upstream, chunks, first, attempt, hedged=index > 0)
+                    if not pending and next_index < len(attempts):
+                        failed_over = True
+                        launch()
+            if last_response is not None:
+                return last_response
+            raise last_error
+        finally:
+            # 取消落败的请求，关闭它们的连接
+            for task in pending:
+                task.cancel()
+            for task in pending:
+                task.add_done_callback(self.discard)
+
+    @staticmethod
+    def discard(task):
+        if not task.cancelled() and task.exception() is None:
+            task.result()[0].release(False)
+
+    def snapshot(self):
+        return dict(self.stats, enabled=self.enabled, ttft=self.tracker.snapshot())
@@ -15,6 +15,9 @@ const AgentService = {
     agentsLoadPromise: null,
     lastLoadTime: 0,
     
+    // 分片存储时按需加载的智能体完整配置（id -> Promise）
+    agentBodyPromises: {},
+    
     // 初始化智能体列表
     init: async function() {
         console.log("开始初始化智能体服务...");
@@ -149,6 +152,14 @@ const AgentService = {
                     source: 'json'
                 };
                 
+                // 分片存储：清单中只有名称等字段，完整配置在选中时加载
+                if (agent.shard) {
+                    formattedAgent.shard = agent.shard;
+                    formattedAgent.shardHash = agent.shardHash;
+                    formattedAgent.bodyLoaded = false;
+                    return formattedAgent;
+                }
+                
                 // 🔧 调试信息：检查API密钥映射
                 if (!formattedAgent.apiKey || formattedAgent.apiKey === 'YOUR_API_KEY_HERE') {
                     console.warn('智能体API密钥配置问题:', {
@@ -241,13 +252,17 @@ const AgentService = {
             // 创建新的Promise并保存引用
             this.agentsLoadPromise = new Promise(async (resolve) => {
                 try {
-                    const response = await fetch('agents.json?t=' + Date.now(), {
-                        headers: {
-                            'Cache-Control': 'no-cache, no-store, must-revalidate',
-                            'Pragma': 'no-cache',
-                            'Expires': '0'
-                        },
-                        cache: 'no-store'
+                    // 优先读取分片存储的清单，只包含渲染列表所需的字段
+                    const manifestAgents = await this.loadAgentManifest();
+                    if (manifestAgents) {
+                        window.cachedAgentsJSON = manifestAgents;
+                        resolve(manifestAgents);
+                        return;
+                    }
+                    
+                    // 每次都向服务器确认（If-None-Match），内容未变时服务器只返回304
+                    const response = await fetch('agents.json', {
+                        cache: 'no-cache'
                     });
                     
                     if (!response.ok) {
@@ -280,6 +295,71 @@ const AgentService = {
         }
     },
     
+    // 读取分片存储的清单（agents/manifest.json），不存在时返回null
+    loadAgentManifest: async function() {
+        try {
+            const response = await fetch('agents/manifest.json', { cache: 'no-cache' });
+            if (!response.ok) {
+                return null;
+            }
+            
+            const manifest = await response.json();
+            if (!manifest || !Array.isArray(manifest.agents)) {
+                return null;
+            }
+            
+            console.log("成功加载agents/manifest.json:", manifest.agents.length, "个智能体");
+            return manifest.agents.map(entry => ({
+                id: entry.id,
+                name: entry.name,
+                model: entry.model,
+                shard: 'agents/' + entry.file,
+                shardHash: entry.hash
+            }));
+        } catch (error) {
+            console.warn("未使用分片存储:", error.message);
+            return null;
+        }
+    },
+    
+    // 加载智能体的完整配置（系统提示词、欢迎语等）；非分片智能体直接返回
+    loadAgentBody: function(agent) {
+        if (!agent || !agent.shard || agent.bodyLoaded !== false) {
+            return Promise.resolve(agent);
+        }
+        
+        if (!this.agentBodyPromises[agent.id]) {
+            this.agentBodyPromises[agent.id] = (async () => {
+                try {
+                    const response = await fetch(agent.shard, { cache: 'no-cache' });
+                    if (!response.ok) {
+                        throw new Error(`HTTP ${response.status}`);
+                    }
+                    
+                    const data = await response.json();
+                    Object.assign(agent, {
+                        name: data.name || agent.name,
+                        apiUrl: data.apiUrl,
+                        apiKey: data.apiKeyVariableName || data.apiKey,
+                        model: data.model || agent.model,
+                        systemPrompt: data.systemPrompt || '',
+                        temperature: data.temperature || 0.7,
+                        maxTokens: data.max_tokens || 2048,
+                        welcomeMessage: data.welcomeMessage || '',
+                        bodyLoaded: true
+                    });
+                    this.saveAgents();
+                } catch (error) {
+                    console.error("加载智能体配置失败:", agent.shard, error);
+                } finally {
+                    delete this.agentBodyPromises[agent.id];
+                }
+                return agent;
+            })();
+        }
+        return this.agentBodyPromises[agent.id];
+    },
+    
     // 保存智能体到本地存储
     saveAgents: function() {
         try {
@@ -412,6 +492,17 @@ const AgentService = {
     selectAgent: function(agentId) {
         this.currentAgent = this.agents.find(agent => agent.id === agentId);
         
+        // 分片存储的智能体先加载完整配置，加载后如果仍是当前智能体再继续
+        if (this.currentAgent && this.currentAgent.shard && this.currentAgent.bodyLoaded === false) {
+            const agent = this.currentAgent;
+            this.loadAgentBody(agent).then(() => {
+                if (this.currentAgent === agent && agent.bodyLoaded) {
+                    this.selectAgent(agentId);
+                }
+            });
+            return agent;
+        }
+        
         if (this.currentAgent) {
             // 隐藏横幅
             this.hidePlatformBanner();
@@ -652,6 +743,8 @@ const AgentService = {
             this.agents[agentIndex] = {
                 ...agentData,
                 source: originalSource,
+                // 本地修改过的agents.json智能体不再由服务器注入配置
+                modified: originalSource === 'json' ? true : agent.modified,
                 isBuiltIn: false
             };
             
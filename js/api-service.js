@@ -5,6 +5,26 @@
 
 // API服务对象
 const ApiService = {
+    // 本地转发服务器(server.py)检测结果，null表示尚未检测
+    proxyCheck: null,
+    
+    // server.py的/v1/health返回的信息（是否启用对话记录存储等）
+    serverInfo: null,
+    
+    // 检测页面是否由server.py提供，是则通过同源的/v1/chat/completions转发
+    detectProxy: function() {
+        if (this.proxyCheck === null) {
+            this.proxyCheck = fetch('/v1/health', { cache: 'no-store' })
+                .then(response => response.ok ? response.json() : null)
+                .then(data => {
+                    this.serverInfo = data;
+                    return !!(data && data.proxy);
+                })
+                .catch(() => false);
+        }
+        return this.proxyCheck;
+    },
+    
     // 调用AI服务
     callAI: async function(agent, userMessage, onChunkReceived, onComplete, onError) {
         if (!agent) {
@@ -14,9 +34,17 @@ const ApiService = {
             return;
         }
         
+        // 有本地转发服务器时走同源接口，复用服务器到上游的长连接
+        const useProxy = await this.detectProxy();
+        
+        // agents.json中未在本地修改过的智能体：只发送智能体ID和对话消息，
+        // 由服务器注入模型参数、系统提示词和API密钥
+        const serverInjected = useProxy && !!(this.serverInfo && this.serverInfo.agentInjection) &&
+            agent.source === 'json' && !agent.modified;
+        
         // 🔧 修复：确保API密钥字段正确
         const apiKey = agent.apiKey || agent.apiKeyVariableName;
-        if (!apiKey || apiKey === 'YOUR_API_KEY_HERE') {
+        if (!serverInjected && (!apiKey || apiKey === 'YOUR_API_KEY_HERE')) {
             console.error('API密钥无效:', { 
                 agentId: agent.id, 
                 agentName: agent.name,
@@ -40,12 +68,18 @@ const ApiService = {
                 : [{ role: 'user', content: userMessage }];
             
             // 添加系统提示词（如果有）
-            if (agent.systemPrompt) {
+            if (agent.systemPrompt && !serverInjected) {
                 messages.unshift({ role: 'system', content: agent.systemPrompt });
             }
             
             // 准备请求数据
-            const requestData = {
+            const requestData = serverInjected ? {
+                messages: messages,
+                top_p: 1,
+                frequency_penalty: 0,
+                presence_penalty: 0,
+                stream: true
+            } : {
                 model: agent.model,
                 messages: messages,
                 temperature: agent.temperature,
@@ -56,12 +90,29 @@ const ApiService = {
                 stream: true
             };
             
+            const endpoint = useProxy ? '/v1/chat/completions' : agent.apiUrl;
+            const headers = {
+                'Content-Type': 'application/json'
+            };
+            if (serverInjected) {
+                headers['X-Agent-Id'] = agent.id;
+            } else {
+                headers['Authorization'] = `Bearer ${apiKey}`;
+            }
+            if (useProxy && !serverInjected) {
+                headers['X-Upstream-Url'] = agent.apiUrl;
+                // 服务器据此查找智能体配置（例如是否允许缓存回复）
+                headers['X-Agent-Id'] = agent.id;
+            }
+            
             // 🔧 调试信息
             console.log('API调用详情:', {
                 agentName: agent.name,
                 apiUrl: agent.apiUrl,
+                viaProxy: useProxy,
                 model: agent.model,
-                apiKeyPrefix: apiKey.substring(0, 10) + '...',
+                serverInjected: serverInjected,
+                apiKeyPrefix: serverInjected ? '(由服务器注入)' : apiKey.substring(0, 10) + '...',
                 messageCount: messages.length
             });
             
@@ -70,12 +121,9 @@ const ApiService = {
             const timeoutId = setTimeout(() => controller.abort(), 30000);
             
             // 发起请求
-            const response = await fetch(agent.apiUrl, {
+            const response = await fetch(endpoint, {
                 method: 'POST',
-                headers: {
-                    'Authorization': `Bearer ${apiKey}`,
-                    'Content-Type': 'application/json'
-                },
+                headers: headers,
                 body: JSON.stringify(requestData),
                 signal: controller.signal
             });
@@ -144,7 +144,7 @@ const App = {
             
             // 初始化聊天服务
             if (window.ChatService) {
-                window.ChatService.init();
+                await window.ChatService.init();
                 console.log("聊天服务初始化完成");
             } else {
                 console.warn("聊天服务不可用");
@@ -376,6 +376,16 @@ const App = {
         if (window.AgentService) {
             const agent = window.AgentService.editAgent(agentId);
             
+            // 分片存储的智能体先加载完整配置再填充表单
+            if (agent && agent.shard && agent.bodyLoaded === false) {
+                window.AgentService.loadAgentBody(agent).then(() => {
+                    if (agent.bodyLoaded) {
+                        this.editAgent(agentId);
+                    }
+                });
+                return;
+            }
+            
             if (agent) {
                 // 获取表单容器
                 const formContainer = document.getElementById('agent-form-container');
@@ -8,16 +8,137 @@ const ChatService = {
     // 存储对话历史 - 以智能体ID为键
     messageHistories: {},
     
+    // 是否使用server.py的对话记录存储（每条消息单独追加，不再重写整个localStorage对象）
+    serverStore: false,
+    
+    // 服务器写入队列，保证消息按顺序追加
+    pendingWrite: Promise.resolve(),
+    
+    // 启动时从服务器读取的每个智能体的最近消息数
+    SERVER_PAGE_SIZE: 50,
+    
+    // 本浏览器的客户端ID（保存在localStorage），服务器只返回该客户端自己的对话记录
+    CLIENT_ID_KEY: 'tangzaiClientId',
+    
+    // 取得（首次使用时生成）客户端ID
+    getClientId: function() {
+        let clientId = null;
+        try {
+            clientId = localStorage.getItem(this.CLIENT_ID_KEY);
+        } catch (e) {
+            // 无法访问localStorage时每次打开页面使用新的ID
+        }
+        if (!clientId || !/^[A-Za-z0-9_-]{16,64}$/.test(clientId)) {
+            if (window.crypto && window.crypto.randomUUID) {
+                clientId = window.crypto.randomUUID();
+            } else {
+                const bytes = new Uint8Array(16);
+                window.crypto.getRandomValues(bytes);
+                clientId = Array.from(bytes, b => b.toString(16).padStart(2, '0')).join('');
+            }
+            try {
+                localStorage.setItem(this.CLIENT_ID_KEY, clientId);
+            } catch (e) {
+                console.warn("无法保存客户端ID:", e);
+            }
+        }
+        this.clientId = clientId;
+        return clientId;
+    },
+    
     // 初始化
-    init: function() {
+    init: async function() {
         this.loadMessageHistories();
         
+        if (await this.useServerStore()) {
+            return this.messageHistories;
+        }
+        
         // 设置定期保存
         setInterval(() => this.saveMessageHistories(), 60000); // 每分钟保存一次
         
         return this.messageHistories;
     },
     
+    // 页面由server.py提供且启用了对话记录存储时，导入本地记录并改为从服务器读取
+    useServerStore: async function() {
+        if (!window.ApiService || !window.ApiService.detectProxy) {
+            return false;
+        }
+        try {
+            if (!await window.ApiService.detectProxy() || !window.ApiService.serverInfo.conversations) {
+                return false;
+            }
+            
+            // 把localStorage中的记录（首次使用或上次写入服务器失败时保存的）合并到服务器，
+            // 服务器只追加它还没有的消息；导入成功后才删除本地记录
+            if (Object.keys(this.messageHistories).length > 0) {
+                const imported = await this.postToServer('/v1/conversations/import', { histories: this.messageHistories });
+                console.log(`已导入本地聊天记录: ${imported.agents} 个智能体, ${imported.messages} 条消息`);
+                localStorage.removeItem('messageHistories');
+            }
+            
+            const response = await fetch(`/v1/conversations?limit=${this.SERVER_PAGE_SIZE}`, {
+                cache: 'no-store',
+                headers: { 'X-Client-Id': this.clientId || this.getClientId() }
+            });
+            if (!response.ok) {
+                throw new Error(`HTTP ${response.status}`);
+            }
+            const data = await response.json();
+            
+            // 保持同一个对象，其他模块持有的引用仍然有效
+            for (const agentId in this.messageHistories) {
+                delete this.messageHistories[agentId];
+            }
+            for (const agentId in data.histories) {
+                this.messageHistories[agentId] = data.histories[agentId].messages.map(
+                    msg => ({ role: msg.role, content: msg.content }));
+            }
+            window.messageHistories = this.messageHistories;
+            this.serverStore = true;
+            console.log("聊天记录改为保存在服务器");
+            return true;
+        } catch (error) {
+            console.warn("服务器对话记录不可用，继续使用本地存储:", error);
+            return false;
+        }
+    },
+    
+    // 向服务器发送JSON请求
+    postToServer: async function(path, data) {
+        const response = await fetch(path, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json', 'X-Client-Id': this.clientId || this.getClientId() },
+            body: JSON.stringify(data)
+        });
+        if (!response.ok) {
+            throw new Error(`HTTP ${response.status}`);
+        }
+        return response.json();
+    },
+    
+    // 把一次写入排入队列；失败时退回到保存整个localStorage对象
+    queueServerWrite: function(path, data) {
+        this.pendingWrite = this.pendingWrite
+            .then(() => this.postToServer(path, data))
+            .catch(error => {
+                console.error("保存到服务器失败，改为保存到本地:", error);
+                this.serverStore = false;
+                this.saveMessageHistories();
+            });
+        return this.pendingWrite;
+    },
+    
+    // 保存一条新消息（服务器模式只追加这一条）
+    persistMessage: function(agentId, message) {
+        if (this.serverStore) {
+            this.queueServerWrite('/v1/conversations/messages', { agentId: agentId, messages: [message] });
+        } else {
+            this.saveMessageHistories();
+        }
+    },
+    
     // 加载聊天记录
     loadMessageHistories: function() {
         try {
@@ -126,13 +247,14 @@ const ChatService = {
         }
         
         // 添加消息
-        this.messageHistories[agentId].push({ role: 'user', content: message });
+        const entry = { role: 'user', content: message };
+        this.messageHistories[agentId].push(entry);
         
         // 更新全局引用
         window.messageHistories = this.messageHistories;
         
-        // 保存到本地存储
-        this.saveMessageHistories();
+        // 保存
+        this.persistMessage(agentId, entry);
         
         return true;
     },
@@ -150,13 +272,14 @@ const ChatService = {
         }
         
         // 添加消息
-        this.messageHistories[agentId].push({ role: 'assistant', content: message });
+        const entry = { role: 'assistant', content: message };
+        this.messageHistories[agentId].push(entry);
         
         // 更新全局引用
         window.messageHistories = this.messageHistories;
         
-        // 保存到本地存储
-        this.saveMessageHistories();
+        // 保存
+        this.persistMessage(agentId, entry);
         
         return true;
     },
@@ -174,8 +297,12 @@ const ChatService = {
             // 更新全局引用
             window.messageHistories = this.messageHistories;
             
-            // 保存到本地存储
-            this.saveMessageHistories();
+            // 保存
+            if (this.serverStore) {
+                this.queueServerWrite('/v1/conversations/clear', { agentId: agentId });
+            } else {
+                this.saveMessageHistories();
+            }
             return true;
         }
         return false;
@@ -190,6 +317,11 @@ const ChatService = {
             return false;
         }
         
+        // 分片存储的智能体在发送前确保已加载系统提示词等完整配置
+        if (window.AgentService && window.AgentService.loadAgentBody) {
+            await window.AgentService.loadAgentBody(currentAgent);
+        }
+        
         // 显示用户消息
         if (window.MessageHandler) {
             window.MessageHandler.displayMessage('你', message, 'user-message');
@@ -40,6 +40,12 @@ const ExportService = {
             console.log('开始转换Markdown为Word...');
             console.log('原始Markdown内容长度:', markdown.length);
             
+            // 由server.py提供时在服务器生成文档，不占用页面主线程
+            if (await this.exportViaServer(markdown, options)) {
+                progressMessage.innerHTML = `<span class="message-sender">系统提示: </span>Word文档 <strong>${options.filename}.docx</strong> 已生成并下载成功！`;
+                return;
+            }
+            
             // 添加标题（如果用户选择了）
             let finalMarkdown = markdown;
             if (options.includeTitle && options.title) {
@@ -175,6 +181,35 @@ const ExportService = {
         }
     },
 
+    // 通过server.py的/v1/export/docx生成文档，成功返回true；服务器不可用或出错时返回false（改为在浏览器中生成）
+    exportViaServer: async function(markdown, options) {
+        if (!window.ApiService || !(await window.ApiService.detectProxy()) ||
+            !(window.ApiService.serverInfo && window.ApiService.serverInfo.docxExport)) {
+            return false;
+        }
+        try {
+            const response = await fetch('/v1/export/docx', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({
+                    markdown: markdown,
+                    filename: options.filename,
+                    title: options.includeTitle ? options.title : null,
+                    timestamp: options.includeTimestamp ? new Date().toLocaleString() : null
+                })
+            });
+            if (!response.ok) {
+                console.error('服务器导出Word失败:', response.status);
+                return false;
+            }
+            saveAs(await response.blob(), `${options.filename}.docx`);
+            return true;
+        } catch (error) {
+            console.error('服务器导出Word失败:', error);
+            return false;
+        }
+    },
+
     // 显示Word导出选项对话框
     showExportOptionsDialog: function(defaultFilename) {
         return new Promise((resolve) => {
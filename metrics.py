@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Prometheus 格式的服务器指标（GET /metrics）
+
+按智能体 id 和模型统计：
+- tangzai_ttft_seconds：收到请求到第一个数据块发给客户端的时间（直方图）
+- tangzai_stream_duration_seconds：整个流式回复的时间（直方图）
+- tangzai_chunk_gap_seconds：相邻两个数据块之间的间隔（直方图）
+- tangzai_upstream_responses_total：上游响应状态码（连接失败记为 error）
+- tangzai_request_bytes_total / tangzai_response_bytes_total：请求体和发给客户端的字节数
+- tangzai_response_cache_total：回复缓存 hit / miss / coalesced（合并到进行中的请求）/ bypass，
+  以及由它算出的 tangzai_response_cache_hit_ratio
+
+每个进程只在自己的事件循环中更新计数（不加锁），记录一次只是一次二分查找和几次加法。
+多进程模式下各工作进程定期把快照发给主进程，/metrics 返回所有工作进程合并后的结果。
+"""
+
+import bisect
+import time
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+GAP_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 每个指标最多的标签组合数，超过后归入 other，避免客户端随意填写的 id 撑大内存
+MAX_SERIES = 1000
+
+# 多进程模式下工作进程向主进程发送快照的间隔（秒）
+PUSH_INTERVAL = 5.0
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+def format_number(value):
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+
+class Metric:
+    """一个指标的所有标签组合；series 的值为数字列表，合并时逐项相加"""
+
+    kind = None
+
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.series = {}
+
+    def width(self):
+        return 1
+
+    def child(self, values):
+        """标签组合对应的计数列表（不存在时创建）"""
+        series = self.series.get(values)
+        if series is None:
+            if len(self.series) >= MAX_SERIES:
+                values = ('other',) * len(self.labels)
+                series = self.series.get(values)
+            if series is None:
+                series = self.series[values] = [0] * self.width()
+        return series
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, values, amount=1):
+        self.child(values)[0] += amount
+
+    def render(self, series, lines):
+        for values, (count,) in sorted(series.items()):
+            lines.append(f'{self.name}{format_labels(self.labels, values)} {format_number(count)}')
+
+
+class Histogram(Metric):
+    """列表布局：各个桶的计数（非累计）、+Inf 桶、总和、次数"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels, buckets):
+        super().__init__(name, help_text, labels)
+        self.buckets = buckets
+
+    def width(self):
+        return len(self.buckets) + 3
+
+    def observe(self, values, value):
+        observe(self.buckets, self.child(values), value)
+
+    def render(self, series, lines):
+        names = self.labels + ('le',)
+        for values, counts in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{format_labels(names, values + (bound,))} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(self.labels, values)} {format_number(counts[-2])}')
+            lines.append(f'{self.name}_count{format_labels(self.labels, values)} {counts[-1]}')
+
+
+def observe(buckets, series, value):
+    """把一次观测记入直方图的计数列表"""
+    series[bisect.bisect_left(buckets, value)] += 1
+    series[-2] += value
+    series[-1] += 1
+
+
+class StreamObservation:
+    """一次聊天请求的计时：首个数据块、数据块间隔、总时长和字节数"""
+
+    __slots__ = ('metrics', 'labels', 'start', 'last', 'sent', 'gaps')
+
+    def __init__(self, metrics, labels, start):
+        self.metrics = metrics
+        self.labels = labels
+        self.start = start
+        self.last = None
+        self.sent = 0
+        self.gaps = metrics.chunk_gap.child(labels)
+
+    def chunk(self, size):
+        now = time.monotonic()
+        if self.last is None:
+            self.metrics.ttft.observe(self.labels, now - self.start)
+        else:
+            observe(GAP_BUCKETS, self.gaps, now - self.last)
+        self.last = now
+        self.sent += size
+
+    def finish(self):
+        if self.last is not None:
+            self.metrics.stream_duration.observe(self.labels, time.monotonic() - self.start)
+        self.metrics.response_bytes.inc(self.labels, self.sent)
+
+
+class Metrics:
+    """一个进程内的全部指标"""
+
+    def __init__(self):
+        labels = ('agent', 'model')
+        self.ttft = Histogram('tangzai_ttft_seconds', '收到请求到第一个数据块发给客户端的时间',
+                              labels, LATENCY_BUCKETS)
+        self.stream_duration = Histogram('tangzai_stream_duration_seconds', '流式回复的总时长',
+                                         labels, LATENCY_BUCKETS)
+        self.chunk_gap = Histogram('tangzai_chunk_gap_seconds', '相邻数据块之间的间隔', labels, GAP_BUCKETS)
+        self.upstream_responses = Counter('tangzai_upstream_responses_total', '上游响应状态码',
+                                          labels + ('status',))
+        self.request_bytes = Counter('tangzai_request_bytes_total', '聊天请求体的字节数', labels)
+        self.response_bytes = Counter('tangzai_response_bytes_total', '发给客户端的回复字节数', labels)
+        self.cache = Counter('tangzai_response_cache_total', '回复缓存的查询结果', labels + ('result',))
+        self.all = [self.ttft, self.stream_duration, self.chunk_gap, self.upstream_responses,
+                    self.request_bytes, self.response_bytes, self.cache]
+
+    def stream(self, agent, model, request_bytes, start=None):
+        """开始记录一次聊天请求"""
+        labels = (agent or '', model or '')
+        self.request_bytes.inc(labels, request_bytes)
+        return StreamObservation(self, labels, start if start is not None else time.monotonic())
+
+    def snapshot(self):
+        """可 JSON 序列化的快照：{指标名: [[标签值...], [计数...]], ...}"""
+        return {metric.name: [[list(values), list(series)] for values, series in metric.series.items()]
+                for metric in self.all}
+
+    def render(self, snapshots):
+        """把一个或多个进程的快照合并，输出 Prometheus 文本格式"""
+        merged = merge(snapshots)
+        lines = []
+        for metric in self.all:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            metric.render(merged.get(metric.name, {}), lines)
+
+        # 缓存命中率：hit / (hit + miss)，合并到进行中的请求不计入
+        ratio = {}
+        for (agent, model, result), (count,) in merged.get(self.cache.name, {}).items():
+            if result in ('hit', 'miss'):
+                totals = ratio.setdefault((agent, model), [0, 0])
+                totals[0 if result == 'hit' else 1] += count
+        lines.append('# HELP tangzai_response_cache_hit_ratio 回复缓存命中率')
+        lines.append('# TYPE tangzai_response_cache_hit_ratio gauge')
+        for values, (hits, misses) in sorted(ratio.items()):
+            if hits + misses:
+                lines.append(f'tangzai_response_cache_hit_ratio{format_labels(("agent", "model"), values)} '
+                             f'{format_number(hits / (hits + misses))}')
+        return '\n'.join(lines) + '\n'
+
+
+def merge(snapshots):
+    """逐项相加多个快照，返回 {指标名: {标签值元组: 计数列表}}"""
+    merged = {}
+    for snapshot in snapshots:
+        for name, entries in (snapshot or {}).items():
+            target = merged.setdefault(name, {})
+            for values, series in entries:
+                key = tuple(values)
+                current = target.get(key)
+                if current is None:
+                    target[key] = list(series)
+                else:
+                    for index, value in enumerate(series):
+                        current[index] += value
+    return merged
+
+
+def fold(total, snapshot):
+    """把已退出的工作进程的快照累加进 total（保持计数单调递增），返回新的快照"""
+    return {name: [[list(values), series] for values, series in entries.items()]
+            for name, entries in merge([total, snapshot]).items()}
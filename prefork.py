@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多进程（prefork）模式
+
+server.py 默认是单个 asyncio 进程，只能用到一个 CPU 核心，重启时正在进行的流式回复会中断。
+加上 --workers N 时由主进程启动 N 个工作进程：
+- 每个工作进程用 SO_REUSEPORT 监听同一个端口，由内核在进程之间分配新连接
+- 限速与排队状态（rate_limiter.py）保存在主进程，工作进程通过本地 Unix 套接字申请许可，
+  所有进程共用同一组令牌桶和队列；其余状态本来就在进程之间共享：
+  agents.json 按修改时间自动重新读取，回复缓存在磁盘上，对话记录在 SQLite（WAL）中
+- 主进程收到 SIGHUP 时平滑重启：先启动新一批工作进程（重新读取代码和配置），全部就绪后
+  再向旧进程发送 SIGTERM；旧进程关闭监听套接字，等待正在进行的请求结束后退出
+- 工作进程意外退出时自动重新启动；收到 SIGTERM / SIGINT 时所有进程处理完当前请求后退出
+- 各工作进程定期把指标快照（metrics.py）发给主进程，/metrics 返回合并后的结果；
+  已退出的工作进程的计数累加保留，重启后计数不会回落
+
+工作进程与主进程之间是按行分隔的 JSON 消息：
+    {"op": "ready", "pid": ...}
+    {"op": "acquire", "id": ..., "key": ..., "model": ..., "cost": ..., "priority": ..., "user": ...}
+        -> {"id": ..., "wait": ..., "depth": ...} 或 {"id": ..., "error": ...}
+    {"op": "cancel", "id": ...}
+    {"op": "refund", "key": ..., "model": ..., "cost": ...}
+    {"op": "report", "key": ..., "model": ..., "status": ..., "retry_after": ...}
+    {"op": "snapshot", "id": ...} -> {"id": ..., "snapshot": {...}}
+    {"op": "metrics", "pid": ..., "snapshot": {...}}（带 id 时回复 {"id": ..., "snapshots": [...]}）
+"""
+
+import asyncio
+import json
+import os
+import signal
+import socket
+import sys
+import tempfile
+
+from metrics import fold
+from rate_limiter import QueueTimeout
+
+# 新一批工作进程就绪的等待上限（秒）
+READY_TIMEOUT = 30.0
+
+# 工作进程收到 SIGTERM 后等待进行中的请求结束的上限（秒）
+DEFAULT_DRAIN_TIMEOUT = 300.0
+
+# 工作进程意外退出后重新启动前的等待（秒）
+RESPAWN_DELAY = 1.0
+
+
+def prefork_supported():
+    """当前平台是否支持多进程模式（需要 SO_REUSEPORT 和 Unix 套接字）"""
+    return hasattr(socket, 'SO_REUSEPORT') and hasattr(socket, 'AF_UNIX') and hasattr(signal, 'SIGHUP')
+
+
+def worker_count(value):
+    """--workers 参数：数字或 auto（CPU 核心数）"""
+    if value == 'auto':
+        return os.cpu_count() or 1
+    return max(0, int(value))
+
+
+def encode(message):
+    return (json.dumps(message, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+class RemoteGrant:
+    """主进程批准的上游请求；接口与 rate_limiter.Grant 相同"""
+
+    def __init__(self, scheduler, api_key, model, cost, wait, depth):
+        self.scheduler = scheduler
+        self.api_key = api_key
+        self.model = model
+        self.cost = cost
+        self.wait = wait
+        self.depth = depth
+
+    def refund(self):
+        self.scheduler.send({'op': 'refund', 'key': self.api_key, 'model': self.model, 'cost': self.cost})
+
+
+class RemoteScheduler:
+    """工作进程中的限速器：向主进程申请许可（接口与 UpstreamScheduler 相同，snapshot 为协程）"""
+
+    def __init__(self, path):
+        self.path = path
+        self.reader = None
+        self.writer = None
+        self.pending = {}     # 消息 id -> Future
+        self.next_id = 0
+        self.lost = asyncio.Event()   # 与主进程的连接断开
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_unix_connection(self.path)
+        asyncio.ensure_future(self.read_replies())
+        self.send({'op': 'ready', 'pid': os.getpid()})
+
+    def send(self, message):
+        if self.writer is not None and not self.writer.is_closing():
+            self.writer.write(encode(message))
+
+    async def read_replies(self):
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                reply = json.loads(line)
+                future = self.pending.pop(reply.get('id'), None)
+                if future is not None and not future.done():
+                    future.set_result(reply)
+                elif 'wait' in reply and 'grant' in reply:
+                    # 申请已被取消，但主进程已经批准：退回令牌
+                    self.send(dict(reply['grant'], op='refund'))
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError('与主进程的连接已断开'))
+            self.pending.clear()
+            self.lost.set()
+
+    async def call(self, message):
+        self.next_id += 1
+        message['id'] = self.next_id
+        future = asyncio.get_running_loop().create_future()
+        self.pending[self.next_id] = future
+        self.send(message)
+        try:
+            return await future
+        except asyncio.CancelledError:
+            if self.pending.pop(message['id'], None) is not None:
+                self.send({'op': 'cancel', 'id': message['id']})
+            raise
+
+    async def acquire(self, api_key, model, cost=0, priority=0, user=''):
+        reply = await self.call({'op': 'acquire', 'key': api_key, 'model': model, 'cost': cost,
+                                 'priority': priority, 'user': user})
+        if 'error' in reply:
+            raise QueueTimeout(reply['error'])
+        return RemoteGrant(self, api_key, model, cost, reply['wait'], reply['depth'])
+
+    def report(self, api_key, model, status, retry_after=None):
+        if status == 429:
+            self.send({'op': 'report', 'key': api_key, 'model': model, 'status': status,
+                       'retry_after': retry_after})
+
+    async def snapshot(self):
+        reply = await self.call({'op': 'snapshot'})
+        return dict(reply['snapshot'], shared=True)
+
+    def push_metrics(self, snapshot):
+        self.send({'op': 'metrics', 'pid': os.getpid(), 'snapshot': snapshot})
+
+    async def collect_metrics(self, snapshot):
+        """发送本进程的指标快照，返回所有工作进程（包括已退出的）的快照列表"""
+        reply = await self.call({'op': 'metrics', 'pid': os.getpid(), 'snapshot': snapshot})
+        return reply['snapshots']
+
+    async def flush(self):
+        if self.writer is not None and not self.writer.is_closing():
+            try:
+                await self.writer.drain()
+            except ConnectionError:
+                pass
+
+
+class Worker:
+    """一个工作进程"""
+
+    def __init__(self, process, generation):
+        self.process = process
+        self.generation = generation
+        self.ready = asyncio.get_running_loop().create_future()
+        self.retired = False   # 已被新一批进程替换，正在退出
+
+
+class Supervisor:
+    """主进程：启动和替换工作进程，保存共享的限速状态"""
+
+    def __init__(self, command, workers, scheduler, pid_file=None):
+        self.command = command        # 启动工作进程的命令（不含 --worker-socket）
+        self.count = workers
+        self.scheduler = scheduler
+        self.pid_file = pid_file
+        self.directory = tempfile.mkdtemp(prefix='tangzai-')
+        self.socket_path = os.path.join(self.directory, 'state.sock')
+        self.workers = {}             # pid -> Worker
+        self.generation = 0
+        self.stopping = False
+        self.stopped = None
+        self.reloading = None
+        self.metrics = {}             # pid -> 工作进程最近的指标快照
+        self.retired_metrics = {}     # 已退出的工作进程的指标累计
+
+    # ---------- 工作进程管理 ----------
+
+    async def spawn(self, generation):
+        process = await asyncio.create_subprocess_exec(*self.command, '--worker-socket', self.socket_path)
+        worker = Worker(process, generation)
+        self.workers[process.pid] = worker
+        asyncio.ensure_future(self.watch(worker))
+        return worker
+
+    async def watch(self, worker):
+        code = await worker.process.wait()
+        self.workers.pop(worker.process.pid, None)
+        if not worker.ready.done():
+            worker.ready.set_exception(RuntimeError(f"工作进程 {worker.process.pid} 启动失败（退出码 {code}）"))
+            return
+        if worker.retired or self.stopping:
+            return
+        print(f"工作进程 {worker.process.pid} 意外退出（退出码 {code}），重新启动")
+        await asyncio.sleep(RESPAWN_DELAY)
+        if not self.stopping and worker.generation == self.generation:
+            await self.spawn(worker.generation)
+
+    async def start_generation(self):
+        """启动新一批工作进程并等待全部就绪；失败时结束这一批并抛出异常"""
+        generation = self.generation + 1
+        workers = [await self.spawn(generation) for _ in range(self.count)]
+        try:
+            await asyncio.wait_for(asyncio.gather(*(worker.ready for worker in workers)), READY_TIMEOUT)
+        except Exception:
+            for worker in workers:
+                worker.retired = True
+                if worker.process.returncode is None:
+                    worker.process.kill()
+            raise
+        self.generation = generation
+        return workers
+
+    def retire(self, workers):
+        """让旧进程停止接受新连接，处理完当前请求后退出"""
+        for worker in workers:
+            worker.retired = True
+            if worker.process.returncode is None:
+                worker.process.send_signal(signal.SIGTERM)
+
+    async def reload(self):
+        """SIGHUP：平滑重启所有工作进程"""
+        old = [worker for worker in self.workers.values() if not worker.retired]
+        print(f"平滑重启：启动 {self.count} 个新的工作进程")
+        try:
+            await self.start_generation()
+        except Exception as e:
+            print(f"新的工作进程未能就绪，继续使用原有进程: {e}")
+            return
+        self.retire(old)
+        print(f"平滑重启完成，{len(old)} 个旧进程处理完当前请求后退出")
+
+    def kill_all(self):
+        for worker in list(self.workers.values()):
+            if worker.process.returncode is None:
+                worker.process.kill()
+
+    def request_reload(self):
+        if self.reloading is None or self.reloading.done():
+            self.reloading = asyncio.ensure_future(self.reload())
+
+    # ---------- 共享状态 ----------
+
+    async def handle_worker(self, reader, writer):
+        tasks = {}   # 消息 id -> 排队中的 acquire 任务
+        pid = None
+
+        def reply(message):
+            if not writer.is_closing():
+                writer.write(encode(message))
+
+        async def acquire(message):
+            try:
+                grant = await self.scheduler.acquire(message['key'], message['model'], message.get('cost', 0),
+                                                     message.get('priority', 0), message.get('user', ''))
+            except QueueTimeout as e:
+                reply({'id': message['id'], 'error': str(e)})
+            else:
+                reply({'id': message['id'], 'wait': grant.wait, 'depth': grant.depth,
+                       'grant': {'key': message['key'], 'model': message['model'], 'cost': grant.cost}})
+            finally:
+                tasks.pop(message['id'], None)
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                op = message.get('op')
+                if op in ('ready', 'metrics'):
+                    pid = message.get('pid')
+                if op == 'ready':
+                    worker = self.workers.get(message.get('pid'))
+                    if worker is not None and not worker.ready.done():
+                        worker.ready.set_result(True)
+                elif op == 'acquire':
+                    tasks[message['id']] = asyncio.ensure_future(acquire(message))
+                elif op == 'cancel':
+                    task = tasks.pop(message.get('id'), None)
+                    if task is not None:
+                        task.cancel()
+                elif op == 'refund':
+                    self.scheduler.lane(message['key'], message['model']).refund(message.get('cost', 0))
+                elif op == 'report':
+                    self.scheduler.report(message['key'], message['model'], message['status'],
+                                          message.get('retry_after'))
+                elif op == 'snapshot':
+                    reply({'id': message['id'], 'snapshot': self.scheduler.snapshot()})
+                elif op == 'metrics':
+                    self.metrics[pid] = message.get('snapshot') or {}
+                    if 'id' in message:
+                        reply({'id': message['id'], 'snapshots': [self.retired_metrics] + list(self.metrics.values())})
+        except (ConnectionError, ValueError, KeyError) as e:
+            print(f"工作进程消息处理出错: {e}")
+        finally:
+            # 工作进程退出：取消它仍在排队的请求
+            for task in tasks.values():
+                task.cancel()
+            if pid in self.metrics:
+                self.retired_metrics = fold(self.retired_metrics, self.metrics.pop(pid))
+            writer.close()
+
+    # ---------- 运行 ----------
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        state_server = await asyncio.start_unix_server(self.handle_worker, self.socket_path)
+        loop.add_signal_handler(signal.SIGHUP, self.request_reload)
+        loop.add_signal_handler(signal.SIGTERM, self.stopped.set)
+        loop.add_signal_handler(signal.SIGINT, self.stopped.set)
+        if self.pid_file:
+            os.makedirs(os.path.dirname(os.path.abspath(self.pid_file)), exist_ok=True)
+            with open(self.pid_file, 'w') as f:
+                f.write(f"{os.getpid()}\n")
+        try:
+            try:
+                await self.start_generation()
+            except Exception as e:
+                print(f"工作进程启动失败: {e}", file=sys.stderr)
+                return 1
+            print(f"主进程 {os.getpid()} 已启动 {self.count} 个工作进程（kill -HUP {os.getpid()} 平滑重启）")
+            await self.stopped.wait()
+            print("\n正在停止：等待工作进程处理完当前请求")
+            return 0
+        finally:
+            self.stopping = True
+            workers = list(self.workers.values())
+            self.retire(workers)
+            # 再次按 Ctrl+C 时不再等待，直接结束工作进程
+            loop.add_signal_handler(signal.SIGINT, self.kill_all)
+            if workers:
+                await asyncio.wait([asyncio.ensure_future(worker.process.wait()) for worker in workers])
+            state_server.close()
+            if self.pid_file:
+                try:
+                    os.unlink(self.pid_file)
+                except OSError:
+                    pass
+            try:
+                os.unlink(self.socket_path)
+                os.rmdir(self.directory)
+            except OSError:
+                pass
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+上游请求的限速与排队
+
+agents.json 中的智能体共用同一个密钥和上游，多人同时提交长任务时上游会返回 429，
+重试只会让情况更糟。server.py 在发出上游请求前先向这里申请：
+- 每个 (密钥, 模型) 一条通道，各有两个令牌桶：每分钟请求数（--rpm）和每分钟输入 token 数（--tpm）
+- 令牌不足时请求排队等待，而不是直接打到上游
+- 排队按优先级出队：交互型智能体（priority 为 interactive，默认 max_tokens 较小的智能体，如通用助手）
+  先于批量总结类智能体；同一优先级内按用户（客户端地址）轮转，一个用户的大量请求不会挡住其他人
+- 上游返回 429 时按 Retry-After 暂停该通道，之后的请求在服务器排队
+- 统计排队长度、等待时间和 429 次数，在 /v1/health 中报告
+- 空的用户队列在出队时删除；没有排队、没有暂停且令牌桶已满的通道在新建通道时移除，
+  密钥和模型很多时通道表不会一直增长（移除的通道与新建的通道状态相同）
+"""
+
+import asyncio
+import collections
+import time
+
+from api_probe import mask_key
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: 'interactive', PRIORITY_BULK: 'bulk'}
+
+# 未配置 priority 时，max_tokens 不超过该值的请求视为交互型
+INTERACTIVE_MAX_TOKENS = 16384
+
+# 令牌桶容量：允许的突发量相当于多少秒的额度
+BURST_SECONDS = 10
+
+# 上游 429 没有 Retry-After 时的暂停时间（秒）
+DEFAULT_RETRY_AFTER = 2.0
+
+DEFAULT_QUEUE_TIMEOUT = 120.0
+
+
+class QueueTimeout(Exception):
+    """排队超过等待上限"""
+
+
+def request_priority(agent, max_tokens):
+    """请求的优先级：智能体配置 priority 优先，否则按 max_tokens 判断"""
+    configured = (agent or {}).get('priority')
+    if configured in ('interactive', 'bulk'):
+        return PRIORITY_INTERACTIVE if configured == 'interactive' else PRIORITY_BULK
+    if not isinstance(max_tokens, int):
+        max_tokens = (agent or {}).get('max_tokens')
+    if isinstance(max_tokens, int) and max_tokens > INTERACTIVE_MAX_TOKENS:
+        return PRIORITY_BULK
+    return PRIORITY_INTERACTIVE
+
+
+class TokenBucket:
+    """每分钟 rate 个令牌；单次消耗超过容量时，桶满即可通过（之后按欠额等待）"""
+
+    def __init__(self, rate_per_minute):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1.0, self.rate * BURST_SECONDS)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, cost, now):
+        """还需等待的秒数"""
+        self.refill(now)
+        needed = min(cost, self.capacity)
+        if self.tokens >= needed:
+            return 0.0
+        return (needed - self.tokens) / self.rate
+
+    def consume(self, cost):
+        self.tokens -= cost
+
+    def refund(self, cost):
+        self.tokens = min(self.capacity, self.tokens + cost)
+
+    def full(self, now):
+        self.refill(now)
+        return self.tokens >= self.capacity
+
+
+class Waiter:
+    def __init__(self, cost, user, priority):
+        self.cost = cost
+        self.user = user
+        self.priority = priority
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued = time.monotonic()
+
+
+class Grant:
+    """一次获准的上游请求；请求最终没有发出时调用 refund 退回令牌"""
+
+    def __init__(self, lane, cost, wait, depth):
+        self.lane = lane
+        self.cost = cost
+        self.wait = wait      # 排队等待的秒数
+        self.depth = depth    # 加入时前面排队的请求数
+
+    def refund(self):
+        self.lane.refund(self.cost)
+
+
+class Lane:
+    """一个 (密钥, 模型) 的令牌桶和等待队列"""
+
+    def __init__(self, name, rpm=0, tpm=0):
+        self.name = name
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.paused_until = 0.0
+        # 优先级 -> {用户: 该用户的等待队列}，同一优先级内按用户轮转
+        self.queues = {PRIORITY_INTERACTIVE: collections.OrderedDict(), PRIORITY_BULK: collections.OrderedDict()}
+        self.timer = None
+        self.stats = {'granted': 0, 'queued': 0, 'timeouts': 0, 'throttled': 0,
+                      'wait_total': 0.0, 'wait_max': 0.0}
+
+    def depth(self):
+        return sum(len(waiters) for queue in self.queues.values() for waiters in queue.values())
+
+    def delay(self, cost, now):
+        delay = max(0.0, self.paused_until - now)
+        if self.requests is not None:
+            delay = max(delay, self.requests.delay(1, now))
+        if self.tokens is not None:
+            delay = max(delay, self.tokens.delay(cost, now))
+        return delay
+
+    def consume(self, cost):
+        if self.requests is not None:
+            self.requests.consume(1)
+        if self.tokens is not None:
+            self.tokens.consume(cost)
+
+    def refund(self, cost):
+        if self.requests is not None:
+            self.requests.refund(1)
+        if self.tokens is not None:
+            self.tokens.refund(cost)
+        self.pump()
+
+    def enqueue(self, waiter):
+        self.queues[waiter.priority].setdefault(waiter.user, collections.deque()).append(waiter)
+        self.stats['queued'] += 1
+        self.pump()
+
+    def remove(self, waiter):
+        queue = self.queues[waiter.priority]
+        waiters = queue.get(waiter.user)
+        if waiters and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del queue[waiter.user]
+
+    def head(self):
+        """下一个应出队的请求：优先级高的先出，同一优先级内轮到的用户先出
+
+        已超时或取消的请求在这里跳过，只剩这些请求的用户队列随之删除。
+        """
+        for priority in sorted(self.queues):
+            queue = self.queues[priority]
+            for user in list(queue):
+                waiters = queue[user]
+                while waiters and waiters[0].future.done():
+                    waiters.popleft()
+                if waiters:
+                    return priority, user, waiters[0]
+                del queue[user]
+        return None
+
+    def idle(self, now):
+        """没有排队的请求、没有暂停且令牌桶已满：移除后重新创建的通道与它完全相同"""
+        if self.head() is not None or self.paused_until > now:
+            return False
+        return all(bucket is None or bucket.full(now) for bucket in (self.requests, self.tokens))
+
+    def pump(self):
+        """放行令牌足够的请求；不够时在令牌恢复后再检查"""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        while True:
+            head = self.head()
+            if head is None:
+                return
+            priority, user, waiter = head
+            now = time.monotonic()
+            delay = self.delay(waiter.cost, now)
+            if delay > 0:
+                self.timer = asyncio.get_running_loop().call_later(delay, self.pump)
+                return
+            queue = self.queues[priority]
+            queue[user].popleft()
+            # 轮转：该用户移到同一优先级的末尾
+            waiters = queue.pop(user)
+            if waiters:
+                queue[user] = waiters
+            self.consume(waiter.cost)
+            wait = now - waiter.enqueued
+            self.stats['granted'] += 1
+            self.stats['wait_total'] += wait
+            self.stats['wait_max'] = max(self.stats['wait_max'], wait)
+            waiter.future.set_result(wait)
+
+    def throttle(self, seconds):
+        """上游返回 429：暂停该通道"""
+        self.stats['throttled'] += 1
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.pump()
+
+    def snapshot(self):
+        granted = self.stats['granted']
+        return {
+            'depth': self.depth(),
+            'depth_by_priority': {PRIORITY_NAMES[priority]: sum(len(waiters) for waiters in queue.values())
+                                  for priority, queue in self.queues.items()},
+            'granted': granted,
+            'timeouts': self.stats['timeouts'],
+            'throttled_429': self.stats['throttled'],
+            'wait_avg_ms': round(self.stats['wait_total'] / granted * 1000, 1) if granted else 0.0,
+            'wait_max_ms': round(self.stats['wait_max'] * 1000, 1),
+            'paused_ms': round(max(0.0, self.paused_until - time.monotonic()) * 1000),
+        }
+
+
+class UpstreamScheduler:
+    """按 (密钥, 模型) 限速和排队"""
+
+    def __init__(self, rpm=0, tpm=0, queue_timeout=DEFAULT_QUEUE_TIMEOUT):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.queue_timeout = queue_timeout
+        self.lanes = {}
+
+    def lane(self, api_key, model):
+        key = (api_key, model)
+        lane = self.lanes.get(key)
+        if lane is None:
+            self.remove_idle()
+            key_text = api_key[7:] if api_key.startswith('Bearer ') else api_key
+            lane = Lane(f"{mask_key(key_text)} {model}", self.rpm, self.tpm)
+            self.lanes[key] = lane
+        return lane
+
+    def remove_idle(self):
+        """移除空闲的通道，返回移除的数量"""
+        now = time.monotonic()
+        idle = [key for key, lane in self.lanes.items() if lane.idle(now)]
+        for key in idle:
+            del self.lanes[key]
+        return len(idle)
+
+    async def acquire(self, api_key, model, cost=0, priority=PRIORITY_INTERACTIVE, user=''):
+        """等待轮到该请求，返回 Grant；超过 queue_timeout 时抛出 QueueTimeout"""
+        lane = self.lane(api_key, model)
+        depth = lane.depth()
+        waiter = Waiter(cost, user, priority)
+        lane.enqueue(waiter)
+        try:
+            wait = await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            lane.stats['timeouts'] += 1
+            raise QueueTimeout(f"排队超过 {self.queue_timeout:g} 秒")
+        finally:
+            if not waiter.future.done():
+                waiter.future.cancel()
+                lane.remove(waiter)
+        return Grant(lane, cost, wait, depth)
+
+    def report(self, api_key, model, status, retry_after=None):
+        """记录上游响应状态；429 时暂停该通道"""
+        if status != 429:
+            return
+        try:
+            seconds = float(retry_after) if retry_after else DEFAULT_RETRY_AFTER
+        except ValueError:
+            seconds = DEFAULT_RETRY_AFTER
+        self.lane(api_key, model).throttle(max(0.0, seconds))
+
+    def snapshot(self):
+        return {
+            'rpm': self.rpm,
+            'tpm': self.tpm,
+            'lanes': {lane.name: lane.snapshot() for lane in self.lanes.values()},
+        }
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+回复缓存
+
+同一个智能体对同一份输入（例如重复粘贴的会议记录）再次生成时，
+直接返回上次的完整回复，省去数分钟的上游生成。
+
+- 缓存键：去掉 stream 后的完整请求体（键排序的规范化 JSON）加上调用方范围的 SHA-256，
+  top_p、stop、tools、response_format、n、seed 等任何参数不同都不会命中；消息内容可以是字符串或内容块列表
+- 默认只缓存结果确定的请求（temperature 为 0、n 不大于 1）：温度大于 0 时用户期望每次得到新的回答。
+  智能体配置 "cacheResponses": true 时总是缓存，false 时从不缓存
+- 内存层：按条目数和字节数限制的 LRU
+- 磁盘层：cache/responses/ 下每条一个 JSON 文件，总大小超限时淘汰最久未使用的文件（按文件修改时间，
+  读取时会更新）。多进程模式下各工作进程共用这个目录：内存索引中没有的键直接尝试读取文件，
+  总大小按目录重新统计，因此一个工作进程写入的回复其他进程也能命中，总大小上限对所有进程一起生效
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def cache_key(payload, scope=''):
+    """根据请求体计算缓存键；scope 用于隔离不同的调用方（如 API 密钥）
+
+    流式与非流式请求的回复相同，只去掉 stream；其余字段全部参与计算。
+    """
+    material = {key: value for key, value in payload.items() if key != 'stream'}
+    encoded = json.dumps(['response', material, scope], ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def should_cache(payload, agent=None):
+    """是否缓存这个请求的回复：智能体明确配置时按配置，否则只缓存确定性的请求"""
+    setting = (agent or {}).get('cacheResponses')
+    if isinstance(setting, bool):
+        return setting
+    temperature = payload.get('temperature')
+    n = payload.get('n')
+    return (isinstance(temperature, (int, float)) and not isinstance(temperature, bool) and temperature == 0
+            and (n is None or n == 1))
+
+
+class MemoryLRU:
+    """按条目数和总字节数限制的 LRU"""
+
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry, size):
+        if size > self.max_bytes:
+            return
+        self.pop(key)
+        self.entries[key] = (entry, size)
+        self.total_bytes += size
+        while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.total_bytes -= evicted_size
+
+    def pop(self, key):
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.total_bytes -= old[1]
+
+
+class DiskCache:
+    """限制总大小的磁盘缓存，淘汰最久未使用的文件"""
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        # 索引：key -> [大小, 最近使用时间]；其他工作进程写入的文件在读取或重新统计时补上
+        self.index = {}
+        self.total_bytes = 0
+        with self.lock:
+            self.rescan()
+
+    def rescan(self):
+        """按目录重新建立索引（调用方需持有 self.lock）"""
+        index = {}
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.json') and entry.is_file():
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                index[entry.name[:-5]] = [stat.st_size, stat.st_mtime]
+                total += stat.st_size
+        self.index = index
+        self.total_bytes = total
+
+    def path_for(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def read(self, key):
+        # 索引中没有时也尝试读取：可能是其他工作进程写入的
+        path = self.path_for(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = f.read()
+            entry = json.loads(data)
+            now = time.time()
+            os.utime(path, (now, now))
+            with self.lock:
+                if key in self.index:
+                    self.index[key][1] = now
+                else:
+                    size = len(data.encode('utf-8'))
+                    self.index[key] = [size, now]
+                    self.total_bytes += size
+            return entry
+        except FileNotFoundError:
+            with self.lock:
+                self.forget(key)
+            return None
+        except (OSError, ValueError):
+            with self.lock:
+                self.forget(key)
+            return None
+
+    def write(self, key, entry):
+        data = json.dumps(entry, ensure_ascii=False).encode('utf-8')
+        if len(data) > self.max_bytes:
+            return
+        path = self.path_for(key)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self.lock:
+            if key in self.index:
+                self.total_bytes -= self.index[key][0]
+            self.index[key] = [len(data), time.time()]
+            self.total_bytes += len(data)
+            self.evict()
+
+    def evict(self):
+        """调用方需持有 self.lock
+
+        每次写入后按目录统计所有工作进程写入的文件和最近使用时间（写入只发生在一次完整回复之后，
+        扫描一次目录的开销可以忽略）。
+        """
+        self.rescan()
+        if self.total_bytes <= self.max_bytes:
+            return
+        for key, _ in sorted(self.index.items(), key=lambda item: item[1][1]):
+            if self.total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(self.path_for(key))
+            except OSError:
+                pass
+            self.forget(key)
+
+    def forget(self, key):
+        info = self.index.pop(key, None)
+        if info is not None:
+            self.total_bytes -= info[0]
+
+
+class ResponseCache:
+    """内存 LRU + 磁盘两级回复缓存；磁盘读写放到线程池，不阻塞事件循环"""
+
+    def __init__(self, directory='cache/responses', memory_entries=256,
+                 memory_bytes=64 * 1024 * 1024, disk_bytes=512 * 1024 * 1024):
+        self.memory = MemoryLRU(memory_entries, memory_bytes)
+        self.disk = DiskCache(directory, disk_bytes)
+        self.stats = {'hits': 0, 'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0}
+
+    async def get(self, key):
+        """查找缓存，返回 {'model', 'content', 'finish_reason', 'created'} 或 None"""
+        cached = self.memory.get(key)
+        if cached is not None:
+            self.stats['hits'] += 1
+            self.stats['memory_hits'] += 1
+            return cached[0]
+
+        entry = await asyncio.to_thread(self.disk.read, key)
+        if entry is None:
+            self.stats['misses'] += 1
+            return None
+
+        self.stats['hits'] += 1
+        self.stats['disk_hits'] += 1
+        self.memory.put(key, entry, len(entry.get('content', '')) * 3)
+        return entry
+
+    async def put(self, key, model, content, finish_reason='stop'):
+        """保存一次完整的回复"""
+        entry = {
+            'model': model,
+            'content': content,
+            'finish_reason': finish_reason or 'stop',
+            'created': int(time.time()),
+        }
+        self.memory.put(key, entry, len(content) * 3)
+        self.stats['stores'] += 1
+        try:
+            await asyncio.to_thread(self.disk.write, key, entry)
+        except OSError as e:
+            print(f"写入回复缓存失败: {str(e)}")
+
+    def snapshot(self):
+        """供 /v1/health 展示的缓存状态"""
+        return dict(self.stats,
+                    memory_entries=len(self.memory.entries),
+                    disk_entries=len(self.disk.index),
+                    disk_bytes=self.disk.total_bytes)
@@ -1,15 +1,32 @@
 #!/bin/bash
 
+PORT=8080
+PID_FILE="data/server-$PORT.pid"
+
+# 重新构建前端资源（页面随即引用新的带哈希文件）
+python build_assets.py || echo "前端构建失败，将直接提供源文件"
+
+# 多进程模式的服务器正在运行：平滑重启（新的工作进程就绪后，旧进程处理完当前请求再退出）
+if [ -f "$PID_FILE" ] && kill -0 "$(cat "$PID_FILE")" 2>/dev/null; then
+  echo "平滑重启服务器（主进程 PID: $(cat "$PID_FILE")）..."
+  kill -HUP "$(cat "$PID_FILE")"
+  exit 0
+fi
+
 # 查找当前运行的HTTP服务器进程
-PID=$(lsof -i:8080 -t)
+PID=$(lsof -i:$PORT -t)
 
-# 如果找到进程，则关闭它
+# 如果找到进程，则关闭它（服务器收到 SIGTERM 后会等进行中的请求结束再退出）
 if [ ! -z "$PID" ]; then
   echo "关闭当前HTTP服务器（PID: $PID）..."
   kill $PID
-  sleep 1
+  for P in $PID; do
+    while kill -0 $P 2>/dev/null; do
+      sleep 1
+    done
+  done
 fi
 
 # 启动新的HTTP服务器
-echo "启动新的HTTP服务器在端口8080..."
-python -m http.server 8080 
\ No newline at end of file
+echo "启动新的HTTP服务器在端口$PORT..."
+python server.py --port $PORT --workers auto --pid-file "$PID_FILE"
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+安全写入与后台保存
+
+- atomic_write / atomic_writer：先写同目录下的临时文件并 fsync，再用 os.replace
+  原子替换目标文件，写到一半崩溃也不会留下损坏的 agents.json
+- SavePipeline：后台写入线程。同名任务在去抖时间内多次提交只执行最后一次，
+  序列化和写盘都不占用 Tk 界面线程；完成结果由界面线程调用 drain() 取回
+"""
+
+import contextlib
+import os
+import queue
+import tempfile
+import threading
+import time
+
+
+def fsync_directory(directory):
+    """把目录项（rename 的结果）刷到磁盘；Windows 不支持打开目录，直接跳过"""
+    if os.name == 'nt':
+        return
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+@contextlib.contextmanager
+def atomic_writer(path, sync=True):
+    """以二进制方式写入临时文件，正常结束时原子替换 path，出错时删除临时文件"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            yield f
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if sync:
+        fsync_directory(directory)
+
+
+def atomic_write(path, data, sync=True):
+    """原子写入字节内容"""
+    with atomic_writer(path, sync) as f:
+        f.write(data)
+
+
+class SavePipeline:
+    """单线程的后台保存队列
+
+    submit(name, job, on_done, delay)：delay 秒后在后台线程执行 job()。
+    同名任务尚未开始时再次提交会替换旧任务并重新计时，连续编辑只写一次。
+    on_done(result, error) 不在后台线程调用，而是由界面线程通过 drain() 执行。
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.pending = {}      # 名称 -> [到期时间, job, [on_done...]]
+        self.running = None    # 正在执行的任务名称
+        self.results = queue.Queue()
+        self.closed = False
+        self.thread = threading.Thread(target=self.worker, name='save-pipeline', daemon=True)
+        self.thread.start()
+
+    def submit(self, name, job, on_done=None, delay=0.0):
+        with self.condition:
+            callbacks = self.pending[name][2] if name in self.pending else []
+            if on_done is not None:
+                callbacks.append(on_done)
+            self.pending[name] = [time.monotonic() + delay, job, callbacks]
+            self.condition.notify()
+
+    def busy(self):
+        """是否还有未执行或未取回结果的任务"""
+        with self.condition:
+            return bool(self.pending) or self.running is not None or not self.results.empty()
+
+    def worker(self):
+        while True:
+            with self.condition:
+                while True:
+                    if self.closed and not self.pending:
+                        return
+                    if self.pending:
+                        name = min(self.pending, key=lambda key: self.pending[key][0])
+                        wait = self.pending[name][0] - time.monotonic()
+                        if wait <= 0 or self.closed:
+                            _, job, callbacks = self.pending.pop(name)
+                            self.running = name
+                            break
+                        self.condition.wait(wait)
+                    else:
+                        self.condition.wait()
+
+            result, error = None, None
+            try:
+                result = job()
+            except Exception as e:
+                error = e
+            for callback in callbacks:
+                self.results.put((callback, result, error))
+            with self.condition:
+                self.running = None
+                self.condition.notify_all()
+
+    def drain(self):
+        """在界面线程中执行已完成任务的回调，返回执行的回调数"""
+        count = 0
+        while True:
+            try:
+                callback, result, error = self.results.get_nowait()
+            except queue.Empty:
+                return count
+            callback(result, error)
+            count += 1
+
+    def flush(self, timeout=None):
+        """立即执行所有等待中的任务并等待完成（例如关闭窗口前）"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            for entry in self.pending.values():
+                entry[0] = 0
+            self.condition.notify_all()
+            while self.pending or self.running is not None:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def close(self, timeout=None):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join(timeout)
@@ -0,0 +1,1347 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+智能体聚合平台服务器
+
+基于 asyncio 的单进程服务器，替代 `python -m http.server`：
+- 提供项目目录下的静态文件（内容哈希 ETag、304 协商缓存、预压缩版本）
+- 提供 /v1/chat/completions 转发接口，复用到上游的长连接，
+  收到上游 SSE 数据块后立即转发给浏览器，不做缓冲
+- 相同输入的回复命中缓存时直接以 SSE 流重放（可按智能体关闭）
+- 转发前按模型的上下文窗口裁剪过长的对话历史（context_budget.py），
+  /v1/context/fit 供页面在发送前按同样的规则裁剪
+- 同时到达的相同请求只向上游发出一次，同一个 SSE 流分发给所有客户端（single_flight.py）
+- 上游请求按 (密钥, 模型) 限速排队，交互型智能体优先（rate_limiter.py）
+- 首个数据块迟迟不到时向备用接口发出对冲请求，失败时故障转移（hedging.py）
+- 请求只带智能体 id 时，由服务器注入模型参数、系统提示词和密钥（agent_requests.py）
+- /v1/conversations 对话记录存储（SQLite，按条追加、分页读取，见 conversation_store.py）
+- /v1/export/docx、/v1/export/batch 在进程池中把 Markdown 导出为 Word，批量导出打包为 zip（docx_export.py）
+- GET /metrics 按智能体和模型输出 Prometheus 格式的延迟直方图和计数（metrics.py）
+- --workers N 时以多进程模式运行，SIGHUP 平滑重启（prefork.py）；SIGTERM 时处理完当前请求再退出
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import ssl
+import sys
+import time
+import urllib.parse
+
+from agent_requests import AgentRequestBuilder, redact_agent
+from agent_shards import ShardStore
+from build_assets import BuiltSite
+from context_budget import count_tokens, fit_request, positive_int
+from docx_export import DOCX_CONTENT_TYPE, DocxExporter, safe_filename
+from hedging import Hedger, attempts_for
+from metrics import PUSH_INTERVAL, Metrics
+from conversation_store import DEFAULT_PAGE_SIZE, ConversationStore, normalize_message, valid_client_id
+from prefork import DEFAULT_DRAIN_TIMEOUT, RemoteScheduler, Supervisor, prefork_supported, worker_count
+from rate_limiter import QueueTimeout, UpstreamScheduler, request_priority
+from response_cache import ResponseCache, cache_key, should_cache
+from single_flight import FlightError, SingleFlight, coalesce_key
+from sse import SSECollector, text_to_events
+from static_assets import StaticCache
+
+# 默认上游地址（agents.json 中的智能体基本都使用该地址）
+DEFAULT_UPSTREAM = 'https://aihubmix.com/v1/chat/completions'
+
+# 请求头/请求体大小限制
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = 32 * 1024 * 1024
+
+# 作为静态文件提供的网站资源类型；JSON 只提供 agents.json 和分片目录，
+# 其他文件（源代码、备份、令牌、数据库、.git 等）一律不提供
+STATIC_EXTENSIONS = {
+    '.html', '.css', '.js', '.jpg', '.jpeg', '.png', '.gif', '.svg', '.ico', '.webp', '.woff', '.woff2', '.md',
+}
+
+# 逐跳头部，转发时不透传
+HOP_BY_HOP_HEADERS = {
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'te', 'trailer', 'transfer-encoding', 'upgrade', 'content-length',
+}
+
+STATUS_REASONS = {
+    200: 'OK', 204: 'No Content', 304: 'Not Modified', 400: 'Bad Request',
+    403: 'Forbidden', 404: 'Not Found', 405: 'Method Not Allowed',
+    413: 'Payload Too Large', 429: 'Too Many Requests',
+    500: 'Internal Server Error', 502: 'Bad Gateway', 503: 'Service Unavailable',
+    504: 'Gateway Timeout',
+}
+
+
+class HttpError(Exception):
+    """请求处理过程中需要直接返回给客户端的错误"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class HttpRequest:
+    """解析后的 HTTP 请求"""
+
+    def __init__(self, method, target, version, headers, body=b''):
+        self.method = method
+        self.target = target
+        self.version = version
+        self.headers = headers  # 键为小写
+        self.body = body
+        self.client = ''        # 客户端地址
+        self.model = None       # 聊天请求的模型（prepare_request 解析请求体时记录）
+        self.observation = None  # 聊天请求的计时（metrics.StreamObservation）
+        self.responded = False   # 是否已经发出响应头
+
+        parsed = urllib.parse.urlsplit(target)
+        self.path = urllib.parse.unquote(parsed.path)
+        self.query = urllib.parse.parse_qs(parsed.query)
+
+    @property
+    def keep_alive(self):
+        connection = self.headers.get('connection', '').lower()
+        if self.version == 'HTTP/1.0':
+            return connection == 'keep-alive'
+        return connection != 'close'
+
+    def json(self):
+        """将请求体解析为 JSON"""
+        try:
+            return json.loads(self.body.decode('utf-8'))
+        except (UnicodeDecodeError, ValueError) as e:
+            raise HttpError(400, f'请求体不是有效的JSON: {str(e)}')
+
+
+async def read_headers(reader):
+    """读取 HTTP 头部块，返回 (起始行, 头部字典)；连接关闭时返回 (None, None)"""
+    try:
+        raw = await reader.readuntil(b'\r\n\r\n')
+    except asyncio.IncompleteReadError:
+        return None, None
+    except asyncio.LimitOverrunError:
+        raise HttpError(400, '请求头过大')
+
+    lines = raw.decode('latin-1').split('\r\n')
+    headers = {}
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return lines[0], headers
+
+
+async def read_request(reader):
+    """从客户端连接读取一个完整请求"""
+    start_line, headers = await read_headers(reader)
+    if start_line is None:
+        return None
+
+    parts = start_line.split(' ')
+    if len(parts) != 3:
+        raise HttpError(400, '无效的请求行')
+    method, target, version = parts
+
+    body = b''
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        chunks = []
+        try:
+            async for chunk in iter_chunked(reader, MAX_BODY_BYTES):
+                chunks.append(chunk)
+        except ValueError:
+            raise HttpError(400, '无效的chunked消息体')
+        body = b''.join(chunks)
+    elif 'content-length' in headers:
+        try:
+            length = int(headers['content-length'])
+        except ValueError:
+            raise HttpError(400, '无效的Content-Length')
+        if length > MAX_BODY_BYTES:
+            raise HttpError(413, '请求体过大')
+        body = await reader.readexactly(length)
+
+    return HttpRequest(method.upper(), target, version, headers, body)
+
+
+async def iter_chunked(reader, limit=None):
+    """逐块读取 chunked 编码的消息体，每收到一块就立即产出
+
+    limit 不为空时，累计大小（按块头声明的大小，在读取数据之前）超过 limit 即返回 413。
+    """
+    total = 0
+    while True:
+        size_line = await reader.readline()
+        if not size_line:
+            raise ConnectionError('chunked 消息体提前结束')
+        size = int(size_line.split(b';', 1)[0].strip() or b'0', 16)
+        total += size
+        if limit is not None and total > limit:
+            raise HttpError(413, '请求体过大')
+        if size == 0:
+            # 跳过 trailer 直到空行
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    return
+        data = await reader.readexactly(size)
+        await reader.readexactly(2)
+        yield data
+
+
+def build_head(status, headers, version='HTTP/1.1'):
+    """构造响应起始行和头部"""
+    reason = STATUS_REASONS.get(status, 'OK')
+    lines = [f'{version} {status} {reason}']
+    for name, value in headers:
+        lines.append(f'{name}: {value}')
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+def override_headers(headers, overrides):
+    """用 overrides 替换 headers 中的同名头（不区分大小写），每个头只出现一次"""
+    names = {name.lower() for name, _ in overrides}
+    return [(name, value) for name, value in headers if name.lower() not in names] + list(overrides)
+
+
+async def send_response(writer, request, status, headers=None, body=b''):
+    """发送一个完整（非流式）响应"""
+    headers = list(headers or [])
+    if status != 304:
+        headers.append(('Content-Length', str(len(body))))
+    keep_alive = request.keep_alive if request else False
+    headers.append(('Connection', 'keep-alive' if keep_alive else 'close'))
+    writer.write(build_head(status, headers))
+    if request is not None:
+        request.responded = True
+    if body and (request is None or request.method != 'HEAD'):
+        writer.write(body)
+    await writer.drain()
+
+
+async def send_json(writer, request, status, data, headers=None):
+    """发送 JSON 响应"""
+    body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+    headers = [('Content-Type', 'application/json; charset=utf-8')] + list(headers or [])
+    await send_response(writer, request, status, headers, body)
+
+
+def error_payload(message, error_type='proxy_error'):
+    """与 OpenAI 接口一致的错误结构，前端 callAI 直接读取 error.message"""
+    return {'error': {'message': message, 'type': error_type}}
+
+
+class StreamWriter:
+    """向客户端逐块写出流式响应
+
+    HTTP/1.1 客户端使用 chunked 编码，HTTP/1.0 客户端直接写出并在结束后关闭连接。
+    """
+
+    def __init__(self, writer, request):
+        self.writer = writer
+        self.request = request
+        self.chunked = request.version != 'HTTP/1.0'
+        self.started = False
+
+    async def start(self, status, headers):
+        headers = list(headers)
+        if self.chunked:
+            headers.append(('Transfer-Encoding', 'chunked'))
+            keep_alive = self.request.keep_alive
+        else:
+            keep_alive = False
+        headers.append(('Connection', 'keep-alive' if keep_alive else 'close'))
+        self.writer.write(build_head(status, headers))
+        self.started = True
+        self.request.responded = True
+        await self.writer.drain()
+
+    async def write(self, data):
+        if not data:
+            return
+        if self.request.observation is not None:
+            self.request.observation.chunk(len(data))
+        if self.chunked:
+            self.writer.write(b'%x\r\n' % len(data) + data + b'\r\n')
+        else:
+            self.writer.write(data)
+        await self.writer.drain()
+
+    async def finish(self):
+        if self.chunked:
+            self.writer.write(b'0\r\n\r\n')
+            await self.writer.drain()
+
+    @property
+    def keep_alive(self):
+        return self.chunked and self.request.keep_alive
+
+
+class UpstreamConnection:
+    """一条到上游的 HTTP/1.1 连接"""
+
+    def __init__(self, key, reader, writer):
+        self.key = key
+        self.reader = reader
+        self.writer = writer
+        self.last_used = time.monotonic()
+        self.requests = 0
+
+    @property
+    def alive(self):
+        return not self.reader.at_eof() and not self.writer.is_closing()
+
+    def close(self):
+        try:
+            self.writer.close()
+        except Exception:
+            pass
+
+
+class UpstreamPool:
+    """按 (scheme, host, port) 复用的上游长连接池
+
+    空闲连接在下一次请求时直接复用，省去 TCP 与 TLS 握手。
+    """
+
+    def __init__(self, max_idle_per_host=16, idle_timeout=60, connect_timeout=10):
+        self.max_idle_per_host = max_idle_per_host
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.idle = {}
+        self.ssl_context = ssl.create_default_context()
+        self.stats = {'connects': 0, 'reuses': 0}
+
+    async def acquire(self, scheme, host, port):
+        """取出一条空闲连接，没有可用连接时新建"""
+        key = (scheme, host, port)
+        idle = self.idle.get(key, [])
+        now = time.monotonic()
+        while idle:
+            conn = idle.pop()
+            if conn.alive and now - conn.last_used < self.idle_timeout:
+                self.stats['reuses'] += 1
+                return conn, True
+            conn.close()
+
+        ssl_context = self.ssl_context if scheme == 'https' else None
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=ssl_context,
+                                    server_hostname=host if ssl_context else None,
+                                    limit=MAX_HEADER_BYTES),
+            timeout=self.connect_timeout
+        )
+        self.stats['connects'] += 1
+        return UpstreamConnection(key, reader, writer), False
+
+    def release(self, conn, reusable):
+        """归还连接；不可复用的连接直接关闭"""
+        if not reusable or not conn.alive:
+            conn.close()
+            return
+        idle = self.idle.setdefault(conn.key, [])
+        if len(idle) >= self.max_idle_per_host:
+            conn.close()
+            return
+        conn.last_used = time.monotonic()
+        idle.append(conn)
+
+    def close_all(self):
+        for conns in self.idle.values():
+            for conn in conns:
+                conn.close()
+        self.idle.clear()
+
+
+class UpstreamResponse:
+    """上游响应；body() 逐块产出原始数据，读完后连接自动归还连接池"""
+
+    def __init__(self, pool, conn, status, headers, read_timeout):
+        self.pool = pool
+        self.conn = conn
+        self.status = status
+        self.headers = headers
+        self.read_timeout = read_timeout
+        self.released = False
+
+    def header(self, name, default=''):
+        return self.headers.get(name.lower(), default)
+
+    def relay_headers(self):
+        """需要透传给客户端的响应头"""
+        return [(name, value) for name, value in self.headers.items()
+                if name not in HOP_BY_HOP_HEADERS]
+
+    async def body(self):
+        reader = self.conn.reader
+        reusable = self.header('connection').lower() != 'close'
+        try:
+            if self.header('transfer-encoding').lower() == 'chunked':
+                chunks = iter_chunked(reader)
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), self.read_timeout)
+                    except StopAsyncIteration:
+                        break
+                    yield chunk
+            elif self.header('content-length'):
+                remaining = int(self.header('content-length'))
+                while remaining > 0:
+                    chunk = await asyncio.wait_for(reader.read(min(remaining, 65536)), self.read_timeout)
+                    if not chunk:
+                        raise ConnectionError('上游响应提前结束')
+                    remaining -= len(chunk)
+                    yield chunk
+            else:
+                reusable = False
+                while True:
+                    chunk = await asyncio.wait_for(reader.read(65536), self.read_timeout)
+                    if not chunk:
+                        break
+                    yield chunk
+        except BaseException:
+            reusable = False
+            raise
+        finally:
+            self.release(reusable)
+
+    async def read(self):
+        """读取完整响应体"""
+        parts = []
+        async for chunk in self.body():
+            parts.append(chunk)
+        return b''.join(parts)
+
+    def release(self, reusable=False):
+        if not self.released:
+            self.released = True
+            self.pool.release(self.conn, reusable)
+
+
+class UpstreamClient:
+    """通过连接池向上游发送请求"""
+
+    def __init__(self, pool=None, read_timeout=300):
+        self.pool = pool or UpstreamPool()
+        self.read_timeout = read_timeout
+
+    async def request(self, method, url, headers, body=b''):
+        parsed = urllib.parse.urlsplit(url)
+        scheme = parsed.scheme or 'https'
+        host = parsed.hostname
+        if not host:
+            raise HttpError(400, f'无效的上游地址: {url}')
+        port = parsed.port or (443 if scheme == 'https' else 80)
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+
+        host_header = host if parsed.port is None else f'{host}:{parsed.port}'
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {host_header}']
+        for name, value in headers:
+            if name.lower() not in HOP_BY_HOP_HEADERS and name.lower() != 'host':
+                lines.append(f'{name}: {value}')
+        lines.append(f'Content-Length: {len(body)}')
+        lines.append('Connection: keep-alive')
+        head = ('\r\n'.join(lines) + '\r\n\r\n').encode('utf-8')
+
+        # 复用的连接可能已被上游关闭，此时换一条新连接重试一次
+        for attempt in range(2):
+            try:
+                conn, reused = await self.pool.acquire(scheme, host, port)
+            except asyncio.TimeoutError:
+                raise HttpError(504, f'连接上游超时: {host}')
+            except OSError as e:
+                raise HttpError(502, f'连接上游失败: {str(e)}')
+            try:
+                conn.writer.write(head + body)
+                await conn.writer.drain()
+                start_line, resp_headers = await asyncio.wait_for(
+                    read_headers(conn.reader), self.read_timeout)
+                if start_line is None:
+                    raise ConnectionResetError('上游连接已关闭')
+            except (ConnectionError, OSError, asyncio.IncompleteReadError) as e:
+                self.pool.release(conn, False)
+                if reused and attempt == 0:
+                    continue
+                raise HttpError(502, f'连接上游失败: {str(e)}')
+            except BaseException:
+                self.pool.release(conn, False)
+                raise
+
+            conn.requests += 1
+            try:
+                status = int(start_line.split(' ', 2)[1])
+            except (IndexError, ValueError):
+                self.pool.release(conn, False)
+                raise HttpError(502, f'无效的上游响应: {start_line}')
+            return UpstreamResponse(self.pool, conn, status, resp_headers, self.read_timeout)
+
+
+class TangzaiServer:
+    """静态文件 + 聊天转发服务器"""
+
+    def __init__(self, root='.', upstream=DEFAULT_UPSTREAM, agents_file='agents.json',
+                 cache_dir=None, response_cache=True, conversation_db=None, hide_agent_secrets=False,
+                 scheduler=None, hedging=True):
+        self.root = os.path.abspath(root)
+        self.default_upstream = upstream
+        self.agents_file = os.path.join(self.root, agents_file)
+        self.shard_store = ShardStore(os.path.join(self.root, 'agents'))
+        self.client = UpstreamClient()
+        self.hide_agent_secrets = hide_agent_secrets
+        self.static = StaticCache(transform=self.redact_static if hide_agent_secrets else None)
+        # python build_assets.py 生成的合并压缩版本（存在且未过期时代替源文件）
+        self.site = BuiltSite(self.root)
+        self.request_builder = AgentRequestBuilder()
+        self.flights = SingleFlight()
+        self.scheduler = scheduler or UpstreamScheduler()
+        self.hedger = Hedger(self.open_attempt, enabled=hedging)
+        self.metrics = Metrics()
+        self.exporter = DocxExporter(os.path.join(self.root, 'cache', 'exports'))
+        self.response_cache = None
+        if response_cache:
+            self.response_cache = ResponseCache(cache_dir or os.path.join(self.root, 'cache', 'responses'))
+        self.conversations = None
+        if conversation_db:
+            os.makedirs(os.path.dirname(os.path.abspath(conversation_db)), exist_ok=True)
+            self.conversations = ConversationStore(conversation_db)
+        # 服务器和编辑器的数据目录（备份中的智能体带密钥，config/ 中有 GitHub 令牌），不作为静态文件提供；
+        # 构建产物通过原来的路径提供
+        self.private_dirs = [os.path.join(self.root, name) for name in ('cache', 'data', 'backups', 'config')]
+        self.private_dirs.append(self.site.out_dir)
+        self._allowed_hosts = None
+        self._agents_by_id = {}
+        self._agents_mtime = None
+        # 连接 -> 是否正在处理请求；停止时等待处理中的请求结束
+        self.connections = {}
+        self.draining = False
+
+        # 路由表：(方法, 路径) -> 处理函数
+        self.routes = {
+            ('POST', '/v1/chat/completions'): self.handle_chat_completions,
+            ('GET', '/v1/health'): self.handle_health,
+            ('GET', '/metrics'): self.handle_metrics,
+            ('POST', '/v1/context/fit'): self.handle_context_fit,
+            ('GET', '/v1/conversations'): self.handle_conversations,
+            ('POST', '/v1/conversations/messages'): self.handle_conversation_append,
+            ('POST', '/v1/conversations/clear'): self.handle_conversation_clear,
+            ('POST', '/v1/conversations/import'): self.handle_conversation_import,
+            ('POST', '/v1/export/docx'): self.handle_export_docx,
+            ('POST', '/v1/export/batch'): self.handle_export_batch,
+        }
+
+    # ---------- 连接处理 ----------
+
+    async def handle_connection(self, reader, writer):
+        peername = writer.get_extra_info('peername')
+        peer = peername[0] if isinstance(peername, tuple) else ''
+        self.connections[writer] = False
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                    if request is not None:
+                        request.client = peer
+                except HttpError as e:
+                    await send_json(writer, None, e.status, error_payload(e.message))
+                    break
+                if request is None:
+                    break
+
+                self.connections[writer] = True
+                keep_alive = await self.dispatch(request, writer)
+                self.connections[writer] = False
+                if not keep_alive or self.draining:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            print(f"处理连接时出错: {str(e)}")
+        finally:
+            self.connections.pop(writer, None)
+            try:
+                writer.close()
+            except Exception:
+                pass
+
+    async def drain(self, timeout=DEFAULT_DRAIN_TIMEOUT):
+        """停止时关闭空闲的长连接，等待处理中的请求（包括流式回复）结束，最多 timeout 秒"""
+        self.draining = True
+        for writer, busy in list(self.connections.items()):
+            if not busy:
+                writer.close()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self.connections and loop.time() < deadline:
+            await asyncio.sleep(0.1)
+        return len(self.connections)
+
+    async def dispatch(self, request, writer):
+        """分发请求，返回连接是否可以继续复用"""
+        handler = self.routes.get((request.method, request.path))
+        if handler is None and request.method == 'HEAD':
+            handler = self.routes.get(('GET', request.path))
+        if handler is None:
+            if any(path == request.path for _, path in self.routes):
+                handler = self.handle_method_not_allowed
+            elif request.method in ('GET', 'HEAD'):
+                handler = self.handle_static
+            else:
+                handler = self.handle_method_not_allowed
+
+        try:
+            result = await handler(request, writer)
+        except HttpError as e:
+            await send_json(writer, request, e.status, error_payload(e.message))
+            return request.keep_alive
+        except (ConnectionError, asyncio.IncompleteReadError):
+            raise
+        except Exception as e:
+            # 未预料的错误：还没有发出响应头时返回 500，客户端不会只看到连接被关闭
+            print(f"处理请求 {request.method} {request.path} 时出错: {e!r}")
+            if not request.responded:
+                request.headers['connection'] = 'close'
+                await send_json(writer, request, 500, error_payload('服务器内部错误'))
+            return False
+        if result is False:
+            return False
+        return request.keep_alive
+
+    # ---------- 静态文件 ----------
+
+    def resolve_path(self, url_path):
+        """把 URL 路径映射到项目目录下的文件，禁止越界访问"""
+        relative = url_path.lstrip('/')
+        full_path = os.path.abspath(os.path.join(self.root, relative))
+        if full_path != self.root and not full_path.startswith(self.root + os.sep):
+            raise HttpError(403, '禁止访问')
+        if os.path.isdir(full_path):
+            full_path = os.path.join(full_path, 'index.html')
+        if not self.is_public(full_path):
+            raise HttpError(403, '禁止访问')
+        built = self.site.resolve(full_path)
+        if built is not None:
+            return built
+        if not os.path.isfile(full_path):
+            raise HttpError(404, f'未找到文件: {url_path}')
+        return full_path
+
+    def is_public(self, full_path):
+        """只提供网站资源：页面、脚本、样式、图片、文档和智能体配置"""
+        parts = os.path.relpath(full_path, self.root).split(os.sep)
+        if any(part.startswith('.') for part in parts):
+            return False
+        if any(full_path == path or full_path.startswith(path + os.sep) for path in self.private_dirs):
+            return False
+        extension = os.path.splitext(full_path)[1].lower()
+        if extension == '.json':
+            return full_path == self.agents_file or os.path.dirname(full_path) == self.shard_store.directory
+        return extension in STATIC_EXTENSIONS
+
+    async def handle_static(self, request, writer):
+        full_path = self.resolve_path(request.path)
+        asset = self.static.get(full_path)
+
+        if self.site.immutable(full_path):
+            # 文件名带内容哈希的构建产物，内容永不改变
+            cache_control = 'public, max-age=31536000, immutable'
+        else:
+            # 每次使用前都向服务器确认，内容未变时只需一次 304 往返
+            cache_control = 'no-cache'
+        headers = [
+            ('ETag', asset.etag),
+            ('Last-Modified', asset.last_modified),
+            ('Cache-Control', cache_control),
+            ('Vary', 'Accept-Encoding'),
+        ]
+        encoding = asset.choose_encoding(request.headers.get('accept-encoding'))
+        headers[0] = ('ETag', asset.etag_for(encoding))
+        if asset.not_modified(request.headers):
+            await send_response(writer, request, 304, headers)
+            return
+
+        headers.append(('Content-Type', asset.content_type))
+        if encoding != 'identity':
+            headers.append(('Content-Encoding', encoding))
+        await send_response(writer, request, 200, headers, asset.variants[encoding])
+
+    def redact_static(self, path, data):
+        """--hide-agent-secrets：提供给浏览器的 agents.json 和分片中去掉密钥"""
+        shard_dir = self.shard_store.directory
+        if path != self.agents_file and not (os.path.dirname(path) == os.path.abspath(shard_dir)
+                                             and path.endswith('.json')):
+            return None
+        try:
+            agents = json.loads(data.decode('utf-8'))
+        except (UnicodeDecodeError, ValueError):
+            return None
+        if isinstance(agents, list):
+            agents = [redact_agent(agent) for agent in agents]
+        elif isinstance(agents, dict) and 'agents' not in agents:
+            agents = redact_agent(agents)
+        else:
+            return None
+        return json.dumps(agents, ensure_ascii=False, indent=2).encode('utf-8')
+
+    async def handle_method_not_allowed(self, request, writer):
+        raise HttpError(405, f'不支持的请求方法: {request.method}')
+
+    async def handle_health(self, request, writer):
+        scheduler = self.scheduler.snapshot()
+        if asyncio.iscoroutine(scheduler):
+            # 多进程模式：限速状态保存在主进程
+            scheduler = await scheduler
+        await send_json(writer, request, 200, {
+            'status': 'ok',
+            'proxy': True,
+            'upstream_pool': dict(self.client.pool.stats),
+            'response_cache': self.response_cache.snapshot() if self.response_cache else None,
+            'single_flight': self.flights.snapshot(),
+            'scheduler': scheduler,
+            'hedging': self.hedger.snapshot(),
+            'worker': os.getpid(),
+            'conversations': self.conversations is not None,
+            'agentInjection': True,
+            'agentSecretsHidden': self.hide_agent_secrets,
+            'docxExport': True,
+        })
+
+    async def handle_metrics(self, request, writer):
+        snapshot = self.metrics.snapshot()
+        if isinstance(self.scheduler, RemoteScheduler):
+            # 多进程模式：合并所有工作进程的指标
+            snapshots = await self.scheduler.collect_metrics(snapshot)
+        else:
+            snapshots = [snapshot]
+        body = self.metrics.render(snapshots).encode('utf-8')
+        await send_response(writer, request, 200, [
+            ('Content-Type', 'text/plain; version=0.0.4; charset=utf-8'),
+            ('Cache-Control', 'no-store'),
+        ], body)
+
+    # ---------- 对话记录 ----------
+
+    def conversation_store(self):
+        if self.conversations is None:
+            raise HttpError(404, '对话记录存储未启用')
+        return self.conversations
+
+    @staticmethod
+    def conversation_client(request):
+        """请求头 X-Client-Id：浏览器生成的客户端 id，对话记录的读写都限定在该客户端内"""
+        client_id = request.headers.get('x-client-id')
+        if not valid_client_id(client_id):
+            raise HttpError(400, '缺少或无效的 X-Client-Id 请求头')
+        return client_id
+
+    def query_int(self, request, name, default=None):
+        values = request.query.get(name)
+        if not values:
+            return default
+        try:
+            return int(values[0])
+        except ValueError:
+            raise HttpError(400, f'参数 {name} 应为整数')
+
+    async def handle_conversations(self, request, writer):
+        """GET /v1/conversations?agent=ID&before=游标&limit=N 分页读取一个智能体的消息；
+        不指定 agent 时返回每个智能体最近的 limit 条消息"""
+        store = self.conversation_store()
+        client_id = self.conversation_client(request)
+        limit = self.query_int(request, 'limit', DEFAULT_PAGE_SIZE)
+        agent_id = (request.query.get('agent') or [None])[0]
+        if agent_id is None:
+            histories = await asyncio.to_thread(store.latest, client_id, limit)
+            return await send_json(writer, request, 200, {'histories': histories})
+        before = self.query_int(request, 'before')
+        messages, cursor = await asyncio.to_thread(store.page, client_id, agent_id, before, limit)
+        await send_json(writer, request, 200, {'agentId': agent_id, 'messages': messages, 'next': cursor})
+
+    def request_agent_id(self, payload):
+        if not isinstance(payload, dict) or payload.get('agentId') in (None, ''):
+            raise HttpError(400, '请求体缺少 agentId')
+        return str(payload['agentId'])
+
+    async def handle_conversation_append(self, request, writer):
+        """追加消息：{agentId, messages: [{role, content}]} 或 {agentId, role, content}"""
+        store = self.conversation_store()
+        client_id = self.conversation_client(request)
+        payload = request.json()
+        agent_id = self.request_agent_id(payload)
+        messages = payload.get('messages')
+        if messages is None:
+            messages = [{'role': payload.get('role'), 'content': payload.get('content')}]
+        if not isinstance(messages, list) or any(normalize_message(message) is None for message in messages):
+            raise HttpError(400, '消息格式无效（需要 role 和字符串 content）')
+        ids = await asyncio.to_thread(store.append, client_id, agent_id, messages)
+        await send_json(writer, request, 200, {'ids': ids})
+
+    async def handle_conversation_clear(self, request, writer):
+        store = self.conversation_store()
+        client_id = self.conversation_client(request)
+        agent_id = self.request_agent_id(request.json())
+        deleted = await asyncio.to_thread(store.clear, client_id, agent_id)
+        await send_json(writer, request, 200, {'deleted': deleted})
+
+    async def handle_conversation_import(self, request, writer):
+        """批量导入 localStorage 中的对话记录：{histories: {智能体id: [消息]}, replace?}；与已有记录合并"""
+        store = self.conversation_store()
+        client_id = self.conversation_client(request)
+        payload = request.json()
+        histories = payload.get('histories') if isinstance(payload, dict) else None
+        if not isinstance(histories, dict):
+            raise HttpError(400, '请求体缺少 histories 对象')
+        result = await asyncio.to_thread(store.import_histories, client_id, histories, bool(payload.get('replace')))
+        await send_json(writer, request, 200, result)
+
+    # ---------- 导出 ----------
+
+    @staticmethod
+    def attachment(filename, extension):
+        """Content-Disposition：中文文件名按 RFC 5987 编码"""
+        name = f'{filename}.{extension}'
+        fallback = name.encode('ascii', 'replace').decode('ascii').replace('?', '_').replace('"', '_')
+        return f'attachment; filename="{fallback}"; filename*=UTF-8\'\'{urllib.parse.quote(name)}'
+
+    async def handle_export_docx(self, request, writer):
+        """把一段 Markdown 导出为 Word：{markdown, filename?, title?, timestamp?}"""
+        payload = request.json()
+        markdown = payload.get('markdown') if isinstance(payload, dict) else None
+        if not isinstance(markdown, str) or not markdown.strip():
+            raise HttpError(400, '没有内容可以导出')
+        title = payload.get('title') if isinstance(payload.get('title'), str) else None
+        timestamp = payload.get('timestamp') if isinstance(payload.get('timestamp'), str) else None
+        data = await self.exporter.export(markdown, title, timestamp)
+        filename = safe_filename(payload.get('filename'), 'AI回复文档')
+        await send_response(writer, request, 200, [
+            ('Content-Type', DOCX_CONTENT_TYPE),
+            ('Content-Disposition', self.attachment(filename, 'docx')),
+            ('Cache-Control', 'no-store'),
+        ], data)
+
+    def conversation_markdown(self, client_id, agent_id):
+        """把客户端与一个智能体的对话记录整理为 Markdown，返回 (文件名, Markdown, 标题)"""
+        agent = self.agent_config(agent_id) or {}
+        name = agent.get('name') or str(agent_id)
+        sections = []
+        for message in self.conversation_store().history(client_id, agent_id):
+            if message['role'] == 'system':
+                continue
+            sender = '我' if message['role'] == 'user' else name
+            sections.append(f"## {sender}\n\n{message['content']}")
+        return name, '\n\n'.join(sections), f'与{name}的对话'
+
+    async def handle_export_batch(self, request, writer):
+        """批量导出为 zip：{documents?: [{filename, markdown, title?}], conversations?: [智能体id], filename?}
+
+        conversations 中的每个智能体导出为一个文档（服务器保存的该客户端的全部对话记录，需要 X-Client-Id）。
+        """
+        payload = request.json()
+        if not isinstance(payload, dict):
+            raise HttpError(400, '请求体必须是 JSON 对象')
+        documents = []
+        for document in payload.get('documents') or []:
+            if isinstance(document, dict) and isinstance(document.get('markdown'), str):
+                title = document.get('title') if isinstance(document.get('title'), str) else None
+                documents.append((document.get('filename'), document['markdown'], title))
+        conversations = payload.get('conversations') or []
+        if conversations:
+            if not isinstance(conversations, list):
+                raise HttpError(400, 'conversations 必须是智能体 id 列表')
+            client_id = self.conversation_client(request)
+            for agent_id in conversations:
+                name, markdown, title = await asyncio.to_thread(self.conversation_markdown, client_id, agent_id)
+                if markdown:
+                    documents.append((name, markdown, title))
+        if not documents:
+            raise HttpError(400, '没有内容可以导出')
+        data = await self.exporter.export_zip(documents)
+        filename = safe_filename(payload.get('filename'), '导出文档')
+        await send_response(writer, request, 200, [
+            ('Content-Type', 'application/zip'),
+            ('Content-Disposition', self.attachment(filename, 'zip')),
+            ('Cache-Control', 'no-store'),
+        ], data)
+
+    # ---------- 聊天转发 ----------
+
+    def refresh_agents(self):
+        """agents.json（或分片存储的清单）修改后重新读取智能体配置"""
+        if self.shard_store.exists():
+            # 分片存储：清单变化时只重新读取哈希变化的分片
+            try:
+                agents = self.shard_store.load_if_changed()
+            except (OSError, ValueError, KeyError) as e:
+                print(f"读取分片存储失败: {str(e)}")
+                agents = None
+            if agents is not None or self._allowed_hosts is None:
+                self.index_agents(agents or [])
+            return
+
+        try:
+            mtime = os.path.getmtime(self.agents_file)
+        except OSError:
+            mtime = None
+
+        if self._allowed_hosts is None or mtime != self._agents_mtime:
+            agents = []
+            try:
+                with open(self.agents_file, 'r', encoding='utf-8') as f:
+                    agents = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"读取agents.json失败: {str(e)}")
+            self.index_agents(agents)
+            self._agents_mtime = mtime
+
+    def index_agents(self, agents):
+        """建立 id -> 智能体 的查找表和允许转发的上游主机集合"""
+        hosts = {urllib.parse.urlsplit(self.default_upstream).hostname}
+        agents_by_id = {}
+        for agent in agents if isinstance(agents, list) else []:
+            if not isinstance(agent, dict):
+                continue
+            agents_by_id[str(agent.get('id'))] = agent
+            host = urllib.parse.urlsplit(str(agent.get('apiUrl') or '')).hostname
+            if host:
+                hosts.add(host)
+        self._allowed_hosts = hosts
+        self._agents_by_id = agents_by_id
+        self.request_builder.clear()
+
+    def allowed_upstream_hosts(self):
+        """允许转发的上游主机：默认上游 + agents.json 中出现的 apiUrl 主机"""
+        self.refresh_agents()
+        return self._allowed_hosts
+
+    def agent_config(self, agent_id):
+        """按 id 查找 agents.json 中的智能体，找不到时返回 None"""
+        if not agent_id:
+            return None
+        self.refresh_agents()
+        return self._agents_by_id.get(str(agent_id))
+
+    def resolve_upstream(self, request):
+        """确定上游地址：优先使用 X-Upstream-Url 头，否则使用默认上游"""
+        url = request.headers.get('x-upstream-url') or self.default_upstream
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+            raise HttpError(400, f'无效的上游地址: {url}')
+        if parsed.hostname not in self.allowed_upstream_hosts():
+            raise HttpError(403, f'上游地址不在允许列表中: {parsed.hostname}')
+        return url
+
+    def upstream_headers(self, request):
+        """转发到上游的请求头"""
+        headers = [
+            ('Content-Type', 'application/json'),
+            ('Accept', request.headers.get('accept', 'text/event-stream')),
+            # 要求上游不压缩，SSE 数据块可以原样转发
+            ('Accept-Encoding', 'identity'),
+        ]
+        if 'authorization' in request.headers:
+            headers.append(('Authorization', request.headers['authorization']))
+        return headers
+
+    def prepare_request(self, request):
+        """转发前整理请求体（直接替换 request.body），返回上下文预算统计或 None
+
+        - 带 X-Agent-Id 且请求体没有 model 时，按智能体配置注入模型参数、系统提示词、密钥和上游地址
+        - 否则按智能体和模型的上下文窗口裁剪客户端发来的历史
+        """
+        try:
+            payload = json.loads(request.body.decode('utf-8'))
+        except (UnicodeDecodeError, ValueError):
+            return None
+        if not isinstance(payload, dict):
+            return None
+
+        agent_id = request.headers.get('x-agent-id')
+        agent = self.agent_config(agent_id)
+        if agent_id and 'model' not in payload:
+            if agent is None:
+                raise HttpError(404, f'未找到智能体: {agent_id}')
+            request.model = agent.get('model')
+            request.body, info = self.request_builder.build(agent, payload)
+            authorization = self.request_builder.authorization(agent)
+            if authorization and 'authorization' not in request.headers:
+                request.headers['authorization'] = authorization
+            if agent.get('apiUrl') and 'x-upstream-url' not in request.headers:
+                request.headers['x-upstream-url'] = agent['apiUrl']
+            return info
+
+        request.model = payload.get('model')
+        payload, info = fit_request(payload, agent)
+        if info and info['dropped']:
+            request.body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        return info
+
+    async def handle_context_fit(self, request, writer):
+        """按上下文预算裁剪页面提交的消息，返回保留的消息和 token 统计
+
+        请求体：{messages, model?, max_tokens?, agentId?, contextWindow?, maxInputTokens?}
+        """
+        payload = request.json()
+        if not isinstance(payload, dict) or not isinstance(payload.get('messages'), list):
+            raise HttpError(400, '请求体缺少 messages 列表')
+        agent = dict(self.agent_config(payload.get('agentId') or request.headers.get('x-agent-id')) or {})
+        for field, setting in (('contextWindow', 'contextWindow'), ('maxInputTokens', 'contextTokens')):
+            if payload.get(field) is None:
+                continue
+            value = positive_int(payload[field])
+            if value is None:
+                raise HttpError(400, f'{field} 必须是正整数')
+            agent[setting] = value
+        fitted, info = fit_request(payload, agent)
+        await send_json(writer, request, 200, dict(info or {}, messages=fitted['messages']))
+
+    async def handle_chat_completions(self, request, writer):
+        start = time.monotonic()
+        budget = self.prepare_request(request)
+        request.observation = self.metrics.stream(*self.metric_labels(request), len(request.body), start)
+        try:
+            return await self.complete_chat(request, writer, budget)
+        finally:
+            request.observation.finish()
+
+    def metric_labels(self, request):
+        """指标标签：(agents.json 中存在的智能体 id，模型)"""
+        agent_id = request.headers.get('x-agent-id')
+        agent = self.agent_config(agent_id)
+        model = request.model if isinstance(request.model, str) else ''
+        return (str(agent_id) if agent is not None else ''), model
+
+    async def complete_chat(self, request, writer, budget):
+        url = self.resolve_upstream(request)
+        labels = request.observation.labels
+        headers = [('X-Context-Dropped', str(budget['dropped']))] if budget and budget['dropped'] else []
+        key, read_cache = self.response_cache_key(request)
+        if key and read_cache:
+            entry = await self.response_cache.get(key)
+            if entry is not None:
+                self.metrics.cache.inc(labels + ('hit',))
+                return await self.replay_cached(entry, key, request, writer)
+
+        flight_key = self.flight_key(request, url)
+        if flight_key is not None:
+            flight = self.flights.get(flight_key)
+            if flight is not None:
+                self.metrics.cache.inc(labels + ('coalesced',))
+                return await self.subscribe(flight, request, writer, headers + [('X-Coalesced', 'HIT')])
+        self.metrics.cache.inc(labels + ('miss' if key else 'bypass',))
+
+        grant = await self.schedule(request)
+        headers += [('X-Queue-Wait-Ms', str(round(grant.wait * 1000))), ('X-Queue-Depth', str(grant.depth))]
+        if flight_key is not None:
+            flight = self.flights.get(flight_key)
+            if flight is not None:
+                # 排队期间相同的请求已经发出
+                grant.refund()
+                return await self.subscribe(flight, request, writer, headers + [('X-Coalesced', 'HIT')])
+            upstream_headers = self.upstream_headers(request)
+
+            async def run(flight):
+                collector = SSECollector() if key else None
+                await flight.run(lambda: self.open_upstream(request, url, upstream_headers, grant), collector)
+                if collector is not None and not flight.aborted and collector.complete and collector.text:
+                    await self.response_cache.put(key, collector.model, collector.text, collector.finish_reason)
+
+            flight = self.flights.start(flight_key, run)
+            return await self.subscribe(flight, request, writer, headers + ([('X-Cache', 'MISS')] if key else []))
+
+        upstream = await self.open_upstream(request, url, self.upstream_headers(request), grant)
+        collector = SSECollector() if key and upstream.status == 200 else None
+        keep_alive = await self.relay(upstream, request, writer, collector, headers)
+
+        if collector is not None and collector.complete and collector.text:
+            await self.response_cache.put(key, collector.model, collector.text, collector.finish_reason)
+        return keep_alive
+
+    def lane_key(self, request):
+        """限速通道：(Authorization 头, 模型)"""
+        try:
+            payload = json.loads(request.body.decode('utf-8'))
+        except (UnicodeDecodeError, ValueError):
+            payload = None
+        return request.headers.get('authorization', ''), payload if isinstance(payload, dict) else {}
+
+    async def schedule(self, request):
+        """按 (密钥, 模型) 排队等待发出上游请求的许可"""
+        api_key, payload = self.lane_key(request)
+        messages = payload.get('messages')
+        cost = count_tokens(messages) if isinstance(messages, list) and all(
+            isinstance(message, dict) for message in messages) else 0
+        agent = self.agent_config(request.headers.get('x-agent-id'))
+        priority = request_priority(agent, payload.get('max_tokens'))
+        try:
+            return await self.scheduler.acquire(api_key, str(payload.get('model')), cost, priority, request.client)
+        except QueueTimeout as e:
+            raise HttpError(429, f'上游繁忙，{e}，请稍后重试')
+
+    async def open_upstream(self, request, url, headers, grant):
+        """发出上游请求，读到首个数据块后返回
+
+        智能体配置了 fallbacks / hedge 时按对冲阈值和故障转移尝试多个上游。
+        """
+        agent = self.agent_config(request.headers.get('x-agent-id'))
+        attempts = attempts_for(agent, url, headers, request.body)
+        labels = request.observation.labels if request.observation is not None else ('', '')
+        upstream = None
+        try:
+            upstream = await self.hedger.request(attempts, hedge=bool(agent and agent.get('hedge')))
+        finally:
+            if upstream is None:
+                # 失败或在等待上游时被取消（客户端全部断开、服务器停止）：请求没有用到许可，退回令牌
+                self.metrics.upstream_responses.inc(labels + ('error',))
+                grant.refund()
+        self.metrics.upstream_responses.inc(labels + (str(upstream.status),))
+        return upstream
+
+    async def open_attempt(self, attempt):
+        """向一个候选上游发出请求，并把状态报告给限速器（429 时暂停该通道）"""
+        upstream = await self.client.request('POST', attempt.url, attempt.headers, attempt.body)
+        authorization = next((value for name, value in attempt.headers if name.lower() == 'authorization'), '')
+        self.scheduler.report(authorization, str(attempt.model), upstream.status, upstream.header('retry-after'))
+        return upstream
+
+    def flight_key(self, request, url):
+        """可与进行中的相同请求合并时返回合并键，否则返回 None
+
+        只合并流式请求；客户端要求重新生成（Cache-Control: no-cache）或智能体配置
+        "coalesceRequests": false 时不合并。键按密钥和上游地址隔离。
+        """
+        if 'no-cache' in request.headers.get('cache-control', '').lower():
+            return None
+        try:
+            payload = json.loads(request.body.decode('utf-8'))
+        except (UnicodeDecodeError, ValueError):
+            return None
+        if not isinstance(payload, dict) or not payload.get('stream'):
+            return None
+        agent = self.agent_config(request.headers.get('x-agent-id'))
+        if agent is not None and agent.get('coalesceRequests') is False:
+            return None
+        return coalesce_key(payload, request.headers.get('authorization', '') + '\n' + url)
+
+    async def subscribe(self, flight, request, writer, extra_headers=()):
+        """把进行中的上游请求转发给一个客户端：先发送已缓存的数据块，再跟随后续数据块"""
+        flight.join()
+        try:
+            try:
+                await flight.wait_started()
+            except FlightError as e:
+                raise HttpError(e.status, e.message)
+            stream = StreamWriter(writer, request)
+            await stream.start(flight.status, override_headers(flight.headers, [
+                ('Cache-Control', 'no-cache'),
+                ('X-Accel-Buffering', 'no'),
+            ] + list(extra_headers)))
+            index = 0
+            while True:
+                chunks, done = await flight.next_chunks(index)
+                if chunks:
+                    # 中途加入时一次发出已到达的全部数据块
+                    await stream.write(b''.join(chunks))
+                index += len(chunks)
+                if done:
+                    break
+            if flight.aborted:
+                # 响应头已经发出，只能中断连接让客户端感知错误
+                return False
+            await stream.finish()
+            return stream.keep_alive
+        except (ConnectionError, asyncio.IncompleteReadError):
+            return False
+        finally:
+            flight.leave()
+
+    def response_cache_key(self, request):
+        """返回 (缓存键, 是否读取缓存)；不可缓存时缓存键为 None
+
+        默认只缓存 temperature 为 0 的请求，智能体的 cacheResponses 可以强制开启或关闭。
+        客户端发送 Cache-Control: no-cache 时跳过读取、重新生成，但仍保存新结果。
+        """
+        if self.response_cache is None:
+            return None, False
+        try:
+            payload = json.loads(request.body.decode('utf-8'))
+        except (UnicodeDecodeError, ValueError):
+            return None, False
+        if not isinstance(payload, dict) or not payload.get('stream'):
+            return None, False
+
+        agent = self.agent_config(request.headers.get('x-agent-id'))
+        if not should_cache(payload, agent):
+            return None, False
+
+        # 缓存按 API 密钥隔离，避免无效密钥通过缓存拿到回复
+        scope = request.headers.get('authorization', '')
+        read_cache = 'no-cache' not in request.headers.get('cache-control', '').lower()
+        return cache_key(payload, scope), read_cache
+
+    async def replay_cached(self, entry, key, request, writer):
+        """把缓存的完整回复重放为普通的 SSE 流"""
+        stream = StreamWriter(writer, request)
+        await stream.start(200, [
+            ('Content-Type', 'text/event-stream; charset=utf-8'),
+            ('Cache-Control', 'no-cache'),
+            ('X-Cache', 'HIT'),
+        ])
+        for event in text_to_events(entry['content'], entry.get('model'), f'cache-{key[:24]}',
+                                    reason=entry.get('finish_reason', 'stop')):
+            await stream.write(event)
+        await stream.finish()
+        return stream.keep_alive
+
+    async def relay(self, upstream, request, writer, collector=None, extra_headers=()):
+        """把上游响应逐块转发给客户端，返回客户端连接是否可以继续复用
+
+        collector 不为空时同时解析转发的内容，用于写入回复缓存；extra_headers 附加到响应头。
+        """
+        stream = StreamWriter(writer, request)
+        overrides = [('Cache-Control', 'no-cache'), ('X-Accel-Buffering', 'no')] + list(extra_headers)
+        if collector is not None:
+            overrides.append(('X-Cache', 'MISS'))
+        # 上游自带的 Cache-Control 等头由代理的取值替换，不重复发出
+        headers = override_headers(upstream.relay_headers(), overrides)
+        try:
+            await stream.start(upstream.status, headers)
+            async for chunk in upstream.body():
+                await stream.write(chunk)
+                if collector is not None:
+                    collector.feed(chunk)
+            await stream.finish()
+        except asyncio.TimeoutError:
+            # 响应头已经发出，只能中断连接让客户端感知错误
+            print("上游响应超时，已中断转发")
+            return False
+        except (ConnectionError, asyncio.IncompleteReadError):
+            # 客户端断开或上游中断：关闭上游连接，停止生成
+            return False
+        finally:
+            upstream.release(False)
+        return stream.keep_alive
+
+
+async def serve(host, port, root, upstream, response_cache=True, conversation_db=None, hide_agent_secrets=False,
+                rpm=0, tpm=0, queue_timeout=120.0, hedging=True, worker_socket=None,
+                drain_timeout=DEFAULT_DRAIN_TIMEOUT):
+    """运行服务器；worker_socket 不为空时作为多进程模式的工作进程运行（限速状态由主进程保存）"""
+    if worker_socket:
+        scheduler = RemoteScheduler(worker_socket)
+    else:
+        scheduler = UpstreamScheduler(rpm, tpm, queue_timeout)
+    server = TangzaiServer(root=root, upstream=upstream, response_cache=response_cache,
+                           conversation_db=conversation_db, hide_agent_secrets=hide_agent_secrets,
+                           scheduler=scheduler, hedging=hedging)
+    warmed = server.static.warm(server.root)
+    if server.site.fresh():
+        warmed += server.static.warm(server.site.out_dir, ('index.html', 'faq.html', 'assets'))
+    listener = await asyncio.start_server(server.handle_connection, host, port,
+                                          limit=MAX_HEADER_BYTES, reuse_port=bool(worker_socket) or None)
+
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    try:
+        loop.add_signal_handler(signal.SIGTERM, stop.set)
+        if worker_socket:
+            # Ctrl+C 由主进程统一处理
+            loop.add_signal_handler(signal.SIGINT, lambda: None)
+    except (NotImplementedError, AttributeError):
+        pass  # Windows 不支持，仍可用 Ctrl+C 停止
+    waits = [asyncio.ensure_future(stop.wait())]
+    pusher = None
+    if worker_socket:
+        await scheduler.connect()
+        waits.append(asyncio.ensure_future(scheduler.lost.wait()))
+        pusher = asyncio.ensure_future(push_metrics(server))
+        print(f"工作进程 {os.getpid()} 已启动（已预加载 {warmed} 个文件）")
+    else:
+        print(f"智能体聚合平台服务器已启动: http://{host or 'localhost'}:{port}")
+        print(f"静态文件目录: {server.root}（已预加载 {warmed} 个文件）")
+        print(f"默认上游: {upstream}")
+    try:
+        await asyncio.wait(waits, return_when=asyncio.FIRST_COMPLETED)
+        # 停止接受新连接，等待进行中的请求结束
+        listener.close()
+        remaining = await server.drain(drain_timeout)
+        if remaining:
+            print(f"进程 {os.getpid()} 等待超时，中断 {remaining} 个连接")
+        if worker_socket:
+            # 退出前把最终的指标交给主进程
+            scheduler.push_metrics(server.metrics.snapshot())
+            await scheduler.flush()
+    finally:
+        for waiter in waits + ([pusher] if pusher else []):
+            waiter.cancel()
+        server.exporter.shutdown()
+        server.client.pool.close_all()
+        if server.conversations is not None:
+            server.conversations.close()
+
+
+async def push_metrics(server):
+    """多进程模式：定期把本进程的指标快照发给主进程"""
+    while True:
+        await asyncio.sleep(PUSH_INTERVAL)
+        server.scheduler.push_metrics(server.metrics.snapshot())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="智能体聚合平台服务器")
+    parser.add_argument('--host', default='', help="监听地址（默认所有地址）")
+    parser.add_argument('--port', type=int, default=8000, help="监听端口（默认8000）")
+    parser.add_argument('--root', default=os.path.dirname(os.path.abspath(__file__)),
+                        help="静态文件目录（默认脚本所在目录）")
+    parser.add_argument('--upstream', default=os.environ.get('TANGZAI_UPSTREAM', DEFAULT_UPSTREAM),
+                        help="默认上游聊天接口地址")
+    parser.add_argument('--no-response-cache', action='store_true', help="关闭回复缓存")
+    parser.add_argument('--conversation-db', help="对话记录数据库（默认 <root>/data/conversations.sqlite3）")
+    parser.add_argument('--no-conversations', action='store_true', help="不在服务器保存对话记录")
+    parser.add_argument('--hide-agent-secrets', action='store_true',
+                        help="提供给浏览器的 agents.json 中去掉密钥（聊天请求由服务器注入密钥）")
+    parser.add_argument('--rpm', type=int, default=int(os.environ.get('TANGZAI_RPM', 0)),
+                        help="每个 (密钥, 模型) 每分钟的上游请求数上限（0 表示不限）")
+    parser.add_argument('--tpm', type=int, default=int(os.environ.get('TANGZAI_TPM', 0)),
+                        help="每个 (密钥, 模型) 每分钟的输入 token 数上限（0 表示不限）")
+    parser.add_argument('--queue-timeout', type=float, default=120.0, help="请求排队等待的上限（秒）")
+    parser.add_argument('--no-hedging', action='store_true', help="不发出对冲请求（仍会故障转移）")
+    parser.add_argument('--workers', default=os.environ.get('TANGZAI_WORKERS', '0'),
+                        help="工作进程数，auto 为 CPU 核心数（默认 0：单进程）")
+    parser.add_argument('--pid-file', help="多进程模式下写入主进程 pid 的文件（kill -HUP 平滑重启）")
+    parser.add_argument('--drain-timeout', type=float, default=DEFAULT_DRAIN_TIMEOUT,
+                        help="停止或重启时等待进行中的请求结束的上限（秒）")
+    parser.add_argument('--worker-socket', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    conversation_db = None
+    if not args.no_conversations:
+        conversation_db = args.conversation_db or os.path.join(args.root, 'data', 'conversations.sqlite3')
+    workers = 0 if args.worker_socket else worker_count(args.workers)
+    if workers and not prefork_supported():
+        print("当前平台不支持多进程模式（需要 SO_REUSEPORT），以单进程运行")
+        workers = 0
+    if workers:
+        # 主进程只保存限速状态并管理工作进程；工作进程重新执行本脚本，平滑重启时会读取新的代码
+        supervisor = Supervisor([sys.executable, os.path.abspath(__file__)] + sys.argv[1:], workers,
+                                UpstreamScheduler(args.rpm, args.tpm, args.queue_timeout), args.pid_file)
+        print(f"智能体聚合平台服务器（{workers} 个工作进程）: http://{args.host or 'localhost'}:{args.port}")
+        print(f"静态文件目录: {os.path.abspath(args.root)}")
+        print(f"默认上游: {args.upstream}")
+        sys.exit(asyncio.run(supervisor.run()))
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.root, args.upstream,
+                          response_cache=not args.no_response_cache, conversation_db=conversation_db,
+                          hide_agent_secrets=args.hide_agent_secrets,
+                          rpm=args.rpm, tpm=args.tpm, queue_timeout=args.queue_timeout,
+                          hedging=not args.no_hedging, worker_socket=args.worker_socket,
+                          drain_timeout=args.drain_timeout))
+    except KeyboardInterrupt:
+        print("\n服务器已停止")
+
+
+if __name__ == "__main__":
+    main()
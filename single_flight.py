@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+相同请求合并（single-flight）
+
+同一时刻多个浏览器向同一个智能体发送相同的输入（例如课堂上同时打开分享链接）时，
+只向上游发出一个请求，把同一个 SSE 流分发给所有等待的客户端：
+- 按规范化请求体（去掉 stream 后键排序的完整 JSON）的哈希识别相同的请求，并按密钥和上游地址隔离；
+  top_p、tools、response_format、n、stop 等任何参数不同都不会合并
+- 上游数据块缓存在内存中，中途加入的客户端先收到已到达的部分，再继续接收后续数据块
+- 上游流由独立的任务读取，发起请求的客户端断开不影响其他客户端；所有客户端都断开后才中断上游
+- 上游结束后立即从登记表中移除，之后的相同请求由回复缓存或新的上游请求处理
+"""
+
+import asyncio
+import hashlib
+import json
+
+
+def coalesce_key(payload, scope=''):
+    """合并键：去掉 stream 后的完整请求体的规范化 JSON 加上调用方范围（密钥和上游地址）的哈希"""
+    material = {key: value for key, value in payload.items() if key != 'stream'}
+    encoded = json.dumps([material, scope], ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class FlightError(Exception):
+    """上游请求在返回响应头之前失败"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class Flight:
+    """一个进行中的上游请求及其已收到的数据块"""
+
+    def __init__(self, key):
+        self.key = key
+        self.status = None
+        self.headers = []
+        self.chunks = []
+        self.done = False
+        self.aborted = False      # 上游中断或超时（客户端只能通过断开连接感知）
+        self.error = None         # 响应头之前的错误（FlightError）
+        self.subscribers = 0
+        self.task = None
+        self.started = asyncio.Event()
+        self.changed = asyncio.Event()
+
+    def wake(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def join(self):
+        self.subscribers += 1
+
+    def leave(self):
+        """客户端离开；没有客户端时中断上游，停止生成"""
+        self.subscribers -= 1
+        if self.subscribers <= 0 and not self.done and self.task is not None:
+            self.task.cancel()
+
+    async def wait_started(self):
+        """等待上游响应头，失败时抛出 FlightError"""
+        await self.started.wait()
+        if self.error is not None:
+            raise self.error
+
+    async def next_chunks(self, index):
+        """返回 index 之后已到达的数据块和上游是否已结束；没有新数据时等待"""
+        while len(self.chunks) <= index and not self.done:
+            changed = self.changed
+            await changed.wait()
+        return self.chunks[index:], self.done
+
+    async def run(self, open_upstream, collector=None):
+        """读取上游响应并缓存数据块
+
+        open_upstream() 返回上游响应（status、relay_headers()、body()、release()）；
+        collector 不为空且状态为 200 时同时解析内容。
+        """
+        try:
+            upstream = await open_upstream()
+        except Exception as e:
+            self.error = FlightError(getattr(e, 'status', 502), getattr(e, 'message', str(e)))
+            self.done = True
+            self.started.set()
+            self.wake()
+            return
+
+        self.status = upstream.status
+        self.headers = upstream.relay_headers()
+        self.started.set()
+        try:
+            async for chunk in upstream.body():
+                self.chunks.append(chunk)
+                if collector is not None and self.status == 200:
+                    collector.feed(chunk)
+                self.wake()
+        except asyncio.TimeoutError:
+            print("上游响应超时，已中断转发")
+            self.aborted = True
+        except (ConnectionError, asyncio.IncompleteReadError):
+            self.aborted = True
+        except asyncio.CancelledError:
+            # 所有客户端都已断开
+            self.aborted = True
+        finally:
+            upstream.release(False)
+            self.done = True
+            self.wake()
+
+
+class SingleFlight:
+    """按请求键登记进行中的上游请求"""
+
+    def __init__(self):
+        self.flights = {}
+        self.stats = {'leaders': 0, 'joined': 0}
+
+    def get(self, key):
+        flight = self.flights.get(key)
+        if flight is not None and not flight.done:
+            self.stats['joined'] += 1
+            return flight
+        return None
+
+    def start(self, key, run):
+        """登记新的请求并在独立任务中执行 run(flight)，结束后自动移除"""
+        flight = Flight(key)
+        self.flights[key] = flight
+        self.stats['leaders'] += 1
+
+        async def runner():
+            try:
+                await run(flight)
+            finally:
+                if self.flights.get(key) is flight:
+                    del self.flights[key]
+
+        flight.task = asyncio.ensure_future(runner())
+        return flight
+
+    def snapshot(self):
+        return dict(self.stats, in_flight=len(self.flights))
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SSE（Server-Sent Events）工具
+
+解析上游返回的流式数据，以及把一段完整文本重新编码成
+与 OpenAI 格式一致的流式响应（前端 callAI 可直接解析）。
+"""
+
+import json
+import time
+
+
+def extract_delta(data):
+    """从一个流式数据对象中取出增量文本，兼容 OpenAI 与 Gemini 格式"""
+    choices = data.get('choices')
+    if choices:
+        delta = choices[0].get('delta') or {}
+        return delta.get('content') or ''
+    candidates = data.get('candidates')
+    if candidates:
+        parts = (candidates[0].get('content') or {}).get('parts') or []
+        if parts:
+            return parts[0].get('text') or ''
+    return ''
+
+
+def finish_reason(data):
+    """取出结束原因（未结束时为 None）"""
+    choices = data.get('choices')
+    if choices:
+        return choices[0].get('finish_reason')
+    candidates = data.get('candidates')
+    if candidates:
+        return candidates[0].get('finishReason')
+    return None
+
+
+class SSECollector:
+    """边转发边解析 SSE 数据块，累积完整回复文本
+
+    数据块可能在任意位置被切开，未完整的行留到下一块再解析。
+    """
+
+    def __init__(self):
+        self.buffer = b''
+        self.parts = []
+        self.events = 0
+        self.done = False
+        self.finish_reason = None
+        self.model = None
+
+    def feed(self, chunk):
+        """输入一个原始数据块，返回其中包含的增量文本"""
+        self.buffer += chunk
+        lines = self.buffer.split(b'\n')
+        self.buffer = lines.pop()
+        texts = []
+        for line in lines:
+            text = self.feed_line(line.strip())
+            if text:
+                texts.append(text)
+        return ''.join(texts)
+
+    def feed_line(self, line):
+        if not line.startswith(b'data:'):
+            return ''
+        payload = line[5:].strip()
+        if payload == b'[DONE]':
+            self.done = True
+            return ''
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            return ''
+        if not isinstance(data, dict):
+            return ''
+
+        self.events += 1
+        self.model = self.model or data.get('model')
+        reason = finish_reason(data)
+        if reason:
+            self.finish_reason = reason
+        text = extract_delta(data)
+        if text:
+            self.parts.append(text)
+        return text
+
+    @property
+    def text(self):
+        return ''.join(self.parts)
+
+    @property
+    def complete(self):
+        """上游是否正常结束（收到 [DONE] 或结束原因）"""
+        return self.done or self.finish_reason is not None
+
+
+def format_event(data):
+    """编码一条 SSE 事件"""
+    return b'data: ' + json.dumps(data, ensure_ascii=False).encode('utf-8') + b'\n\n'
+
+
+def text_to_events(text, model, completion_id, piece_chars=512, reason='stop'):
+    """把完整文本切成若干 OpenAI 格式的流式事件，最后以 [DONE] 结束"""
+    created = int(time.time())
+
+    def chunk(delta, finish=None):
+        return format_event({
+            'id': completion_id,
+            'object': 'chat.completion.chunk',
+            'created': created,
+            'model': model,
+            'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish}],
+        })
+
+    yield chunk({'role': 'assistant', 'content': ''})
+    for start in range(0, len(text), piece_chars):
+        yield chunk({'content': text[start:start + piece_chars]})
+    yield chunk({}, reason)
+    yield b'data: [DONE]\n\n'
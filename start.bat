@@ -1,4 +1,5 @@
 @echo off
 echo 启动智能体聚合平台服务器...
 echo 请保持本窗口打开，按Ctrl+C可停止服务器
-python -m http.server 8000 
\ No newline at end of file
+python build_assets.py
+python server.py --port 8000 
\ No newline at end of file
@@ -1,4 +1,7 @@
 #!/bin/bash
 echo "启动智能体聚合平台服务器..."
 echo "请保持本窗口打开，按Ctrl+C可停止服务器"
-python -m http.server 8000 
\ No newline at end of file
+# 合并压缩前端资源（失败时直接提供源文件）
+python build_assets.py || echo "前端构建失败，将直接提供源文件"
+# 每个CPU核心一个工作进程；执行 restart-server.sh 或 kill -HUP <主进程> 可平滑重启
+python server.py --port 8000 --workers auto --pid-file data/server-8000.pid
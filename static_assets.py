@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+静态资源缓存
+
+为 server.py 提供静态文件的内存缓存：
+- 按文件内容计算强 ETag，支持 If-None-Match / If-Modified-Since 条件请求返回 304
+- 预先生成 gzip（以及安装了 brotli 时的 br）压缩版本并缓存在内存中
+- 文件旁已有 .gz / .br 预压缩文件（构建步骤生成）时直接使用
+- 每次请求只做一次 stat，文件修改后自动失效
+"""
+
+import email.utils
+import gzip
+import hashlib
+import mimetypes
+import os
+from collections import OrderedDict
+
+try:
+    import brotli  # 可选依赖
+except ImportError:
+    brotli = None
+
+# 值得压缩的内容类型
+COMPRESSIBLE_TYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/markdown', 'text/javascript',
+    'application/javascript', 'application/json', 'image/svg+xml',
+}
+
+# 小于该大小的文件压缩收益很小
+MIN_COMPRESS_BYTES = 512
+
+# 编码 -> 预压缩文件后缀
+PRECOMPRESSED_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+
+def content_type_for(path):
+    """根据文件名推断 Content-Type，文本类型附加 utf-8 编码"""
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    if content_type.startswith('text/') or content_type in ('application/javascript', 'application/json'):
+        content_type += '; charset=utf-8'
+    return content_type
+
+
+def parse_accept_encoding(header):
+    """解析 Accept-Encoding，返回 {编码: q值}"""
+    accepted = {}
+    for part in (header or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, params = part.partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    return accepted
+
+
+def etag_matches(if_none_match, etag):
+    """判断 If-None-Match 是否命中（按弱比较，忽略 W/ 前缀和编码后缀）"""
+    if if_none_match.strip() == '*':
+        return True
+    base = etag.strip('"')
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        candidate = candidate.strip('"')
+        # 压缩版本的 ETag 形如 "<hash>-gz"，内容未变即视为命中
+        if candidate == base or candidate.split('-', 1)[0] == base:
+            return True
+    return False
+
+
+class StaticAsset:
+    """一个已缓存的静态文件及其压缩版本"""
+
+    def __init__(self, path, stat, data, precompressed=True):
+        self.path = path
+        self.mtime_ns = stat.st_mtime_ns
+        self.size = stat.st_size
+        self.content_type = content_type_for(path)
+        self.etag = '"' + hashlib.sha256(data).hexdigest()[:32] + '"'
+        self.last_modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+        self.variants = {'identity': data}
+        self.prepare_variants(data, precompressed)
+
+    @property
+    def compressible(self):
+        return self.content_type.split(';')[0] in COMPRESSIBLE_TYPES and self.size >= MIN_COMPRESS_BYTES
+
+    def prepare_variants(self, data, precompressed=True):
+        """生成压缩版本：优先使用磁盘上未过期的预压缩文件，其次在内存中压缩"""
+        if not self.compressible:
+            return
+
+        for encoding, suffix in (PRECOMPRESSED_SUFFIXES.items() if precompressed else ()):
+            precompressed = self.path + suffix
+            try:
+                if os.stat(precompressed).st_mtime_ns >= self.mtime_ns:
+                    with open(precompressed, 'rb') as f:
+                        self.variants[encoding] = f.read()
+            except OSError:
+                pass
+
+        if 'gzip' not in self.variants:
+            self.variants['gzip'] = gzip.compress(data, compresslevel=9, mtime=0)
+        if 'br' not in self.variants and brotli is not None:
+            self.variants['br'] = brotli.compress(data)
+
+        # 压缩后反而更大的版本没有意义
+        for encoding in list(self.variants):
+            if encoding != 'identity' and len(self.variants[encoding]) >= len(data):
+                del self.variants[encoding]
+
+    @property
+    def nbytes(self):
+        return sum(len(body) for body in self.variants.values())
+
+    def is_fresh(self, stat):
+        return stat.st_mtime_ns == self.mtime_ns and stat.st_size == self.size
+
+    def choose_encoding(self, accept_encoding):
+        """根据客户端 Accept-Encoding 选择最小的可用版本"""
+        accepted = parse_accept_encoding(accept_encoding)
+        best = 'identity'
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and accepted.get(encoding, accepted.get('*', 0)) > 0:
+                if len(self.variants[encoding]) < len(self.variants[best]):
+                    best = encoding
+        return best
+
+    def etag_for(self, encoding):
+        """不同编码的响应体不同，强 ETag 也必须不同"""
+        if encoding == 'identity':
+            return self.etag
+        suffix = 'gz' if encoding == 'gzip' else encoding
+        return self.etag[:-1] + '-' + suffix + '"'
+
+    def not_modified(self, headers):
+        """判断条件请求是否可以返回 304"""
+        if_none_match = headers.get('if-none-match')
+        if if_none_match is not None:
+            return etag_matches(if_none_match, self.etag)
+        if_modified_since = headers.get('if-modified-since')
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(self.mtime_ns // 1_000_000_000) <= int(since)
+        return False
+
+
+class StaticCache:
+    """按路径缓存 StaticAsset，超出内存上限时淘汰最久未使用的文件
+
+    transform(path, data) 可以改写文件内容（返回 None 表示不改写），改写后的文件不使用磁盘上的预压缩版本。
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_file_bytes=8 * 1024 * 1024, transform=None):
+        self.transform = transform
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.assets = OrderedDict()
+        self.total_bytes = 0
+
+    def get(self, path):
+        """取得文件的缓存；文件修改后重新读取"""
+        stat = os.stat(path)
+        asset = self.assets.get(path)
+        if asset is not None and asset.is_fresh(stat):
+            self.assets.move_to_end(path)
+            return asset
+
+        with open(path, 'rb') as f:
+            data = f.read()
+        transformed = self.transform(path, data) if self.transform is not None else None
+        if transformed is not None:
+            asset = StaticAsset(path, stat, transformed, precompressed=False)
+        else:
+            asset = StaticAsset(path, stat, data)
+        self.store(path, asset)
+        return asset
+
+    def store(self, path, asset):
+        old = self.assets.pop(path, None)
+        if old is not None:
+            self.total_bytes -= old.nbytes
+        # 超大文件不常驻内存
+        if asset.size > self.max_file_bytes:
+            return
+        self.assets[path] = asset
+        self.total_bytes += asset.nbytes
+        while self.total_bytes > self.max_bytes and len(self.assets) > 1:
+            _, evicted = self.assets.popitem(last=False)
+            self.total_bytes -= evicted.nbytes
+
+    def warm(self, root, paths=('agents.json', 'agents/manifest.json', 'index.html', 'style.css', 'faq.html', 'js')):
+        """启动时预先读取并压缩常用资源"""
+        count = 0
+        for relative in paths:
+            full_path = os.path.join(root, relative)
+            if os.path.isdir(full_path):
+                names = sorted(os.listdir(full_path))
+                files = [os.path.join(full_path, name) for name in names
+                         if not name.endswith(tuple(PRECOMPRESSED_SUFFIXES.values()))]
+            else:
+                files = [full_path]
+            for file_path in files:
+                if os.path.isfile(file_path):
+                    try:
+                        self.get(file_path)
+                        count += 1
+                    except OSError as e:
+                        print(f"预加载静态资源失败 {file_path}: {str(e)}")
+        return count
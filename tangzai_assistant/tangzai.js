@@ -213,6 +213,31 @@ document.addEventListener('DOMContentLoaded', function() {
         showSystemMessage('聊天记录已清除');
     }
     
+    // 知识库请求中历史消息的token预算
+    const HISTORY_TOKEN_BUDGET = 8000;
+    
+    // 按token预算裁剪历史：页面由server.py提供时使用服务器的上下文预算接口，
+    // 否则退回到只取最近的10条消息(5轮对话)
+    async function fitHistory(history) {
+        const messages = history.map(msg => ({ role: msg.role, content: msg.content }));
+        try {
+            const response = await fetch('/v1/context/fit', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ messages: messages, maxInputTokens: HISTORY_TOKEN_BUDGET })
+            });
+            if (response.ok) {
+                const data = await response.json();
+                if (Array.isArray(data.messages)) {
+                    return data.messages;
+                }
+            }
+        } catch (error) {
+            console.warn('上下文预算接口不可用，使用固定条数:', error);
+        }
+        return messages.slice(-10);
+    }
+    
     // 使用非流式API调用知识库服务
     async function callKnowledgeBaseAPI(query) {
         if (!currentSettings.apiKey || !currentSettings.serviceId) {
@@ -240,8 +265,8 @@ document.addEventListener('DOMContentLoaded', function() {
                 // 清空默认消息，只使用历史聊天记录
                 requestData.messages = [];
                 
-                // 只取最近的10条消息(5轮对话)，避免上下文过长
-                const recentHistory = chatHistory.slice(-10);
+                // 按token预算保留最近的消息，避免上下文过长
+                const recentHistory = await fitHistory(chatHistory);
                 
                 recentHistory.forEach(msg => {
                     requestData.messages.push({
@@ -343,8 +368,8 @@ document.addEventListener('DOMContentLoaded', function() {
                 // 清空默认消息，只使用历史聊天记录
                 requestData.messages = [];
                 
-                // 只取最近的10条消息(5轮对话)，避免上下文过长
-                const recentHistory = chatHistory.slice(-10);
+                // 按token预算保留最近的消息，避免上下文过长
+                const recentHistory = await fitHistory(chatHistory);
                 
                 recentHistory.forEach(msg => {
                     requestData.messages.push({
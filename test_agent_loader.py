@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""agent_loader 延迟加载与保存的往返测试"""
+
+import json
+
+import pytest
+
+from agent_loader import AgentFile, AgentFileError, scan_agents, string_end
+
+AGENTS = [
+    {'id': 1, 'name': '写作助手', 'model': 'gpt-4o', 'systemPrompt': '你是"写作"助手\\n' * 50,
+     'welcomeMessage': '你好！', 'temperature': 0.7},
+    {'id': 'b', 'name': 'Quote "\\', 'systemPrompt': 'tail \\\\"', 'tags': ['a', {'b': [1, 2]}]},
+    {'id': 3, 'name': '无长文本'},
+]
+
+
+def write_agents(path, agents):
+    path.write_text(json.dumps(agents, ensure_ascii=False, indent=2), encoding='utf-8')
+
+
+def test_string_end():
+    data = b'"a\\"b\\\\" , "c"'
+    assert string_end(data, 0) == 8
+    assert string_end(data, 11) == 14
+    with pytest.raises(AgentFileError):
+        string_end(b'"abc\\"', 0)
+
+
+def test_scan_agents_rejects_broken_json():
+    with pytest.raises(AgentFileError):
+        scan_agents(b'[{"name": "a"')
+    with pytest.raises(AgentFileError):
+        scan_agents(b'{"name": "a"}')
+
+
+def test_lazy_load_and_save_round_trip(tmp_path):
+    path = tmp_path / 'agents.json'
+    write_agents(path, AGENTS)
+    original = path.read_bytes()
+
+    agent_file = AgentFile(str(path))
+    agents = agent_file.load()
+    # 长文本字段延迟加载
+    assert 'systemPrompt' not in agents[0] and not agent_file.is_loaded(agents[0])
+    assert agent_file.is_loaded(agents[2])
+    assert agent_file.peek(agents[1]) == AGENTS[1]
+    assert agent_file.read_field(agents[0], 'welcomeMessage') == '你好！'
+
+    # 未加载的智能体原样复制，写回的文件与 json.dumps(indent=2) 逐字节相同
+    agent_file.save(agents)
+    assert path.read_bytes() == original
+
+    # 修改一个智能体后保存，其余智能体的位置记录随之更新
+    agents[2]['name'] = '改名'
+    agents.insert(0, {'id': 0, 'name': '新增'})
+    agent_file.save(agents)
+    expected = [{'id': 0, 'name': '新增'}] + AGENTS[:2] + [dict(AGENTS[2], name='改名')]
+    assert json.loads(path.read_text(encoding='utf-8')) == expected
+    assert agent_file.load_all(agents) == expected
+    # 字段顺序与原文件一致
+    assert list(agents[1]) == list(AGENTS[0])
+
+
+def test_stored_digest_matches_backup_blob(tmp_path):
+    from backup_store import agent_blob
+
+    path = tmp_path / 'agents.json'
+    write_agents(path, AGENTS)
+    agent_file = AgentFile(str(path))
+    agents = agent_file.load()
+    assert [agent_file.stored_digest(agent) for agent in agents[:2]] == [agent_blob(agent)[0] for agent in AGENTS[:2]]
+
+
+def test_external_change_detected(tmp_path):
+    path = tmp_path / 'agents.json'
+    write_agents(path, AGENTS)
+    agent_file = AgentFile(str(path))
+    agents = agent_file.load()
+    write_agents(path, AGENTS + [{'id': 4}])
+    with pytest.raises(AgentFileError):
+        agent_file.load_fields(agents[0])
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""agent_shards 分片存储的往返测试"""
+
+import json
+import os
+
+from agent_shards import MANIFEST_NAME, ShardStore, shard_filename
+from backup_store import agent_blob
+
+AGENTS = [
+    {'id': 'writer', 'name': '写作助手', 'model': 'gpt-4o', 'systemPrompt': '长文本' * 100},
+    {'id': 'manifest', 'name': '与清单同名'},
+    {'id': 'Writer', 'name': '大小写不同'},
+    {'id': '中文/id', 'name': '不安全的 id'},
+    {'name': '没有 id'},
+]
+
+
+def test_shard_filename():
+    used = {MANIFEST_NAME}
+    names = [shard_filename(agent_id, used) for agent_id in ('a', 'A', 'manifest', 'Manifest', '../x', None)]
+    assert names[:4] == ['a.json', 'A-2.json', 'manifest-2.json', 'Manifest-3.json']
+    assert names[4].startswith('___x-') and '/' not in names[4]
+    assert len({name.lower() for name in names}) == len(names)
+
+
+def test_save_load_round_trip(tmp_path):
+    directory = str(tmp_path / 'agents')
+    store = ShardStore(directory)
+    assert not store.exists()
+
+    assert store.save(AGENTS) == (len(AGENTS), 0)
+    assert ShardStore(directory).load() == AGENTS
+
+    manifest = store.read_manifest()
+    files = [entry['file'] for entry in manifest['agents']]
+    assert MANIFEST_NAME not in [name.lower() for name in files]
+    assert len({name.lower() for name in files}) == len(AGENTS)
+    # 分片内容与备份对象相同，清单中的哈希即对象哈希
+    for agent, entry in zip(AGENTS, manifest['agents']):
+        digest, data = agent_blob(agent)
+        assert entry['hash'] == digest
+        with open(os.path.join(directory, entry['file']), 'rb') as f:
+            assert f.read() == data
+
+
+def test_save_writes_only_changed_shards(tmp_path):
+    directory = str(tmp_path / 'agents')
+    store = ShardStore(directory)
+    store.save(AGENTS)
+
+    agents = json.loads(json.dumps(AGENTS))
+    agents[0]['name'] = '改名'
+    del agents[3]
+    assert store.save(agents) == (1, 1)
+    assert sorted(os.listdir(directory)) == sorted([MANIFEST_NAME] + [entry['file'] for entry in store.read_manifest()['agents']])
+
+    reader = ShardStore(directory)
+    assert reader.load() == agents
+    assert reader.load_if_changed() is None
+
+
+def test_tracked_files(tmp_path):
+    store = ShardStore(str(tmp_path / 'agents'))
+    store.save(AGENTS[:2])
+    files = store.tracked_files()
+    assert f'agents/{MANIFEST_NAME}' in files
+    assert len(files) == 3
+    assert [digest for digest, _ in store.backup_items()] == [agent_blob(agent)[0] for agent in AGENTS[:2]]
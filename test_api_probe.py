@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""api_probe 针对 fake_openai.py 的测试"""
+
+import pytest
+
+from api_probe import format_report, probe_agents, unique_targets
+from fake_openai import start_fake_openai
+
+KEY = 'sk-test-0123456789abcdef'
+
+
+@pytest.fixture
+def fake():
+    servers = []
+
+    def start(**options):
+        server = start_fake_openai(**options)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def agent(name, url, model='gpt-4o-mini', key=KEY):
+    return {'name': name, 'apiUrl': url, 'model': model, 'apiKeyVariableName': key}
+
+
+def test_probe_deduplicates_targets(fake):
+    server = fake(keys=[KEY])
+    agents = [
+        agent('甲', server.api_url),
+        agent('乙', server.api_url),
+        agent('丙', server.api_url, model='gpt-4o'),
+        agent('丁', server.api_url, key='sk-wrong-0123456789'),
+        agent('戊', server.api_url, key='YOUR_API_KEY_HERE'),
+    ]
+    assert len(unique_targets(agents)) == 4
+
+    results = probe_agents(agents, concurrency=4, timeout=5)
+    # 甲乙共用一次请求，占位符密钥不发请求
+    assert len(server.state.requests) == 3
+    assert [result.agents for result in results] == [['甲', '乙'], ['丙'], ['丁'], ['戊']]
+    assert [result.ok for result in results] == [True, True, False, False]
+    assert results[2].status == 401 and results[2].message == 'Incorrect API key provided'
+    assert results[3].status is None and results[3].latency is None
+    assert '去重后验证 4 个' in format_report(agents, results)
+
+
+def test_probe_concurrency_limit(fake):
+    server = fake(latency=0.2)
+    agents = [agent(f'智能体{i}', server.api_url, model=f'model-{i}') for i in range(6)]
+    results = probe_agents(agents, concurrency=2, timeout=5)
+    assert all(result.ok for result in results)
+    assert server.state.max_active <= 2
+
+
+def test_probe_timeout(fake):
+    server = fake(latency=2.0)
+    result, = probe_agents([agent('慢', server.api_url)], timeout=0.3)
+    assert not result.ok
+    assert result.message == '请求超时'
+    assert result.latency < 1.5
@@ -1,9 +1,13 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import argparse
 import json
 import sys
 import os
+import time
+
+from api_probe import DEFAULT_CONCURRENCY, DEFAULT_TIMEOUT, format_report, probe_agents, unique_targets
 
 def validate_api_key(api_key):
     """验证 API 密钥格式"""
@@ -26,10 +30,10 @@ def validate_api_key(api_key):
     
     return True, "API密钥格式正确"
 
-def test_current_agents():
+def test_current_agents(file_path='agents.json'):
     """测试当前 agents.json 中的 API 密钥"""
     try:
-        with open('agents.json', 'r', encoding='utf-8') as f:
+        with open(file_path, 'r', encoding='utf-8') as f:
             agents = json.load(f)
         
         print("🔍 正在检查 agents.json 中的 API 密钥...")
@@ -87,7 +91,38 @@ def test_validation_function():
         print(f"结果: {status} - {message}")
         print()
 
+def validate_agents_live(file_path='agents.json', concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT):
+    """在线验证：每个不同的 (密钥, 地址, 模型) 并发发送一次最小请求"""
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            agents = json.load(f)
+    except Exception as e:
+        print(f"❌ 读取 {file_path} 失败: {str(e)}")
+        return False
+    
+    targets = unique_targets(agents)
+    print(f"\n🌐 在线验证 {len(agents)} 个智能体（去重后 {len(targets)} 个请求，并发 {concurrency}，超时 {timeout} 秒）...")
+    print("=" * 60)
+    
+    def on_result(result):
+        mark = "✅" if result.ok else "❌"
+        print(f"{mark} {result.model} @ {result.api_url}  {result.describe()}")
+    
+    start = time.perf_counter()
+    results = probe_agents(agents, concurrency=concurrency, timeout=timeout, on_result=on_result)
+    print("=" * 60)
+    print(format_report(agents, results))
+    print(f"\n总耗时: {time.perf_counter() - start:.2f} 秒")
+    return all(result.ok for result in results)
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="API 密钥验证工具")
+    parser.add_argument('--live', action='store_true', help='实际请求接口验证密钥、地址和模型')
+    parser.add_argument('--file', default='agents.json', help='要检查的智能体配置文件')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help='在线验证时的最大并发请求数')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, help='在线验证时每个请求的超时（秒）')
+    args = parser.parse_args()
+    
     print("🔧 API 密钥验证工具")
     print("=" * 60)
     
@@ -95,7 +130,9 @@ if __name__ == "__main__":
     test_validation_function()
     
     # 测试当前文件
-    if os.path.exists('agents.json'):
-        test_current_agents()
+    if not os.path.exists(args.file):
+        print(f"❌ 未找到 {args.file} 文件")
+    elif args.live:
+        sys.exit(0 if validate_agents_live(args.file, args.concurrency, args.timeout) else 1)
     else:
-        print("❌ 未找到 agents.json 文件") 
\ No newline at end of file
+        test_current_agents(args.file)
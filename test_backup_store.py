@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""backup_store 去重备份的往返测试"""
+
+import json
+import os
+import threading
+import time
+
+from backup_store import BackupStore, agent_blob
+
+AGENTS = [
+    {'id': 1, 'name': '写作助手', 'systemPrompt': '长文本' * 100},
+    {'id': 2, 'name': '翻译助手', 'model': 'gpt-4o'},
+    {'id': 3, 'name': '空提示词', 'systemPrompt': ''},
+]
+
+
+def object_files(store):
+    return sorted(name for _, _, files in os.walk(store.objects_dir) for name in files)
+
+
+def test_snapshot_round_trip(tmp_path):
+    store = BackupStore(str(tmp_path / 'backups'))
+    name, written = store.save_snapshot(AGENTS, kind='auto')
+    assert written == len(AGENTS)
+    assert name.startswith('agents_auto_backup_')
+    assert store.load_snapshot(name) == AGENTS
+    assert store.snapshot_text(name) == json.dumps(AGENTS, ensure_ascii=False, indent=2)
+    # 对象以内容哈希命名
+    assert [json.loads(store.get_object(agent_blob(agent)[0])) for agent in AGENTS] == AGENTS
+
+
+def test_unchanged_agents_stored_once(tmp_path):
+    store = BackupStore(str(tmp_path / 'backups'))
+    store.save_snapshot(AGENTS)
+    changed = [dict(AGENTS[0], name='改名')] + AGENTS[1:]
+    second, written = store.save_snapshot(changed)
+    assert written == 1
+    assert len(object_files(store)) == len(AGENTS) + 1
+    assert store.load_snapshot(second) == changed
+    # 同一秒内的快照名称不重复
+    assert len({entry['name'] for entry in store.list_snapshots()}) == 2
+
+
+def test_save_raw_round_trip(tmp_path):
+    broken = tmp_path / 'agents.json'
+    broken.write_bytes(b'[{"id": 1, ')
+    store = BackupStore(str(tmp_path / 'backups'))
+    name = store.save_raw(str(broken))
+    assert name.startswith('agents_error_')
+    assert store.snapshot_text(name) == '[{"id": 1, '
+
+
+def test_prune_collects_unreferenced_objects(tmp_path):
+    store = BackupStore(str(tmp_path / 'backups'))
+    names = [store.save_snapshot([dict(AGENTS[0], version=i)] + AGENTS[1:])[0] for i in range(4)]
+    assert len(object_files(store)) == 4 + 2
+
+    removed = store.prune(2)
+    assert sorted(removed) == sorted(names[:2])
+    assert len(object_files(store)) == 2 + 2
+    for name in names[2:]:
+        assert store.load_snapshot(name)[0]['version'] == names.index(name)
+
+
+def test_catalog_rebuilt_from_disk(tmp_path):
+    backup_dir = tmp_path / 'backups'
+    store = BackupStore(str(backup_dir))
+    name = store.save_snapshot(AGENTS)[0]
+    (backup_dir / 'agents_backup_20240101_000000.json').write_text(json.dumps(AGENTS[:1]), encoding='utf-8')
+    store.catalog.close()
+    for suffix in ('', '-wal', '-shm'):
+        path = backup_dir / ('catalog.sqlite3' + suffix)
+        if path.exists():
+            path.unlink()
+
+    rebuilt = BackupStore(str(backup_dir))
+    entries = {entry['name']: entry for entry in rebuilt.list_snapshots()}
+    assert entries[name]['agent_count'] == len(AGENTS)
+    assert entries['agents_backup_20240101_000000.json']['legacy']
+    assert [agent_id for agent_id, _, _ in rebuilt.diff_entries(name)] == ['1', '2', '3']
+
+
+def test_preview_pages_match_snapshot_text(tmp_path):
+    store = BackupStore(str(tmp_path / 'backups'))
+    agents = [{'id': i, 'name': f'智能体{i}'} for i in range(25)]
+    for name in (store.save_snapshot(agents)[0], store.save_snapshot([])[0]):
+        preview = store.preview(name, page_agents=10)
+        text = ''.join(preview.page(i) for i in range(preview.page_count))
+        assert text == store.snapshot_text(name)
+        assert json.loads(text) == store.load_snapshot(name)
+
+
+def test_garbage_collection_waits_for_save(tmp_path):
+    store = BackupStore(str(tmp_path / 'backups'))
+    store.save_snapshot(AGENTS)
+    store.delete_snapshot(store.list_snapshots()[0]['name'])
+    started = threading.Event()
+    collected = []
+
+    def slow_items():
+        # 第一个对象已存在而被跳过，此时在另一个线程清理未引用的对象
+        for i, agent in enumerate(AGENTS):
+            digest, data = agent_blob(agent)
+            yield digest, lambda data=data: data
+            if i == 0:
+                started.set()
+                time.sleep(0.2)
+
+    def collect():
+        started.wait(5)
+        collected.append(store.collect_garbage())
+
+    thread = threading.Thread(target=collect)
+    thread.start()
+    name = store.save_objects(slow_items())[0]
+    thread.join()
+    # 清理等到快照登记引用之后才进行，保存时跳过写入的对象不会被删除
+    assert collected == [0]
+    assert store.load_snapshot(name) == AGENTS
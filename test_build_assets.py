@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""build_assets 的压缩与按内容哈希命名"""
+
+import json
+import shutil
+import subprocess
+
+import pytest
+
+from build_assets import build, content_hash, minify_css, minify_js
+
+NODE = shutil.which('node')
+
+
+def run_node(source):
+    """用 node 执行脚本，返回标准输出"""
+    result = subprocess.run([NODE, '-e', source], capture_output=True, text=True, timeout=10)
+    assert result.returncode == 0, result.stderr
+    return result.stdout
+
+
+def test_regex_and_division():
+    source = ("var a = 10, b = 2, g = 1;\n"
+              "var x = a / b / g;\n"
+              "var y = (a) / 2;\n"
+              "var i = 1;\n"
+              "var z = i++ / 2;\n"
+              "var r = /ab+c/gi.test('xabbc');\n"
+              "var t = typeof /x/;\n"
+              "var re = /[/]\\//.source;\n")
+    assert minify_js(source) == ("var a=10,b=2,g=1;var x=a/b/g;var y=(a)/2;var i=1;var z=i++/2;"
+                                 "var r=/ab+c/gi.test('xabbc');var t=typeof/x/;var re=/[/]\\//.source;\n")
+
+
+def test_template_literal_keeps_slashes():
+    source = ("var host = 'h';\n"
+              "var u = `http://${host}/x // 不是注释 ${ {a: 1}.a } /* 也不是 */`;\n"
+              "var v = `${`in//ner`}`; // 这才是注释\n")
+    assert minify_js(source) == ("var host='h';var u=`http://${host}/x // 不是注释 ${{a:1}.a} /* 也不是 */`;"
+                                 "var v=`${`in//ner`}`;\n")
+
+
+def test_newline_after_return_kept():
+    # return 后的换行会插入分号，函数返回 undefined
+    source = "function f() {\n  return\n  42;\n}\n"
+    assert minify_js(source) == "function f(){return\n42;}\n"
+
+
+def test_increment_across_newline():
+    # a\n++b 是 a; ++b，不能连成 a++b；a + +b 之间的空格也要保留
+    source = "var a = 1, b = 2;\na\n++b\nvar c = a + +b, d = a - -b;\n"
+    assert minify_js(source) == "var a=1,b=2;a\n++b\nvar c=a+ +b,d=a- -b;\n"
+
+
+def test_license_comment_kept():
+    assert minify_js("/*! MIT */\n// 注释\nvar a = 1; /* 注释 */\n") == "/*! MIT */\nvar a=1;\n"
+
+
+@pytest.mark.skipif(NODE is None, reason='需要 node')
+def test_minified_js_runs_the_same():
+    source = ("var a = 10, b = 2, i = 1, host = 'h';\n"
+              "function f() {\n  return\n  42;\n}\n"
+              "a\n++b\n"
+              "var out = [a / 2 / 1, i++ / 2, /ab+c/.test('abbc'), `http://${host}/x // y`, f(), a + +b];\n"
+              "console.log(JSON.stringify(out));\n")
+    minified = minify_js(source)
+    assert run_node(minified) == run_node(source)
+    assert json.loads(run_node(minified)) == [5, 0.5, True, 'http://h/x // y', None, 13]
+
+
+def test_minify_css():
+    source = (".a  {  color: red ;  }\n/* 注释 */\n.b::after { content: \"  /* x */ \"; }\n/*! keep */\n"
+              "@media (max-width: 600px) { .c { margin: 0 auto ; } }\n")
+    assert minify_css(source) == ('.a{color:red}.b::after{content:"  /* x */ "}/*! keep */\n'
+                                  ' @media (max-width:600px){.c{margin:0 auto}}\n')
+
+
+def make_site(root, script):
+    (root / 'js').mkdir(exist_ok=True)
+    (root / 'js' / 'a.js').write_text(script, encoding='utf-8')
+    (root / 'js' / 'b.js').write_text('var b = 2;\n', encoding='utf-8')
+    (root / 'index.html').write_text(
+        '<html><head>\n'
+        '    <!-- build:js app -->\n'
+        '    <script src="js/a.js" defer></script>\n'
+        '    <script src="js/b.js" defer></script>\n'
+        '    <!-- endbuild -->\n'
+        '</head></html>\n', encoding='utf-8')
+
+
+def test_bundle_named_by_content_hash(tmp_path):
+    # 单行的文件视为已压缩，这里用多行源文件
+    make_site(tmp_path, 'var a = 1;\nvar c = a / 2;\n')
+    manifest, _ = build(str(tmp_path))
+    name = manifest['bundles']['app.js']
+    data = (tmp_path / 'dist' / name).read_bytes()
+    assert data == b'var a=1;var c=a/2;\n;\nvar b = 2;\n'
+    assert name == f'assets/app.{content_hash(data)}.js'
+    page = (tmp_path / 'dist' / 'index.html').read_text(encoding='utf-8')
+    assert f'<script src="{name}" defer></script>' in page and 'js/a.js' not in page
+
+    # 内容不变时文件名不变；内容改变时换新文件名，旧文件保留给已打开的页面
+    assert build(str(tmp_path))[0]['bundles']['app.js'] == name
+    make_site(tmp_path, 'var a = 3;\nvar c = a / 2;\n')
+    changed = build(str(tmp_path))[0]['bundles']['app.js']
+    assert changed != name
+    assert (tmp_path / 'dist' / changed).exists() and (tmp_path / 'dist' / name).exists()
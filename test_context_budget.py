@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""context_budget 预算计算与 /v1/context/fit 的参数校验"""
+
+import json
+
+from context_budget import (DEFAULT_WINDOW, SAFETY_RATIO, count_tokens, fit_messages, fit_request,
+                            input_budget, model_window, positive_int)
+
+
+def conversation(turns, text='这是一段比较长的对话内容。' * 20):
+    messages = [{'role': 'system', 'content': '你是助手'}]
+    for i in range(turns):
+        messages.append({'role': 'user', 'content': f'{i} {text}'})
+        messages.append({'role': 'assistant', 'content': f'{i} {text}'})
+    messages.append({'role': 'user', 'content': '最后的问题'})
+    return messages
+
+
+def test_positive_int():
+    assert [positive_int(value) for value in (8192, 8192.0, ' 8192 ', '8k', -1, 0, 1.5, True, None, [])] == \
+        [8192, 8192, 8192, None, None, None, None, None, None, None]
+
+
+def test_invalid_agent_settings_fall_back():
+    assert model_window('gpt-4o', {'contextWindow': 'abc'}) == 128000
+    assert model_window('unknown', {'contextWindow': -5}) == DEFAULT_WINDOW
+    assert model_window('gpt-4o', {'contextWindow': '4096'}) == 4096
+    assert input_budget(10000, 'many', 'none') == int(10000 * SAFETY_RATIO)
+    payload, info = fit_request({'model': 'gpt-4o', 'messages': conversation(2)},
+                                {'contextWindow': 'big', 'contextTokens': 'small'})
+    assert info['window'] == 128000 and info['dropped'] == 0
+
+
+def test_fit_messages_keeps_system_and_last():
+    messages = conversation(20)
+    budget = count_tokens(messages) // 3
+    kept, info = fit_messages(messages, budget)
+    assert kept[0] == messages[0] and kept[-1] == messages[-1]
+    assert info['dropped'] == len(messages) - len(kept) > 0
+    assert info['tokens'] <= budget
+    # 保留的历史是连续的最新部分，且不以助手消息开头
+    assert kept[1:] == messages[len(messages) - len(kept) + 1:]
+    assert kept[1]['role'] == 'user'
+
+
+def test_context_fit_validates_numbers(fake_openai, proxy):
+    server = proxy(fake_openai().api_url)
+    messages = conversation(20)
+    for field, value in (('contextWindow', 'abc'), ('maxInputTokens', -1), ('maxInputTokens', '1e3')):
+        status, _, body = server.request('POST', '/v1/context/fit', {'messages': messages, field: value})
+        assert status == 400, (field, value)
+        assert field in json.loads(body)['error']['message']
+
+    status, _, body = server.request('POST', '/v1/context/fit', {'messages': messages, 'maxInputTokens': 500})
+    result = json.loads(body)
+    assert status == 200 and result['budget'] == 500 and result['dropped'] > 0
+
+
+def test_chat_with_invalid_agent_window(fake_openai, proxy):
+    upstream = fake_openai()
+    server = proxy(upstream.api_url, agents=[{'id': 'a', 'model': 'gpt-4o-mini', 'contextWindow': 'abc',
+                                              'contextTokens': 'x', 'apiKeyVariableName': 'sk-test-0123456789abcdef'}])
+    status, _, _ = server.chat({'messages': conversation(2), 'stream': True}, {'X-Agent-Id': 'a'})
+    assert status == 200
+    status, _, _ = server.chat({'model': 'gpt-4o-mini', 'messages': conversation(2), 'stream': True},
+                               {'X-Agent-Id': 'a'})
+    assert status == 200
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""conversation_store 按客户端隔离、旧库迁移、分页和导入合并（临时 SQLite 文件）"""
+
+import json
+import sqlite3
+
+import pytest
+
+from conversation_store import ConversationStore, overlap, valid_client_id
+
+ALICE = 'alice-0123456789abcdef'
+BOB = 'bob-0123456789abcdef00'
+
+
+def msg(role, content):
+    return {'role': role, 'content': content}
+
+
+def turns(*contents):
+    """按 user / assistant 交替生成消息"""
+    return [msg('user' if i % 2 == 0 else 'assistant', content) for i, content in enumerate(contents)]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ConversationStore(str(tmp_path / 'conversations.sqlite3'))
+    yield store
+    store.close()
+
+
+def test_valid_client_id():
+    assert valid_client_id(ALICE)
+    assert not valid_client_id('short')
+    assert not valid_client_id('x' * 65)
+    assert not valid_client_id('has space 0123456789')
+    assert not valid_client_id(None)
+
+
+def test_scoped_by_client(store):
+    store.append(ALICE, 'a1', turns('你好', '你好！'))
+    store.append(BOB, 'a1', turns('hi'))
+
+    assert store.history(ALICE, 'a1') == turns('你好', '你好！')
+    assert store.history(BOB, 'a1') == turns('hi')
+    assert list(store.latest(BOB)) == ['a1'] and len(store.latest(BOB)['a1']['messages']) == 1
+    # 其他客户端既看不到也删不掉
+    assert store.clear(BOB, 'a1') == 1
+    assert store.count(ALICE, 'a1') == 2
+    assert store.page(BOB, 'a1') == ([], None)
+
+
+def test_append_skips_invalid_messages(store):
+    ids = store.append(ALICE, 7, [msg('user', 'ok'), msg('tool', 'x'), {'role': 'user', 'content': ['part']}, 'bad'])
+    assert len(ids) == 1
+    assert store.history(ALICE, '7') == [msg('user', 'ok')]
+
+
+def test_paged_reads(store):
+    store.append(ALICE, 'a1', turns(*[str(i) for i in range(12)]))
+    store.append(ALICE, 'a2', turns('other'))
+    pages = []
+    cursor = None
+    while True:
+        messages, cursor = store.page(ALICE, 'a1', before=cursor, limit=5)
+        pages.append([message['content'] for message in messages])
+        if cursor is None:
+            break
+    # 从最新的往前，每页内按时间顺序
+    assert pages == [['7', '8', '9', '10', '11'], ['2', '3', '4', '5', '6'], ['0', '1']]
+    assert store.page(ALICE, 'a1', limit=0)[0][0]['content'] == '11'
+    latest = store.latest(ALICE, limit=3)
+    assert [m['content'] for m in latest['a1']['messages']] == ['9', '10', '11'] and latest['a1']['next']
+    assert latest['a2']['next'] is None
+
+
+def test_overlap():
+    stored = [('user', 'a'), ('assistant', 'b'), ('user', 'c')]
+    assert overlap(stored, [('user', 'c'), ('assistant', 'd')]) == 1
+    assert overlap(stored, stored + [('assistant', 'd')]) == 3
+    assert overlap(stored, [('user', 'x')]) == 0
+    assert overlap([], stored) == 0
+    # 取最长的重合
+    repeated = [('user', 'a'), ('user', 'a')]
+    assert overlap(repeated, [('user', 'a'), ('user', 'a'), ('user', 'b')]) == 2
+
+
+def test_import_merges_local_fallback(store):
+    store.append(ALICE, 'a1', turns('q1', 'r1', 'q2', 'r2'))
+    # 服务器写入失败后浏览器保存的历史：从服务器读到的最近消息 + 之后的新消息
+    local = turns('q2', 'r2', 'q3', 'r3')
+    result = store.import_histories(ALICE, {'a1': local, 'a2': turns('new')})
+    assert result == {'agents': 2, 'messages': 3, 'skipped': 0}
+    assert [m['content'] for m in store.history(ALICE, 'a1')] == ['q1', 'r1', 'q2', 'r2', 'q3', 'r3']
+
+    # 重复导入同一份数据不产生重复消息
+    assert store.import_histories(ALICE, {'a1': local, 'a2': turns('new')}) == {'agents': 0, 'messages': 0, 'skipped': 2}
+    # 与服务器记录没有重合时整体追加
+    store.import_histories(ALICE, {'a1': turns('other')})
+    assert store.count(ALICE, 'a1') == 7
+    # 其他客户端的导入不与 ALICE 的记录合并
+    assert store.import_histories(BOB, {'a1': local})['messages'] == 4
+
+
+def test_import_replace(store):
+    store.append(ALICE, 'a1', turns('old'))
+    store.append(BOB, 'a1', turns('bob'))
+    assert store.import_histories(ALICE, {'a1': turns('new', 'reply'), 'bad': 'x'}, replace=True)['messages'] == 2
+    assert store.history(ALICE, 'a1') == turns('new', 'reply')
+    assert store.history(BOB, 'a1') == turns('bob')
+
+
+def test_migrates_legacy_database(tmp_path):
+    path = str(tmp_path / 'legacy.sqlite3')
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        CREATE TABLE messages (id INTEGER PRIMARY KEY AUTOINCREMENT, agent_id TEXT NOT NULL,
+                               role TEXT NOT NULL, content TEXT NOT NULL, created REAL NOT NULL);
+        CREATE INDEX messages_agent ON messages (agent_id, id);
+        INSERT INTO messages (agent_id, role, content, created) VALUES ('a1', 'user', '旧消息', 0);
+    """)
+    connection.commit()
+    connection.close()
+
+    store = ConversationStore(path)
+    try:
+        # 旧记录不属于任何客户端
+        assert store.count() == 1
+        assert store.count(ALICE) == 0 and store.latest(ALICE) == {}
+        store.append(ALICE, 'a1', turns('新消息'))
+        assert store.history(ALICE, 'a1') == turns('新消息')
+        indexes = {row[1] for row in store.connection.execute('PRAGMA index_list(messages)')}
+        assert 'messages_client' in indexes and 'messages_agent' not in indexes
+    finally:
+        store.close()
+    # 再次打开不会重复迁移
+    ConversationStore(path).close()
+
+
+def test_http_requires_client_id(fake_openai, proxy, tmp_path):
+    server = proxy(fake_openai().api_url, conversation_db=str(tmp_path / 'data' / 'conversations.sqlite3'))
+    body = {'agentId': 'a1', 'messages': turns('你好')}
+    assert server.request('POST', '/v1/conversations/messages', body)[0] == 400
+    assert server.request('GET', '/v1/conversations', headers={'X-Client-Id': 'bad'})[0] == 400
+
+    assert server.request('POST', '/v1/conversations/messages', body, {'X-Client-Id': ALICE})[0] == 200
+    status, _, data = server.request('GET', '/v1/conversations?agent=a1', headers={'X-Client-Id': ALICE})
+    assert status == 200 and [m['content'] for m in json.loads(data)['messages']] == ['你好']
+    _, _, data = server.request('GET', '/v1/conversations?agent=a1', headers={'X-Client-Id': BOB})
+    assert json.loads(data)['messages'] == []
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""fake_openai.py 模拟接口的测试"""
+
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+from fake_openai import make_reply, start_fake_openai
+from sse import SSECollector
+
+KEY = 'sk-test-0123456789abcdef'
+
+
+@pytest.fixture
+def fake():
+    servers = []
+
+    def start(**options):
+        server = start_fake_openai(**options)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def post(url, payload, key=KEY):
+    request = urllib.request.Request(url, data=json.dumps(payload).encode('utf-8'), method='POST', headers={
+        'Content-Type': 'application/json',
+        'Authorization': f'Bearer {key}',
+    })
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+def test_make_reply_length():
+    assert len(make_reply(1000)) == 1000
+    assert make_reply(50) == make_reply(50)
+
+
+def test_completion_and_stream(fake):
+    server = fake(reply_chars=100, chunk_chars=7)
+    status, body = post(server.api_url, {'model': 'gpt-4o-mini', 'messages': []})
+    assert status == 200
+    assert json.loads(body)['choices'][0]['message']['content'] == make_reply(100)
+
+    status, body = post(server.api_url, {'model': 'gpt-4o-mini', 'messages': [], 'stream': True})
+    collector = SSECollector()
+    collector.feed(body)
+    assert status == 200
+    assert collector.text == make_reply(100) and collector.done
+    assert collector.events == 100 // 7 + 1 + 2  # 角色、内容块、结束原因
+
+
+def test_errors(fake):
+    server = fake(keys=[KEY], models=['m1'])
+    assert post(server.api_url, {'model': 'm1'}, key='sk-wrong')[0] == 401
+    assert post(server.api_url, {'model': 'm2'})[0] == 404
+    assert post(server.api_url, {'model': 'm1', 'max_tokens': 1})[0] == 200
+    assert [status for _, _, status in server.state.requests] == [401, 404, 200]
+
+    failing = fake(error_rate=1.0)
+    status, body = post(failing.api_url, {'model': 'm1'})
+    assert status == 500 and json.loads(body)['error']['code'] == 'server_error'
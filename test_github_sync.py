@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""github_sync 针对 fake_github.py 的测试"""
+
+import pytest
+
+from fake_github import start_fake_github
+from github_sync import GitHubClient, SyncState, git_blob_sha
+
+OWNER, REPO, BRANCH = 'tangzai', 'agents', 'main'
+
+
+@pytest.fixture
+def github():
+    server = start_fake_github()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_client(github):
+    return GitHubClient(OWNER, REPO, token='test-token', api_base=github.api_base)
+
+
+def requests_since(github, start):
+    return [(method, status) for method, _, status in github.state.requests[start:]]
+
+
+def test_git_blob_sha_matches_git():
+    # 与 `git hash-object` 的结果一致
+    assert git_blob_sha(b'') == 'e69de29bb2d1d6434b8b29ae775ad8c2e48c5391'
+    assert git_blob_sha(b'hello\n') == 'ce013625030ba8dba906f756967f9e9ca394464a'
+
+
+def test_sync_file_skips_unchanged_with_304(github, tmp_path):
+    content = b'[{"id": 1}]'
+    github.state.commit_files(OWNER, REPO, BRANCH, {'agents.json': content}, 'init')
+    client = make_client(github)
+    state = SyncState(str(tmp_path / 'github_state.json'))
+
+    # 第一次：读取远程 sha 和 ETag，内容相同不上传
+    assert client.sync_file('agents.json', BRANCH, content, 'sync', state) == (False, git_blob_sha(content))
+    assert requests_since(github, 0) == [('GET', 200)]
+
+    # 第二次：带 If-None-Match，远程未变化只返回 304，只发一次请求
+    start = len(github.state.requests)
+    count = client.request_count
+    uploaded, sha = client.sync_file('agents.json', BRANCH, content, 'sync', SyncState(state.path))
+    assert (uploaded, sha) == (False, git_blob_sha(content))
+    assert client.request_count - count == 1
+    assert requests_since(github, start) == [('GET', 304)]
+
+
+def test_sync_file_uploads_changes(github, tmp_path):
+    github.state.commit_files(OWNER, REPO, BRANCH, {'agents.json': b'[]'}, 'init')
+    client = make_client(github)
+    state = SyncState(str(tmp_path / 'github_state.json'))
+
+    content = b'[{"id": 2}]'
+    assert client.sync_file('agents.json', BRANCH, content, 'sync', state) == (True, git_blob_sha(content))
+    assert [method for method, _ in requests_since(github, 0)] == ['GET', 'PUT']
+    assert github.state.head_files(OWNER, REPO, BRANCH)['agents.json'] == content
+
+    # 上传后缓存的 ETag 已失效，下一次重新读取后确认相同，不再上传
+    start = len(github.state.requests)
+    assert client.sync_file('agents.json', BRANCH, content, 'sync', state)[0] is False
+    assert requests_since(github, start) == [('GET', 200)]
+
+
+def test_sync_file_creates_missing_file(github, tmp_path):
+    github.state.commit_files(OWNER, REPO, BRANCH, {}, 'init')
+    client = make_client(github)
+    uploaded, sha = client.sync_file('new.json', BRANCH, b'{}', 'add', SyncState(str(tmp_path / 'state.json')))
+    assert uploaded and sha == git_blob_sha(b'{}')
+    assert requests_since(github, 0) == [('GET', 404), ('PUT', 201)]
+
+
+def test_commit_files_single_commit(github):
+    github.state.commit_files(OWNER, REPO, BRANCH, {'agents/manifest.json': b'{}', 'agents/old.json': b'{}'}, 'init')
+    client = make_client(github)
+    files = {'agents/manifest.json': b'{"version": 1}', 'agents/a.json': b'{"id": "a"}', 'agents/b.json': b'{"id": "b"}'}
+
+    committed, head = client.commit_files(BRANCH, files, 'batch', deleted=['agents/old.json'])
+    assert committed
+    # 无论文件多少都是 5 次请求：读取分支、读取提交、创建 tree、创建提交、更新分支
+    assert [method for method, _ in requests_since(github, 0)] == ['GET', 'GET', 'POST', 'POST', 'PATCH']
+    assert github.state.refs[(OWNER, REPO, BRANCH)] == head
+    assert github.state.head_files(OWNER, REPO, BRANCH) == files
+
+
+def test_commit_files_noop_when_unchanged(github):
+    files = {'agents/manifest.json': b'{}', 'agents/a.json': b'{"id": "a"}'}
+    github.state.commit_files(OWNER, REPO, BRANCH, files, 'init')
+    head = github.state.refs[(OWNER, REPO, BRANCH)]
+    client = make_client(github)
+
+    # tree 与远程相同：不创建提交，也不移动分支
+    assert client.commit_files(BRANCH, dict(files), 'batch') == (False, head)
+    assert client.request_count == 3
+    assert [method for method, _ in requests_since(github, 0)] == ['GET', 'GET', 'POST']
+    assert github.state.refs[(OWNER, REPO, BRANCH)] == head
+
+
+def test_commit_files_rejects_binary(github):
+    github.state.commit_files(OWNER, REPO, BRANCH, {}, 'init')
+    with pytest.raises(ValueError):
+        make_client(github).commit_files(BRANCH, {'image.png': b'\x89PNG\xff'}, 'batch')
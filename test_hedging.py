@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""hedging 的对冲与故障转移，上游为 fake_openai.py"""
+
+import asyncio
+import json
+import time
+
+import pytest
+
+from fake_openai import make_reply, start_fake_openai
+from hedging import MIN_HEDGE_DELAY, MIN_SAMPLES, Hedger, TTFTTracker, attempts_for
+from rate_limiter import UpstreamScheduler
+from server import HttpRequest, UpstreamClient
+from sse import SSECollector
+
+KEY = 'sk-test-0123456789abcdef'
+BACKUP_KEY = 'sk-backup-0123456789abcdef'
+
+
+@pytest.fixture
+def fake():
+    servers = []
+
+    def start(**options):
+        server = start_fake_openai(reply_chars=40, **options)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def chat_body(model='gpt-4o-mini'):
+    return json.dumps({'model': model, 'messages': [{'role': 'user', 'content': 'hi'}], 'stream': True}).encode('utf-8')
+
+
+def run(agent, url, hedge=False, tracker=None):
+    """通过 Hedger 发出请求，返回 (响应, 完整回复文本, Hedger)"""
+
+    async def main():
+        client = UpstreamClient(read_timeout=10)
+
+        async def open_attempt(attempt):
+            return await client.request('POST', attempt.url, attempt.headers, attempt.body)
+
+        hedger = Hedger(open_attempt, tracker=tracker)
+        headers = [('Content-Type', 'application/json'), ('Authorization', f'Bearer {KEY}')]
+        response = await hedger.request(attempts_for(agent, url, headers, chat_body()), hedge=hedge)
+        collector = SSECollector()
+        async for chunk in response.body():
+            collector.feed(chunk)
+        client.pool.close_all()
+        return response, collector.text, hedger
+
+    return asyncio.run(main())
+
+
+def fast_tracker(url, model='gpt-4o-mini'):
+    """已有足够快速样本的 TTFT 记录，对冲阈值降到下限"""
+    tracker = TTFTTracker()
+    for _ in range(MIN_SAMPLES):
+        tracker.record((url, model), 0.01)
+    return tracker
+
+
+def test_attempts_for_fallbacks():
+    agent = {'fallbacks': [{'apiUrl': 'http://b/v1', 'model': 'other', 'apiKey': 'sk-b'}, {'model': 'no-url'}]}
+    headers = [('Authorization', f'Bearer {KEY}')]
+    primary, fallback = attempts_for(agent, 'http://a/v1', headers, chat_body())
+    assert primary.target == ('http://a/v1', 'gpt-4o-mini')
+    assert fallback.target == ('http://b/v1', 'other')
+    assert json.loads(fallback.body)['model'] == 'other'
+    assert fallback.headers == [('Authorization', 'Bearer sk-b')]
+
+
+def test_attempts_for_keeps_primary_key_on_same_origin():
+    agent = {'fallbacks': [{'apiUrl': 'http://A:80/v2', 'model': 'other'}, {'apiUrl': 'http://b/v1', 'model': 'x'}]}
+    headers = [('Authorization', f'Bearer {KEY}')]
+    attempts = attempts_for(agent, 'http://a/v1', headers, chat_body())
+    # 同源的备用接口沿用原密钥；其他服务商没有配置密钥，不发出请求
+    assert [attempt.target for attempt in attempts] == [('http://a/v1', 'gpt-4o-mini'), ('http://A:80/v2', 'other')]
+    assert attempts[1].headers == headers
+
+
+def test_failover_on_server_error(fake):
+    primary = fake(error_rate=1.0)
+    backup = fake()
+    agent = {'fallbacks': [{'apiUrl': backup.api_url, 'apiKey': BACKUP_KEY}]}
+    response, text, hedger = run(agent, primary.api_url)
+    assert response.status == 200 and response.hedged
+    assert ('X-Hedged', '1') in response.relay_headers()
+    assert text == make_reply(40)
+    assert hedger.stats['failovers'] == 1 and hedger.stats['hedged'] == 0
+
+
+def test_fallback_uses_its_own_key(fake):
+    primary = fake(error_rate=1.0)
+    backup = fake(keys=[BACKUP_KEY])
+    agent = {'fallbacks': [{'apiUrl': backup.api_url, 'apiKey': BACKUP_KEY}]}
+    response, text, _ = run(agent, primary.api_url)
+    assert response.status == 200 and response.attempt.url == backup.api_url
+    assert text == make_reply(40)
+
+
+def test_fallback_without_key_on_other_origin_is_skipped(fake):
+    primary = fake(error_rate=1.0)
+    backup = fake()
+    response, _, hedger = run({'fallbacks': [{'apiUrl': backup.api_url}]}, primary.api_url)
+    assert response.status == 500 and response.attempt.url == primary.api_url
+    assert backup.state.requests == [] and hedger.stats['failovers'] == 0
+
+
+def test_grant_refunded_when_open_upstream_cancelled(fake_openai, proxy):
+    upstream = fake_openai(latency=3.0)
+    server = proxy(upstream.api_url, scheduler=UpstreamScheduler(rpm=60))
+
+    async def cancel():
+        grant = await server.server.scheduler.acquire(f'Bearer {KEY}', 'gpt-4o-mini')
+        bucket = grant.lane.requests
+        request = HttpRequest('POST', '/v1/chat/completions', 'HTTP/1.1', {}, chat_body())
+        headers = [('Content-Type', 'application/json'), ('Authorization', f'Bearer {KEY}')]
+        task = asyncio.ensure_future(server.server.open_upstream(request, upstream.api_url, headers, grant))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return bucket.tokens, bucket.capacity
+
+    tokens, capacity = server.call(cancel())
+    # 请求还没有收到上游数据就被取消，令牌退回到满
+    assert tokens == pytest.approx(capacity)
+
+
+def test_all_attempts_fail_returns_last_error(fake):
+    primary = fake(error_rate=1.0)
+    backup = fake(error_rate=1.0)
+    agent = {'fallbacks': [{'apiUrl': backup.api_url, 'apiKey': BACKUP_KEY}]}
+    response, _, _ = run(agent, primary.api_url)
+    assert response.status == 500
+    assert response.attempt.url == backup.api_url
+
+
+def test_hedge_to_fallback_when_primary_slow(fake):
+    primary = fake(latency=3.0)
+    backup = fake()
+    agent = {'fallbacks': [{'apiUrl': backup.api_url, 'apiKey': BACKUP_KEY}], 'hedge': True}
+    start = time.perf_counter()
+    response, text, hedger = run(agent, primary.api_url, hedge=True, tracker=fast_tracker(primary.api_url))
+    elapsed = time.perf_counter() - start
+    assert response.status == 200 and response.attempt.url == backup.api_url
+    assert text == make_reply(40)
+    assert MIN_HEDGE_DELAY <= elapsed < 2.0
+    assert hedger.stats['hedged'] == 1 and hedger.stats['hedge_wins'] == 1
+
+
+def test_no_hedge_when_primary_fast(fake):
+    primary = fake()
+    backup = fake()
+    agent = {'fallbacks': [{'apiUrl': backup.api_url, 'apiKey': BACKUP_KEY}], 'hedge': True}
+    response, _, hedger = run(agent, primary.api_url, hedge=True)
+    assert response.status == 200 and not response.hedged
+    assert hedger.stats['hedged'] == 0
+    assert backup.state.requests == []
+    # 首个数据块的耗时被记录下来
+    assert len(hedger.tracker.samples[(primary.api_url, 'gpt-4o-mini')]) == 1
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""rate_limiter 令牌桶、优先级排队、超时和空闲通道清理"""
+
+import asyncio
+
+import pytest
+
+from rate_limiter import (BURST_SECONDS, PRIORITY_BULK, PRIORITY_INTERACTIVE, QueueTimeout, TokenBucket,
+                          UpstreamScheduler, request_priority)
+
+
+def test_token_bucket_refill():
+    bucket = TokenBucket(60)  # 每秒 1 个
+    assert bucket.capacity == BURST_SECONDS
+    start = bucket.updated
+    assert bucket.delay(1, start) == 0
+    bucket.consume(bucket.capacity)
+    assert bucket.delay(1, start) == pytest.approx(1.0)
+    assert bucket.delay(1, start + 0.5) == pytest.approx(0.5)
+    assert bucket.delay(1, start + 1) == 0
+    # 恢复不超过容量；单次消耗超过容量时桶满即可通过
+    bucket.refill(start + 1000)
+    assert bucket.tokens == bucket.capacity and bucket.full(start + 1000)
+    assert bucket.delay(bucket.capacity * 5, start + 1000) == 0
+    bucket.consume(3)
+    bucket.refund(100)
+    assert bucket.tokens == bucket.capacity
+
+
+def test_request_priority():
+    assert request_priority(None, 1024) == PRIORITY_INTERACTIVE
+    assert request_priority(None, 32000) == PRIORITY_BULK
+    assert request_priority({'max_tokens': 32000}, None) == PRIORITY_BULK
+    assert request_priority({'priority': 'interactive', 'max_tokens': 32000}, None) == PRIORITY_INTERACTIVE
+
+
+def test_priority_and_round_robin_order():
+    async def run():
+        scheduler = UpstreamScheduler(rpm=6000)
+        lane = scheduler.lane('Bearer k', 'm')
+        lane.throttle(0.2)  # 暂停期间全部排队，恢复后按顺序放行
+        order = []
+
+        async def request(name, priority, user):
+            await scheduler.acquire('Bearer k', 'm', 0, priority, user)
+            order.append(name)
+
+        names = [('bulk', PRIORITY_BULK, 'c'), ('a1', PRIORITY_INTERACTIVE, 'a'), ('a2', PRIORITY_INTERACTIVE, 'a'),
+                 ('a3', PRIORITY_INTERACTIVE, 'a'), ('b1', PRIORITY_INTERACTIVE, 'b')]
+        tasks = []
+        for name, priority, user in names:
+            tasks.append(asyncio.ensure_future(request(name, priority, user)))
+            await asyncio.sleep(0)
+        assert lane.depth() == len(names)
+        await asyncio.gather(*tasks)
+        return order, lane
+
+    order, lane = asyncio.run(run())
+    # 交互型先于批量；同一优先级内按用户轮转
+    assert order == ['a1', 'b1', 'a2', 'a3', 'bulk']
+    assert lane.depth() == 0 and lane.stats['granted'] == 5
+
+
+def test_rate_limit_delays_requests():
+    async def run():
+        scheduler = UpstreamScheduler(rpm=60)  # 容量 10，之后每秒 1 个
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        grants = [await scheduler.acquire('Bearer k', 'm') for _ in range(BURST_SECONDS + 1)]
+        return loop.time() - start, grants
+
+    elapsed, grants = asyncio.run(run())
+    assert 0.8 < elapsed < 2.0
+    assert grants[-1].wait > 0.8
+
+
+def test_queue_timeout_leaves_no_empty_queues():
+    async def run():
+        scheduler = UpstreamScheduler(rpm=60, queue_timeout=0.1)
+        lane = scheduler.lane('Bearer k', 'm')
+        lane.throttle(5)
+        with pytest.raises(QueueTimeout):
+            await scheduler.acquire('Bearer k', 'm', 0, PRIORITY_INTERACTIVE, 'user')
+        return lane
+
+    lane = asyncio.run(run())
+    assert lane.stats['timeouts'] == 1
+    assert lane.depth() == 0
+    assert all(not queue for queue in lane.queues.values())
+
+
+def test_head_drops_queues_of_cancelled_waiters():
+    async def run():
+        scheduler = UpstreamScheduler(rpm=60)
+        lane = scheduler.lane('Bearer k', 'm')
+        lane.throttle(5)
+        task = asyncio.ensure_future(scheduler.acquire('Bearer k', 'm', 0, PRIORITY_BULK, 'gone'))
+        await asyncio.sleep(0)
+        # 等待者已结束但仍留在队列中（例如超时与出队交错）
+        lane.queues[PRIORITY_BULK]['gone'][0].future.cancel()
+        assert lane.head() is None
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return lane
+
+    lane = asyncio.run(run())
+    assert 'gone' not in lane.queues[PRIORITY_BULK]
+
+
+def test_idle_lanes_removed():
+    async def run():
+        unlimited = UpstreamScheduler()
+        for i in range(100):
+            await unlimited.acquire(f'Bearer key-{i}', 'm')
+
+        limited = UpstreamScheduler(rpm=60)
+        await limited.acquire('Bearer busy', 'm')
+        limited.lane('Bearer paused', 'm').throttle(60)
+        await limited.acquire('Bearer other', 'm')
+        kept = set(limited.lanes)
+        # 令牌恢复后通道不再需要保留
+        for lane in limited.lanes.values():
+            lane.requests.tokens = lane.requests.capacity
+        limited.lane('Bearer new', 'm')
+        return unlimited, kept, limited
+
+    unlimited, kept, limited = asyncio.run(run())
+    assert len(unlimited.lanes) == 1
+    assert kept == {('Bearer busy', 'm'), ('Bearer paused', 'm'), ('Bearer other', 'm')}
+    assert set(limited.lanes) == {('Bearer paused', 'm'), ('Bearer new', 'm')}
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""response_cache 缓存键、缓存策略和经由 server.py 的命中测试"""
+
+import asyncio
+
+from fake_openai import make_reply
+from response_cache import DiskCache, ResponseCache, cache_key, should_cache
+from sse import SSECollector
+
+BASE = {
+    'model': 'gpt-4o-mini',
+    'messages': [{'role': 'system', 'content': '你是助手'}, {'role': 'user', 'content': '会议记录'}],
+    'temperature': 0,
+    'stream': True,
+}
+
+
+def test_cache_key_covers_every_parameter():
+    key = cache_key(BASE, 'Bearer a')
+    assert cache_key(dict(BASE, stream=False), 'Bearer a') == key
+    assert cache_key(dict(reversed(list(BASE.items()))), 'Bearer a') == key
+    assert cache_key(BASE, 'Bearer b') != key
+    for name, value in (('top_p', 0.1), ('stop', ['\n']), ('tools', []), ('tool_choice', 'none'),
+                        ('response_format', {'type': 'json_object'}), ('n', 1), ('seed', 7), ('max_tokens', 10)):
+        assert cache_key(dict(BASE, **{name: value}), 'Bearer a') != key, name
+
+
+def test_cache_key_accepts_content_parts():
+    parts = dict(BASE, messages=[{'role': 'system', 'content': [{'type': 'text', 'text': '你是助手'}]},
+                                 {'role': 'user', 'content': '会议记录'}])
+    assert cache_key(parts) != cache_key(BASE)
+    assert cache_key(parts) == cache_key(dict(parts))
+
+
+def test_should_cache_only_deterministic_by_default():
+    assert should_cache(BASE)
+    assert should_cache(dict(BASE, temperature=0.0))
+    assert not should_cache(dict(BASE, temperature=0.7))
+    assert not should_cache({k: v for k, v in BASE.items() if k != 'temperature'})
+    assert not should_cache(dict(BASE, n=2))
+    assert not should_cache(dict(BASE, temperature=False))
+    assert should_cache(dict(BASE, temperature=0.7), {'cacheResponses': True})
+    assert not should_cache(BASE, {'cacheResponses': False})
+
+
+def test_disk_cache_shared_between_instances(tmp_path):
+    first = ResponseCache(str(tmp_path), memory_entries=4)
+    second = ResponseCache(str(tmp_path), memory_entries=4)
+
+    async def run():
+        await first.put('k' * 64, 'm', '回复')
+        return await second.get('k' * 64)
+
+    assert asyncio.run(run())['content'] == '回复'
+    assert 'k' * 64 in DiskCache(str(tmp_path)).index
+
+
+def read_stream(body):
+    collector = SSECollector()
+    collector.feed(body)
+    return collector.text
+
+
+def test_proxy_cache_hits_only_identical_requests(fake_openai, proxy):
+    upstream = fake_openai(reply_chars=30)
+    server = proxy(upstream.api_url)
+
+    status, headers, body = server.chat(BASE)
+    assert status == 200 and dict(headers)['X-Cache'] == 'MISS'
+    status, headers, body = server.chat(BASE)
+    assert dict(headers)['X-Cache'] == 'HIT' and read_stream(body) == make_reply(30)
+    assert len(upstream.state.requests) == 1
+
+    # 只有 top_p 不同也不命中
+    assert dict(server.chat(dict(BASE, top_p=0.1))[1])['X-Cache'] == 'MISS'
+    # 温度大于 0 不缓存
+    for _ in range(2):
+        assert 'X-Cache' not in dict(server.chat(dict(BASE, temperature=0.7))[1])
+    assert len(upstream.state.requests) == 4
+
+
+def test_proxy_cache_with_content_parts(fake_openai, proxy):
+    upstream = fake_openai(reply_chars=30)
+    server = proxy(upstream.api_url)
+    payload = dict(BASE, messages=[{'role': 'system', 'content': [{'type': 'text', 'text': '你是助手'}]},
+                                   {'role': 'user', 'content': [{'type': 'text', 'text': '会议记录'}]}])
+    assert server.chat(payload)[0] == 200
+    status, headers, body = server.chat(payload)
+    assert status == 200 and dict(headers)['X-Cache'] == 'HIT'
+
+
+def test_agent_opt_in(fake_openai, proxy):
+    upstream = fake_openai(reply_chars=30)
+    server = proxy(upstream.api_url, agents=[{'id': 'a', 'cacheResponses': True}, {'id': 'b'}])
+    payload = dict(BASE, temperature=0.7)
+    server.chat(payload, {'X-Agent-Id': 'a'})
+    assert dict(server.chat(payload, {'X-Agent-Id': 'a'})[1])['X-Cache'] == 'HIT'
+    assert 'X-Cache' not in dict(server.chat(payload, {'X-Agent-Id': 'b'})[1])
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""save_pipeline 原子写入与后台保存队列的测试"""
+
+import json
+import os
+import threading
+
+import pytest
+
+from save_pipeline import SavePipeline, atomic_write, atomic_writer
+
+
+@pytest.fixture
+def pipeline():
+    pipeline = SavePipeline()
+    yield pipeline
+    pipeline.close(timeout=5)
+
+
+def test_atomic_write_replaces_file(tmp_path):
+    path = tmp_path / 'agents.json'
+    atomic_write(str(path), b'[]')
+    atomic_write(str(path), b'[{"id": 1}]')
+    assert path.read_bytes() == b'[{"id": 1}]'
+    assert os.listdir(tmp_path) == ['agents.json']
+
+
+def test_atomic_writer_keeps_original_on_error(tmp_path):
+    path = tmp_path / 'agents.json'
+    path.write_bytes(b'[]')
+    with pytest.raises(RuntimeError):
+        with atomic_writer(str(path)) as f:
+            f.write(b'[{"id": ')
+            raise RuntimeError('写到一半')
+    assert path.read_bytes() == b'[]'
+    assert os.listdir(tmp_path) == ['agents.json']
+
+
+def test_save_round_trip(pipeline, tmp_path):
+    path = str(tmp_path / 'agents.json')
+    agents = [{'id': 1, 'name': '写作助手'}]
+    results = []
+    pipeline.submit('agents', lambda: atomic_write(path, json.dumps(agents).encode('utf-8')) or len(agents),
+                    on_done=lambda result, error: results.append((result, error)))
+    assert pipeline.flush(timeout=5)
+    # 回调只在 drain() 中执行
+    assert results == []
+    assert pipeline.drain() == 1
+    assert results == [(1, None)]
+    with open(path, 'r', encoding='utf-8') as f:
+        assert json.load(f) == agents
+    assert not pipeline.busy()
+
+
+def test_debounce_runs_latest_job_once(pipeline):
+    calls = []
+    done = []
+    for i in range(5):
+        pipeline.submit('agents', lambda i=i: calls.append(i) or i, on_done=lambda result, error: done.append(result),
+                        delay=10)
+    assert pipeline.busy()
+    assert pipeline.flush(timeout=5)
+    pipeline.drain()
+    # 同名任务只执行最后一次，但每个提交者的回调都会收到结果
+    assert calls == [4]
+    assert done == [4] * 5
+
+
+def test_errors_reported_to_callback(pipeline):
+    errors = []
+    pipeline.submit('broken', lambda: 1 / 0, on_done=lambda result, error: errors.append(error))
+    pipeline.flush(timeout=5)
+    pipeline.drain()
+    assert len(errors) == 1 and isinstance(errors[0], ZeroDivisionError)
+
+
+def test_close_runs_pending_jobs(tmp_path):
+    pipeline = SavePipeline()
+    ran = threading.Event()
+    pipeline.submit('agents', ran.set, delay=60)
+    pipeline.close(timeout=5)
+    assert ran.is_set()
+    assert not pipeline.thread.is_alive()
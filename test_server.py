@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""server.py 请求解析与错误处理"""
+
+import json
+import socket
+
+from server import MAX_BODY_BYTES, HttpError, send_json
+
+
+def raw_request(proxy, data):
+    """发送原始字节，返回服务器的完整响应（直到连接关闭）"""
+    with socket.create_connection(('127.0.0.1', proxy.port), timeout=10) as sock:
+        try:
+            sock.sendall(data)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        parts = []
+        while True:
+            try:
+                chunk = sock.recv(65536)
+            except ConnectionResetError:
+                break
+            if not chunk:
+                break
+            parts.append(chunk)
+        return b''.join(parts)
+
+
+def status_of(response):
+    return int(response.split(b' ', 2)[1]) if response else None
+
+
+def chunked_head(path='/v1/context/fit'):
+    return (f'POST {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n'
+            'Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n').encode('latin-1')
+
+
+def test_chunked_body(fake_openai, proxy):
+    server = proxy(fake_openai().api_url)
+    body = json.dumps({'messages': [{'role': 'user', 'content': '你好'}]}).encode('utf-8')
+    data = chunked_head() + b'%x\r\n%s\r\n' % (5, body[:5]) + b'%x\r\n%s\r\n' % (len(body) - 5, body[5:]) + b'0\r\n\r\n'
+    response = raw_request(server, data)
+    assert status_of(response) == 200
+    assert json.loads(response.split(b'\r\n\r\n', 1)[1])['messages'][0]['content'] == '你好'
+
+
+def test_chunked_body_over_limit(fake_openai, proxy):
+    server = proxy(fake_openai().api_url)
+    # 块头声明的大小超过上限时不读取数据直接拒绝
+    response = raw_request(server, chunked_head() + b'%x\r\n' % (MAX_BODY_BYTES + 1))
+    assert status_of(response) == 413
+
+    piece = b'x' * (1024 * 1024)
+    data = chunked_head() + (b'%x\r\n%s\r\n' % (len(piece), piece)) * (MAX_BODY_BYTES // len(piece) + 1)
+    assert status_of(raw_request(server, data)) == 413
+
+
+def test_invalid_chunk_size(fake_openai, proxy):
+    server = proxy(fake_openai().api_url)
+    assert status_of(raw_request(server, chunked_head() + b'zz\r\n')) == 400
+
+
+def test_content_length_over_limit(fake_openai, proxy):
+    server = proxy(fake_openai().api_url)
+    data = (f'POST /v1/context/fit HTTP/1.1\r\nHost: localhost\r\nContent-Length: {MAX_BODY_BYTES + 1}\r\n\r\n'
+            ).encode('latin-1')
+    assert status_of(raw_request(server, data)) == 413
+
+
+def test_unexpected_error_returns_500(fake_openai, proxy):
+    server = proxy(fake_openai().api_url)
+
+    async def broken(request, writer):
+        raise TypeError('模拟的错误')
+
+    async def broken_after_headers(request, writer):
+        await send_json(writer, request, 200, {'ok': True})
+        raise KeyError('响应之后的错误')
+
+    async def http_error(request, writer):
+        raise HttpError(418, '自定义错误')
+
+    server.server.routes[('GET', '/broken')] = broken
+    server.server.routes[('GET', '/broken-late')] = broken_after_headers
+    server.server.routes[('GET', '/teapot')] = http_error
+
+    status, headers, body = server.request('GET', '/broken')
+    assert status == 500 and dict(headers)['Connection'] == 'close'
+    assert json.loads(body)['error']['message'] == '服务器内部错误'
+    # 已经发出响应头时只关闭连接，不再写第二个响应
+    response = raw_request(server, b'GET /broken-late HTTP/1.1\r\nHost: localhost\r\n\r\n')
+    assert status_of(response) == 200 and response.count(b'HTTP/1.1') == 1
+    assert server.request('GET', '/teapot')[0] == 418
+
+
+def header_values(headers, name):
+    return [value for key, value in headers if key.lower() == name.lower()]
+
+
+def test_static_response_has_single_cache_control(fake_openai, proxy, tmp_path):
+    (tmp_path / 'index.html').write_text('<h1>探仔</h1>', encoding='utf-8')
+    server = proxy(fake_openai().api_url)
+    status, headers, _ = server.request('GET', '/index.html')
+    assert status == 200
+    assert header_values(headers, 'Cache-Control') == ['no-cache']
+
+    etag = header_values(headers, 'ETag')[0]
+    status, headers, _ = server.request('GET', '/index.html', headers={'If-None-Match': etag})
+    assert status == 304
+    assert header_values(headers, 'Cache-Control') == ['no-cache']
+
+
+def test_stream_replaces_upstream_cache_control(fake_openai, proxy):
+    # 模拟接口的流式响应自带 Cache-Control，代理替换而不是再追加一个
+    server = proxy(fake_openai().api_url)
+    status, headers, _ = server.chat({'model': 'gpt-4o-mini', 'stream': True, 'temperature': 0.7,
+                                      'messages': [{'role': 'user', 'content': 'hi'}]})
+    assert status == 200
+    assert header_values(headers, 'Cache-Control') == ['no-cache']
+    assert header_values(headers, 'X-Accel-Buffering') == ['no']
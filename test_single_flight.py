@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""相同请求合并：经由 server.py 转发到 fake_openai.py"""
+
+import json
+import socket
+import threading
+import time
+
+from conftest import KEY
+from fake_openai import make_reply
+from single_flight import coalesce_key
+from sse import SSECollector
+
+PAYLOAD = {
+    'model': 'gpt-4o-mini',
+    'messages': [{'role': 'user', 'content': '同一份会议记录'}],
+    'temperature': 0.7,
+    'stream': True,
+}
+
+
+def slow_upstream(fake_openai):
+    # 首个数据块前等待 0.5 秒，之后每秒 40 块，整个流约 1 秒
+    return fake_openai(latency=0.5, reply_chars=80, chunk_chars=4, token_rate=40)
+
+
+def parallel_chats(server, payloads, stagger=0.05):
+    """并发发送聊天请求，返回 [(状态码, 响应头字典, 回复文本)]"""
+    results = [None] * len(payloads)
+
+    def worker(i):
+        status, headers, body = server.chat(payloads[i])
+        collector = SSECollector()
+        collector.feed(body)
+        results[i] = (status, dict(headers), collector.text)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(payloads))]
+    for thread in threads:
+        thread.start()
+        time.sleep(stagger)
+    for thread in threads:
+        thread.join(10)
+    return results
+
+
+def chat_requests(upstream):
+    """上游收到的聊天请求数（流式响应在结束后才记录，稍等片刻）"""
+    deadline = time.monotonic() + 2
+    count = -1
+    while time.monotonic() < deadline:
+        previous, count = count, len(upstream.state.requests)
+        if count == previous:
+            break
+        time.sleep(0.2)
+    return count
+
+
+def test_coalesce_key():
+    key = coalesce_key(PAYLOAD, 'scope')
+    assert coalesce_key(dict(PAYLOAD, stream=False), 'scope') == key
+    assert coalesce_key(PAYLOAD, 'other') != key
+    assert coalesce_key(dict(PAYLOAD, top_p=0.5), 'scope') != key
+    assert coalesce_key(dict(PAYLOAD, messages=[{'role': 'user', 'content': [{'type': 'text', 'text': 'x'}]}]),
+                        'scope') != key
+
+
+def test_identical_requests_share_one_upstream_call(fake_openai, proxy):
+    upstream = slow_upstream(fake_openai)
+    server = proxy(upstream.api_url)
+    results = parallel_chats(server, [PAYLOAD] * 4)
+
+    assert [status for status, _, _ in results] == [200] * 4
+    assert all(text == make_reply(80) for _, _, text in results)
+    assert sum(headers.get('X-Coalesced') == 'HIT' for _, headers, _ in results) == 3
+    assert server.server.flights.stats == {'leaders': 1, 'joined': 3}
+    assert chat_requests(upstream) == 1
+
+
+def test_different_bodies_not_merged(fake_openai, proxy):
+    upstream = slow_upstream(fake_openai)
+    server = proxy(upstream.api_url)
+    payloads = [PAYLOAD, dict(PAYLOAD, top_p=0.1), dict(PAYLOAD, stop=['。']),
+                dict(PAYLOAD, response_format={'type': 'text'})]
+    results = parallel_chats(server, payloads)
+
+    assert all(status == 200 and text == make_reply(80) for status, _, text in results)
+    assert not any('X-Coalesced' in headers for _, headers, _ in results)
+    assert server.server.flights.stats['leaders'] == 4
+    assert chat_requests(upstream) == 4
+
+
+def test_follower_survives_leader_disconnect(fake_openai, proxy):
+    upstream = slow_upstream(fake_openai)
+    server = proxy(upstream.api_url)
+    body = json.dumps(PAYLOAD).encode('utf-8')
+    leader = socket.create_connection(('127.0.0.1', server.port), timeout=10)
+    leader.sendall((f'POST /v1/chat/completions HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n'
+                    f'Authorization: Bearer {KEY}\r\nContent-Length: {len(body)}\r\n\r\n').encode('latin-1') + body)
+    time.sleep(0.1)
+
+    follower = []
+    thread = threading.Thread(target=lambda: follower.extend(parallel_chats(server, [PAYLOAD], stagger=0)))
+    thread.start()
+    # 领头的客户端收到第一批数据后断开
+    assert leader.recv(65536).startswith(b'HTTP/1.1 200')
+    leader.close()
+    thread.join(10)
+
+    (status, headers, text), = follower
+    assert status == 200 and headers.get('X-Coalesced') == 'HIT'
+    assert text == make_reply(80)
+    assert chat_requests(upstream) == 1
+    assert [status for _, _, status in upstream.state.requests] == [200]